@@ -0,0 +1,101 @@
+"""
+Measures the aggregate throughput of `TretWorkspace.abackup` when 1 to 200 workspaces are backed up concurrently
+from one event loop, and how long the event loop is blocked meanwhile (the delays of a 10ms ticker),
+against backing them up one after the other with `TretWorkspace.backup` from the loop.
+
+Usage:
+    python benchmarks/bench_async_backup.py --concurrency 1 10 50 100 200 --max-workers 32 [--git]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from tret import TretArguments, TretWorkspace  # noqa: E402
+from tret.core.async_api import configure_async_io  # noqa: E402
+
+TICK_INTERVAL = 0.01
+
+
+async def _ticker(lags: list):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(TICK_INTERVAL)
+        lags.append(time.perf_counter() - start - TICK_INTERVAL)
+
+
+async def _run(workspaces: list, concurrent: bool) -> tuple[float, list]:
+    lags = []
+    ticker = asyncio.create_task(_ticker(lags))
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    if concurrent:
+        await asyncio.gather(*[workspace.abackup(datafiles_to_backup_as_tarball=["dataset"]) for workspace in workspaces])
+    else:
+        for workspace in workspaces:
+            workspace.backup(datafiles_to_backup_as_tarball=["dataset"])
+            await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    # lets the ticker observe the last blocking period
+    await asyncio.sleep(TICK_INTERVAL * 2)
+    ticker.cancel()
+    return elapsed, lags
+
+
+def _report(label: str, count: int, elapsed: float, lags: list):
+    lags = sorted(lags)
+    print(
+        f"{label:<24}: {count / elapsed:6.2f} workspaces/s, event loop delay median {lags[len(lags) // 2] * 1000:7.1f}ms, "
+        f"max {lags[-1] * 1000:7.1f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 100, 200])
+    parser.add_argument("--max-workers", type=int, default=32)
+    parser.add_argument("--max-compressions", type=int, default=None)
+    parser.add_argument("--max-git-processes", type=int, default=None)
+    parser.add_argument("--sequential", type=int, default=10, help="Workspaces backed up one after the other.")
+    parser.add_argument("--files", type=int, default=20, help="Data files of each workspace.")
+    parser.add_argument("--git", action="store_true", help="Back up the codes of a git repository instead of tarballs.")
+    args = parser.parse_args()
+
+    configure_async_io(
+        max_workers=args.max_workers, max_compressions=args.max_compressions, max_git_processes=args.max_git_processes,
+    )
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.makedirs(os.path.join(temp_dir, "dataset"))
+        for i in range(args.files):
+            with open(os.path.join(temp_dir, "dataset", f"sample{i}.json"), "w") as fout:
+                fout.write(f"{{\"id\": {i}, \"values\": {list(range(1000))}}}")
+        os.chdir(temp_dir)
+        if args.git:
+            with open("train.py", "w") as fout:
+                fout.write("import json\n")
+            git = ["git", "-c", "user.name=tret", "-c", "user.email=tret@example.com"]
+            for command in [["init", "-q"], ["add", "train.py"], ["commit", "-q", "-m", "initial"]]:
+                subprocess.run(git + command, check=True)
+
+        def _workspaces(label: str, count: int) -> list:
+            return [
+                TretWorkspace(TretArguments(
+                    workspace_name=f"{label}-{i}", force_backup_codes_as_tarball=not args.git, use_daemon=False,
+                ))
+                for i in range(count)
+            ]
+
+        elapsed, lags = asyncio.run(_run(_workspaces("sequential", args.sequential), concurrent=False))
+        _report(f"{args.sequential} sequential backup", args.sequential, elapsed, lags)
+        for concurrency in args.concurrency:
+            elapsed, lags = asyncio.run(_run(_workspaces(f"concurrent{concurrency}", concurrency), concurrent=True))
+            _report(f"{concurrency} concurrent abackup", concurrency, elapsed, lags)
+
+
+if __name__ == "__main__":
+    main()
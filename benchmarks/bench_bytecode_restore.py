@@ -0,0 +1,108 @@
+"""
+Measures the first-import time of a restored project of many small modules, when its bytecode is left to the first
+import, precompiled in a process pool by `restore_codes(bytecode="precompile")`, or reused from the hash-based pycs
+backed up with the codes by `restore_codes(bytecode="reuse")`. Restore times include the bytecode step.
+
+Usage:
+    python benchmarks/bench_bytecode_restore.py --modules 2000
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from tret.core.code_backup_and_restore import backup_codes, restore_codes  # noqa: E402
+
+MODULE_TEMPLATE = '''
+import os
+import json
+
+
+class Model{index}:
+    """A model of module {index}."""
+
+    def __init__(self, hidden_size: int = {index}):
+        self.hidden_size = hidden_size
+        self.layers = [dict(index=i, size=hidden_size * i) for i in range(8)]
+
+    def forward(self, inputs: list) -> list:
+        return [sum(layer["size"] * x for layer in self.layers) for x in inputs]
+
+    def save(self, path: str):
+        with open(os.path.join(path, "model{index}.json"), "w") as fout:
+            json.dump(self.layers, fout)
+
+
+def build(config: dict) -> Model{index}:
+    return Model{index}(**{{key: value for key, value in config.items() if key == "hidden_size"}})
+'''
+
+# imports every module of the package, and prints the time it took
+IMPORT_PROBE = """
+import sys, time, importlib
+start = time.perf_counter()
+for index in range(int(sys.argv[1])):
+    importlib.import_module("project_pkg.mod%d" % index)
+print(time.perf_counter() - start)
+"""
+
+
+def _first_import_time(project_dir: str, num_modules: int) -> float:
+    # the first import writes the pycs it compiles, as it does by default
+    environment = {key: value for key, value in os.environ.items() if key != "PYTHONDONTWRITEBYTECODE"}
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE, str(num_modules)], cwd=project_dir, env=environment, stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+    return float(output)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modules", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        package_dir = os.path.join(source_dir, "project_pkg")
+        os.makedirs(package_dir)
+        open(os.path.join(package_dir, "__init__.py"), "w").close()
+        for index in range(args.modules):
+            with open(os.path.join(package_dir, f"mod{index}.py"), "w") as fout:
+                fout.write(MODULE_TEMPLATE.format(index=index))
+
+        workspace_dir = os.path.join(temp_dir, "workspace")
+        os.makedirs(workspace_dir)
+        os.chdir(source_dir)
+        start = time.perf_counter()
+        backup_codes(workspace_dir, additional_codefiles_to_backup=[package_dir], backup_codes_as_tarball=True, modules={})
+        print(f"backup: {time.perf_counter() - start:.2f}s without bytecode", end=", ")
+        start = time.perf_counter()
+        backup_codes(
+            workspace_dir, additional_codefiles_to_backup=[package_dir], backup_codes_as_tarball=True, modules={},
+            backup_bytecode=True,
+        )
+        print(f"{time.perf_counter() - start:.2f}s with bytecode")
+
+        for bytecode in [None, "precompile", "reuse"]:
+            # a fresh checkout of the project, without any `__pycache__`, where the codes are restored
+            restore_dir = os.path.join(temp_dir, f"restore-{bytecode}")
+            shutil.copytree(source_dir, restore_dir, ignore=shutil.ignore_patterns("__pycache__"))
+            os.chdir(restore_dir)
+            start = time.perf_counter()
+            restore_codes(workspace_dir, bytecode=bytecode)
+            restore_time = time.perf_counter() - start
+            import_time = _first_import_time(restore_dir, args.modules)
+            print(
+                f"bytecode={str(bytecode):<10} restore {restore_time:6.2f}s, first import {import_time:6.2f}s, "
+                f"total {restore_time + import_time:6.2f}s, second import {_first_import_time(restore_dir, args.modules):6.2f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Benchmarks the throughput of content-defined chunking and of backing up into the chunk store.
+
+Usage:
+    python benchmarks/bench_chunking.py --size-mb 512
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from tret.core import chunk_store  # noqa: E402
+from tret.core.chunk_store import iter_chunks, backup_files_as_chunks  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--change-ratio", type=float, default=0.02)
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    data = os.urandom(size)
+    print(f"numpy available: {chunk_store.np is not None}, cpu count: {os.cpu_count()}")
+
+    start = time.perf_counter()
+    num_chunks = sum(1 for _ in iter_chunks(io.BytesIO(data)))
+    elapsed = time.perf_counter() - start
+    print(f"chunking: {num_chunks} chunks, {size / elapsed / 1e9:.3f} GB/s")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filepath = os.path.join(temp_dir, "data.bin")
+        chunk_store_dir = os.path.join(temp_dir, ".tret-chunks")
+        with open(filepath, "wb") as fout:
+            fout.write(data)
+
+        start = time.perf_counter()
+        backup_files_as_chunks([filepath], os.path.join(temp_dir, "ws1", "data"), chunk_store_dir)
+        elapsed = time.perf_counter() - start
+        print(f"first backup: {size / elapsed / 1e9:.3f} GB/s")
+
+        # overwrite a few regions, the way appended or re-sharded files change between runs
+        changed_bytes = int(size * args.change_ratio)
+        with open(filepath, "r+b") as fout:
+            for offset in range(0, size, size // 8):
+                fout.seek(offset)
+                fout.write(os.urandom(changed_bytes // 8))
+        stored_before = sum(len(filenames) for _, _, filenames in os.walk(chunk_store_dir))
+        start = time.perf_counter()
+        backup_files_as_chunks([filepath], os.path.join(temp_dir, "ws2", "data"), chunk_store_dir)
+        elapsed = time.perf_counter() - start
+        stored_after = sum(len(filenames) for _, _, filenames in os.walk(chunk_store_dir))
+        print(
+            f"second backup ({args.change_ratio:.0%} changed): {size / elapsed / 1e9:.3f} GB/s, "
+            f"{stored_after - stored_before} new chunks out of {num_chunks}"
+        )
+
+
+if __name__ == "__main__":
+    main()
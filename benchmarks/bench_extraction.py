@@ -0,0 +1,75 @@
+"""
+Benchmarks restoring a tarball of many small files through `restore_files_from_tarball` against `tarfile.extractall`.
+
+Usage:
+    python benchmarks/bench_extraction.py --num-files 100000 --file-size 2048
+"""
+import io
+import os
+import sys
+import time
+import shutil
+import tarfile
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from tret.utils.tarball_utils import restore_files_from_tarball  # noqa: E402
+
+
+def _extractall(tarball_path: str, output_dir: str, **kwargs):
+    with tarfile.open(tarball_path, "r") as tar:
+        tar.extractall(path=output_dir, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-files", type=int, default=100000)
+    parser.add_argument("--file-size", type=int, default=2048)
+    parser.add_argument("--files-per-dir", type=int, default=100)
+    parser.add_argument("--max-workers", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    print(f"cpu count: {os.cpu_count()}")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tarball_path = os.path.join(temp_dir, "small-files.tar.gz")
+        start = time.perf_counter()
+        with tarfile.open(tarball_path, "w:gz", compresslevel=6) as tar:
+            for i in range(args.num_files):
+                # half random, half repeated content, so that the archive compresses like source trees do
+                content = os.urandom(args.file_size // 2) + b"x" * (args.file_size - args.file_size // 2)
+                tarinfo = tarfile.TarInfo(f"dir{i // args.files_per_dir:05d}/file{i:07d}.bin")
+                tarinfo.size, tarinfo.mode, tarinfo.mtime = len(content), 0o644, time.time()
+                tar.addfile(tarinfo, io.BytesIO(content))
+        print(
+            f"created {args.num_files} files of {args.file_size} bytes in {time.perf_counter() - start:.2f}s, "
+            f"tarball {os.path.getsize(tarball_path) / 1e6:.1f}MB"
+        )
+
+        extract_kwargs = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+        candidates = [
+            ("extractall", lambda output_dir: _extractall(tarball_path, output_dir)),
+            ("extractall(filter='data')", lambda output_dir: _extractall(tarball_path, output_dir, **extract_kwargs)),
+            ("restore_files_from_tarball", lambda output_dir: restore_files_from_tarball(tarball_path, output_dir, max_workers=args.max_workers)),
+        ]
+        # the candidates take turns, and pending writeback is flushed before each run, so that they share the same disk state
+        timings = {name: [] for name, _ in candidates}
+        for _ in range(args.repeat):
+            for name, extract in candidates:
+                output_dir = os.path.join(temp_dir, "output")
+                if hasattr(os, "sync"):
+                    os.sync()
+                start = time.perf_counter()
+                extract(output_dir)
+                timings[name].append(time.perf_counter() - start)
+                shutil.rmtree(output_dir)
+        baseline = min(timings["extractall"])
+        for name, _ in candidates:
+            best = min(timings[name])
+            print(f"{name:<28} best of {args.repeat}: {best:.2f}s, {args.num_files / best:.0f} files/s, {baseline / best:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Benchmarks the git work of a code backup, i.e. finding the repository, listing the tracked files, and reading HEAD and
+the diff against it, through GitPython (as `backup_codes` did before) and through `GitRepository`, together with the
+number of `git` processes started. Also compares checking many recorded commits (as `tret scrub` does) with one
+`git cat-file -e` process each against one persistent `git cat-file --batch-check` process.
+
+Usage:
+    python benchmarks/bench_git_backend.py --num-files 5000 --rounds 10
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from tret.utils.git_utils import GitRepository, find_git_worktree  # noqa: E402
+
+_num_processes = 0
+_popen_init = subprocess.Popen.__init__
+
+
+def _counting_popen_init(self, *args, **kwargs):
+    global _num_processes
+    _num_processes += 1
+    _popen_init(self, *args, **kwargs)
+
+
+def _git(repo_dir, *args):
+    return subprocess.run(
+        ["git", "-c", "user.name=tret", "-c", "user.email=tret@example.com", *args],
+        cwd=repo_dir, check=True, stdout=subprocess.PIPE,
+    ).stdout.decode("utf-8").strip()
+
+
+def _gitpython_backup(start_dir: str):
+    from git.repo import Repo
+
+    # the GitPython backend constructed a `Repo` for every directory up to the repository
+    path = start_dir
+    while True:
+        try:
+            repo = Repo(path)
+            break
+        except Exception:
+            path = os.path.dirname(path)
+    tracked_files = [key[0] for key in repo.index.entries.keys()]
+    commit_hash = repo.head.commit.hexsha
+    diff = repo.git.diff(commit_hash)
+    return tracked_files, commit_hash, diff
+
+
+def _tret_backup(start_dir: str):
+    repo = GitRepository(worktree_dir=find_git_worktree(start_dir))
+    tracked_files = repo.tracked_files()
+    commit_hash = repo.head_commit()
+    diff = repo.diff(commit_hash)
+    return tracked_files, commit_hash, diff
+
+
+def _measure(function, *args, rounds: int):
+    global _num_processes
+    _num_processes = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = function(*args)
+    return (time.perf_counter() - start) / rounds, _num_processes / rounds, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-files", type=int, default=5000)
+    parser.add_argument("--num-commits", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as repo_dir:
+        for i in range(args.num_files):
+            dirpath = os.path.join(repo_dir, f"package{i % 50}")
+            os.makedirs(dirpath, exist_ok=True)
+            with open(os.path.join(dirpath, f"module{i}.py"), "w") as fout:
+                fout.write(f"value = {i}\n")
+        _git(repo_dir, "init", "-q")
+        _git(repo_dir, "add", ".")
+        _git(repo_dir, "commit", "-q", "-m", "initial")
+        for i in range(args.num_commits):
+            _git(repo_dir, "commit", "-q", "--allow-empty", "-m", f"commit {i}")
+        commits = _git(repo_dir, "rev-list", "HEAD").splitlines()
+        with open(os.path.join(repo_dir, "package0", "module0.py"), "a") as fout:
+            fout.write("changed = True\n")
+        start_dir = os.path.join(repo_dir, "package0")
+
+        subprocess.Popen.__init__ = _counting_popen_init
+        try:
+            results = {}
+            for name, function in [("GitPython", _gitpython_backup), ("GitRepository", _tret_backup)]:
+                function(start_dir)
+                elapsed, num_processes, results[name] = _measure(function, start_dir, rounds=args.rounds)
+                print(f"backup   {name:<14} {elapsed * 1000:8.1f}ms, {num_processes:.0f} git processes")
+            assert sorted(results["GitPython"][0]) == sorted(results["GitRepository"][0])
+            assert results["GitPython"][1:] == results["GitRepository"][1:]
+
+            def _per_process():
+                for commit in commits:
+                    subprocess.run(
+                        ["git", "--git-dir", os.path.join(repo_dir, ".git"), "cat-file", "-e", f"{commit}^{{commit}}"],
+                        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                    )
+
+            def _batch():
+                repo = GitRepository(worktree_dir=repo_dir)
+                assert all(repo.object_type(f"{commit}^{{commit}}") == "commit" for commit in commits)
+                repo.close()
+
+            for name, function in [("cat-file -e", _per_process), ("--batch-check", _batch)]:
+                elapsed, num_processes, _ = _measure(function, rounds=1)
+                print(
+                    f"commits  {name:<14} {elapsed * 1000:8.1f}ms for {len(commits)} commits, "
+                    f"{num_processes:.0f} git processes"
+                )
+        finally:
+            subprocess.Popen.__init__ = _popen_init
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Measures `tret which-runs` queries on the lineage index of a base directory with many workspaces, against scanning the
+`.tretlineage` records of every workspace, and the time taken to merge the segments written by backups into the index.
+
+Usage:
+    python benchmarks/bench_lineage.py --workspaces 2000 --files 200 --versions 20
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from tret.constants import LINEAGE_FILENAME, TRET_ATTRIBUTES_FILENAME  # noqa: E402
+from tret.core.lineage import (  # noqa: E402
+    find_runs,
+    git_blob_id,
+    update_lineage_index,
+    add_workspace_to_lineage_index,
+)
+
+
+def _scan_workspaces(basedir: str, path: str, blob_id: str) -> list[str]:
+    names = []
+    for name in sorted(os.listdir(basedir)):
+        lineage_filepath = os.path.join(basedir, name, LINEAGE_FILENAME)
+        if os.path.isfile(lineage_filepath):
+            if json.load(open(lineage_filepath, "r", encoding="utf-8"))["files"].get(path) == blob_id:
+                names.append(name)
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workspaces", type=int, default=2000)
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--versions", type=int, default=20, help="Number of versions of each file across workspaces.")
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as basedir:
+        paths = [f"src/module_{i}.py" for i in range(args.files)]
+        versions = {path: [git_blob_id(f"{path} {version}".encode("utf-8")) for version in range(args.versions)] for path in paths}
+        start = time.perf_counter()
+        for i in range(args.workspaces):
+            workspace_dir = os.path.join(basedir, f"run-{i}")
+            os.makedirs(workspace_dir)
+            lineage = {"files": {path: rng.choice(versions[path]) for path in paths}, "snippets": {}}
+            with open(os.path.join(workspace_dir, LINEAGE_FILENAME), "w", encoding="utf-8") as fout:
+                json.dump(lineage, fout)
+            with open(os.path.join(workspace_dir, TRET_ATTRIBUTES_FILENAME), "w", encoding="utf-8") as fout:
+                json.dump({"backup_timestamp": i}, fout)
+            add_workspace_to_lineage_index(basedir, f"run-{i}", workspace_dir)
+        print(f"recorded {args.workspaces} backups: {(time.perf_counter() - start) / args.workspaces * 1000:.2f}ms per backup")
+
+        start = time.perf_counter()
+        update_lineage_index(basedir)
+        print(f"merged into the index:   {time.perf_counter() - start:8.2f}s")
+
+        path, blob_id = paths[0], versions[paths[0]][0]
+        start = time.perf_counter()
+        expected = _scan_workspaces(basedir, path, blob_id)
+        print(f"scanning workspaces:     {(time.perf_counter() - start) * 1000:8.1f}ms, {len(expected)} runs")
+        for query_path in [path, "module_0.py"]:
+            start = time.perf_counter()
+            runs = find_runs(basedir, query_path, blob_id=blob_id[:7])
+            elapsed = time.perf_counter() - start
+            assert sorted(run["workspace"] for run in runs) == sorted(expected)
+            print(f"which-runs {query_path:<14} {elapsed * 1000:8.1f}ms, {len(runs)} runs")
+
+
+if __name__ == "__main__":
+    main()
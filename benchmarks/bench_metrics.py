@@ -0,0 +1,62 @@
+"""
+Measures the cost of `TretWorkspace.log_metrics` per training step, against appending one JSON line per step to a
+file, and the time `tret metrics` takes to reduce one metric across many workspaces.
+
+Usage:
+    python benchmarks/bench_metrics.py --steps 100000 --workspaces 200
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from tret.core.metrics import MetricsLogger, aggregate_metric  # noqa: E402
+
+
+def _log_jsonl(filepath: str, steps: int) -> float:
+    start = time.perf_counter()
+    with open(filepath, "a") as fout:
+        for step in range(steps):
+            fout.write(json.dumps({"step": step, "loss": 1.0 / (step + 1), "lr": 0.1, "grad_norm": 1.5}) + "\n")
+            fout.flush()
+    return time.perf_counter() - start
+
+
+def _log_metrics(workspace_dir: str, steps: int) -> float:
+    start = time.perf_counter()
+    logger = MetricsLogger(workspace_dir)
+    for step in range(steps):
+        logger.log(step, {"loss": 1.0 / (step + 1), "lr": 0.1, "grad_norm": 1.5})
+    logger.close()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=100000)
+    parser.add_argument("--workspaces", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        elapsed = _log_jsonl(os.path.join(temp_dir, "metrics.jsonl"), args.steps)
+        print(f"json lines      {elapsed / args.steps * 1e6:6.2f}us per step")
+        elapsed = _log_metrics(os.path.join(temp_dir, "run"), args.steps)
+        print(f"log_metrics     {elapsed / args.steps * 1e6:6.2f}us per step")
+
+        workspace_dirs = [os.path.join(temp_dir, f"run-{i}") for i in range(args.workspaces)]
+        for workspace_dir in workspace_dirs:
+            _log_metrics(workspace_dir, args.steps // 10)
+        for reduction in ["last", "min", "mean"]:
+            start = time.perf_counter()
+            results = aggregate_metric(workspace_dirs, "loss", reduction=reduction, max_workers=args.workers)
+            elapsed = time.perf_counter() - start
+            print(f"{reduction:<4} over {len(results)} workspaces of {args.steps // 10} steps: {elapsed * 1000:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Measures the startup latency of a Python command launched by `tret run`, i.e. with the site hook which records its
+modules at exit, against the same command launched directly, and the time the launcher takes to finish the backup
+after the command exits.
+
+Usage:
+    python benchmarks/bench_run_launcher.py --rounds 20
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from tret import TretArguments, TretWorkspace  # noqa: E402
+from tret.core.launcher import run_experiment, _prepare_site_hook  # noqa: E402
+
+# prints the time between the launch and the first line of the command, measured by the command itself
+STARTUP_PROBE = "import sys, time; print(time.time() - float(sys.argv[1]))"
+
+
+def _startup_latency(environment: dict) -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", STARTUP_PROBE, repr(time.time())], env=environment, stdout=subprocess.PIPE, check=True,
+    ).stdout
+    return float(output)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        hooked_environment = _prepare_site_hook(os.path.join(temp_dir, "hook"))
+        for label, environment in [("direct", dict(os.environ)), ("site hook", hooked_environment)]:
+            latencies = [_startup_latency(environment) for _ in range(args.rounds)]
+            print(f"{label:<10} startup: median {statistics.median(latencies) * 1000:6.1f}ms, min {min(latencies) * 1000:6.1f}ms")
+
+        project_dir = os.path.join(temp_dir, "project")
+        os.makedirs(project_dir)
+        with open(os.path.join(project_dir, "train.py"), "w") as fout:
+            fout.write("import json\n")
+        os.chdir(project_dir)
+        workspace = TretWorkspace(TretArguments(workspace_name="bench", force_backup_codes_as_tarball=True, use_daemon=False))
+        start = time.perf_counter()
+        run_experiment([sys.executable, "train.py"], workspace)
+        print(f"tret run of an empty script, including the backup: {(time.perf_counter() - start) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Counts the metadata operations a backup does on the workspace base directory, written directly (as on a shared NFS or
+Lustre home) and through a node-local staging directory (`TretArguments.staging_dir`), which publishes the workspace
+as a single pack. Operations are counted through audit events (opens, mkdir, rename, remove, symlink, listdir, chmod,
+utime, ...) on paths under the base directory; `stat` calls are not audited and not counted.
+
+Usage:
+    python benchmarks/bench_staged_backup.py --num-files 2000 --rounds 3
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import collections
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from tret import TretArguments, TretWorkspace  # noqa: E402
+
+METADATA_AUDIT_EVENTS = frozenset([
+    "open", "os.mkdir", "os.rename", "os.remove", "os.rmdir", "os.symlink", "os.link", "os.listdir", "os.scandir",
+    "os.chmod", "os.chown", "os.utime", "os.truncate", "shutil.copyfile", "shutil.copymode", "shutil.copystat",
+])
+_counts = collections.Counter()
+_counted_prefix = None
+
+
+def _audit_hook(event: str, args: tuple):
+    if _counted_prefix is None or event not in METADATA_AUDIT_EVENTS or not args:
+        return
+    path = args[0]
+    if isinstance(path, (str, bytes, os.PathLike)) and os.fsdecode(os.fspath(path)).startswith(_counted_prefix):
+        _counts[event] += 1
+
+
+def _backup(project_dir: str, basedir: str, name: str, staging_dir: str = None) -> tuple[float, collections.Counter]:
+    global _counted_prefix
+    _counts.clear()
+    _counted_prefix = os.path.join(basedir, "")
+    start = time.perf_counter()
+    workspace = TretWorkspace(TretArguments(
+        workspace_basedir=basedir,
+        workspace_name=name,
+        staging_dir=staging_dir,
+        force_backup_codes_as_tarball=True,
+        use_daemon=False,
+    ))
+    workspace.backup(
+        datafiles_to_backup=[os.path.join(project_dir, "configs")],
+        datafiles_to_backup_as_tarball=[os.path.join(project_dir, "samples")],
+        datafiles_to_backup_as_symlink=[os.path.join(project_dir, "checkpoint.bin")],
+    )
+    elapsed = time.perf_counter() - start
+    _counted_prefix = None
+    return elapsed, collections.Counter(_counts)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-files", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--basedir", default=None, help="The (shared) workspace base directory. Defaults to a temporary directory.")
+    args = parser.parse_args()
+    sys.addaudithook(_audit_hook)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        project_dir = os.path.join(temp_dir, "project")
+        for dirname in ["configs", "samples"]:
+            os.makedirs(os.path.join(project_dir, dirname))
+            for i in range(args.num_files // 2):
+                with open(os.path.join(project_dir, dirname, f"{i}.json"), "w") as fout:
+                    fout.write(f"{{\"id\": {i}}}")
+        with open(os.path.join(project_dir, "checkpoint.bin"), "wb") as fout:
+            fout.write(os.urandom(1024))
+        basedir = args.basedir or os.path.join(temp_dir, "shared")
+        os.chdir(project_dir)
+
+        for round_index in range(args.rounds):
+            for mode, staging_dir in [("direct", None), ("staged", os.path.join(temp_dir, "scratch"))]:
+                elapsed, counts = _backup(project_dir, basedir, f"{mode}-{round_index}", staging_dir)
+                top_events = ", ".join(f"{event} {count}" for event, count in counts.most_common(4))
+                print(f"{mode:<7} {elapsed * 1000:8.1f}ms, {sum(counts.values()):6d} metadata ops ({top_events})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
-from .core import TretWorkspace
+from .core import TretWorkspace, TieringPolicy
 from .arguments import TretArguments
 
 __all__ = [
     "TretWorkspace",
     "TretArguments",
+    "TieringPolicy",
 ]
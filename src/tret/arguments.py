@@ -19,6 +19,13 @@ class TretArguments:
         default=None,
         metadata={"help": "The name of current workspace. Defaults to current datetime."},
     )
+    staging_dir: str = dataclasses.field(
+        default=None,
+        metadata={"help": "A node-local directory (e.g. on tmpfs or a local SSD) where workspaces are built, and then published "
+                          "into 'workspace_basedir' as a single pack at the end of every backup. Suited for workspace base "
+                          "directories on NFS or Lustre, where metadata operations are slow. Defaults to None, i.e., "
+                          "workspaces are written into 'workspace_basedir' directly."},
+    )
     create_directory: bool = dataclasses.field(
         default=True,
         metadata={"help": "Whether to create workspace directory if not exists. Defaults to 'True'."},
@@ -29,3 +36,41 @@ class TretArguments:
         default=False,
         metadata={"help": "Whether to forcely backup codes as a tarball regardless the existence of git. Defaults to 'False'."},
     )
+    add_wheels_to_wheelhouse: bool = dataclasses.field(
+        default=False,
+        metadata={"help": "Whether to add wheels of the recorded requirements to the wheelhouse of the workspace base directory, "
+                          "so that `tret env build` can rebuild the environment offline. Defaults to 'False'."},
+    )
+    backup_bytecode: bool = dataclasses.field(
+        default=False,
+        metadata={"help": "Whether to also back up hash-based pycs of the backed up Python codes for this interpreter, "
+                          "so that `restore(bytecode='reuse')` does not compile the restored codes again. Defaults to 'False'."},
+    )
+    track_opened_files: bool = dataclasses.field(
+        default=False,
+        metadata={"help": "Whether to record the files under the working directory which the experiment opens for reading, "
+                          "e.g. configs and templates, through an audit hook, and back them up with the codes "
+                          "(or into the data tarball if larger than 1MiB). Defaults to 'False'."},
+    )
+
+    # daemon arguments
+    use_daemon: bool = dataclasses.field(
+        default=False,
+        metadata={"help": "Whether to send backups and restores to a running `tret daemon` of this environment. "
+                          "Without a running daemon, they are always done in process. Defaults to 'False'."},
+    )
+
+    # storage arguments
+    storage_url: str = dataclasses.field(
+        default=None,
+        metadata={"help": "Where workspaces are persisted, e.g. 's3://bucket/prefix'. "
+                          "Defaults to None, i.e., only the local 'workspace_basedir' is used."},
+    )
+    storage_endpoint_url: str = dataclasses.field(
+        default=None,
+        metadata={"help": "Endpoint of S3-compatible storages such as MinIO. Defaults to None."},
+    )
+    storage_max_workers: int = dataclasses.field(
+        default=8,
+        metadata={"help": "Number of concurrent requests to the storage. Defaults to '8'."},
+    )
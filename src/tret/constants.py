@@ -2,18 +2,56 @@
 DEFAULT_WORKSPACE_DIR = "tret-workspaces"
 TRET_ATTRIBUTES_FILENAME = ".tretattributes"
 
+# entries of the workspace base directory which are not workspaces start with this prefix
+TRET_INTERNAL_PREFIX = ".tret-"
+TRET_PACKS_DIRNAME = ".tret-packs"
+# chunks referenced by staged backups which have not been published yet, so that gc keeps them
+TRET_STAGED_CHUNKS_DIRNAME = ".tret-staged-chunks"
+TRET_GC_LOCK_FILENAME = ".tret-gc.lock"
+TRET_GC_STATE_FILENAME = ".tret-gc-state.json"
+TRET_SCRUB_STATE_FILENAME = ".tret-scrub-state.json"
+CHUNK_STORE_DIRNAME = ".tret-chunks"
+WHEELHOUSE_DIRNAME = ".tret-wheelhouse"
+ENVIRONMENTS_DIRNAME = ".tret-envs"
+# staging directories of `tret import`, and repositories keeping the imported commits of repositories which are not here
+TRET_IMPORT_PREFIX = ".tret-import-"
+TRET_GIT_DIRNAME = ".tret-git"
+# index of the versions of the code files each workspace has backed up, queried by `tret which-runs`
+TRET_LINEAGE_DIRNAME = ".tret-lineage"
+
 # requirements.txt filename
 REQUIREMENTS_TXT_FILENAME = "tret-requirements.txt"
 
 # code tarball names
 CODES_TARBALL_FILENAME = "codes.tar.gz"
 CURRENT_CODES_TARBALL_FILENAME = "current-codes.tar.gz"
+RESTORE_JOURNAL_MEMBERNAME = ".tret-restore-journal"
+# hash-based pycs of the backed up codes, for the interpreter with this cache tag, e.g. `bytecode-cpython-311.tar.gz`
+BYTECODE_TARBALL_FILENAME_TEMPLATE = "bytecode-{cache_tag}.tar.gz"
 
 # data tarball names
 DATA_TARBALL_FILENAME = "data.tar.gz"
+# recipes of data files backed up into the chunk store
+CHUNK_RECIPES_FILENAME = "chunks.json"
+
+# outputs checkpointed by `TretWorkspace.watch`
+OUTPUTS_DIRNAME = "outputs"
+OUTPUTS_MANIFEST_FILENAME = ".tretoutputs"
+
+# scalar metrics logged by `TretWorkspace.log_metrics`
+METRICS_DIRNAME = "metrics"
+
+# command line, working directory and environment of experiments launched by `tret run`
+RUN_INFO_FILENAME = ".tretrun"
+
+# versions of the code files backed up into a workspace
+LINEAGE_FILENAME = ".tretlineage"
 
 # git info names
 GIT_INFO_FILENAME = ".gitinfo"
 GIT_REPO_PATH_KEYNAME = "GIT_REPO_PATH"
 GIT_DIFF_INFO_KEYNAME = "GIT_DIFF_INFO"
 GIT_COMMIT_HASH_KEYNAME = "GIT_COMMIT_HASH"
+
+# gitignore-style patterns of files excluded from backups
+TRETIGNORE_FILENAME = ".tretignore"
@@ -1 +1,2 @@
 from .main_class import TretWorkspace
+from .data_tiering import TieringPolicy
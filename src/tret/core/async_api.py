@@ -0,0 +1,104 @@
+import os
+import json
+import asyncio
+import threading
+import concurrent.futures
+from typing import Optional
+from ..constants import DEFAULT_WORKSPACE_DIR, TRET_ATTRIBUTES_FILENAME
+from ..utils.io_limits import set_io_limits, cancellation_scope, check_cancelled
+from .garbage_collection import list_workspaces
+
+# blocking work of all the coroutines runs in one executor, so that it is bounded however many tasks are created
+DEFAULT_MAX_WORKERS = 32
+
+_max_workers = DEFAULT_MAX_WORKERS
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def configure_async_io(
+    max_workers: Optional[int] = None,
+    max_compressions: Optional[int] = None,
+    max_disk_bandwidth: Optional[float] = None,
+    max_git_processes: Optional[int] = None,
+):
+    """
+    Sets the size of the executor shared by the coroutines of tret, and the limits shared by all the backups and
+    restores of this process, see `tret.utils.io_limits.set_io_limits`. Running operations are not affected.
+
+    Args:
+        max_workers (int, optional): Maximum number of blocking operations running at the same time. Defaults to None, i.e., 32.
+        max_compressions (int, optional): Maximum number of tarballs or chunks compressed at the same time. Defaults to None, i.e., no limit.
+        max_disk_bandwidth (float, optional): Maximum bytes per second written by tarballs, data copies and chunks. Defaults to None, i.e., no limit.
+        max_git_processes (int, optional): Maximum number of git commands run at the same time. Defaults to None, i.e., no limit.
+    """
+    global _max_workers, _executor
+    with _executor_lock:
+        _max_workers = max_workers or DEFAULT_MAX_WORKERS
+        previous_executor, _executor = _executor, None
+    if previous_executor is not None:
+        # operations submitted before still run to completion
+        previous_executor.shutdown(wait=False)
+    set_io_limits(max_compressions=max_compressions, max_disk_bandwidth=max_disk_bandwidth, max_git_processes=max_git_processes)
+
+
+def get_io_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """Returns the executor shared by the coroutines of tret, created on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=_max_workers, thread_name_prefix="tret-io")
+            # all the workers are started now: `submit` starts a missing worker and waits for it to be scheduled,
+            # which blocks the event loop for up to a few switch intervals per worker once the others are busy
+            barrier = threading.Barrier(_max_workers + 1)
+            for _ in range(_max_workers):
+                _executor.submit(barrier.wait)
+            barrier.wait()
+        return _executor
+
+
+async def run_in_io_executor(function, *args, **kwargs):
+    """
+    Runs a blocking function in the shared executor without blocking the event loop.
+
+    Cancelling the awaiting task cancels the function: if it has not started yet, it never runs, otherwise it raises
+    `concurrent.futures.CancelledError` at its next cancellation point (before each git command, compression and
+    write of a limited size), and the task waits for it to stop before being cancelled, so that the slots it holds
+    are released and no file is left half-written. A function with no cancellation point left runs to completion.
+    """
+    cancel_event = threading.Event()
+
+    def _run():
+        with cancellation_scope(cancel_event):
+            check_cancelled()
+            return function(*args, **kwargs)
+
+    concurrent_future = get_io_executor().submit(_run)
+    future = asyncio.wrap_future(concurrent_future)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        cancel_event.set()
+        if not concurrent_future.cancel():
+            await asyncio.wait([future])
+        raise
+
+
+def _read_attributes(workspace_dir: str) -> dict:
+    with open(os.path.join(workspace_dir, TRET_ATTRIBUTES_FILENAME), "r", encoding="utf-8") as fin:
+        return json.load(fin)
+
+
+async def alist(workspace_basedir: str = DEFAULT_WORKSPACE_DIR) -> list[dict]:
+    """Coroutine version of `tret.core.garbage_collection.list_workspaces`."""
+    return await run_in_io_executor(list_workspaces, workspace_basedir)
+
+
+async def aread_attributes(workspace_dir: str) -> dict:
+    """
+    Reads the `.tretattributes` of a workspace, i.e. its backup time, metadata and manifest.
+
+    Raises:
+        FileNotFoundError: If the backup of the workspace has not completed.
+    """
+    return await run_in_io_executor(_read_attributes, workspace_dir)
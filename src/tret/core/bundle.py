@@ -0,0 +1,563 @@
+import os
+import sys
+import json
+import stat
+import zlib
+import shutil
+import struct
+import hashlib
+import tempfile
+import warnings
+import subprocess
+from typing import BinaryIO, Optional, Union
+from ..constants import (
+    TRET_ATTRIBUTES_FILENAME,
+    TRET_INTERNAL_PREFIX,
+    TRET_IMPORT_PREFIX,
+    TRET_GIT_DIRNAME,
+    CHUNK_STORE_DIRNAME,
+    GIT_INFO_FILENAME,
+    GIT_REPO_PATH_KEYNAME,
+    GIT_COMMIT_HASH_KEYNAME,
+)
+from .chunk_store import (
+    load_chunk_recipes,
+    get_chunk_store_dir,
+    _chunk_filepath,
+    ZLIB_CHUNK_PREFIX,
+)
+from .data_restore import _link_file, _remove_existing
+from ..utils.file_utils import atomic_open
+from ..utils.git_utils import get_git_repository, write_gitinfo
+from ..utils.tarball_utils import _is_inside
+
+BUNDLE_MAGIC = b"TRETBUNDLE\x00\x01"
+BUNDLE_FORMAT_VERSION = 1
+# every frame is its kind, the length and the CRC-32 of its payload, followed by the payload
+FRAME_HEADER = struct.Struct(">4sQI")
+FRAME_HEAD = b"HEAD"
+FRAME_GIT_BUNDLE = b"GITB"
+FRAME_CHUNK = b"CHNK"
+FRAME_FILE = b"FILE"
+FRAME_LINK = b"LINK"
+FRAME_DATA = b"DATA"
+FRAME_INDEX = b"INDX"
+# contents of files and git bundles are split into DATA frames of at most this size, which is the granularity of resuming
+BUNDLE_BLOCK_SIZE = 4 * 1024 * 1024
+# the progress of an import is saved at least every this many bytes, and whenever the import stops
+IMPORT_STATE_SAVE_BYTES = 256 * 1024 * 1024
+IMPORT_STATE_FILENAME = ".tret-import-state.json"
+BUNDLE_GIT_REF_PREFIX = "refs/tret/snapshots/"
+READ_SIZE = 1024 * 1024
+
+
+def _pack_frame_header(kind: bytes, payload: bytes) -> bytes:
+    return FRAME_HEADER.pack(kind, len(payload), zlib.crc32(payload))
+
+
+def _chain_digest(digest: str, frame_header: bytes) -> str:
+    """The digest of all the frames so far, chained over their headers, which include the CRC-32 of the payloads."""
+    return hashlib.sha256(bytes.fromhex(digest) + frame_header).hexdigest()
+
+
+def _hash_file(filepath: str) -> str:
+    hasher = hashlib.sha256()
+    with open(filepath, "rb") as fin:
+        while data := fin.read(READ_SIZE):
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+def _list_workspace_entries(workspace_dir: str) -> list[tuple[str, str]]:
+    """Lists the files and symbolic links of a workspace in a deterministic order, as (relative path, path)."""
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(workspace_dir):
+        dirnames.sort()
+        # symbolic links to directories are listed in `dirnames` but not followed by `os.walk`
+        for name in sorted(filenames + [dirname for dirname in dirnames if os.path.islink(os.path.join(dirpath, dirname))]):
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path) or stat.S_ISREG(os.lstat(path).st_mode):
+                entries.append((os.path.relpath(path, workspace_dir), path))
+    return entries
+
+
+def _iter_blocks(filepath: str):
+    with open(filepath, "rb") as fin:
+        while block := fin.read(BUNDLE_BLOCK_SIZE):
+            yield block
+
+
+def _create_git_bundle(git_dir: str, commits: list[str], output: str) -> list[str]:
+    """
+    Creates a git bundle of `commits`, each under a ref `refs/tret/snapshots/<commit>`. The refs are created in a
+    temporary repository borrowing the objects of `git_dir` through alternates, so the repository itself is not modified.
+
+    Returns:
+        list[str]: The commits in the bundle, commits which do not exist in the repository are skipped with a warning.
+    """
+    repo = get_git_repository(git_dir)
+    existing_commits = [commit for commit in commits if repo.object_type(f"{commit}^{{commit}}") == "commit"]
+    missing_commits = sorted(set(commits) - set(existing_commits))
+    if missing_commits:
+        warnings.warn(f"Commits {missing_commits} do not exist in '{git_dir}' and are not exported.")
+    if not existing_commits:
+        return []
+    with tempfile.TemporaryDirectory(prefix=TRET_INTERNAL_PREFIX) as temp_git_dir:
+        subprocess.run(["git", "init", "-q", "--bare", temp_git_dir], check=True, stdout=subprocess.DEVNULL)
+        with open(os.path.join(temp_git_dir, "objects", "info", "alternates"), "w", encoding="utf-8") as fout:
+            fout.write(os.path.join(repo.common_dir, "objects") + "\n")
+        for commit in existing_commits:
+            subprocess.run(
+                ["git", "--git-dir", temp_git_dir, "update-ref", f"{BUNDLE_GIT_REF_PREFIX}{commit}", commit], check=True,
+            )
+        subprocess.run(
+            ["git", "--git-dir", temp_git_dir, "bundle", "create", "-q", os.path.abspath(output), "--all"],
+            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+    return existing_commits
+
+
+def _iter_export_frames(workspace_dirs: list[str], temp_dir: str):
+    """Yields the (kind, payload) of all the frames of a bundle but its index, in a deterministic order."""
+    names = [os.path.basename(workspace_dir) for workspace_dir in workspace_dirs]
+    bundle_hasher = hashlib.sha256()
+    for name, workspace_dir in zip(names, workspace_dirs):
+        with open(os.path.join(workspace_dir, TRET_ATTRIBUTES_FILENAME), "rb") as fin:
+            bundle_hasher.update(name.encode("utf-8") + b"\0" + fin.read())
+    head = {"version": BUNDLE_FORMAT_VERSION, "bundle_id": bundle_hasher.hexdigest(), "workspaces": names}
+    yield FRAME_HEAD, json.dumps(head).encode("utf-8")
+
+    # the snapshot commits of every repository, so that codes can be restored where the commits have not been pushed
+    commits_by_git_dir = {}
+    for workspace_dir in workspace_dirs:
+        gitinfo_filepath = os.path.join(workspace_dir, GIT_INFO_FILENAME)
+        if os.path.isfile(gitinfo_filepath):
+            gitinfo = json.load(open(gitinfo_filepath, "r", encoding="utf-8"))
+            commits_by_git_dir.setdefault(gitinfo[GIT_REPO_PATH_KEYNAME], set()).add(gitinfo[GIT_COMMIT_HASH_KEYNAME])
+    for i, (git_dir, commits) in enumerate(sorted(commits_by_git_dir.items())):
+        if not os.path.isdir(git_dir):
+            warnings.warn(f"The repository '{git_dir}' does not exist, the commits of its workspaces are not exported.")
+            continue
+        git_bundle_filepath = os.path.join(temp_dir, f"{i}.bundle")
+        commits = _create_git_bundle(git_dir, sorted(commits), git_bundle_filepath)
+        if commits:
+            header = {"git_dir": git_dir, "commits": commits, "size": os.path.getsize(git_bundle_filepath)}
+            yield FRAME_GIT_BUNDLE, json.dumps(header).encode("utf-8")
+            for block in _iter_blocks(git_bundle_filepath):
+                yield FRAME_DATA, block
+
+    # chunks are stored once however many workspaces reference them, as they are stored in the chunk store
+    chunk_store_dirs = {}
+    for workspace_dir in workspace_dirs:
+        for recipe in load_chunk_recipes(os.path.join(workspace_dir, "data")).values():
+            for chunk_hash, _ in recipe["chunks"]:
+                chunk_store_dirs.setdefault(chunk_hash, get_chunk_store_dir(workspace_dir))
+    for chunk_hash, chunk_store_dir in sorted(chunk_store_dirs.items()):
+        with open(_chunk_filepath(chunk_store_dir, chunk_hash), "rb") as fin:
+            yield FRAME_CHUNK, chunk_hash.encode("ascii") + fin.read()
+
+    # only files whose size is shared with another file can be duplicates, so only those are hashed
+    entries = [
+        (name, relpath, path, os.lstat(path))
+        for name, workspace_dir in zip(names, workspace_dirs)
+        for relpath, path in _list_workspace_entries(workspace_dir)
+    ]
+    size_counts = {}
+    for _, _, path, path_stat in entries:
+        if stat.S_ISREG(path_stat.st_mode) and path_stat.st_size > 0:
+            size_counts[path_stat.st_size] = size_counts.get(path_stat.st_size, 0) + 1
+    first_by_content = {}
+    for name, relpath, path, path_stat in entries:
+        if stat.S_ISLNK(path_stat.st_mode):
+            yield FRAME_LINK, json.dumps({"workspace": name, "path": relpath, "target": os.readlink(path)}).encode("utf-8")
+            continue
+        header = {
+            "workspace": name,
+            "path": relpath,
+            "size": path_stat.st_size,
+            "mode": stat.S_IMODE(path_stat.st_mode),
+            "mtime_ns": path_stat.st_mtime_ns,
+        }
+        if size_counts.get(path_stat.st_size, 0) > 1:
+            content_key = (path_stat.st_size, _hash_file(path))
+            if content_key in first_by_content:
+                header["same_as"] = first_by_content[content_key]
+            else:
+                first_by_content[content_key] = [name, relpath]
+        yield FRAME_FILE, json.dumps(header).encode("utf-8")
+        if "same_as" not in header:
+            for block in _iter_blocks(path):
+                yield FRAME_DATA, block
+
+
+def _read_frame(fin: BinaryIO) -> Optional[tuple[bytes, bytes, bytes]]:
+    """
+    Reads the next frame.
+
+    Returns:
+        tuple: The frame header, kind and payload, or None at the end of the stream, including in a truncated frame.
+
+    Raises:
+        ValueError: If the payload does not match its CRC-32.
+    """
+    frame_header = fin.read(FRAME_HEADER.size)
+    if len(frame_header) < FRAME_HEADER.size:
+        return None
+    kind, length, crc = FRAME_HEADER.unpack(frame_header)
+    payload = fin.read(length)
+    if len(payload) < length:
+        return None
+    if zlib.crc32(payload) != crc:
+        raise ValueError(f"The {kind!r} frame is corrupted.")
+    return frame_header, kind, payload
+
+
+def _read_good_frame_headers(bundle_path: str) -> list[bytes]:
+    """Reads the headers of the frames of a partial bundle, up to the first truncated or corrupted frame."""
+    frame_headers = []
+    with open(bundle_path, "rb") as fin:
+        if fin.read(len(BUNDLE_MAGIC)) != BUNDLE_MAGIC:
+            return frame_headers
+        while True:
+            try:
+                frame = _read_frame(fin)
+            except ValueError:
+                break
+            if frame is None:
+                break
+            frame_headers.append(frame[0])
+    return frame_headers
+
+
+def export_bundle(workspace_dirs: list[str], output: str, resume: bool = True) -> dict:
+    """
+    Exports workspaces into a single bundle file, which is written and read sequentially, so that many workspaces
+    can be moved between nodes without copying their files one by one, e.g. `tret export ... -o - | ssh node tret import -`.
+
+    The bundle is a sequence of frames, each checksummed with CRC-32: a header listing the workspaces, a git bundle of
+    the snapshot commits of each repository recorded in `.gitinfo`, the chunks referenced by the workspaces, and then
+    the files and symbolic links of every workspace, where identical files are stored once. It ends with an index
+    of the number of frames and a digest chained over all of them.
+
+    The bundle is written into `<output>.partial` first. Since frames are produced in a deterministic order, an
+    interrupted export resumes after the longest prefix of frames of the partial bundle which are still identical.
+
+    Args:
+        workspace_dirs (list[str]): The workspaces to export, with distinct names.
+        output (str): The path of the bundle, or "-" for the standard output.
+        resume (bool, optional): Whether to resume from `<output>.partial`. Defaults to True.
+
+    Returns:
+        dict: The exported `workspaces`, the number of `frames`, the bundle `bytes`, and the `reused_bytes` of the partial bundle.
+    """
+    workspace_dirs = [os.path.abspath(workspace_dir) for workspace_dir in workspace_dirs]
+    names = [os.path.basename(workspace_dir) for workspace_dir in workspace_dirs]
+    assert len(set(names)) == len(names), f"Workspaces with the same name cannot be exported together: {names}."
+    for workspace_dir in workspace_dirs:
+        assert os.path.isfile(os.path.join(workspace_dir, TRET_ATTRIBUTES_FILENAME)), \
+            f"Workspace '{workspace_dir}' does not exist or its backup has not completed."
+
+    with tempfile.TemporaryDirectory(prefix=TRET_INTERNAL_PREFIX) as temp_dir:
+        frames = _iter_export_frames(workspace_dirs, temp_dir)
+        if output == "-":
+            return _write_bundle(sys.stdout.buffer, frames, names, [])
+        partial_filepath = f"{output}.partial"
+        kept_frame_headers = _read_good_frame_headers(partial_filepath) if resume and os.path.isfile(partial_filepath) else []
+        with open(partial_filepath, "r+b" if kept_frame_headers else "wb") as fout:
+            report = _write_bundle(fout, frames, names, kept_frame_headers)
+            fout.truncate()
+        os.replace(partial_filepath, output)
+    return report
+
+
+def _write_bundle(fout: BinaryIO, frames, names: list[str], kept_frame_headers: list[bytes]) -> dict:
+    offset, reused_bytes, digest, num_frames = len(BUNDLE_MAGIC), 0, "", 0
+    if not kept_frame_headers:
+        fout.write(BUNDLE_MAGIC)
+
+    def _emit(kind: bytes, payload: bytes):
+        nonlocal offset, reused_bytes, digest, num_frames
+        frame_header = _pack_frame_header(kind, payload)
+        if num_frames < len(kept_frame_headers) and kept_frame_headers[num_frames] == frame_header:
+            # the frame is already in the partial bundle
+            reused_bytes += len(frame_header) + len(payload)
+        else:
+            if kept_frame_headers:
+                # frames after the first differing one are rewritten
+                fout.seek(offset)
+                kept_frame_headers.clear()
+            fout.write(frame_header)
+            fout.write(payload)
+        offset += len(frame_header) + len(payload)
+        digest = _chain_digest(digest, frame_header)
+        num_frames += 1
+
+    for kind, payload in frames:
+        _emit(kind, payload)
+    _emit(FRAME_INDEX, json.dumps({"frames": num_frames, "digest": digest}).encode("utf-8"))
+    if kept_frame_headers:
+        fout.seek(offset)
+    fout.flush()
+    return {"workspaces": names, "frames": num_frames, "bytes": offset, "reused_bytes": reused_bytes}
+
+
+def _is_workspace_name(name: str) -> bool:
+    return name not in ("", ".", "..") and os.sep not in name and "/" not in name and not name.startswith(TRET_INTERNAL_PREFIX)
+
+
+def _check_staged_path(staging_dir: str, workspace_name: str, relpath: str) -> str:
+    """
+    Returns the path of a file of a workspace inside the staging directory.
+
+    Raises:
+        ValueError: If the path would be outside of the staged workspace, e.g. through `..` or a symbolic link.
+    """
+    if not _is_workspace_name(workspace_name):
+        raise ValueError(f"Invalid workspace name {workspace_name!r} in the bundle.")
+    root = os.path.realpath(os.path.join(staging_dir, workspace_name))
+    path = os.path.normpath(os.path.join(root, relpath))
+    if os.path.isabs(relpath) or not _is_inside(root, path) or path == root:
+        raise ValueError(f"Invalid path {relpath!r} of workspace '{workspace_name}' in the bundle.")
+    # the nearest existing parent is resolved before creating the missing ones
+    existing_dir = os.path.dirname(path)
+    while not os.path.lexists(existing_dir):
+        existing_dir = os.path.dirname(existing_dir)
+    if not _is_inside(root, os.path.realpath(existing_dir)):
+        raise ValueError(f"Path {relpath!r} of workspace '{workspace_name}' in the bundle is outside of the workspace.")
+    return path
+
+
+def _staged_path(staging_dir: str, workspace_name: str, relpath: str) -> str:
+    """Like `_check_staged_path`, and prepares the path to be written, i.e. creates its parents and removes it."""
+    path = _check_staged_path(staging_dir, workspace_name, relpath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _remove_existing(path)
+    return path
+
+
+def _copy_duplicate(src: str, dst: str, header: dict):
+    """
+    Restores a file with the same content as an already imported one, through a hard link if it has the same mode,
+    like gc deduplicates code tarballs. The linked file keeps the mtime of the first one.
+    """
+    if stat.S_IMODE(os.stat(src).st_mode) == header["mode"]:
+        _link_file(src, dst)
+        return
+    shutil.copyfile(src, dst)
+    os.chmod(dst, header["mode"])
+    os.utime(dst, ns=(header["mtime_ns"], header["mtime_ns"]))
+
+
+def _fetch_git_bundle(git_bundle_filepath: str, git_dir: str, workspace_basedir: str, git_repo: Optional[str]) -> Optional[str]:
+    """
+    Fetches the snapshot commits of a git bundle into `git_repo`, or into the recorded repository if it exists here,
+    or else into a bare repository under `.tret-git` of the workspace base directory.
+
+    Returns:
+        str: The git directory the imported workspaces should record instead of `git_dir`, or None to keep it.
+    """
+    recorded_git_dir = None
+    if git_repo is not None:
+        repo = get_git_repository(git_repo)
+        recorded_git_dir = repo.git_dir
+    elif os.path.isdir(git_dir):
+        repo = get_git_repository(git_dir)
+    else:
+        git_name = hashlib.sha256(git_dir.encode("utf-8")).hexdigest()[:16]
+        bare_git_dir = os.path.join(workspace_basedir, TRET_GIT_DIRNAME, f"{git_name}.git")
+        if not os.path.isdir(bare_git_dir):
+            subprocess.run(["git", "init", "-q", "--bare", bare_git_dir], check=True, stdout=subprocess.DEVNULL)
+        repo = get_git_repository(bare_git_dir)
+        warnings.warn(
+            f"The repository '{git_dir}' of the imported workspaces does not exist here, their commits are kept in "
+            f"'{bare_git_dir}'. Import again with `git_repo` set to a clone of the project to restore their codes."
+        )
+    repo.run("fetch", "-q", git_bundle_filepath, f"{BUNDLE_GIT_REF_PREFIX}*:{BUNDLE_GIT_REF_PREFIX}*")
+    return recorded_git_dir
+
+
+def _load_import_state(staging_dir: str) -> Optional[dict]:
+    state_filepath = os.path.join(staging_dir, IMPORT_STATE_FILENAME)
+    if not os.path.isfile(state_filepath):
+        return None
+    try:
+        return json.load(open(state_filepath, "r", encoding="utf-8"))
+    except ValueError:
+        return None
+
+
+def _save_import_state(staging_dir: str, state: dict):
+    with atomic_open(os.path.join(staging_dir, IMPORT_STATE_FILENAME), "w", encoding="utf-8") as fout:
+        json.dump(state, fout, ensure_ascii=False)
+
+
+def _skip_bytes(fin: BinaryIO, nbytes: int):
+    if fin.seekable():
+        fin.seek(nbytes, os.SEEK_CUR)
+        return
+    while nbytes > 0:
+        data = fin.read(min(nbytes, READ_SIZE))
+        if not data:
+            break
+        nbytes -= len(data)
+
+
+def _store_imported_chunk(payload: bytes, chunk_store_dir: str):
+    chunk_hash, stored = payload[:64].decode("ascii"), payload[64:]
+    chunk = zlib.decompress(stored[1:]) if stored[:1] == ZLIB_CHUNK_PREFIX else stored[1:]
+    if hashlib.sha256(chunk).hexdigest() != chunk_hash:
+        raise ValueError(f"Chunk {chunk_hash} in the bundle does not match its hash.")
+    chunk_filepath = _chunk_filepath(chunk_store_dir, chunk_hash)
+    if not os.path.isfile(chunk_filepath):
+        os.makedirs(os.path.dirname(chunk_filepath), exist_ok=True)
+        with atomic_open(chunk_filepath, "wb") as fout:
+            fout.write(stored)
+
+
+def import_bundle(source: Union[str, BinaryIO], workspace_basedir: str, git_repo: Optional[str] = None) -> dict:
+    """
+    Imports the workspaces of a bundle written by `export_bundle` into a workspace base directory, while it is read.
+
+    Chunks are written into the chunk store of the base directory and files into a staging directory
+    `.tret-import-<bundle id>`, whose workspaces are moved into the base directory once the index at the end of the
+    bundle has been verified. The snapshot commits are fetched into a repository (see `_fetch_git_bundle`), and the
+    `.gitinfo` of the workspaces is updated if it is `git_repo`.
+
+    The progress is saved in the staging directory whenever the import stops, e.g. at the end of a bundle which has
+    only been partly transferred so far. Importing the same bundle again resumes after the last completely imported item.
+
+    Args:
+        source (str | BinaryIO): The path of the bundle, "-" for the standard input, or a binary file object.
+        workspace_basedir (str): The base directory to import the workspaces into.
+        git_repo (str, optional): A clone of the project to fetch the snapshot commits into. Defaults to None.
+
+    Raises:
+        FileExistsError: If a workspace of the bundle already exists in the base directory.
+        ValueError: If the bundle is corrupted or invalid.
+
+    Returns:
+        dict: The `workspaces` of the bundle, whether the import is `complete`, and the `offset` imported up to.
+    """
+    if isinstance(source, str):
+        with (open(source, "rb") if source != "-" else open(sys.stdin.fileno(), "rb", closefd=False)) as fin:
+            return import_bundle(fin, workspace_basedir, git_repo=git_repo)
+
+    fin = source
+    if fin.read(len(BUNDLE_MAGIC)) != BUNDLE_MAGIC:
+        raise ValueError("The input is not a tret bundle.")
+    frame = _read_frame(fin)
+    if frame is None or frame[1] != FRAME_HEAD:
+        raise ValueError("The bundle does not start with its header.")
+    head = json.loads(frame[2])
+    if head["version"] > BUNDLE_FORMAT_VERSION:
+        raise ValueError(f"The bundle has format version {head['version']}, which is newer than this version of tret.")
+    names = head["workspaces"]
+    for name in names:
+        if not _is_workspace_name(name):
+            raise ValueError(f"Invalid workspace name {name!r} in the bundle.")
+
+    staging_dir = os.path.join(workspace_basedir, f"{TRET_IMPORT_PREFIX}{head['bundle_id'][:16]}")
+    state = _load_import_state(staging_dir)
+    offset = len(BUNDLE_MAGIC) + len(frame[0]) + len(frame[2])
+    if state is None:
+        existing_names = [name for name in names if os.path.lexists(os.path.join(workspace_basedir, name))]
+        if existing_names:
+            raise FileExistsError(f"Workspaces {existing_names} already exist in '{workspace_basedir}'.")
+        state = {"offset": offset, "frames": 1, "digest": _chain_digest("", frame[0]), "git": {}}
+        for name in names:
+            os.makedirs(os.path.join(staging_dir, name), exist_ok=True)
+    else:
+        _skip_bytes(fin, state["offset"] - offset)
+        offset = state["offset"]
+    chunk_store_dir = os.path.join(workspace_basedir, CHUNK_STORE_DIRNAME)
+
+    # the item (file or git bundle) whose DATA frames are being read
+    item, fout, remaining = None, None, 0
+    digest, num_frames, saved_offset = state["digest"], state["frames"], state["offset"]
+    complete = False
+
+    def _finish_item():
+        nonlocal item, fout
+        fout.close()
+        if item["kind"] == FRAME_GIT_BUNDLE:
+            state["git"][item["git_dir"]] = _fetch_git_bundle(item["path"], item["git_dir"], workspace_basedir, git_repo)
+            os.remove(item["path"])
+        else:
+            os.chmod(item["path"], item["mode"])
+            os.utime(item["path"], ns=(item["mtime_ns"], item["mtime_ns"]))
+        item, fout = None, None
+
+    try:
+        while True:
+            frame = _read_frame(fin)
+            if frame is None:
+                break
+            frame_header, kind, payload = frame
+            if kind != FRAME_DATA:
+                if item is not None:
+                    raise ValueError(f"The bundle ends an item at offset {offset} before all of its data.")
+                # every item starts at a frame which is not DATA, the import resumes from there
+                state.update(offset=offset, frames=num_frames, digest=digest)
+                if offset - saved_offset >= IMPORT_STATE_SAVE_BYTES:
+                    _save_import_state(staging_dir, state)
+                    saved_offset = offset
+
+            if kind == FRAME_DATA:
+                if item is None or len(payload) > remaining:
+                    raise ValueError(f"Unexpected data at offset {offset} of the bundle.")
+                fout.write(payload)
+                remaining -= len(payload)
+                if remaining == 0:
+                    _finish_item()
+            elif kind == FRAME_FILE:
+                header = json.loads(payload)
+                path = _staged_path(staging_dir, header["workspace"], header["path"])
+                if "same_as" in header:
+                    _copy_duplicate(_check_staged_path(staging_dir, *header["same_as"]), path, header)
+                else:
+                    item, fout, remaining = {**header, "kind": kind, "path": path}, open(path, "wb"), header["size"]
+                    if remaining == 0:
+                        _finish_item()
+            elif kind == FRAME_LINK:
+                header = json.loads(payload)
+                os.symlink(header["target"], _staged_path(staging_dir, header["workspace"], header["path"]))
+            elif kind == FRAME_CHUNK:
+                _store_imported_chunk(payload, chunk_store_dir)
+            elif kind == FRAME_GIT_BUNDLE:
+                header = json.loads(payload)
+                path = os.path.join(staging_dir, f"{TRET_INTERNAL_PREFIX}git-{num_frames}.bundle")
+                item, fout, remaining = {**header, "kind": kind, "path": path}, open(path, "wb"), header["size"]
+            elif kind == FRAME_INDEX:
+                index = json.loads(payload)
+                if index["frames"] != num_frames or index["digest"] != digest:
+                    raise ValueError("The index of the bundle does not match its frames.")
+                complete = True
+                break
+            else:
+                raise ValueError(f"Unknown frame {kind!r} at offset {offset} of the bundle.")
+            offset += len(frame_header) + len(payload)
+            digest = _chain_digest(digest, frame_header)
+            num_frames += 1
+    finally:
+        if fout is not None:
+            fout.close()
+        if not complete:
+            _save_import_state(staging_dir, state)
+
+    if not complete:
+        return {"workspaces": names, "complete": False, "offset": state["offset"]}
+    for name in names:
+        staged_workspace_dir = os.path.join(staging_dir, name)
+        gitinfo_filepath = os.path.join(staged_workspace_dir, GIT_INFO_FILENAME)
+        if os.path.isfile(gitinfo_filepath):
+            gitinfo = json.load(open(gitinfo_filepath, "r", encoding="utf-8"))
+            recorded_git_dir = state["git"].get(gitinfo[GIT_REPO_PATH_KEYNAME])
+            if recorded_git_dir is not None:
+                gitinfo[GIT_REPO_PATH_KEYNAME] = recorded_git_dir
+                write_gitinfo(gitinfo_filepath, gitinfo)
+        workspace_dir = os.path.join(workspace_basedir, name)
+        if os.path.lexists(workspace_dir):
+            raise FileExistsError(f"Workspace '{workspace_dir}' has been created during the import.")
+        os.replace(staged_workspace_dir, workspace_dir)
+    shutil.rmtree(staging_dir)
+    return {"workspaces": names, "complete": True, "offset": offset}
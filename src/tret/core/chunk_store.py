@@ -0,0 +1,338 @@
+import os
+import json
+import zlib
+import bisect
+import collections
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from ..constants import (
+    CHUNK_STORE_DIRNAME,
+    CHUNK_RECIPES_FILENAME,
+)
+from ..utils.file_utils import atomic_open
+from ..utils.io_limits import compression_slot, consume_disk_bandwidth
+from ..utils.ignore_utils import IgnoreMatcher
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# chunking parameters, changing any of them changes chunk boundaries and thus breaks deduplication with existing chunks
+CHUNK_MIN_SIZE = 512 * 1024
+CHUNK_AVG_SIZE = 2 * 1024 * 1024
+CHUNK_MAX_SIZE = 8 * 1024 * 1024
+CHUNK_HASH_WINDOW = 64
+# normalized chunking: a stricter mask before the average size and a looser one after it
+CHUNK_MASK_SMALL = (1 << 23) - 1
+CHUNK_MASK_LARGE = (1 << 19) - 1
+
+READ_SIZE = 64 * 1024 * 1024
+COMPRESSIBILITY_SAMPLE_SIZE = 64 * 1024
+
+# prefixes of stored chunks
+RAW_CHUNK_PREFIX = b"r"
+ZLIB_CHUNK_PREFIX = b"z"
+
+
+def _build_gear_table() -> list[int]:
+    return [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:4], "little") for i in range(256)]
+
+
+GEAR_TABLE = _build_gear_table()
+_GEAR_ARRAY = np.array(GEAR_TABLE, dtype=np.uint32) if np is not None else None
+# finding candidates is only parallelized on multiple cores
+_CANDIDATES_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count()) if np is not None and (os.cpu_count() or 1) > 1 else None
+
+
+def _find_candidates_numpy(buffer: bytes, window: int):
+    """Finds the positions where the rolling hash matches the masks, with NumPy."""
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    # the rolling hash at position i is the sum of the gear values of the `window` bytes ending at i, modulo 2^32,
+    # i.e., the difference of two prefix sums. Operations are done in place to save memory bandwidth.
+    prefix_sums = _GEAR_ARRAY[data]
+    np.cumsum(prefix_sums, dtype=np.uint32, out=prefix_sums)
+    masked_hashes = np.subtract(prefix_sums[window:], prefix_sums[:-window])
+    np.bitwise_and(masked_hashes, CHUNK_MASK_LARGE, out=masked_hashes)
+    candidates_large = np.flatnonzero(masked_hashes == 0) + window
+    if prefix_sums[window - 1] & CHUNK_MASK_LARGE == 0:
+        candidates_large = np.concatenate([[window - 1], candidates_large])
+    # the small mask is stricter than the large one, so its candidates are among the large ones
+    starts = candidates_large - window
+    hashes = prefix_sums[candidates_large] - np.where(starts >= 0, prefix_sums[np.maximum(starts, 0)], 0).astype(np.uint32)
+    candidates_small = candidates_large[(hashes & CHUNK_MASK_SMALL) == 0]
+    return candidates_small.tolist(), candidates_large.tolist()
+
+
+def _find_candidates_parallel(buffer: bytes, window: int, segment_size: int = 16 * 1024 * 1024):
+    """
+    Splits a buffer into overlapping segments whose candidates are found by a thread pool,
+    NumPy releases the GIL so segments are processed on all cores.
+    """
+    segment_starts = list(range(0, len(buffer), segment_size))
+
+    def _find_in_segment(segment_start: int):
+        # overlap by `window - 1` bytes so that every position gets a complete window
+        offset = max(segment_start - window + 1, 0)
+        segment = buffer[offset:segment_start + segment_size]
+        if len(segment) < window:
+            return [], []
+        candidates_small, candidates_large = _find_candidates_numpy(segment, window)
+        return (
+            [position + offset for position in candidates_small if position + offset >= segment_start],
+            [position + offset for position in candidates_large if position + offset >= segment_start],
+        )
+
+    candidates_small, candidates_large = [], []
+    for small, large in _CANDIDATES_EXECUTOR.map(_find_in_segment, segment_starts):
+        candidates_small.extend(small)
+        candidates_large.extend(large)
+    return candidates_small, candidates_large
+
+
+def _find_candidates_python(buffer: bytes, window: int):
+    """Pure-python equivalent of `_find_candidates_numpy`, used when NumPy is not installed."""
+    candidates_small, candidates_large = [], []
+    rolling_hash = 0
+    for i, byte in enumerate(buffer):
+        rolling_hash += GEAR_TABLE[byte]
+        if i >= window:
+            rolling_hash -= GEAR_TABLE[buffer[i - window]]
+        if i >= window - 1:
+            masked_hash = rolling_hash & 0xFFFFFFFF
+            if masked_hash & CHUNK_MASK_LARGE == 0:
+                candidates_large.append(i)
+                if masked_hash & CHUNK_MASK_SMALL == 0:
+                    candidates_small.append(i)
+    return candidates_small, candidates_large
+
+
+def _find_candidates(buffer: bytes, window: int):
+    if len(buffer) < window:
+        return [], []
+    if np is None:
+        return _find_candidates_python(buffer, window)
+    if _CANDIDATES_EXECUTOR is not None:
+        return _find_candidates_parallel(buffer, window)
+    return _find_candidates_numpy(buffer, window)
+
+
+def _first_candidate_in(candidates: list[int], low: int, high: int):
+    index = bisect.bisect_left(candidates, low)
+    if index < len(candidates) and candidates[index] < high:
+        return candidates[index]
+    return None
+
+
+def iter_chunks(
+    fileobj,
+    min_size: int = CHUNK_MIN_SIZE,
+    avg_size: int = CHUNK_AVG_SIZE,
+    max_size: int = CHUNK_MAX_SIZE,
+    read_size: int = READ_SIZE,
+):
+    """
+    Splits a binary stream into content-defined chunks, in the style of FastCDC.
+
+    A rolling hash over a window of `CHUNK_HASH_WINDOW` bytes is computed for every position (vectorized with NumPy when
+    available). A chunk ends at the first position after `min_size` whose hash matches the strict mask before `avg_size`,
+    or the loose mask after it, and at `max_size` at the latest. Since boundaries only depend on nearby content,
+    inserting or removing bytes only changes the chunks around the edit.
+
+    Args:
+        fileobj: A binary file object.
+        min_size, avg_size, max_size (int, optional): Chunk size limits in bytes.
+        read_size (int, optional): Number of bytes read at a time. Defaults to 64MiB.
+
+    Yields:
+        bytes: The chunks, in order.
+    """
+    assert CHUNK_HASH_WINDOW <= min_size < avg_size < max_size <= read_size
+    buffer = b""
+    eof = False
+    while not eof or buffer:
+        if not eof:
+            data = fileobj.read(read_size)
+            eof = not data
+            buffer = buffer + data if buffer else data
+        candidates_small, candidates_large = _find_candidates(buffer, CHUNK_HASH_WINDOW)
+        start = 0
+        while True:
+            remaining = len(buffer) - start
+            if remaining == 0 or (remaining < max_size and not eof):
+                break
+            boundary = _first_candidate_in(candidates_small, start + min_size - 1, start + avg_size - 1)
+            if boundary is None:
+                boundary = _first_candidate_in(candidates_large, start + avg_size - 1, start + max_size - 1)
+            end = boundary + 1 if boundary is not None else min(start + max_size, len(buffer))
+            yield buffer[start:end]
+            start = end
+        buffer = buffer[start:]
+
+
+def _chunk_filepath(chunk_store_dir: str, chunk_hash: str) -> str:
+    return os.path.join(chunk_store_dir, chunk_hash[:2], chunk_hash)
+
+
+def _store_chunk(chunk_store_dir: str, chunk: bytes, compresslevel: int) -> str:
+    chunk_hash = hashlib.sha256(chunk).hexdigest()
+    chunk_filepath = _chunk_filepath(chunk_store_dir, chunk_hash)
+    if os.path.isfile(chunk_filepath):
+        # refresh the mtime, so that a concurrent gc does not remove a chunk which is referenced again
+        os.utime(chunk_filepath)
+        return chunk_hash
+    # already compressed data is stored raw, which is detected on a sample first to save compressing the whole chunk
+    stored = RAW_CHUNK_PREFIX + chunk
+    sample = chunk[:COMPRESSIBILITY_SAMPLE_SIZE]
+    with compression_slot():
+        if len(zlib.compress(sample, compresslevel)) < 0.95 * len(sample):
+            compressed = zlib.compress(chunk, compresslevel)
+            if len(compressed) < 0.95 * len(chunk):
+                stored = ZLIB_CHUNK_PREFIX + compressed
+    os.makedirs(os.path.dirname(chunk_filepath), exist_ok=True)
+    consume_disk_bandwidth(len(stored))
+    with atomic_open(chunk_filepath, "wb") as fout:
+        fout.write(stored)
+    return chunk_hash
+
+
+def _load_chunk(chunk_store_dir: str, chunk_hash: str) -> bytes:
+    with open(_chunk_filepath(chunk_store_dir, chunk_hash), "rb") as fin:
+        stored = fin.read()
+    return zlib.decompress(stored[1:]) if stored[:1] == ZLIB_CHUNK_PREFIX else stored[1:]
+
+
+def backup_file_as_chunks(
+    filepath: str,
+    chunk_store_dir: str,
+    executor: ThreadPoolExecutor,
+    compresslevel: int = 3,
+    max_pending_chunks: int = 16,
+) -> dict:
+    """
+    Stores a file into the chunk store, only new chunks are written.
+    Chunks are hashed, compressed and written by `executor` while the file is being chunked.
+
+    Returns:
+        dict: The recipe of the file, with its size, sha256 and the list of (chunk hash, chunk size).
+    """
+    file_hasher = hashlib.sha256()
+    size = 0
+    futures = []
+    chunk_sizes = []
+    with open(filepath, "rb") as fin:
+        for chunk in iter_chunks(fin):
+            file_hasher.update(chunk)
+            size += len(chunk)
+            chunk_sizes.append(len(chunk))
+            futures.append(executor.submit(_store_chunk, chunk_store_dir, chunk, compresslevel))
+            if len(futures) > max_pending_chunks:
+                # bound the number of chunks held in memory by pending writes
+                futures[-max_pending_chunks - 1].result()
+    return {
+        "size": size,
+        "sha256": file_hasher.hexdigest(),
+        "chunks": [[future.result(), chunk_size] for future, chunk_size in zip(futures, chunk_sizes)],
+    }
+
+
+def backup_files_as_chunks(
+    filepaths: list[str],
+    data_backup_dir: str,
+    chunk_store_dir: str,
+    max_workers: int = None,
+    ignore_matcher: IgnoreMatcher = None,
+) -> dict:
+    """
+    Backs up files and directories into a content-defined chunk store shared by all the workspaces of a base directory,
+    and records the chunk recipe of each file into `chunks.json` of the workspace data directory.
+    Backing up a slightly changed file only writes its new chunks.
+
+    Args:
+        filepaths (list[str]): List of file or directory paths to back up.
+        data_backup_dir (str): The data directory of the workspace.
+        chunk_store_dir (str): The directory of the chunk store.
+        max_workers (int, optional): Number of threads hashing, compressing and writing chunks. Defaults to the cpu count.
+        ignore_matcher (IgnoreMatcher, optional): Excludes paths inside the backed up directories. Defaults to None.
+
+    Returns:
+        dict: The recipes of all the chunked files in the workspace, keyed by their relative paths.
+    """
+    recipes_filepath = os.path.join(data_backup_dir, CHUNK_RECIPES_FILENAME)
+    recipes = load_chunk_recipes(data_backup_dir)
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        for filepath in filepaths:
+            if not os.path.exists(filepath):
+                raise FileNotFoundError(f"'{filepath}' does not exists.")
+            basename = os.path.basename(os.path.normpath(filepath))
+            if os.path.isfile(filepath):
+                recipes[basename] = backup_file_as_chunks(filepath, chunk_store_dir, executor)
+                continue
+            for dirpath, _, filenames in (ignore_matcher.walk(filepath) if ignore_matcher else os.walk(filepath)):
+                for filename in filenames:
+                    sub_filepath = os.path.join(dirpath, filename)
+                    relpath = os.path.join(basename, os.path.relpath(sub_filepath, filepath))
+                    recipes[relpath] = backup_file_as_chunks(sub_filepath, chunk_store_dir, executor)
+    os.makedirs(data_backup_dir, exist_ok=True)
+    with atomic_open(recipes_filepath, "w", encoding="utf-8") as fout:
+        json.dump(recipes, fout, ensure_ascii=False)
+    return recipes
+
+
+def load_chunk_recipes(data_backup_dir: str) -> dict:
+    recipes_filepath = os.path.join(data_backup_dir, CHUNK_RECIPES_FILENAME)
+    if not os.path.isfile(recipes_filepath):
+        return {}
+    return json.load(open(recipes_filepath, "r", encoding="utf-8"))
+
+
+def restore_file_from_chunks(
+    recipe: dict,
+    chunk_store_dir: str,
+    output: str,
+    max_workers: int = None,
+    max_prefetched_chunks: int = 16,
+):
+    """
+    Reassembles a chunked file by streaming its chunks in order, while the next chunks are read and decompressed in parallel.
+
+    Raises:
+        ValueError: If the reassembled file does not match the recorded hash.
+    """
+    chunk_hashes = [chunk_hash for chunk_hash, _ in recipe["chunks"]]
+    file_hasher = hashlib.sha256()
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        with atomic_open(output, "wb") as fout:
+            futures = collections.deque()
+            for chunk_hash in chunk_hashes:
+                futures.append(executor.submit(_load_chunk, chunk_store_dir, chunk_hash))
+                if len(futures) >= max_prefetched_chunks:
+                    chunk = futures.popleft().result()
+                    file_hasher.update(chunk)
+                    fout.write(chunk)
+            while futures:
+                chunk = futures.popleft().result()
+                file_hasher.update(chunk)
+                fout.write(chunk)
+            if file_hasher.hexdigest() != recipe["sha256"]:
+                raise ValueError(f"Restored file '{output}' does not match its recorded hash.")
+
+
+def restore_files_from_chunks(data_backup_dir: str, chunk_store_dir: str, output_dir: str):
+    """
+    Restores all the chunked files of a workspace into `output_dir`.
+
+    Args:
+        data_backup_dir (str): The data directory of the workspace.
+        chunk_store_dir (str): The directory of the chunk store.
+        output_dir (str): The directory where the files will be restored.
+    """
+    for relpath, recipe in load_chunk_recipes(data_backup_dir).items():
+        restore_file_from_chunks(recipe, chunk_store_dir, os.path.join(output_dir, relpath))
+
+
+def get_chunk_store_dir(workspace_dir: str) -> str:
+    """The chunk store is shared by all the workspaces of a base directory."""
+    return os.path.join(os.path.dirname(os.path.abspath(workspace_dir)), CHUNK_STORE_DIRNAME)
@@ -1,11 +1,12 @@
 import os
 import json
-import tempfile
-from git.repo import Repo
+import warnings
+from typing import Optional
 from ..constants import (
     REQUIREMENTS_TXT_FILENAME,
     CODES_TARBALL_FILENAME,
     CURRENT_CODES_TARBALL_FILENAME,
+    BYTECODE_TARBALL_FILENAME_TEMPLATE,
     GIT_INFO_FILENAME,
     GIT_REPO_PATH_KEYNAME,
     GIT_DIFF_INFO_KEYNAME,
@@ -13,38 +14,30 @@ from ..constants import (
 )
 from ..utils.tarball_utils import (
     create_tarball_from_files,
-    restore_files_from_tarball,
+    restore_changed_files_from_tarball,
     get_filepaths_in_tarball,
 )
+from ..utils.file_utils import atomic_open
+from ..utils.bytecode_utils import (
+    get_cache_tag,
+    create_bytecode_tarball,
+    restore_bytecode_from_tarball,
+    precompile_files,
+    remove_orphan_bytecode,
+)
+from ..utils.ignore_utils import IgnoreMatcher
+from ..utils.git_utils import (
+    find_git_worktree,
+    get_git_repository,
+    write_gitinfo,
+)
+from .lineage import record_code_lineage
 from ..utils.module_detection import (
     detect_all_modules,
     generate_requirements_txt,
 )
 
 
-def get_git_repo_path(path: str):
-    """
-    Recursively finds the path to the root of a Git repository starting from the given path until reaching current working directory.
-
-    Args:
-        path (str): The starting path to search for the Git repository.
-
-    Returns:
-        str: The path to the Git repository if found, otherwise None.
-    """
-    working_directory = os.getcwd()
-    try:
-        _ = Repo(path)
-        return path
-    except Exception:
-        dirname = os.path.basename(path)
-        # if working directory is inside `dirname`, it means there does not exist any git repository inside the workspace directory.
-        if dirname != working_directory and working_directory.startswith(dirname):
-            return None
-        else:
-            return get_git_repo_path(os.path.dirname(path))
-
-
 def _start_point_for_finding_git_repo(workspace_dir: str):
     working_directory = os.getcwd()
     if os.path.abspath(workspace_dir).startswith(working_directory):
@@ -53,10 +46,33 @@ def _start_point_for_finding_git_repo(workspace_dir: str):
         return working_directory
 
 
+def snapshot_git_state(workspace_dir: str) -> Optional[dict]:
+    """
+    Records the current commit and the diff of the working tree against it, as they are written into `.gitinfo`.
+
+    Returns:
+        dict: The git info, or None if the working directory is not inside a git repository.
+    """
+    git_repo_path = find_git_worktree(_start_point_for_finding_git_repo(workspace_dir))
+    if not git_repo_path:
+        return None
+    repo = get_git_repository(git_repo_path)
+    commit_hash = repo.head_commit()
+    return {
+        GIT_REPO_PATH_KEYNAME: repo.git_dir,
+        GIT_COMMIT_HASH_KEYNAME: commit_hash,
+        GIT_DIFF_INFO_KEYNAME: repo.diff(commit_hash),
+    }
+
+
 def backup_codes(
     workspace_dir: str,
     additional_codefiles_to_backup: list[str] = [],
     backup_codes_as_tarball: bool = False,
+    ignore_matcher: IgnoreMatcher = None,
+    modules: dict = None,
+    git_state: Optional[dict] = None,
+    backup_bytecode: bool = False,
 ):
     """
     Backs up code files from the current workspace.
@@ -69,23 +85,35 @@ def backup_codes(
         workspace_dir (str): The directory where the backup files will be stored.
         additional_codefiles_to_backup (list[str], optional): Additional code files to include in the backup. Defaults to [].
         backup_codes_as_tarball (bool, optional): If True, backs up all code files as a tarball regardless of Git presence. Defaults to False.
+        ignore_matcher (IgnoreMatcher, optional): Excludes paths inside additional code directories.
+            Defaults to None, i.e., the `.tretignore` of the working directory.
+        modules (dict, optional): The modules imported by the experiment. Defaults to None, i.e., `sys.modules`.
+        git_state (dict, optional): The git state recorded by `snapshot_git_state` when the experiment started,
+            which is written into `.gitinfo` instead of the current one. Defaults to None.
+        backup_bytecode (bool, optional): Also back up hash-based pycs of the Python code files for this interpreter,
+            which `restore_codes` can reuse. Defaults to False.
 
     Raises:
         FileNotFoundError: If any of the specified code files do not exist.
         OSError: If there is an error creating or writing to the backup files.
 
     Returns:
-        None
+        dict: The manifest of `codes.tar.gz`, mapping each archived file to its size and content hash.
+            Empty if no code tarball is written.
     """
     working_directory = os.getcwd()
-    classified_modules = detect_all_modules()
+    manifest = {}
+    classified_modules = detect_all_modules(modules)
     external_modules = classified_modules["external_modules"]
     requirements = generate_requirements_txt(external_modules)
 
     start_point = _start_point_for_finding_git_repo(workspace_dir)
-    git_repo_path = get_git_repo_path(start_point)
+    git_repo_path = find_git_worktree(start_point)
 
-    all_codesfiles_backup = additional_codefiles_to_backup + [module.__file__ for module in classified_modules['local_modules']]
+    # modules whose source file has been removed since they were imported cannot be backed up
+    all_codesfiles_backup = additional_codefiles_to_backup + [
+        module.__file__ for module in classified_modules['local_modules'] if os.path.isfile(module.__file__)
+    ]
     all_codesfiles_backup = [os.path.abspath(file) for file in all_codesfiles_backup]
     # deduplication
     all_codesfiles_backup = list(set(all_codesfiles_backup))
@@ -94,34 +122,29 @@ def backup_codes(
         # Here, codes are defined as local modules imported by this experiment and user-defined additional codefiles.
         rel_filepaths = [os.path.relpath(file, working_directory) for file in all_codesfiles_backup]
 
-        requirements_filepath = os.path.join(working_directory, REQUIREMENTS_TXT_FILENAME)
-        with open(requirements_filepath, "w", encoding="utf-8") as fout:
-            fout.write("\n".join(requirements))
-        rel_filepaths += [os.path.relpath(requirements_filepath, working_directory)]
-
+        # requirements are added to the tarball from memory, so nothing is written into the working directory.
         codes_tarball_filepath = os.path.join(workspace_dir, CODES_TARBALL_FILENAME)
         create_tarball_from_files(
             filepaths=rel_filepaths,
             output=codes_tarball_filepath,
             append_data_to_existing_tarball=False,
+            members_from_memory={REQUIREMENTS_TXT_FILENAME: "\n".join(requirements).encode("utf-8")},
+            ignore_matcher=ignore_matcher,
+            manifest=manifest,
         )
-        os.remove(requirements_filepath)
+        lineage_codefiles = {
+            name: os.path.join(working_directory, name) for name in manifest if name != REQUIREMENTS_TXT_FILENAME
+        }
     else:
-        def _get_gitrepo_tracked_files(repo: Repo):
-            tracked_files = []
-            for key in repo.index.entries.keys():
-                tracked_files.append(key[0])
-            return tracked_files
-
         # if git exists, save the current commit hash and the diff between current code and commit.
         requirements_filepath = os.path.join(workspace_dir, REQUIREMENTS_TXT_FILENAME)
-        with open(requirements_filepath, "w", encoding="utf-8") as fout:
+        with atomic_open(requirements_filepath, "w", encoding="utf-8") as fout:
             fout.write("\n".join(requirements))
 
-        repo = Repo(git_repo_path)
+        # HEAD and the index are read from disk, so that only `git diff` starts a git process
+        repo = get_git_repository(git_repo_path)
         # get not tracked codefiles, which will be backed up as a tarball
-        git_tracked_files = _get_gitrepo_tracked_files(repo)
-        git_tracked_files = [os.path.abspath(file) for file in git_tracked_files]
+        git_tracked_files = {os.path.join(repo.worktree_dir, path) for path in repo.tracked_files()}
         git_not_tracked_codefiles = [
             os.path.relpath(item, working_directory)
             for item in all_codesfiles_backup if item not in git_tracked_files
@@ -132,37 +155,63 @@ def backup_codes(
                 filepaths=git_not_tracked_codefiles,
                 output=codes_tarball_filepath,
                 append_data_to_existing_tarball=False,
+                ignore_matcher=ignore_matcher,
+                manifest=manifest,
             )
+        lineage_codefiles = {name: os.path.join(working_directory, name) for name in manifest}
+        lineage_codefiles.update({
+            os.path.relpath(item, repo.worktree_dir): item for item in all_codesfiles_backup if item in git_tracked_files
+        })
 
         # for git-tracked files, just backup current git commit hash and diff-results for restorage
-        commit_hash = repo.head.commit.hexsha
-        diff = repo.git.diff(commit_hash)
+        gitinfo = git_state or snapshot_git_state(workspace_dir)
         git_info_filepath = os.path.join(workspace_dir, GIT_INFO_FILENAME)
-        gitinfo = {
-            GIT_REPO_PATH_KEYNAME: repo.git_dir,
-            GIT_COMMIT_HASH_KEYNAME: commit_hash,
-            GIT_DIFF_INFO_KEYNAME: diff,
-        }
-        json.dump(
-            gitinfo,
-            open(git_info_filepath, "w", encoding="utf-8"),
-            ensure_ascii=False,
-            indent=4,
-        )
+        write_gitinfo(git_info_filepath, gitinfo)
+    record_code_lineage(workspace_dir, lineage_codefiles)
+    if backup_bytecode:
+        if get_cache_tag() is None:
+            warnings.warn("This interpreter does not cache bytecode, no bytecode is backed up.")
+        else:
+            create_bytecode_tarball(
+                [filepath for filepath in lineage_codefiles.values() if filepath.endswith(".py")],
+                output=os.path.join(workspace_dir, BYTECODE_TARBALL_FILENAME_TEMPLATE.format(cache_tag=get_cache_tag())),
+                working_directory=working_directory,
+            )
+    return manifest
+
+
+BYTECODE_RESTORE_MODES = ("reuse", "precompile")
+
 
+def _restore_bytecode(workspace_dir: str, bytecode: str, source_filepaths: list[str], working_directory: str):
+    """Removes orphan pycs next to the restored Python files, then reuses the backed up pycs or compiles them."""
+    assert bytecode in BYTECODE_RESTORE_MODES, f"Unknown bytecode mode '{bytecode}', expected one of {BYTECODE_RESTORE_MODES}."
+    source_filepaths = [filepath for filepath in source_filepaths if filepath.endswith(".py") and os.path.isfile(filepath)]
+    remove_orphan_bytecode([os.path.dirname(filepath) for filepath in source_filepaths])
+    reused = set()
+    cache_tag = get_cache_tag()
+    bytecode_tarball_filepath = os.path.join(workspace_dir, BYTECODE_TARBALL_FILENAME_TEMPLATE.format(cache_tag=cache_tag))
+    if bytecode == "reuse" and cache_tag is not None and os.path.isfile(bytecode_tarball_filepath):
+        reused = set(restore_bytecode_from_tarball(bytecode_tarball_filepath, output_dir=working_directory))
+    # files without backed up pycs of this interpreter are compiled
+    precompile_files([filepath for filepath in source_filepaths if filepath not in reused])
 
-def restore_codes(workspace_dir: str):
+
+def restore_codes(workspace_dir: str, bytecode: Optional[str] = None):
     """
     Restores the code files in the specified workspace directory.
 
     This function performs the following steps:
     1. Checks if the workspace directory contains either a git information directory or a code tarball file.
-    2. If a code tarball file exists, backs up the current codes to another tarball `current-codes.tar.gz`.
-    3. Restores codes tracked by git by checking out to the stored commit and applying unstaged changes from diff info.
-    4. Restores codes from the tarball, potentially overwriting git-tracked codes.
+    2. Restores codes tracked by git by checking out to the stored commit and applying unstaged changes from diff info.
+    3. Restores codes from the tarball, potentially overwriting git-tracked codes. Only files that differ from the working tree
+       are written, and their current version is saved into the rollback journal `current-codes.tar.gz` beforehand.
 
     Args:
         workspace_dir (str): The path to the workspace directory.
+        bytecode (str, optional): "reuse" restores the pycs backed up with the codes for this interpreter, and compiles
+            the other restored Python files in a process pool; "precompile" compiles all of them. Both remove the pycs
+            whose source does not exist anymore next to them. Defaults to None, i.e., pycs are left untouched.
 
     Raises:
         AssertionError: If neither the git information directory nor the code tarball file exists in the workspace directory.
@@ -173,43 +222,46 @@ def restore_codes(workspace_dir: str):
     assert os.path.isfile(git_info_filepath) or os.path.isfile(codes_tarball_filepath), \
         f"Codes in Workspace '{workspace_dir}' have corrupted."
 
-    if os.path.isfile(codes_tarball_filepath):
-        # if there are codes in the codes.tar.gz, which means these codes are not tracked by git,
-        # we need to backup them to another tarball `current-codes.tar.gz` first.
-        current_codes_tarball_filepath = os.path.join(workspace_dir, CURRENT_CODES_TARBALL_FILENAME)
-        if not os.path.isfile(current_codes_tarball_filepath):
-            filepaths_in_codes_tarball = get_filepaths_in_tarball(codes_tarball_filepath)
-            filepaths_in_codes_tarball = [filepath for filepath in filepaths_in_codes_tarball if os.path.exists(filepath)]
-            create_tarball_from_files(
-                filepaths=filepaths_in_codes_tarball,
-                output=current_codes_tarball_filepath,
-                append_data_to_existing_tarball=False,
-            )
-            print(
-                f"Backup current codes into {current_codes_tarball_filepath}, "
-                "you can restore it through `TretWorkspace.restore_current_codes_from_tarball()`."
-            )
-
     # we first restore codes which can be restore through git,
     # then restore codes that are stored in the tarball.
     # That's because there may be some duplication between git tracked codes and codes in the tarball.
     # In the case of git tracked codes can be restored easier and are not afraid of overwriting,
     # we firstly restore the codes from git, then restore the codes from tarball which may overwrite the codes from git.
+    restored_filepaths = []
     if os.path.isfile(git_info_filepath):
         # if git exists, checkout to the stored commit,
         # then restore the unstaged changes from diff info.
         gitinfo = json.load(open(git_info_filepath, "r", encoding="utf-8"))
         commit_hash = gitinfo[GIT_COMMIT_HASH_KEYNAME]
 
-        repo = Repo(gitinfo[GIT_REPO_PATH_KEYNAME])
-        repo.git.checkout(commit_hash)
-        with tempfile.NamedTemporaryFile(mode="w", encoding="utf-8", prefix="git-diff-info") as fout:
-            fout.write(gitinfo[GIT_DIFF_INFO_KEYNAME])
-            fout.flush()
-            repo.git.apply(fout.name, allow_empty=True)
+        repo = get_git_repository(gitinfo[GIT_REPO_PATH_KEYNAME])
+        repo.run("checkout", commit_hash)
+        # the diff is piped into `git apply` through stdin instead of being written into a temporary file.
+        # Recorded diffs do not end with the trailing newline of `git diff`, which `git apply` requires.
+        diff = gitinfo[GIT_DIFF_INFO_KEYNAME]
+        if diff and not diff.endswith("\n"):
+            diff += "\n"
+        repo.run("apply", "--allow-empty", "-", input=diff.encode("utf-8", errors="surrogateescape"))
+        if bytecode is not None:
+            restored_filepaths.extend(os.path.join(repo.worktree_dir, path) for path in repo.tracked_files())
 
     if os.path.isfile(codes_tarball_filepath):
-        restore_files_from_tarball(codes_tarball_filepath, output_dir=working_directory)
-        requirements_filepath = os.path.join(working_directory, REQUIREMENTS_TXT_FILENAME)
-        if os.path.isfile(requirements_filepath):
-            os.remove(requirements_filepath)
+        # codes in the codes.tar.gz are not tracked by git, so the current version of every file that is about to change
+        # is saved into the rollback journal `current-codes.tar.gz` first. Unchanged files are neither saved nor rewritten.
+        current_codes_tarball_filepath = os.path.join(workspace_dir, CURRENT_CODES_TARBALL_FILENAME)
+        changed_files = restore_changed_files_from_tarball(
+            codes_tarball_filepath,
+            output_dir=working_directory,
+            journal_path=current_codes_tarball_filepath,
+            excluded_members=[REQUIREMENTS_TXT_FILENAME],
+        )
+        if changed_files:
+            print(
+                f"Backup current version of {len(changed_files)} changed files into {current_codes_tarball_filepath}, "
+                "you can restore it through `TretWorkspace.restore_current_codes_from_tarball()`."
+            )
+        if bytecode is not None:
+            restored_filepaths.extend(os.path.join(working_directory, name) for name in get_filepaths_in_tarball(codes_tarball_filepath))
+
+    if bytecode is not None:
+        _restore_bytecode(workspace_dir, bytecode, restored_filepaths, working_directory)
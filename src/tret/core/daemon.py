@@ -0,0 +1,363 @@
+import io
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import struct
+import hashlib
+import builtins
+import tempfile
+import warnings
+import contextlib
+from typing import Optional
+from .code_backup_and_restore import (
+    backup_codes,
+    restore_codes,
+    _start_point_for_finding_git_repo,
+)
+from .data_backup import backup_data
+from .data_tiering import TieringPolicy
+from ..utils.git_utils import find_git_worktree
+from ..utils.ignore_utils import load_ignore_matcher
+from ..utils.module_detection import (
+    build_distribution_index,
+    _get_site_package_directories,
+)
+
+# overrides the socket of the daemon, e.g. for daemons shared by several environments of the same interpreter
+DAEMON_SOCKET_ENVVAR = "TRET_DAEMON_SOCKET"
+# bumped whenever requests change, so that clients fall back to in-process mode on mismatched daemons
+PROTOCOL_VERSION = 1
+MESSAGE_HEADER = struct.Struct("!Q")
+
+
+def get_daemon_socket_path() -> str:
+    """The socket of the daemon serving the current environment, as indexes are only valid in one environment."""
+    if os.environ.get(DAEMON_SOCKET_ENVVAR):
+        return os.environ[DAEMON_SOCKET_ENVVAR]
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    environment_key = hashlib.sha256(sys.executable.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(runtime_dir, f"tret-{os.getuid()}-{environment_key}.sock")
+
+
+def _peer_uid(connection: socket.socket) -> Optional[int]:
+    """Returns the uid of the process at the other end of a Unix socket, or None if the platform does not report it."""
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    return struct.unpack("3i", credentials)[1]
+
+
+def _send_message(connection: socket.socket, message: dict):
+    # non-ASCII characters are escaped, including the surrogate escapes of diffs of files which are not UTF-8
+    content = json.dumps(message).encode("utf-8")
+    connection.sendall(MESSAGE_HEADER.pack(len(content)) + content)
+
+
+def _recv_exactly(connection: socket.socket, nbytes: int) -> Optional[bytes]:
+    buffer = bytearray()
+    while len(buffer) < nbytes:
+        data = connection.recv(min(nbytes - len(buffer), 1024 * 1024))
+        if not data:
+            return None
+        buffer += data
+    return bytes(buffer)
+
+
+def _recv_message(connection: socket.socket) -> Optional[dict]:
+    header = _recv_exactly(connection, MESSAGE_HEADER.size)
+    if header is None:
+        return None
+    content = _recv_exactly(connection, MESSAGE_HEADER.unpack(header)[0])
+    return None if content is None else json.loads(content.decode("utf-8"))
+
+
+class _ModuleInfo:
+    """Stands for a module of the client process, with the attributes needed to classify it."""
+    def __init__(self, name: str, file: Optional[str]):
+        self.__name__ = name
+        self.__file__ = file
+
+
+def describe_modules(modules: dict = None) -> list:
+    """Describes the imported modules, so that a daemon can classify them on behalf of this process."""
+    modules = sys.modules if modules is None else modules
+    descriptions = []
+    for key, module in list(modules.items()):
+        name = getattr(module, "__name__", None)
+        if not isinstance(name, str):
+            continue
+        file = getattr(module, "__file__", None)
+        descriptions.append([key, name, file if isinstance(file, str) else None, id(module)])
+    return descriptions
+
+
+def _restore_modules(descriptions: list) -> dict:
+    # modules imported under several names are the same object, thus backed up once
+    module_infos, modules = {}, {}
+    for key, name, file, module_id in descriptions:
+        if module_id not in module_infos:
+            module_infos[module_id] = _ModuleInfo(name, file)
+        modules[key] = module_infos[module_id]
+    return modules
+
+
+def _backup(request: dict) -> dict:
+    workspace_dir = request["workspace_dir"]
+    ignore_matcher = load_ignore_matcher(os.getcwd(), request["workspace_basedir"], request.get("exclude_patterns"))
+    modules = _restore_modules(request["modules"]) if request.get("modules") is not None else None
+    codes_manifest = backup_codes(
+        workspace_dir,
+        additional_codefiles_to_backup=request.get("additional_codefiles_to_backup") or [],
+        backup_codes_as_tarball=request.get("backup_codes_as_tarball", False),
+        ignore_matcher=ignore_matcher,
+        modules=modules,
+        git_state=request.get("git_state"),
+        backup_bytecode=request.get("backup_bytecode", False),
+    )
+    tiering_policy = request.get("tiering_policy")
+    data_manifest = backup_data(
+        workspace_dir=workspace_dir,
+        ignore_matcher=ignore_matcher,
+        tiering_policy=TieringPolicy(**tiering_policy) if tiering_policy else None,
+        **request.get("data_arguments", {}),
+    )
+    return {"codes": codes_manifest, "data": data_manifest}
+
+
+def _restore_codes(request: dict) -> None:
+    restore_codes(request["workspace_dir"], bytecode=request.get("bytecode"))
+
+
+OPERATIONS = {
+    "backup": _backup,
+    "restore_codes": _restore_codes,
+}
+# handled by the daemon itself instead of a worker
+CONTROL_OPERATIONS = ("ping", "shutdown")
+
+
+def run_request_in_process(request: dict):
+    """Runs a request in the current process, which is what clients do when no daemon is running."""
+    return OPERATIONS[request["op"]](request)
+
+
+def request_daemon(request: dict, socket_path: Optional[str] = None) -> Optional[dict]:
+    """
+    Sends a request to the daemon of the current environment.
+    Its output and warnings are replayed in this process, and its errors are raised again.
+
+    Args:
+        request (dict): The request, with `op` and the arguments of the operation.
+        socket_path (str, optional): The socket of the daemon. Defaults to `get_daemon_socket_path()`.
+
+    Returns:
+        dict: The response, with the return value of the operation as `result`,
+            or None if no daemon is running, in which case the request should be run in process.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    socket_path = socket_path or get_daemon_socket_path()
+    try:
+        # requests carry paths and run code, they are never sent to a daemon of another user
+        if os.stat(socket_path).st_uid != os.getuid():
+            warnings.warn(f"'{socket_path}' is owned by another user, the request is run in process instead.")
+            return None
+    except FileNotFoundError:
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except OSError:
+        connection.close()
+        return None
+    with connection:
+        _send_message(connection, {**request, "cwd": os.getcwd(), "protocol": PROTOCOL_VERSION})
+        response = _recv_message(connection)
+    if response is None:
+        raise RuntimeError(f"The tret daemon at '{socket_path}' closed the connection without responding.")
+    if response.get("unsupported"):
+        warnings.warn(f"The tret daemon at '{socket_path}' does not support this request, running it in process instead.")
+        return None
+    if response.get("output"):
+        print(response["output"], end="")
+    for message in response.get("warnings", []):
+        warnings.warn(message)
+    if not response["ok"]:
+        error_class = getattr(builtins, response["error_type"], None)
+        if not (isinstance(error_class, type) and issubclass(error_class, Exception)):
+            error_class = RuntimeError
+        raise error_class(response["error"])
+    return response
+
+
+class TretDaemon:
+    """
+    A long-running process serving `TretWorkspace.backup` and `restore` of the processes of one environment over a
+    local Unix socket.
+
+    The daemon keeps warm what every process would otherwise pay for again: the imports, the index of installed
+    distributions, the site-packages directories and the discovered git repositories. Each request is run by a worker
+    forked from the warm daemon (at most `max_workers` at a time), which works in the working directory of the client
+    and does all the compression and copy I/O, so that clients only send their module list and paths.
+
+    Args:
+        socket_path (str, optional): The socket to listen on. Defaults to `get_daemon_socket_path()`.
+        max_workers (int, optional): Maximum number of concurrent requests. Defaults to the cpu count.
+    """
+    def __init__(self, socket_path: Optional[str] = None, max_workers: Optional[int] = None):
+        assert hasattr(socket, "AF_UNIX") and hasattr(os, "fork"), "The tret daemon requires Unix sockets and `fork`."
+        self.socket_path = socket_path or get_daemon_socket_path()
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.workers = set()
+        self.stopping = False
+        self.site_packages_mtimes = None
+
+    def _get_site_packages_mtimes(self) -> dict:
+        mtimes = {}
+        for directory in _get_site_package_directories():
+            with contextlib.suppress(OSError):
+                mtimes[directory] = os.stat(directory).st_mtime_ns
+        return mtimes
+
+    def warm_up(self):
+        """Builds the indexes, and rebuilds them whenever distributions are installed or removed."""
+        mtimes = self._get_site_packages_mtimes()
+        if mtimes != self.site_packages_mtimes:
+            build_distribution_index()
+            self.site_packages_mtimes = mtimes
+
+    def _prepare(self, request: dict):
+        # the repository is discovered in the daemon, so that the cache is kept after the worker exits
+        if request["op"] == "backup":
+            working_directory = os.getcwd()
+            try:
+                os.chdir(request["cwd"])
+                find_git_worktree(_start_point_for_finding_git_repo(request["workspace_dir"]))
+            finally:
+                os.chdir(working_directory)
+
+    def _run_worker(self, connection: socket.socket, request: dict):
+        output = io.StringIO()
+        with warnings.catch_warnings(record=True) as caught_warnings, contextlib.redirect_stdout(output):
+            warnings.simplefilter("always")
+            try:
+                os.chdir(request["cwd"])
+                response = {"ok": True, "result": run_request_in_process(request)}
+            except Exception as error:
+                response = {"ok": False, "error_type": type(error).__name__, "error": str(error)}
+        response["output"] = output.getvalue()
+        response["warnings"] = [str(warning.message) for warning in caught_warnings]
+        _send_message(connection, response)
+
+    def _reap_workers(self, block: bool = False):
+        while self.workers:
+            try:
+                pid, _ = os.waitpid(-1, 0 if block else os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear()
+                return
+            if pid == 0:
+                return
+            self.workers.discard(pid)
+            if block:
+                return
+
+    def _handle_connection(self, connection: socket.socket, listener: socket.socket):
+        peer_uid = _peer_uid(connection)
+        if peer_uid is not None and peer_uid != os.getuid():
+            warnings.warn(f"Refused a connection of uid {peer_uid} to the tret daemon.")
+            return
+        connection.settimeout(30)
+        request = _recv_message(connection)
+        if request is None:
+            return
+        if request.get("protocol") != PROTOCOL_VERSION or (request.get("op") not in OPERATIONS and request.get("op") not in CONTROL_OPERATIONS):
+            _send_message(connection, {"ok": False, "unsupported": True})
+            return
+        if request["op"] in CONTROL_OPERATIONS:
+            self.stopping = request["op"] == "shutdown"
+            _send_message(connection, {"ok": True, "result": {"pid": os.getpid(), "workers": len(self.workers)}})
+            return
+        connection.settimeout(None)
+        self.warm_up()
+        self._prepare(request)
+        while len(self.workers) >= self.max_workers:
+            self._reap_workers(block=True)
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                listener.close()
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                self._run_worker(connection, request)
+            except BaseException:
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        self.workers.add(pid)
+
+    def _bind(self) -> socket.socket:
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                raise RuntimeError(f"A tret daemon is already listening on '{self.socket_path}'.")
+            except (ConnectionRefusedError, FileNotFoundError):
+                # left by a daemon which has not exited cleanly
+                os.remove(self.socket_path)
+            finally:
+                probe.close()
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # the socket is created only accessible to this user, instead of being restricted after `bind`
+        previous_umask = os.umask(0o177)
+        try:
+            listener.bind(self.socket_path)
+        finally:
+            os.umask(previous_umask)
+        listener.listen(128)
+        listener.settimeout(1.0)
+        return listener
+
+    def serve_forever(self):
+        """Serves requests until SIGTERM, SIGINT or a `shutdown` request, then waits for the running workers."""
+        def _stop(signum, frame):
+            self.stopping = True
+
+        signal.signal(signal.SIGTERM, _stop)
+        signal.signal(signal.SIGINT, _stop)
+        self.warm_up()
+        listener = self._bind()
+        try:
+            while not self.stopping:
+                self._reap_workers()
+                try:
+                    connection, _ = listener.accept()
+                except (socket.timeout, InterruptedError):
+                    continue
+                with connection:
+                    try:
+                        self._handle_connection(connection, listener)
+                    except OSError as error:
+                        warnings.warn(f"Failed to serve a request: {error}")
+        finally:
+            listener.close()
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.socket_path)
+            while self.workers:
+                self._reap_workers(block=True)
+
+
+def stop_daemon(socket_path: Optional[str] = None, timeout: float = 60.0) -> bool:
+    """Asks the daemon to exit once its running requests are finished. Returns False if no daemon is running."""
+    socket_path = socket_path or get_daemon_socket_path()
+    response = request_daemon({"op": "shutdown"}, socket_path=socket_path)
+    if response is None:
+        return False
+    deadline = time.monotonic() + timeout
+    while os.path.exists(socket_path) and time.monotonic() < deadline:
+        time.sleep(0.1)
+    return True
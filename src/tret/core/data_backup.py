@@ -1,10 +1,30 @@
 import os
 import shutil
-from ..constants import DATA_TARBALL_FILENAME
+from ..constants import (
+    DATA_TARBALL_FILENAME,
+    CHUNK_RECIPES_FILENAME,
+)
 from ..utils.tarball_utils import (
     create_tarball_from_files,
+    hash_fileobj,
+)
+from ..utils.io_limits import limited_copy
+from ..utils.ignore_utils import (
+    IgnoreMatcher,
+    load_ignore_matcher,
+)
+from .chunk_store import (
+    backup_files_as_chunks,
+    get_chunk_store_dir,
+)
+from .data_tiering import (
+    TieringPolicy,
+    plan_data_tiering,
+    TIER_COPY,
+    TIER_TARBALL,
+    TIER_CHUNKS,
+    TIER_SYMLINK,
 )
-
 
 def backup_data(
     workspace_dir: str,
@@ -12,6 +32,11 @@ def backup_data(
     files_to_backup_as_tarball: list[str] = None,
     files_to_backup_as_symlink: list[str] = None,
     append_data_to_existing_tarball: bool = True,
+    files_to_backup_as_chunks: list[str] = None,
+    chunk_store_dir: str = None,
+    ignore_matcher: IgnoreMatcher = None,
+    files_to_backup_auto: list[str] = None,
+    tiering_policy: TieringPolicy = None,
 ):
     """
     Backs up specified files and directories from the workspace to a backup directory.
@@ -21,11 +46,48 @@ def backup_data(
         files_to_backup (list[str], optional): List of file or directory paths to copy to the backup directory.
         files_to_backup_as_tarball (list[str], optional): List of file or directory paths to include in a tarball.
         files_to_backup_as_symlink (list[str], optional): List of file or directory paths to create symbolic links for in the backup directory.
+        append_data_to_existing_tarball (bool, optional): Whether to append new data to an existing data tarball. Defaults to True.
+        files_to_backup_as_chunks (list[str], optional): List of file or directory paths to back up into the deduplicating
+            chunk store, suited for large files which change slightly between backups.
+        chunk_store_dir (str, optional): The directory of the chunk store. Defaults to `.tret-chunks` in the workspace base directory.
+        ignore_matcher (IgnoreMatcher, optional): Excludes paths inside the backed up directories.
+            Defaults to None, i.e., the `.tretignore` of the working directory.
+        files_to_backup_auto (list[str], optional): List of file or directory paths routed automatically to one of
+            the ways above, according to their sizes and how compressible their content is (see `classify_datafile`).
+        tiering_policy (TieringPolicy, optional): The thresholds of the automatic routing. Defaults to `TieringPolicy()`.
 
     Raises:
         FileNotFoundError: If any path is not a file or directory.
+
+    Returns:
+        dict: The manifest of the backed up data, with the sizes and sha256 of copied files, tarball members and
+            chunked files, and the targets of symbolic links. It is recorded so that data can be compared without reading it.
+            With `files_to_backup_auto`, it also records the chosen way of each path and why, and the estimated
+            time and space saved against compressing all of them into the data tarball, under `auto`.
     """
     data_backup_dir = os.path.join(workspace_dir, "data")
+    if ignore_matcher is None:
+        ignore_matcher = load_ignore_matcher()
+    manifest = {"files": {}, "tarball": {}, "symlinks": {}, "chunks": {}}
+    if files_to_backup_auto:
+        plan = plan_data_tiering(files_to_backup_auto, policy=tiering_policy, ignore_matcher=ignore_matcher)
+        routes = {
+            TIER_COPY: files_to_backup,
+            TIER_TARBALL: files_to_backup_as_tarball,
+            TIER_CHUNKS: files_to_backup_as_chunks,
+            TIER_SYMLINK: files_to_backup_as_symlink,
+        }
+        routes = {tier: list(paths or []) for tier, paths in routes.items()}
+        for path, classification in plan["paths"].items():
+            # links are resolved from the data directory, so their targets must not be relative to the working directory
+            routes[classification["tier"]].append(os.path.abspath(path) if classification["tier"] == TIER_SYMLINK else path)
+        files_to_backup = routes[TIER_COPY]
+        files_to_backup_as_tarball = routes[TIER_TARBALL]
+        files_to_backup_as_chunks = routes[TIER_CHUNKS]
+        files_to_backup_as_symlink = routes[TIER_SYMLINK]
+        # the estimate of what the tiering saves is recorded with the plan, instead of being printed into the
+        # output of the experiment
+        manifest["auto"] = plan
     if files_to_backup:
         os.makedirs(data_backup_dir, exist_ok=True)
         for filepath in files_to_backup:
@@ -35,11 +97,14 @@ def backup_data(
                 shutil.copytree(
                     src=src,
                     dst=dst,
+                    ignore=lambda dirpath, names, top=src: ignore_matcher.filter_names(top, dirpath, names),
+                    copy_function=limited_copy,
                 )
             elif os.path.isfile(filepath) or os.path.islink(filepath):
-                shutil.copyfile(
-                    src=src,
-                    dst=dst,
+                limited_copy(
+                    src,
+                    dst,
+                    copy_function=shutil.copyfile,
                     follow_symlinks=False,
                 )
             else:
@@ -65,8 +130,32 @@ def backup_data(
 
         os.makedirs(data_backup_dir, exist_ok=True)
         data_tarball_filepath = os.path.join(data_backup_dir, DATA_TARBALL_FILENAME)
+        # members are hashed while they are written, including the appended ones
         create_tarball_from_files(
             filepaths=files_to_backup_as_tarball,
             output=data_tarball_filepath,
             append_data_to_existing_tarball=append_data_to_existing_tarball,
+            ignore_matcher=ignore_matcher,
+            manifest=manifest["tarball"],
         )
+
+    if files_to_backup_as_chunks:
+        chunk_store_dir = chunk_store_dir or get_chunk_store_dir(workspace_dir)
+        recipes = backup_files_as_chunks(
+            files_to_backup_as_chunks, data_backup_dir, chunk_store_dir, ignore_matcher=ignore_matcher,
+        )
+        for relpath, recipe in recipes.items():
+            manifest["chunks"][relpath] = {"size": recipe["size"], "sha256": recipe["sha256"]}
+
+    if os.path.isdir(data_backup_dir):
+        for dirpath, dirnames, filenames in os.walk(data_backup_dir):
+            # symbolic links to directories are listed in `dirnames` but not followed by `os.walk`
+            for filename in filenames + dirnames:
+                filepath = os.path.join(dirpath, filename)
+                relpath = os.path.relpath(filepath, data_backup_dir)
+                if os.path.islink(filepath):
+                    manifest["symlinks"][relpath] = os.readlink(filepath)
+                elif os.path.isfile(filepath) and relpath not in (DATA_TARBALL_FILENAME, CHUNK_RECIPES_FILENAME):
+                    with open(filepath, "rb") as fin:
+                        manifest["files"][relpath] = {"size": os.path.getsize(filepath), "sha256": hash_fileobj(fin)}
+    return manifest
@@ -0,0 +1,244 @@
+import os
+import json
+import shutil
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from ..constants import (
+    TRET_ATTRIBUTES_FILENAME,
+    DATA_TARBALL_FILENAME,
+    CHUNK_RECIPES_FILENAME,
+)
+from ..utils.tarball_utils import (
+    restore_files_from_tarball,
+    get_filepaths_in_tarball,
+    hash_fileobj,
+)
+from ..utils.io_limits import limited_copy
+from .chunk_store import (
+    load_chunk_recipes,
+    restore_file_from_chunks,
+    get_chunk_store_dir,
+)
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+# copied files are hard linked to the workspace (falling back to copies across file systems),
+# reflinked or copied, or not restored at all when only the archives are extracted
+RESTORE_MODE_HARDLINK = "hardlink"
+RESTORE_MODE_COPY = "copy"
+RESTORE_MODE_EXTRACT = "extract"
+RESTORE_MODES = (RESTORE_MODE_HARDLINK, RESTORE_MODE_COPY, RESTORE_MODE_EXTRACT)
+
+# `FICLONE` of linux/fs.h, which shares the extents of a file on copy-on-write file systems such as btrfs and XFS
+FICLONE = 0x40049409
+SYMLINKS_DIRNAME = "symlinks"
+
+
+def _clone_file(src: str, dst: str):
+    """Copies a file through a reflink if the file system supports it, otherwise through a regular copy."""
+    if fcntl is not None:
+        try:
+            with open(src, "rb") as fin, open(dst, "wb") as fout:
+                fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+            shutil.copystat(src, dst)
+            return
+        except OSError:
+            pass
+    limited_copy(src, dst)
+
+
+def _link_file(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # e.g., across file systems, or on file systems without hard links
+        _clone_file(src, dst)
+
+
+def _remove_existing(path: str):
+    if os.path.islink(path) or os.path.isfile(path):
+        os.remove(path)
+    elif os.path.isdir(path):
+        shutil.rmtree(path)
+
+
+def plan_data_restore(workspace_dir: str, mode: str = RESTORE_MODE_HARDLINK) -> dict:
+    """
+    Lists what restoring the data of a workspace would write, without reading any data.
+
+    Args:
+        workspace_dir (str): The workspace directory.
+        mode (str, optional): One of `RESTORE_MODES`. Defaults to "hardlink".
+
+    Returns:
+        dict: The copied `files` (mapping their relative paths to the paths inside the workspace), the `symlinks`
+            (mapping their relative paths to their targets), the regular `tarball` members, and the `chunks` recipes.
+    """
+    assert mode in RESTORE_MODES, f"Unknown data restore mode '{mode}', expected one of {RESTORE_MODES}."
+    data_backup_dir = os.path.join(workspace_dir, "data")
+    plan = {"files": {}, "symlinks": {}, "tarball": [], "chunks": load_chunk_recipes(data_backup_dir)}
+    if not os.path.isdir(data_backup_dir):
+        return plan
+
+    if mode != RESTORE_MODE_EXTRACT:
+        for dirpath, dirnames, filenames in os.walk(data_backup_dir):
+            for name in filenames + dirnames:
+                path = os.path.join(dirpath, name)
+                relpath = os.path.relpath(path, data_backup_dir)
+                if relpath in (DATA_TARBALL_FILENAME, CHUNK_RECIPES_FILENAME):
+                    continue
+                if os.path.islink(path):
+                    # data backed up as symbolic links are restored next to the copied data
+                    if relpath.startswith(SYMLINKS_DIRNAME + os.sep):
+                        relpath = relpath[len(SYMLINKS_DIRNAME) + 1:]
+                    plan["symlinks"][relpath] = os.readlink(path)
+                elif os.path.isfile(path):
+                    plan["files"][relpath] = path
+
+    data_tarball_filepath = os.path.join(data_backup_dir, DATA_TARBALL_FILENAME)
+    if os.path.isfile(data_tarball_filepath):
+        manifest = _load_data_manifest(workspace_dir)
+        if "tarball" in manifest:
+            plan["tarball"] = sorted(manifest["tarball"])
+        else:
+            # workspaces backed up before the manifest was recorded
+            plan["tarball"] = get_filepaths_in_tarball(data_tarball_filepath)
+    return plan
+
+
+def _load_data_manifest(workspace_dir: str) -> dict:
+    tret_attributes_filepath = os.path.join(workspace_dir, TRET_ATTRIBUTES_FILENAME)
+    if not os.path.isfile(tret_attributes_filepath):
+        return {}
+    tret_attributes = json.load(open(tret_attributes_filepath, "r", encoding="utf-8"))
+    return (tret_attributes.get("manifest") or {}).get("data") or {}
+
+
+def _verify_file(filepath: str, size: int, sha256: str = None) -> Optional[str]:
+    if not os.path.isfile(filepath):
+        return f"'{filepath}' is missing."
+    if os.path.getsize(filepath) != size:
+        return f"'{filepath}' has size {os.path.getsize(filepath)}, {size} recorded."
+    if sha256 is not None:
+        with open(filepath, "rb") as fin:
+            if hash_fileobj(fin) != sha256:
+                return f"'{filepath}' does not match its recorded sha256."
+    return None
+
+
+def _verify_data_restore(plan: dict, manifest: dict, target_dir: str, max_workers: int = None) -> list[str]:
+    expected = []
+    for relpath, path in plan["files"].items():
+        # files missing from the manifest are only checked against the size of their backed up copy
+        entry = manifest.get("files", {}).get(relpath) or {"size": os.path.getsize(path)}
+        expected.append((relpath, entry["size"], entry.get("sha256")))
+    for name, entry in manifest.get("tarball", {}).items():
+        if name in plan["tarball"]:
+            expected.append((name, entry["size"], entry.get("sha256")))
+    # chunked files are verified against their recorded sha256 while being reassembled
+    expected += [(relpath, recipe["size"], None) for relpath, recipe in plan["chunks"].items()]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_verify_file, os.path.join(target_dir, relpath), size, sha256)
+            for relpath, size, sha256 in expected
+        ]
+        errors = [error for error in (future.result() for future in futures) if error is not None]
+    for relpath, link_target in plan["symlinks"].items():
+        filepath = os.path.join(target_dir, relpath)
+        if not os.path.islink(filepath) or os.readlink(filepath) != link_target:
+            errors.append(f"'{filepath}' is not a symbolic link to '{link_target}'.")
+        elif not os.path.exists(filepath):
+            errors.append(f"The target '{link_target}' of '{filepath}' does not exist.")
+    return errors
+
+
+def restore_data(
+    workspace_dir: str,
+    target_dir: str,
+    mode: str = RESTORE_MODE_HARDLINK,
+    overwrite: bool = False,
+    verify: bool = True,
+    max_workers: int = None,
+) -> dict:
+    """
+    Materializes the backed up data of a workspace into `target_dir`, where each backed up path is restored under its
+    base name (and tarball members under their names inside the tarball).
+
+    Copied files are hard linked to the workspace in the "hardlink" mode (so restoring takes no space, but modifying
+    them in place also modifies the backup), reflinked or copied in the "copy" mode, and skipped in the "extract" mode,
+    which only extracts the data tarball and reassembles the chunked files. The data tarball is extracted through the
+    parallel extraction of `restore_files_from_tarball`, and symbolic links are recreated with their recorded targets.
+
+    Existing paths in `target_dir` are never overwritten unless `overwrite` is set: conflicts are checked before
+    anything is written.
+
+    Args:
+        workspace_dir (str): The workspace directory.
+        target_dir (str): The directory where the data will be restored.
+        mode (str, optional): One of "hardlink", "copy" and "extract". Defaults to "hardlink".
+        overwrite (bool, optional): Whether to replace existing paths. Defaults to False.
+        verify (bool, optional): Whether to verify the restored data against the recorded sizes and hashes. Defaults to True.
+        max_workers (int, optional): Number of threads linking, copying and extracting files. Defaults to the cpu count.
+
+    Raises:
+        FileExistsError: If any restored path exists and `overwrite` is not set.
+        ValueError: If the restored data does not match the recorded sizes and hashes.
+
+    Returns:
+        dict: The relative paths of the restored `files`, `symlinks`, `tarball` members and `chunks`.
+    """
+    plan = plan_data_restore(workspace_dir, mode=mode)
+    relpaths = list(plan["files"]) + list(plan["symlinks"]) + list(plan["tarball"]) + list(plan["chunks"])
+    if not overwrite:
+        conflicts = [relpath for relpath in relpaths if os.path.lexists(os.path.join(target_dir, relpath))]
+        if conflicts:
+            raise FileExistsError(
+                f"{len(conflicts)} paths already exist in '{target_dir}', e.g. {conflicts[:5]}. "
+                "Set `overwrite` to replace them."
+            )
+    os.makedirs(target_dir, exist_ok=True)
+    max_workers = max_workers or os.cpu_count()
+
+    def _materialize(relpath: str, src: str):
+        dst = os.path.join(target_dir, relpath)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if overwrite:
+            _remove_existing(dst)
+        if mode == RESTORE_MODE_HARDLINK:
+            _link_file(src, dst)
+        else:
+            _clone_file(src, dst)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for future in [executor.submit(_materialize, relpath, src) for relpath, src in plan["files"].items()]:
+            future.result()
+
+    for relpath, link_target in plan["symlinks"].items():
+        dst = os.path.join(target_dir, relpath)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if overwrite:
+            _remove_existing(dst)
+        os.symlink(link_target, dst)
+
+    if plan["tarball"]:
+        restore_files_from_tarball(
+            os.path.join(workspace_dir, "data", DATA_TARBALL_FILENAME), target_dir, max_workers=max_workers,
+        )
+
+    chunk_store_dir = get_chunk_store_dir(workspace_dir)
+    for relpath, recipe in plan["chunks"].items():
+        restore_file_from_chunks(recipe, chunk_store_dir, os.path.join(target_dir, relpath), max_workers=max_workers)
+
+    if verify:
+        errors = _verify_data_restore(plan, _load_data_manifest(workspace_dir), target_dir, max_workers=max_workers)
+        if errors:
+            raise ValueError("The restored data does not match the backup:\n" + "\n".join(errors))
+    return {
+        "files": list(plan["files"]),
+        "symlinks": list(plan["symlinks"]),
+        "tarball": list(plan["tarball"]),
+        "chunks": list(plan["chunks"]),
+    }
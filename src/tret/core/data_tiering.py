@@ -0,0 +1,210 @@
+import os
+import zlib
+import time
+import dataclasses
+from typing import Optional
+from ..utils.ignore_utils import IgnoreMatcher
+
+# tiers of automatically routed data, with the `backup_data` arguments they are routed to
+TIER_COPY = "copy"
+TIER_TARBALL = "tarball"
+TIER_CHUNKS = "chunks"
+TIER_SYMLINK = "symlink"
+
+# signatures of formats which are already compressed, thus not worth compressing again
+COMPRESSED_FORMAT_SIGNATURES = [
+    (0, b"\x1f\x8b", "gzip"),
+    (0, b"\x28\xb5\x2f\xfd", "zstd"),
+    (0, b"\xfd7zXZ\x00", "xz"),
+    (0, b"BZh", "bzip2"),
+    (0, b"7z\xbc\xaf\x27\x1c", "7z"),
+    (0, b"\x04\x22\x4d\x18", "lz4"),
+    (0, b"\xff\xd8\xff", "jpeg"),
+    (0, b"\x89PNG\r\n\x1a\n", "png"),
+    (0, b"PAR1", "parquet"),
+    (4, b"ftyp", "mp4"),
+]
+
+SAMPLE_SIZE = 64 * 1024
+NUM_SAMPLES = 3
+# number of the largest files sampled in a directory
+NUM_SAMPLED_FILES_PER_DIRECTORY = 8
+# `create_tarball_from_files` compresses data tarballs with this level
+TARBALL_COMPRESSLEVEL = 6
+
+
+@dataclasses.dataclass
+class TieringPolicy:
+    """
+    Thresholds of the automatic data tiering.
+
+    Args:
+        symlink_min_size (int): Paths of at least this many bytes are linked instead of copied. Defaults to 10GiB.
+        chunks_min_size (int): Paths of at least this many bytes are backed up into the deduplicating chunk store.
+            Defaults to 256MiB.
+        min_compression_saving (float): Paths are compressed only if the estimated compression saves at least this
+            fraction of their size. Defaults to 0.1.
+        copy_bytes_per_second (float): Assumed throughput of plain copies, used in the estimates. Defaults to 500MB/s.
+        chunks_bytes_per_second (float): Assumed throughput of the chunk store before compression. Defaults to 200MB/s.
+    """
+    symlink_min_size: int = 10 * 1024 ** 3
+    chunks_min_size: int = 256 * 1024 ** 2
+    min_compression_saving: float = 0.1
+    copy_bytes_per_second: float = 500e6
+    chunks_bytes_per_second: float = 200e6
+
+
+def detect_compressed_format(header: bytes) -> Optional[str]:
+    for offset, signature, format_name in COMPRESSED_FORMAT_SIGNATURES:
+        if header[offset:offset + len(signature)] == signature:
+            return format_name
+    return None
+
+
+def _sample_compression(filepath: str, size: int) -> tuple[int, int, float]:
+    """Trial-compresses samples from the start, middle and end of a file. Returns raw bytes, compressed bytes and seconds."""
+    offsets = sorted({0, max(size // 2 - SAMPLE_SIZE // 2, 0), max(size - SAMPLE_SIZE, 0)})[:NUM_SAMPLES]
+    raw_bytes, compressed_bytes, seconds = 0, 0, 0.0
+    with open(filepath, "rb") as fin:
+        for offset in offsets:
+            fin.seek(offset)
+            sample = fin.read(SAMPLE_SIZE)
+            start = time.perf_counter()
+            compressed_bytes += len(zlib.compress(sample, TARBALL_COMPRESSLEVEL))
+            seconds += time.perf_counter() - start
+            raw_bytes += len(sample)
+    return raw_bytes, compressed_bytes, seconds
+
+
+def _list_files(path: str, ignore_matcher: Optional[IgnoreMatcher]) -> list[tuple[str, int]]:
+    if os.path.isfile(path):
+        return [(path, os.path.getsize(path))]
+    files = []
+    for dirpath, _, filenames in (ignore_matcher.walk(path) if ignore_matcher else os.walk(path)):
+        for filename in filenames:
+            filepath = os.path.join(dirpath, filename)
+            if os.path.isfile(filepath) and not os.path.islink(filepath):
+                files.append((filepath, os.path.getsize(filepath)))
+    return files
+
+
+def classify_datafile(
+    path: str,
+    policy: Optional[TieringPolicy] = None,
+    ignore_matcher: Optional[IgnoreMatcher] = None,
+) -> dict:
+    """
+    Decides how a data file or directory is backed up, from its size and a sample of its content.
+
+    Paths above `symlink_min_size` are linked and paths above `chunks_min_size` are deduplicated in the chunk store.
+    Smaller paths are copied as they are when their content is already compressed (detected by magic bytes,
+    otherwise by trial-compressing a few samples), and compressed into the data tarball otherwise.
+    Directories are routed as a whole, sampling their largest files.
+
+    Args:
+        path (str): The file or directory.
+        policy (TieringPolicy, optional): The thresholds. Defaults to None, i.e., `TieringPolicy()`.
+        ignore_matcher (IgnoreMatcher, optional): Excludes paths inside directories. Defaults to None.
+
+    Returns:
+        dict: The `tier`, the `reason` of the choice, the `size`, the estimated `compression_ratio` (compressed / raw)
+            and the estimated `compress_bytes_per_second` of gzip on this data.
+    """
+    policy = policy or TieringPolicy()
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"'{path}' does not exists.")
+    files = _list_files(path, ignore_matcher)
+    size = sum(file_size for _, file_size in files)
+
+    raw_bytes, compressed_bytes, seconds, formats = 0, 0, 0.0, set()
+    for filepath, file_size in sorted(files, key=lambda item: item[1], reverse=True)[:NUM_SAMPLED_FILES_PER_DIRECTORY]:
+        with open(filepath, "rb") as fin:
+            format_name = detect_compressed_format(fin.read(16))
+        if format_name is not None:
+            formats.add(format_name)
+            # already compressed data is not sampled, it is assumed to be stored as is
+            raw_bytes += min(file_size, SAMPLE_SIZE * NUM_SAMPLES)
+            compressed_bytes += min(file_size, SAMPLE_SIZE * NUM_SAMPLES)
+            continue
+        sample_raw_bytes, sample_compressed_bytes, sample_seconds = _sample_compression(filepath, file_size)
+        raw_bytes += sample_raw_bytes
+        compressed_bytes += sample_compressed_bytes
+        seconds += sample_seconds
+    compression_ratio = min(compressed_bytes / raw_bytes, 1.0) if raw_bytes else 1.0
+    compress_bytes_per_second = raw_bytes / seconds if seconds > 0 else policy.copy_bytes_per_second
+
+    classification = {
+        "size": size,
+        "compression_ratio": round(compression_ratio, 4),
+        "compress_bytes_per_second": compress_bytes_per_second,
+    }
+    if size >= policy.symlink_min_size:
+        tier = TIER_SYMLINK
+        reason = f"size {size} >= symlink_min_size {policy.symlink_min_size}"
+    elif size >= policy.chunks_min_size:
+        tier = TIER_CHUNKS
+        reason = f"size {size} >= chunks_min_size {policy.chunks_min_size}"
+    elif formats:
+        tier = TIER_COPY
+        reason = f"already compressed ({', '.join(sorted(formats))})"
+    elif 1 - compression_ratio < policy.min_compression_saving:
+        tier = TIER_COPY
+        reason = f"incompressible (estimated ratio {compression_ratio:.2f})"
+    else:
+        tier = TIER_TARBALL
+        reason = f"compressible (estimated ratio {compression_ratio:.2f})"
+    classification.update({"tier": tier, "reason": reason})
+    return classification
+
+
+def estimate_tier_cost(classification: dict, tier: str, policy: Optional[TieringPolicy] = None) -> tuple[float, float]:
+    """Estimates the seconds and the stored bytes of backing up a classified path with a tier."""
+    policy = policy or TieringPolicy()
+    size = classification["size"]
+    compressed_size = size * classification["compression_ratio"]
+    compress_seconds = size / classification["compress_bytes_per_second"]
+    if tier == TIER_SYMLINK:
+        return 0.0, 0.0
+    if tier == TIER_COPY:
+        return size / policy.copy_bytes_per_second, float(size)
+    if tier == TIER_CHUNKS:
+        # chunks are only compressed when compressible, and unchanged chunks are not stored again (not estimated here)
+        compressible = 1 - classification["compression_ratio"] >= policy.min_compression_saving
+        seconds = size / policy.chunks_bytes_per_second + (compress_seconds if compressible else 0.0)
+        return seconds, compressed_size if compressible else float(size)
+    return compress_seconds, compressed_size
+
+
+def plan_data_tiering(
+    paths: list[str],
+    policy: Optional[TieringPolicy] = None,
+    ignore_matcher: Optional[IgnoreMatcher] = None,
+) -> dict:
+    """
+    Classifies data paths, and estimates the time and bytes saved against the naive choice,
+    i.e., compressing everything into the data tarball.
+
+    Args:
+        paths (list[str]): Data files or directories.
+        policy (TieringPolicy, optional): The thresholds. Defaults to None, i.e., `TieringPolicy()`.
+        ignore_matcher (IgnoreMatcher, optional): Excludes paths inside directories. Defaults to None.
+
+    Returns:
+        dict: `paths`, mapping each path to its classification, and `estimate`, with the estimated seconds and
+            bytes of the naive choice and of the chosen tiers.
+    """
+    policy = policy or TieringPolicy()
+    plan = {"paths": {}, "estimate": {"naive_seconds": 0.0, "naive_bytes": 0.0, "seconds": 0.0, "bytes": 0.0}}
+    for path in paths:
+        classification = classify_datafile(path, policy=policy, ignore_matcher=ignore_matcher)
+        plan["paths"][path] = classification
+        naive_seconds, naive_bytes = estimate_tier_cost(classification, TIER_TARBALL, policy)
+        seconds, stored_bytes = estimate_tier_cost(classification, classification["tier"], policy)
+        plan["estimate"]["naive_seconds"] += naive_seconds
+        plan["estimate"]["naive_bytes"] += naive_bytes
+        plan["estimate"]["seconds"] += seconds
+        plan["estimate"]["bytes"] += stored_bytes
+    estimate = plan["estimate"]
+    estimate["seconds_saved"] = estimate["naive_seconds"] - estimate["seconds"]
+    estimate["bytes_saved"] = estimate["naive_bytes"] - estimate["bytes"]
+    return plan
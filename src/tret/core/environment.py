@@ -0,0 +1,251 @@
+import os
+import re
+import sys
+import base64
+import shutil
+import hashlib
+import zipfile
+import subprocess
+import importlib.metadata
+from typing import Optional
+from ..constants import (
+    REQUIREMENTS_TXT_FILENAME,
+    CODES_TARBALL_FILENAME,
+    WHEELHOUSE_DIRNAME,
+    ENVIRONMENTS_DIRNAME,
+)
+from ..utils.file_utils import atomic_open
+from ..utils.tarball_utils import read_members_from_tarball
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+ENVIRONMENT_COMPLETE_MARKER = ".tret-complete"
+
+# files of installed distributions which are generated by the installer, thus not part of wheels
+INSTALLER_GENERATED_FILES = {"INSTALLER", "RECORD", "REQUESTED", "direct_url.json"}
+
+
+def read_workspace_requirements(workspace_dir: str) -> list[str]:
+    """
+    Reads the requirements recorded in a workspace, either as a plain file (with git) or inside the code tarball.
+
+    Returns:
+        list[str]: The requirements, e.g. `["numpy==1.26.4"]`.
+    """
+    requirements_filepath = os.path.join(workspace_dir, REQUIREMENTS_TXT_FILENAME)
+    codes_tarball_filepath = os.path.join(workspace_dir, CODES_TARBALL_FILENAME)
+    content = b""
+    if os.path.isfile(requirements_filepath):
+        with open(requirements_filepath, "rb") as fin:
+            content = fin.read()
+    elif os.path.isfile(codes_tarball_filepath):
+        content = read_members_from_tarball(codes_tarball_filepath, [REQUIREMENTS_TXT_FILENAME]).get(REQUIREMENTS_TXT_FILENAME, b"")
+    return [line.strip() for line in content.decode("utf-8").splitlines() if line.strip()]
+
+
+def _normalize_distribution_name(name: str) -> str:
+    # wheel filenames use the normalized name with underscores
+    return re.sub(r"[-_.]+", "_", name).lower()
+
+
+def _find_wheel(wheelhouse_dir: str, name: str, version: str) -> Optional[str]:
+    prefix = f"{_normalize_distribution_name(name)}-{version}-"
+    if not os.path.isdir(wheelhouse_dir):
+        return None
+    for filename in os.listdir(wheelhouse_dir):
+        if filename.endswith(".whl") and filename.lower().startswith(prefix.lower()):
+            return os.path.join(wheelhouse_dir, filename)
+    return None
+
+
+def _record_hash(content: bytes) -> str:
+    digest = hashlib.sha256(content).digest()
+    return "sha256=" + base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
+
+
+def repack_installed_distribution(name: str, wheelhouse_dir: str) -> Optional[str]:
+    """
+    Rebuilds a wheel from an installed distribution, using the files listed in its `RECORD`, without any network access.
+
+    Files outside of the installation directory (e.g., console scripts, which the installer regenerates from
+    `entry_points.txt`), bytecode caches and installer-generated metadata are left out, and `RECORD` is regenerated.
+
+    Args:
+        name (str): The distribution name.
+        wheelhouse_dir (str): The directory to write the wheel into.
+
+    Returns:
+        str: The path of the wheel, or None if the distribution cannot be repacked (e.g., not installed from a wheel).
+    """
+    try:
+        distribution = importlib.metadata.distribution(name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+    wheel_metadata = distribution.read_text("WHEEL")
+    if wheel_metadata is None or distribution.files is None:
+        return None
+    tags = [line.split(":", 1)[1].strip() for line in wheel_metadata.splitlines() if line.startswith("Tag:")]
+    if not tags:
+        return None
+
+    dist_info_dirname = None
+    members = []
+    for file in distribution.files:
+        relpath = str(file).replace(os.sep, "/")
+        if relpath.startswith("../") or "__pycache__" in relpath:
+            continue
+        if relpath.endswith(".dist-info/" + os.path.basename(relpath)) and relpath.count("/") == 1:
+            dist_info_dirname = relpath.split("/")[0]
+            if os.path.basename(relpath) in INSTALLER_GENERATED_FILES:
+                continue
+        members.append((relpath, file.locate()))
+    if dist_info_dirname is None:
+        return None
+
+    version = distribution.version
+    wheel_filename = f"{_normalize_distribution_name(distribution.metadata['Name'])}-{version}-{tags[0]}.whl"
+    wheel_filepath = os.path.join(wheelhouse_dir, wheel_filename)
+    os.makedirs(wheelhouse_dir, exist_ok=True)
+    records = []
+    with atomic_open(wheel_filepath, "wb") as fout:
+        with zipfile.ZipFile(fout, "w", compression=zipfile.ZIP_DEFLATED) as wheel:
+            for relpath, filepath in members:
+                if not os.path.isfile(filepath):
+                    continue
+                with open(filepath, "rb") as fin:
+                    content = fin.read()
+                wheel.writestr(relpath, content)
+                records.append(f"{relpath},{_record_hash(content)},{len(content)}")
+            record_relpath = f"{dist_info_dirname}/RECORD"
+            records.append(f"{record_relpath},,")
+            wheel.writestr(record_relpath, "\n".join(records) + "\n")
+    return wheel_filepath
+
+
+def add_requirements_to_wheelhouse(requirements: list[str], wheelhouse_dir: str) -> list[str]:
+    """
+    Makes sure that the wheelhouse contains a wheel of every recorded distribution, repacking the missing ones from
+    the current environment. Wheels are shared by all workspaces, so each distribution version is only stored once.
+
+    Args:
+        requirements (list[str]): Requirements as recorded by `generate_requirements_txt`.
+        wheelhouse_dir (str): The wheelhouse directory.
+
+    Returns:
+        list[str]: The requirements which are still missing from the wheelhouse.
+    """
+    missing = []
+    for requirement in requirements:
+        name, _, version = requirement.partition("==")
+        if _find_wheel(wheelhouse_dir, name, version):
+            continue
+        try:
+            installed_version = importlib.metadata.version(name)
+        except importlib.metadata.PackageNotFoundError:
+            installed_version = None
+        if installed_version != version or repack_installed_distribution(name, wheelhouse_dir) is None:
+            missing.append(requirement)
+    return missing
+
+
+def _environment_key(requirements: list[str]) -> str:
+    key_material = "\n".join(sorted(requirements) + [sys.implementation.cache_tag, sys.platform, sys.executable])
+    return hashlib.sha256(key_material.encode("utf-8")).hexdigest()[:16]
+
+
+def _materialize_with_hardlinks(source_dir: str, target_dir: str):
+    """
+    Recreates an environment at another location by hard linking its files.
+    Text files under `bin` mentioning the source location (activation scripts, shebangs) are rewritten instead of linked.
+    """
+    for dirpath, dirnames, filenames in os.walk(source_dir):
+        target_dirpath = os.path.join(target_dir, os.path.relpath(dirpath, source_dir))
+        os.makedirs(target_dirpath, exist_ok=True)
+        for name in filenames + dirnames:
+            source_path = os.path.join(dirpath, name)
+            target_path = os.path.join(target_dirpath, name)
+            if name == ENVIRONMENT_COMPLETE_MARKER:
+                continue
+            if os.path.islink(source_path):
+                os.symlink(os.readlink(source_path), target_path)
+                continue
+            if name in dirnames:
+                continue
+            if os.path.basename(dirpath) in ("bin", "Scripts") or name == "pyvenv.cfg":
+                with open(source_path, "rb") as fin:
+                    content = fin.read()
+                if source_dir.encode("utf-8") in content:
+                    with open(target_path, "wb") as fout:
+                        fout.write(content.replace(source_dir.encode("utf-8"), target_dir.encode("utf-8")))
+                    shutil.copymode(source_path, target_path)
+                    continue
+            os.link(source_path, target_path)
+
+
+def build_environment(
+    workspace_dir: str,
+    wheelhouse_dir: str,
+    environments_dir: str,
+    target_dir: Optional[str] = None,
+) -> str:
+    """
+    Builds a virtual environment from the requirements recorded in a workspace, installing only from the local wheelhouse.
+
+    Environments are cached by their requirements (and interpreter), so workspaces with identical requirements share
+    a single installation. With `target_dir`, the cached environment is materialized there through hard links.
+
+    Args:
+        workspace_dir (str): The workspace directory.
+        wheelhouse_dir (str): The local wheelhouse directory.
+        environments_dir (str): The directory of cached environments.
+        target_dir (str, optional): Where to materialize the environment. Defaults to None, i.e., use the cached one.
+
+    Raises:
+        subprocess.CalledProcessError: If the environment cannot be created or a requirement is missing from the wheelhouse.
+
+    Returns:
+        str: The directory of the environment.
+    """
+    assert os.path.isdir(workspace_dir), f"The workspace directory '{workspace_dir}' does not exist."
+    requirements = read_workspace_requirements(workspace_dir)
+    environment_dir = os.path.abspath(os.path.join(environments_dir, _environment_key(requirements)))
+    complete_marker_filepath = os.path.join(environment_dir, ENVIRONMENT_COMPLETE_MARKER)
+    os.makedirs(environments_dir, exist_ok=True)
+    # the location of the environment is baked into its scripts, so it is built in place under a lock
+    # (concurrent builders of the same environment wait for each other) and marked complete once installed.
+    with open(f"{environment_dir}.lock", "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            if not os.path.isfile(complete_marker_filepath):
+                shutil.rmtree(environment_dir, ignore_errors=True)
+                subprocess.run([sys.executable, "-m", "venv", environment_dir], check=True)
+                if requirements:
+                    python_filepath = os.path.join(environment_dir, "Scripts" if os.name == "nt" else "bin", "python")
+                    subprocess.run(
+                        [python_filepath, "-m", "pip", "install", "--no-index", "--find-links", wheelhouse_dir,
+                         "--disable-pip-version-check", *requirements],
+                        check=True,
+                    )
+                open(complete_marker_filepath, "w").close()
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    if target_dir is None:
+        return environment_dir
+    target_dir = os.path.abspath(target_dir)
+    assert not os.path.exists(target_dir), f"'{target_dir}' already exists."
+    _materialize_with_hardlinks(environment_dir, target_dir)
+    return target_dir
+
+
+def get_wheelhouse_dir(workspace_basedir: str) -> str:
+    return os.path.join(workspace_basedir, WHEELHOUSE_DIRNAME)
+
+
+def get_environments_dir(workspace_basedir: str) -> str:
+    return os.path.join(workspace_basedir, ENVIRONMENTS_DIRNAME)
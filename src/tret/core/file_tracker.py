@@ -0,0 +1,120 @@
+import os
+import sys
+import warnings
+import importlib.machinery
+from typing import Optional
+from ..utils.ignore_utils import IgnoreMatcher
+from ..utils.module_detection import _get_site_package_directories
+
+# audit events whose first argument is the path of a file read by the experiment
+TRACKED_AUDIT_EVENTS = frozenset(["open", "ctypes.dlopen"])
+_WRITE_FLAGS = os.O_WRONLY | os.O_RDWR | getattr(os, "O_APPEND", 0)
+
+# tracked files up to this size are backed up with the codes, larger ones into the data tarball
+TRACKED_CODEFILE_MAX_SIZE = 1024 * 1024
+TRACKED_DATAFILE_MAX_SIZE = 64 * 1024 * 1024
+
+
+def _is_ignored_with_parents(ignore_matcher: IgnoreMatcher, filepath: str) -> bool:
+    """Whether a file or any of its parent directories below the root of `ignore_matcher` is excluded."""
+    parts = ignore_matcher.relpath(filepath, filepath).split("/")
+    parents = ("/".join(parts[:i]) for i in range(1, len(parts)))
+    return ignore_matcher.match("/".join(parts)) or any(ignore_matcher.match(parent, is_dir=True) for parent in parents)
+
+
+class OpenedFileTracker:
+    """
+    Records the files under a project root which are opened for reading, e.g., configs, prompt templates, tokenizer files,
+    and shared libraries, through an audit hook (`sys.addaudithook`), so that they can be backed up without being listed.
+
+    A file is recorded when it is first opened for reading, files first opened for writing are outputs of the experiment
+    and are never recorded. The hook is called for every audit event of the interpreter, so it only does a set lookup for paths it has already
+    seen, and resolves new paths once. Audit hooks cannot be removed, a stopped tracker only returns immediately.
+
+    Args:
+        root_dir (str, optional): Only files under this directory are recorded. Defaults to the current working directory.
+        exclude_dirs (list[str], optional): Directories under `root_dir` whose files are not recorded, e.g. the workspaces.
+            Site-packages directories (of virtual environments inside the project) are always excluded.
+    """
+    def __init__(self, root_dir: Optional[str] = None, exclude_dirs: Optional[list[str]] = None):
+        self.root_dir = os.path.abspath(root_dir or os.getcwd())
+        self._root_prefix = os.path.join(self.root_dir, "")
+        self._exclude_prefixes = tuple(
+            os.path.join(os.path.abspath(dirpath), "") for dirpath in [*(exclude_dirs or []), *_get_site_package_directories()]
+        )
+        self.active = False
+        self._hook_added = False
+        self._seen = set()
+        self.files = set()
+
+    def start(self):
+        self.active = True
+        if not self._hook_added:
+            sys.addaudithook(self._audit_hook)
+            self._hook_added = True
+
+    def stop(self):
+        self.active = False
+
+    def _audit_hook(self, event: str, args: tuple):
+        if event not in TRACKED_AUDIT_EVENTS or not self.active:
+            return
+        # errors raised by audit hooks abort the audited operation, so they are never propagated
+        try:
+            path = args[0]
+            if path in self._seen:
+                return
+            self._seen.add(path)
+            if event != "open" or not args[2] & _WRITE_FLAGS:
+                self._record(path)
+        except Exception:
+            pass
+
+    def _record(self, path):
+        if isinstance(path, int):
+            # opened file descriptors
+            return
+        path = os.path.abspath(os.fsdecode(os.fspath(path)))
+        if path.startswith(self._root_prefix) and not path.startswith(self._exclude_prefixes):
+            self.files.add(path)
+
+    def tracked_files(self) -> list[str]:
+        """
+        Returns the recorded files which still exist, together with the extension modules under the project root,
+        which are loaded without audited `open` events.
+        """
+        for module in list(sys.modules.values()):
+            filepath = getattr(module, "__file__", None)
+            if isinstance(filepath, str) and filepath.endswith(tuple(importlib.machinery.EXTENSION_SUFFIXES)):
+                self._record(filepath)
+        # the set is copied first, since the hook may add files from other threads meanwhile
+        return sorted(filepath for filepath in list(self.files) if os.path.isfile(filepath))
+
+    def split_backup_paths(self, ignore_matcher: Optional[IgnoreMatcher] = None) -> tuple[list[str], list[str]]:
+        """
+        Splits the tracked files into files backed up with the codes and files backed up into the data tarball by their sizes.
+        Files larger than `TRACKED_DATAFILE_MAX_SIZE` are not backed up, with a warning.
+
+        Args:
+            ignore_matcher (IgnoreMatcher, optional): Excludes the ignored files. Defaults to None.
+
+        Returns:
+            tuple[list[str], list[str]]: The code files, and the data files relative to the current working directory.
+        """
+        codefiles, datafiles, skipped_files = [], [], []
+        for filepath in self.tracked_files():
+            if ignore_matcher is not None and _is_ignored_with_parents(ignore_matcher, filepath):
+                continue
+            size = os.path.getsize(filepath)
+            if size <= TRACKED_CODEFILE_MAX_SIZE:
+                codefiles.append(filepath)
+            elif size <= TRACKED_DATAFILE_MAX_SIZE:
+                datafiles.append(os.path.relpath(filepath))
+            else:
+                skipped_files.append(filepath)
+        if skipped_files:
+            warnings.warn(
+                f"{len(skipped_files)} files read by the experiment are larger than {TRACKED_DATAFILE_MAX_SIZE} bytes and "
+                f"are not backed up automatically, e.g. {skipped_files[:5]}. Back them up explicitly if needed."
+            )
+        return codefiles, datafiles
@@ -0,0 +1,607 @@
+import io
+import os
+import copy
+import json
+import time
+import shutil
+import tarfile
+import warnings
+from typing import Callable, Optional
+from ..constants import (
+    TRET_ATTRIBUTES_FILENAME,
+    CODES_TARBALL_FILENAME,
+    CURRENT_CODES_TARBALL_FILENAME,
+    TRET_PACKS_DIRNAME,
+    TRET_STAGED_CHUNKS_DIRNAME,
+    TRET_GC_LOCK_FILENAME,
+    TRET_GC_STATE_FILENAME,
+    TRET_INTERNAL_PREFIX,
+    CHUNK_STORE_DIRNAME,
+)
+from .chunk_store import load_chunk_recipes
+from ..utils.file_utils import atomic_open
+from ..utils.tarball_utils import hash_fileobj, _data_filter, _member_filepath, _EXTRACT_KWARGS
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+class _GCLock:
+    """An exclusive, non-blocking lock on a workspace base directory, so that only one gc runs at a time."""
+    def __init__(self, workspace_basedir: str):
+        self.lock_filepath = os.path.join(workspace_basedir, TRET_GC_LOCK_FILENAME)
+        self.lock_file = None
+
+    def __enter__(self):
+        self.lock_file = open(self.lock_filepath, "a")
+        if fcntl is None:
+            warnings.warn("File locking is not supported on this platform, concurrent gc runs are not prevented.")
+            return self
+        try:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self.lock_file.close()
+            raise RuntimeError(f"Another gc is running on '{os.path.dirname(self.lock_filepath)}'.")
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+        self.lock_file.close()
+
+
+def _get_directory_size_and_mtime(directory: str):
+    """Returns the total size of the files inside `directory` (symbolic links are not followed) and the latest mtime."""
+    total_size, latest_mtime = 0, os.lstat(directory).st_mtime
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for name in filenames + dirnames:
+            file_stat = os.lstat(os.path.join(dirpath, name))
+            latest_mtime = max(latest_mtime, file_stat.st_mtime)
+            if name in filenames:
+                total_size += file_stat.st_size
+    return total_size, latest_mtime
+
+
+def _load_pack_indexes(workspace_basedir: str) -> list[tuple]:
+    """Returns (pack filepath, index) of every pack in the base directory, sorted by name."""
+    packs_dir = os.path.join(workspace_basedir, TRET_PACKS_DIRNAME)
+    if not os.path.isdir(packs_dir):
+        return []
+    packs = []
+    for filename in sorted(os.listdir(packs_dir)):
+        if filename.endswith(".json"):
+            with open(os.path.join(packs_dir, filename), "r", encoding="utf-8") as fin:
+                index = json.load(fin)
+            packs.append((os.path.join(packs_dir, f"{filename[:-len('.json')]}.tar"), index))
+    return packs
+
+
+def _get_packed_sizes(pack_filepath: str, index: dict) -> dict:
+    """Returns the bytes taken by each workspace of a pack, from the byte ranges of its index."""
+    offsets = sorted((entry["offset"], name) for name, entry in index.items())
+    end = os.path.getsize(pack_filepath)
+    return {
+        name: (offsets[i + 1][0] if i + 1 < len(offsets) else end) - offset
+        for i, (offset, name) in enumerate(offsets)
+    }
+
+
+def list_workspaces(workspace_basedir: str) -> list[dict]:
+    """
+    Lists the workspaces in a base directory, from the oldest backup to the newest,
+    including the workspaces which only exist in packs of `.tret-packs`.
+
+    Args:
+        workspace_basedir (str): The base directory of workspaces.
+
+    Returns:
+        list[dict]: One entry per workspace, with its name, directory, backup timestamp, size, latest mtime, metadata,
+            whether its backup has completed (i.e., `.tretattributes` has been written), whether it is `unpacked`
+            (i.e., its directory exists), and the `packs` which contain it.
+    """
+    workspaces = {}
+    if not os.path.isdir(workspace_basedir):
+        return []
+    for name in os.listdir(workspace_basedir):
+        workspace_dir = os.path.join(workspace_basedir, name)
+        if name.startswith(TRET_INTERNAL_PREFIX) or os.path.islink(workspace_dir) or not os.path.isdir(workspace_dir):
+            continue
+        size, latest_mtime = _get_directory_size_and_mtime(workspace_dir)
+        tret_attributes_filepath = os.path.join(workspace_dir, TRET_ATTRIBUTES_FILENAME)
+        complete = os.path.isfile(tret_attributes_filepath)
+        tret_attributes = {}
+        if complete:
+            try:
+                tret_attributes = json.load(open(tret_attributes_filepath, "r", encoding="utf-8"))
+            except ValueError:
+                # attributes are being written by a concurrent backup
+                complete = False
+        workspaces[name] = {
+            "name": name,
+            "dir": workspace_dir,
+            "backup_timestamp": tret_attributes.get("backup_timestamp", latest_mtime),
+            "size": size,
+            "mtime": latest_mtime,
+            "metadata": tret_attributes.get("metadata", {}),
+            "complete": complete,
+            "unpacked": True,
+            "packs": [],
+        }
+    for pack_filepath, index in _load_pack_indexes(workspace_basedir):
+        sizes = _get_packed_sizes(pack_filepath, index)
+        pack_mtime = os.path.getmtime(pack_filepath)
+        for name, entry in index.items():
+            workspace = workspaces.get(name)
+            if workspace is None:
+                workspace = workspaces[name] = {
+                    "name": name,
+                    "dir": os.path.join(workspace_basedir, name),
+                    "backup_timestamp": entry.get("backup_timestamp") or pack_mtime,
+                    "size": 0,
+                    "mtime": pack_mtime,
+                    "metadata": entry.get("metadata", {}),
+                    "complete": True,
+                    "unpacked": False,
+                    "packs": [],
+                }
+            elif not workspace["unpacked"] and (entry.get("backup_timestamp") or 0) > workspace["backup_timestamp"]:
+                # the latest packed backup is the one which is unpacked on demand
+                workspace.update(backup_timestamp=entry["backup_timestamp"], metadata=entry.get("metadata", {}))
+            if not workspace["unpacked"]:
+                workspace["size"] += sizes[name]
+                workspace["mtime"] = max(workspace["mtime"], pack_mtime)
+            workspace["packs"].append(pack_filepath)
+    return sorted(workspaces.values(), key=lambda workspace: workspace["backup_timestamp"])
+
+
+def select_expired_workspaces(
+    workspaces: list[dict],
+    keep_last: Optional[int] = None,
+    keep_tagged: bool = False,
+    max_age: Optional[float] = None,
+    max_total_size: Optional[int] = None,
+    keep_predicate: Optional[Callable[[dict], bool]] = None,
+    now: Optional[float] = None,
+) -> list[dict]:
+    """
+    Applies retention policies to a list of workspaces sorted from the oldest to the newest.
+
+    A workspace is protected if it is among the `keep_last` newest ones, if it is tagged (its metadata has a non-empty `tags`)
+    and `keep_tagged` is set, or if `keep_predicate(metadata)` is true. Unprotected workspaces expire when they are older than
+    `max_age`, or, starting from the oldest, as long as the total size exceeds `max_total_size`.
+    If only `keep_last` is given, every unprotected workspace expires.
+
+    Args:
+        workspaces (list[dict]): Workspaces as returned by `list_workspaces`.
+        keep_last (int, optional): Number of newest workspaces to keep. Defaults to None.
+        keep_tagged (bool, optional): Whether to keep tagged workspaces. Defaults to False.
+        max_age (float, optional): Maximum age in seconds. Defaults to None.
+        max_total_size (int, optional): Maximum total size in bytes of all workspaces. Defaults to None.
+        keep_predicate (Callable[[dict], bool], optional): Keeps workspaces whose metadata satisfies it. Defaults to None.
+        now (float, optional): The current timestamp. Defaults to `time.time()`.
+
+    Returns:
+        list[dict]: The expired workspaces.
+    """
+    now = time.time() if now is None else now
+    protected = set()
+    if keep_last:
+        protected.update(workspace["name"] for workspace in workspaces[-keep_last:])
+    for workspace in workspaces:
+        if keep_tagged and workspace["metadata"].get("tags"):
+            protected.add(workspace["name"])
+        if keep_predicate is not None and keep_predicate(workspace["metadata"]):
+            protected.add(workspace["name"])
+
+    expired = []
+    for workspace in workspaces:
+        if workspace["name"] in protected:
+            continue
+        if max_age is not None and now - workspace["backup_timestamp"] > max_age:
+            expired.append(workspace)
+        elif max_age is None and max_total_size is None and keep_last is not None:
+            expired.append(workspace)
+
+    if max_total_size is not None:
+        expired_names = {workspace["name"] for workspace in expired}
+        total_size = sum(workspace["size"] for workspace in workspaces if workspace["name"] not in expired_names)
+        for workspace in workspaces:
+            if total_size <= max_total_size:
+                break
+            if workspace["name"] in protected or workspace["name"] in expired_names:
+                continue
+            expired.append(workspace)
+            expired_names.add(workspace["name"])
+            total_size -= workspace["size"]
+    return expired
+
+
+def _load_gc_state(workspace_basedir: str) -> dict:
+    state_filepath = os.path.join(workspace_basedir, TRET_GC_STATE_FILENAME)
+    if not os.path.isfile(state_filepath):
+        return {"hashes": {}}
+    try:
+        return json.load(open(state_filepath, "r", encoding="utf-8"))
+    except ValueError:
+        return {"hashes": {}}
+
+
+def _save_gc_state(workspace_basedir: str, state: dict):
+    state_filepath = os.path.join(workspace_basedir, TRET_GC_STATE_FILENAME)
+    with atomic_open(state_filepath, "w", encoding="utf-8") as fout:
+        json.dump(state, fout, ensure_ascii=False)
+
+
+def _get_cached_hash(state: dict, filepath: str) -> str:
+    """Hashes a file, reusing the hash of previous gc runs if the file has not changed since."""
+    file_stat = os.stat(filepath)
+    key = f"{os.path.abspath(filepath)}:{file_stat.st_size}:{file_stat.st_mtime_ns}"
+    if key not in state["hashes"]:
+        with open(filepath, "rb") as fin:
+            state["hashes"][key] = hash_fileobj(fin)
+    return state["hashes"][key]
+
+
+def _is_modified_since(workspace: dict) -> bool:
+    """Checks whether a workspace has been written to since it was listed."""
+    if not workspace["unpacked"]:
+        # a workspace only in packs is modified by unpacking it
+        return os.path.lexists(workspace["dir"])
+    if not os.path.isdir(workspace["dir"]):
+        return True
+    _, latest_mtime = _get_directory_size_and_mtime(workspace["dir"])
+    return latest_mtime > workspace["mtime"]
+
+
+TRASH_PREFIX = f"{TRET_INTERNAL_PREFIX}trash-"
+
+
+def _remove_workspace(workspace: dict, workspace_basedir: str):
+    # renaming first makes the removal atomic for concurrent readers,
+    # the name is unique so that the trash left by an interrupted run is never in the way
+    trash_dir = os.path.join(workspace_basedir, f"{TRASH_PREFIX}{workspace['name']}-{os.getpid()}-{time.time_ns()}")
+    os.replace(workspace["dir"], trash_dir)
+    shutil.rmtree(trash_dir)
+
+
+def _rewrite_pack_without(pack_filepath: str, index: dict, names: set):
+    """
+    Removes workspaces from a pack. The remaining workspaces are copied into a new pack, whose index is written before
+    the old pack is removed, so that they can be unpacked from either pack at any time.
+    """
+    packs_dir = os.path.dirname(pack_filepath)
+    remaining = {name: entry for name, entry in index.items() if name not in names}
+    if remaining:
+        new_pack_name = f"pack-{time.time_ns()}"
+        new_index = {}
+        with open(pack_filepath, "rb") as fin, tarfile.open(fileobj=fin, mode="r:") as old_tar, \
+                atomic_open(os.path.join(packs_dir, f"{new_pack_name}.tar"), "wb") as fout, \
+                tarfile.open(fileobj=fout, mode="w:") as tar:
+            for member in old_tar:
+                name = member.name.split("/", 1)[0]
+                if name not in remaining:
+                    continue
+                if name not in new_index:
+                    new_index[name] = {**remaining[name], "offset": fout.tell()}
+                fileobj = None
+                if member.islnk() and member.linkname.split("/", 1)[0] not in remaining:
+                    # the target is removed with its workspace, the link becomes a copy of it
+                    data = old_tar.extractfile(member).read()
+                    member = copy.copy(member)
+                    member.type, member.linkname, member.size = tarfile.REGTYPE, "", len(data)
+                    fileobj = io.BytesIO(data)
+                elif member.isfile():
+                    fileobj = old_tar.extractfile(member)
+                tar.addfile(member, fileobj)
+        with atomic_open(os.path.join(packs_dir, f"{new_pack_name}.json"), "w", encoding="utf-8") as fout:
+            json.dump(new_index, fout, ensure_ascii=False, indent=4)
+    os.remove(f"{pack_filepath[:-len('.tar')]}.json")
+    os.remove(pack_filepath)
+
+
+def _remove_from_packs(workspaces: list[dict], workspace_basedir: str):
+    """Drops workspaces from every pack containing them, so that they are not unpacked on demand anymore."""
+    backup_timestamps = {workspace["name"]: workspace["backup_timestamp"] for workspace in workspaces}
+    pack_filepaths = {pack_filepath for workspace in workspaces for pack_filepath in workspace["packs"]}
+    for pack_filepath, index in _load_pack_indexes(workspace_basedir):
+        # a staged backup may have published a newer pack of the workspace since it was listed
+        names = {
+            name for name, entry in index.items()
+            if name in backup_timestamps and (entry.get("backup_timestamp") or 0) <= backup_timestamps[name]
+        }
+        if pack_filepath in pack_filepaths and names:
+            _rewrite_pack_without(pack_filepath, index, names)
+
+
+def _get_referenced_chunks(workspace_dir: str) -> set:
+    recipes = load_chunk_recipes(os.path.join(workspace_dir, "data"))
+    return {chunk_hash for recipe in recipes.values() for chunk_hash, _ in recipe["chunks"]}
+
+
+def _sweep_chunks(workspace_basedir: str, grace_period: float, now: float, dry_run: bool, record: Callable):
+    """Removes the chunks which are not referenced by any workspace, either unpacked, packed or being staged."""
+    chunk_store_dir = os.path.join(workspace_basedir, CHUNK_STORE_DIRNAME)
+    if not os.path.isdir(chunk_store_dir):
+        return
+    referenced = set()
+    # records are removed once their workspace is published, so they are read before the indexes of the packs
+    records_dir = os.path.join(workspace_basedir, TRET_STAGED_CHUNKS_DIRNAME)
+    if os.path.isdir(records_dir):
+        for filename in os.listdir(records_dir):
+            try:
+                with open(os.path.join(records_dir, filename), "r", encoding="utf-8") as fin:
+                    referenced.update(json.load(fin))
+            except FileNotFoundError:
+                continue
+    for name in os.listdir(workspace_basedir):
+        workspace_dir = os.path.join(workspace_basedir, name)
+        if not name.startswith(TRET_INTERNAL_PREFIX) and os.path.isdir(workspace_dir):
+            referenced |= _get_referenced_chunks(workspace_dir)
+    for _, index in _load_pack_indexes(workspace_basedir):
+        for entry in index.values():
+            referenced.update(entry.get("chunks", []))
+
+    for dirpath, _, filenames in os.walk(chunk_store_dir):
+        for filename in filenames:
+            chunk_filepath = os.path.join(dirpath, filename)
+            chunk_stat = os.stat(chunk_filepath)
+            # recent chunks may belong to a backup whose recipe has not been written yet
+            if filename in referenced or now - chunk_stat.st_mtime <= grace_period:
+                continue
+            if not dry_run:
+                os.remove(chunk_filepath)
+            record("remove-chunk", chunk_filepath, chunk_stat.st_size)
+
+
+def _pack_workspaces(workspaces: list[dict], workspace_basedir: str, pack_name: str) -> tuple[str, dict]:
+    """
+    Packs workspaces into a single uncompressed tarball, together with an index of the byte range of each workspace,
+    so that one workspace can be unpacked without reading the whole pack.
+
+    Returns:
+        tuple[str, dict]: The path of the pack and its index.
+    """
+    packs_dir = os.path.join(workspace_basedir, TRET_PACKS_DIRNAME)
+    os.makedirs(packs_dir, exist_ok=True)
+    pack_filepath = os.path.join(packs_dir, f"{pack_name}.tar")
+    index = {}
+    with atomic_open(pack_filepath, "wb") as fout:
+        with tarfile.open(fileobj=fout, mode="w:") as tar:
+            for workspace in workspaces:
+                start = fout.tell()
+                # hard links only point within their workspace, so that each workspace can be unpacked alone
+                tar.inodes = {}
+                tar.add(workspace["dir"], arcname=workspace["name"], recursive=True)
+                index[workspace["name"]] = {
+                    "offset": start,
+                    "backup_timestamp": workspace["backup_timestamp"],
+                    "metadata": workspace["metadata"],
+                    # chunks are kept outside of packs, the references are recorded so that they are not collected
+                    "chunks": sorted(_get_referenced_chunks(workspace["dir"])),
+                }
+    index_filepath = os.path.join(packs_dir, f"{pack_name}.json")
+    with atomic_open(index_filepath, "w", encoding="utf-8") as fout:
+        json.dump(index, fout, ensure_ascii=False, indent=4)
+    return pack_filepath, index
+
+
+def find_packed_workspace(workspace_basedir: str, workspace_name: str) -> Optional[tuple]:
+    """
+    Finds a workspace compacted into a pack, or published into one by a staged backup.
+    If several packs contain the workspace, the one with the latest backup is returned.
+
+    Returns:
+        tuple: (pack filepath, byte offset of the workspace in the pack), or None if the workspace is not packed.
+    """
+    found, latest_backup_timestamp = None, None
+    for pack_filepath, index in _load_pack_indexes(workspace_basedir):
+        if workspace_name in index:
+            backup_timestamp = index[workspace_name].get("backup_timestamp") or 0
+            if found is None or backup_timestamp > latest_backup_timestamp:
+                found, latest_backup_timestamp = (pack_filepath, index[workspace_name]["offset"]), backup_timestamp
+    return found
+
+
+def _extract_pack_member(tar: tarfile.TarFile, member: tarfile.TarInfo, dest_path: str):
+    """
+    Extracts a member of a pack into the resolved directory `dest_path` with the semantics of the `data` filter,
+    except that symbolic links are recreated as they are: the data of workspaces links to absolute paths on purpose.
+    """
+    if member.issym():
+        filepath = _member_filepath(dest_path, member.name)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        if os.path.lexists(filepath):
+            os.remove(filepath)
+        os.symlink(member.linkname, filepath)
+        return
+    # checked here as well, for the versions of python without extraction filters
+    _data_filter(member, dest_path, os.path.realpath)
+    tar.extract(member, path=dest_path, **_EXTRACT_KWARGS)
+
+
+def unpack_workspace(workspace_basedir: str, workspace_name: str, output_basedir: Optional[str] = None) -> bool:
+    """
+    Extracts a workspace compacted into a pack back into the base directory.
+
+    Args:
+        workspace_basedir (str): The base directory of workspaces.
+        workspace_name (str): The name of the workspace.
+        output_basedir (str, optional): The directory to extract the workspace into. Defaults to `workspace_basedir`.
+
+    Returns:
+        bool: True if the workspace has been unpacked, False if it is not in any pack.
+    """
+    found = find_packed_workspace(workspace_basedir, workspace_name)
+    if found is None:
+        return False
+    pack_filepath, offset = found
+    output_basedir = output_basedir or workspace_basedir
+    os.makedirs(output_basedir, exist_ok=True)
+    dest_path = os.path.realpath(output_basedir)
+    with open(pack_filepath, "rb") as fin:
+        fin.seek(offset)
+        with tarfile.open(fileobj=fin, mode="r:") as tar:
+            for member in tar:
+                if member.name != workspace_name and not member.name.startswith(f"{workspace_name}/"):
+                    # members of one workspace are contiguous in the pack
+                    break
+                _extract_pack_member(tar, member, dest_path)
+    return True
+
+
+def collect_garbage(
+    workspace_basedir: str,
+    keep_last: Optional[int] = None,
+    keep_tagged: bool = False,
+    max_age: Optional[float] = None,
+    max_total_size: Optional[int] = None,
+    keep_predicate: Optional[Callable[[dict], bool]] = None,
+    journal_max_age: Optional[float] = None,
+    compact_older_than: Optional[float] = None,
+    compact_max_workspace_size: int = 16 * 1024 * 1024,
+    grace_period: float = 600.0,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Reclaims disk space in a workspace base directory.
+
+    The following actions are performed, in order:
+    1. Workspaces expired by the retention policies (see `select_expired_workspaces`) are removed,
+       together with their copies in packs.
+    2. Rollback journals (`current-codes.tar.gz`) older than `journal_max_age` are removed.
+    3. Identical `codes.tar.gz` of different workspaces are deduplicated through hard links.
+    4. Small workspaces older than `compact_older_than` are compacted into a single pack with an index.
+       They can still be restored, since `TretWorkspace.restore` unpacks them on demand.
+    5. Chunks of the chunk store which are not referenced by any workspace anymore are removed.
+
+    Workspaces whose backup has not completed, or which have been modified within `grace_period`, are never touched,
+    and each workspace is checked again right before it is modified, so gc is safe while backups are being written.
+    Workspaces left in the trash by an interrupted run are removed first.
+    Hashes of code tarballs are cached between runs, so repeated runs only read new tarballs.
+
+    Args:
+        workspace_basedir (str): The base directory of workspaces.
+        keep_last, keep_tagged, max_age, max_total_size, keep_predicate: Retention policies, see `select_expired_workspaces`.
+        journal_max_age (float, optional): Maximum age in seconds of rollback journals. Defaults to None, i.e., keep them.
+        compact_older_than (float, optional): Minimum age in seconds of workspaces to compact. Defaults to None, i.e., no compaction.
+        compact_max_workspace_size (int, optional): Maximum size in bytes of a workspace to be compacted. Defaults to 16MiB.
+        grace_period (float, optional): Workspaces modified more recently than this many seconds are skipped. Defaults to 600.
+        dry_run (bool, optional): If True, only reports what would be done. Defaults to False.
+
+    Returns:
+        dict: A report with the list of actions (`action`, `path`, `bytes`) and the total `reclaimed_bytes`.
+    """
+    assert os.path.isdir(workspace_basedir), f"The workspace base directory '{workspace_basedir}' does not exist."
+    report = {"actions": [], "reclaimed_bytes": 0, "dry_run": dry_run}
+
+    def _record(action: str, path: str, nbytes: int):
+        report["actions"].append({"action": action, "path": path, "bytes": nbytes})
+        report["reclaimed_bytes"] += nbytes
+
+    with _GCLock(workspace_basedir):
+        now = time.time()
+        state = _load_gc_state(workspace_basedir)
+        # workspaces renamed into the trash by an interrupted run
+        for name in sorted(os.listdir(workspace_basedir)):
+            trash_dir = os.path.join(workspace_basedir, name)
+            if name.startswith(TRASH_PREFIX) and os.path.isdir(trash_dir) and not os.path.islink(trash_dir):
+                nbytes, _ = _get_directory_size_and_mtime(trash_dir)
+                if not dry_run:
+                    shutil.rmtree(trash_dir)
+                _record("remove", trash_dir, nbytes)
+        workspaces = [
+            workspace for workspace in list_workspaces(workspace_basedir)
+            if workspace["complete"] and now - workspace["mtime"] > grace_period
+        ]
+
+        expired = select_expired_workspaces(
+            workspaces,
+            keep_last=keep_last,
+            keep_tagged=keep_tagged,
+            max_age=max_age,
+            max_total_size=max_total_size,
+            keep_predicate=keep_predicate,
+            now=now,
+        )
+        if not dry_run:
+            expired = [workspace for workspace in expired if not _is_modified_since(workspace)]
+            # packed copies go first, so that the workspace is not unpacked again in the meantime
+            _remove_from_packs(expired, workspace_basedir)
+            for workspace in expired:
+                if workspace["unpacked"]:
+                    _remove_workspace(workspace, workspace_basedir)
+        expired_names = set()
+        for workspace in expired:
+            expired_names.add(workspace["name"])
+            _record("remove", workspace["dir"], workspace["size"])
+        workspaces = [workspace for workspace in workspaces if workspace["name"] not in expired_names]
+
+        if journal_max_age is not None:
+            for workspace in workspaces:
+                journal_filepath = os.path.join(workspace["dir"], CURRENT_CODES_TARBALL_FILENAME)
+                if os.path.isfile(journal_filepath) and now - os.path.getmtime(journal_filepath) > journal_max_age:
+                    nbytes = os.path.getsize(journal_filepath)
+                    if not dry_run:
+                        os.remove(journal_filepath)
+                    _record("remove-journal", journal_filepath, nbytes)
+
+        to_compact = []
+        if compact_older_than is not None:
+            to_compact = [
+                workspace for workspace in workspaces
+                # workspaces unpacked on demand are still in their packs
+                if workspace["unpacked"] and not workspace["packs"]
+                and now - workspace["backup_timestamp"] > compact_older_than
+                and workspace["size"] <= compact_max_workspace_size
+                and not os.path.isfile(os.path.join(workspace["dir"], CURRENT_CODES_TARBALL_FILENAME))
+            ]
+        compacted_names = {workspace["name"] for workspace in to_compact}
+
+        codes_tarballs_by_hash = {}
+        for workspace in workspaces:
+            if workspace["name"] in compacted_names:
+                continue
+            codes_tarball_filepath = os.path.join(workspace["dir"], CODES_TARBALL_FILENAME)
+            if not os.path.isfile(codes_tarball_filepath) or os.path.islink(codes_tarball_filepath):
+                continue
+            content_hash = _get_cached_hash(state, codes_tarball_filepath)
+            if content_hash not in codes_tarballs_by_hash:
+                codes_tarballs_by_hash[content_hash] = codes_tarball_filepath
+                continue
+            original_filepath = codes_tarballs_by_hash[content_hash]
+            if os.path.samefile(original_filepath, codes_tarball_filepath):
+                continue
+            nbytes = os.path.getsize(codes_tarball_filepath)
+            if not dry_run:
+                temp_link_filepath = f"{codes_tarball_filepath}.tret-link"
+                os.link(original_filepath, temp_link_filepath)
+                os.replace(temp_link_filepath, codes_tarball_filepath)
+            _record("dedup", codes_tarball_filepath, nbytes)
+
+        if len(to_compact) > 1:
+            if not dry_run:
+                to_compact = [workspace for workspace in to_compact if not _is_modified_since(workspace)]
+                pack_filepath, index = _pack_workspaces(to_compact, workspace_basedir, pack_name=f"pack-{int(now * 1000)}")
+                # a backup written into a workspace while it was packed may be missing from the pack
+                modified_names = {workspace["name"] for workspace in to_compact if _is_modified_since(workspace)}
+                if modified_names:
+                    _rewrite_pack_without(pack_filepath, index, modified_names)
+                    to_compact = [workspace for workspace in to_compact if workspace["name"] not in modified_names]
+                for workspace in to_compact:
+                    _remove_workspace(workspace, workspace_basedir)
+            for workspace in to_compact:
+                # files are stored uncompressed in the pack, what is saved is the per-file overhead on the file system.
+                _record("compact", workspace["dir"], 0)
+
+        _sweep_chunks(workspace_basedir, grace_period=grace_period, now=now, dry_run=dry_run, record=_record)
+
+        if not dry_run:
+            live_keys = {
+                key for key in state["hashes"]
+                if os.path.isfile(key.rsplit(":", 2)[0])
+            }
+            state["hashes"] = {key: value for key, value in state["hashes"].items() if key in live_keys}
+            _save_gc_state(workspace_basedir, state)
+    return report
@@ -0,0 +1,193 @@
+import os
+import sys
+import json
+import time
+import shlex
+import signal
+import shutil
+import tempfile
+import warnings
+import subprocess
+import concurrent.futures
+from typing import Optional
+from ..constants import RUN_INFO_FILENAME
+from ..utils.file_utils import atomic_open
+from .code_backup_and_restore import snapshot_git_state
+
+# set in the environment of the launched command, for the site hook of every Python process it starts
+RUN_MODULES_DIR_ENV = "TRET_RUN_MODULES_DIR"
+# values of environment variables whose names contain one of these are not recorded
+SECRET_ENV_MARKERS = ("TOKEN", "SECRET", "PASSWORD", "PASSWD", "CREDENTIAL", "API_KEY", "ACCESS_KEY", "PRIVATE_KEY")
+REDACTED_VALUE = "<redacted>"
+FORWARDED_SIGNALS = ("SIGTERM", "SIGHUP", "SIGUSR1", "SIGUSR2")
+
+# `sitecustomize` of the launched Python processes. It only registers an exit handler, so the startup is unchanged,
+# and then imports the `sitecustomize` it shadows, if any.
+SITE_HOOK_SOURCE = r'''
+import os
+import sys
+import atexit
+
+
+def _tret_record_modules():
+    try:
+        import json
+        prefixes = tuple(
+            os.path.join(os.path.abspath(prefix), "")
+            for prefix in {sys.prefix, sys.exec_prefix, sys.base_prefix, sys.base_exec_prefix}
+        )
+        descriptions = []
+        for key, module in list(sys.modules.items()):
+            name, file = getattr(module, "__name__", None), getattr(module, "__file__", None)
+            if not isinstance(name, str):
+                continue
+            file = file if isinstance(file, str) else None
+            # modules of the interpreter, of its environment and this hook are never local
+            if file is not None and os.path.abspath(file).startswith((*prefixes, os.path.join(_tret_hook_dir, ""))):
+                continue
+            descriptions.append([key, name, file, "%d:%d" % (os.getpid(), id(module))])
+        filepath = os.path.join(os.environ["TRET_RUN_MODULES_DIR"], "%d.json" % os.getpid())
+        with open(filepath + ".tmp", "w", encoding="utf-8") as fout:
+            json.dump({"cwd": os.getcwd(), "modules": descriptions}, fout)
+        os.replace(filepath + ".tmp", filepath)
+    except Exception:
+        pass
+
+
+if os.environ.get("TRET_RUN_MODULES_DIR"):
+    atexit.register(_tret_record_modules)
+
+_tret_hook_dir = os.path.dirname(os.path.abspath(__file__))
+_tret_sys_path = sys.path[:]
+sys.path[:] = [path for path in sys.path if os.path.abspath(path or os.curdir) != _tret_hook_dir]
+_tret_module = sys.modules.pop("sitecustomize")
+try:
+    import sitecustomize  # noqa: F401
+except ImportError:
+    pass
+finally:
+    # the import system expects this module in `sys.modules` once it has been executed
+    sys.modules["sitecustomize"] = _tret_module
+    sys.path[:] = _tret_sys_path
+'''
+
+
+def _redact_environment(environment: dict) -> dict:
+    return {
+        key: REDACTED_VALUE if any(marker in key.upper() for marker in SECRET_ENV_MARKERS) else value
+        for key, value in environment.items()
+    }
+
+
+def _prepare_site_hook(hook_dir: str) -> dict:
+    """Writes the site hook into `hook_dir`, and returns the environment which makes Python processes load it."""
+    modules_dir = os.path.join(hook_dir, "modules")
+    os.makedirs(modules_dir)
+    with open(os.path.join(hook_dir, "sitecustomize.py"), "w", encoding="utf-8") as fout:
+        fout.write(SITE_HOOK_SOURCE)
+    environment = dict(os.environ)
+    python_path = environment.get("PYTHONPATH")
+    environment["PYTHONPATH"] = hook_dir if not python_path else os.pathsep.join([hook_dir, python_path])
+    environment[RUN_MODULES_DIR_ENV] = modules_dir
+    return environment
+
+
+def _collect_modules(modules_dir: str) -> list:
+    """Merges the modules recorded by every Python process of the command, ignoring those started in other directories."""
+    descriptions, working_directory = {}, os.getcwd()
+    for filename in sorted(os.listdir(modules_dir)):
+        if not filename.endswith(".json"):
+            continue
+        recorded = json.load(open(os.path.join(modules_dir, filename), "r", encoding="utf-8"))
+        # local modules are classified relative to the working directory of the launcher
+        if os.path.abspath(recorded["cwd"]) != working_directory:
+            continue
+        for description in recorded["modules"]:
+            descriptions.setdefault(description[0], description)
+    return list(descriptions.values())
+
+
+def _write_run_info(workspace_dir: str, run_info: dict):
+    os.makedirs(workspace_dir, exist_ok=True)
+    with atomic_open(os.path.join(workspace_dir, RUN_INFO_FILENAME), "w", encoding="utf-8") as fout:
+        json.dump(run_info, fout, ensure_ascii=False, indent=4)
+
+
+def _wait_forwarding_signals(process: subprocess.Popen) -> int:
+    """
+    Waits for the command, forwarding the signals a scheduler sends to stop or warn a job to it, so that its backup
+    is still finished after it exits. SIGINT is ignored, the terminal sends it to the command as well.
+    """
+    previous_handlers = {}
+
+    def _forward(signum, frame):
+        if process.poll() is None:
+            process.send_signal(signum)
+
+    for name in ("SIGINT", *FORWARDED_SIGNALS):
+        signum = getattr(signal, name, None)
+        if signum is not None:
+            previous_handlers[signum] = signal.signal(signum, signal.SIG_IGN if name == "SIGINT" else _forward)
+    try:
+        return process.wait()
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+
+def run_experiment(command: list[str], workspace, metadata: Optional[dict] = None, **backup_kwargs) -> int:
+    """
+    Runs a command line experiment and backs it up into `workspace` without importing tret into it.
+
+    The command is started first. While it starts up, its argv, working directory and (redacted) environment are
+    recorded into `.tretrun` (completed with its return code at exit), and the git state is snapshotted, so that the
+    backup records the codes as they were when the command started. Every Python process of the command loads a site hook which records its imported modules
+    at exit, and the backup of their local modules, requirements and data is done after the command has exited.
+
+    Args:
+        command (list[str]): The command and its arguments.
+        workspace (TretWorkspace): The workspace to back up into.
+        metadata (dict, optional): Metadata recorded in `.tretattributes`, in addition to the command and its return code.
+        **backup_kwargs: Other arguments of `TretWorkspace.backup`.
+
+    Returns:
+        int: The return code of the command, negative if it has been killed by a signal.
+    """
+    assert command, "No command to run."
+    hook_dir = tempfile.mkdtemp(prefix="tret-run-")
+    try:
+        environment = _prepare_site_hook(hook_dir)
+        start_time = time.time()
+        process = subprocess.Popen(command, env=environment)
+        run_info = {
+            "argv": list(command),
+            "cwd": os.getcwd(),
+            "environment": _redact_environment(dict(os.environ)),
+            "python": sys.executable,
+            "pid": process.pid,
+            "start_time": start_time,
+        }
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            git_state_future = executor.submit(snapshot_git_state, workspace.workspace_dir)
+            run_info_future = executor.submit(_write_run_info, workspace.workspace_dir, dict(run_info))
+            returncode = _wait_forwarding_signals(process)
+        git_state = git_state_future.result()
+        run_info_future.result()
+
+        run_info.update({"end_time": time.time(), "returncode": returncode})
+        _write_run_info(workspace.workspace_dir, run_info)
+        modules = _collect_modules(os.path.join(hook_dir, "modules"))
+        if not modules:
+            warnings.warn(
+                "No Python process of the command has recorded its modules (e.g. the command is not Python, was killed, "
+                "or ignores PYTHONPATH), only the git state and the given files are backed up."
+            )
+        workspace.backup(
+            metadata={"command": shlex.join(command), "returncode": returncode, **(metadata or {})},
+            modules=modules,
+            git_state=git_state,
+            **backup_kwargs,
+        )
+    finally:
+        shutil.rmtree(hook_dir, ignore_errors=True)
+    return returncode
@@ -0,0 +1,453 @@
+import os
+import ast
+import re
+import json
+import hashlib
+import tarfile
+import textwrap
+import threading
+import warnings
+from typing import Optional
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ..constants import (
+    TRET_ATTRIBUTES_FILENAME,
+    TRET_INTERNAL_PREFIX,
+    TRET_PACKS_DIRNAME,
+    TRET_LINEAGE_DIRNAME,
+    LINEAGE_FILENAME,
+    CODES_TARBALL_FILENAME,
+    REQUIREMENTS_TXT_FILENAME,
+    GIT_INFO_FILENAME,
+    GIT_REPO_PATH_KEYNAME,
+    GIT_COMMIT_HASH_KEYNAME,
+    GIT_DIFF_INFO_KEYNAME,
+)
+from ..utils.file_utils import atomic_open
+from ..utils.git_utils import get_git_repository
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+# the index of a base directory: the registry of indexed workspaces, one shard per basename hash prefix
+# mapping each path to the workspaces of each of its versions, and the segments of backups not merged yet
+LINEAGE_REGISTRY_FILENAME = "workspaces.json"
+LINEAGE_SHARDS_DIRNAME = "shards"
+LINEAGE_PENDING_DIRNAME = "pending"
+LINEAGE_LOCK_FILENAME = ".lock"
+LINEAGE_SHARD_PREFIX_LENGTH = 2
+SNIPPET_HASH_LENGTH = 16
+# blob ids of files changed by a recorded diff are only known abbreviated, as in the `index` lines of the diff
+MIN_HASH_PREFIX_LENGTH = 4
+# lines of a source file with their line endings, split like the `ast` module does, i.e. not at form feeds
+SOURCE_LINE_REGEX = re.compile(r"[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+$")
+# `ast.parse` is not thread-safe in some CPython versions (gh-106905), e.g. with concurrent `TretWorkspace.abackup`
+_ast_parse_lock = threading.Lock()
+
+
+def git_blob_id(data: bytes) -> str:
+    """Returns the id git gives to a file with this content, i.e. what `git hash-object` prints."""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def hash_snippet(source: str) -> str:
+    """Hashes the source of a definition, ignoring its indentation and trailing whitespace."""
+    lines = [line.rstrip() for line in textwrap.dedent(source).strip("\n").splitlines()]
+    return hashlib.sha1("\n".join(lines).encode("utf-8")).hexdigest()[:SNIPPET_HASH_LENGTH]
+
+
+def extract_snippets(source: bytes) -> dict:
+    """
+    Hashes every function and class definition of a Python source file.
+
+    Returns:
+        dict: A mapping from the qualified name of each definition (e.g. `Model.forward`) to the hash of its source,
+            empty if the file is not valid Python.
+    """
+    try:
+        text = source.decode("utf-8")
+        with _ast_parse_lock:
+            tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        return {}
+    snippets = {}
+    # split once, `ast.get_source_segment` splits the whole source again for every definition
+    lines = [line.encode("utf-8") for line in SOURCE_LINE_REGEX.findall(text)]
+
+    def _visit(node: ast.AST, prefix: str):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                qualname = f"{prefix}{child.name}"
+                if child.end_lineno is not None and child.end_col_offset is not None:
+                    # the same segment as `ast.get_source_segment`, whose column offsets are in utf-8 bytes
+                    segment = lines[child.lineno - 1:child.end_lineno]
+                    segment[-1] = segment[-1][:child.end_col_offset]
+                    segment[0] = segment[0][child.col_offset:]
+                    snippets[qualname] = hash_snippet(b"".join(segment).decode("utf-8"))
+                _visit(child, f"{qualname}.")
+            elif isinstance(child, (ast.stmt, ast.excepthandler, ast.match_case)):
+                # definitions are statements, expressions never contain any
+                _visit(child, prefix)
+
+    _visit(tree, "")
+    return snippets
+
+
+def _lineage_of_contents(contents: dict) -> dict:
+    """Builds a lineage record from the content of each code file."""
+    lineage = {"files": {}, "snippets": {}}
+    for path, data in contents.items():
+        blob_id = git_blob_id(data)
+        lineage["files"][path] = blob_id
+        if path.endswith(".py"):
+            lineage["snippets"][blob_id] = extract_snippets(data)
+    return lineage
+
+
+def record_code_lineage(workspace_dir: str, codefiles: dict):
+    """
+    Records the version of each backed up code file into `.tretlineage` of the workspace, i.e. its git blob id,
+    and the hashes of the definitions of Python files, so that `tret which-runs` can find the workspaces which ran it.
+
+    Args:
+        workspace_dir (str): The workspace directory.
+        codefiles (dict): A mapping from the recorded path of each code file (relative to the root of its git repository,
+            or to the working directory for files backed up in `codes.tar.gz`) to its path on disk.
+    """
+    contents = {}
+    for path, filepath in codefiles.items():
+        with open(filepath, "rb") as fin:
+            contents[path] = fin.read()
+    with atomic_open(os.path.join(workspace_dir, LINEAGE_FILENAME), "w", encoding="utf-8") as fout:
+        json.dump(_lineage_of_contents(contents), fout, ensure_ascii=False)
+
+
+def _apply_recorded_diff(files: dict, diff: str):
+    """Updates the blob ids of the files of a commit with the `index` lines of the diff recorded in `.gitinfo`."""
+    path = old_path = None
+    for line in diff.splitlines():
+        if line.startswith("diff --git "):
+            # paths with spaces are ambiguous in this line, the later `rename` lines are exact
+            old_path, _, path = line[len("diff --git a/"):].partition(" b/")
+        elif line.startswith("rename from "):
+            old_path = line[len("rename from "):]
+        elif line.startswith("rename to "):
+            path = line[len("rename to "):]
+            if old_path in files:
+                files[path] = files.pop(old_path)
+        elif line.startswith("deleted file mode"):
+            files.pop(path, None)
+        elif line.startswith("index ") and ".." in line:
+            new_blob_id = line.split()[1].split("..")[1]
+            if set(new_blob_id) == {"0"}:
+                files.pop(path, None)
+            else:
+                files[path] = new_blob_id
+
+
+def _lineage_from_backup(workspace_dir: str) -> dict:
+    """Rebuilds the lineage record of a workspace backed up before lineage was recorded, from its `.gitinfo` and code tarball."""
+    lineage = {"files": {}, "snippets": {}}
+    gitinfo_filepath = os.path.join(workspace_dir, GIT_INFO_FILENAME)
+    if os.path.isfile(gitinfo_filepath):
+        gitinfo = json.load(open(gitinfo_filepath, "r", encoding="utf-8"))
+        repo = get_git_repository(gitinfo[GIT_REPO_PATH_KEYNAME])
+        output = repo.run("ls-tree", "-r", "-z", gitinfo[GIT_COMMIT_HASH_KEYNAME]).stdout
+        files = {}
+        for entry in output.split(b"\0"):
+            if not entry:
+                continue
+            info, _, path = entry.partition(b"\t")
+            _, object_type, blob_id = info.decode("ascii").split()
+            if object_type == "blob":
+                files[os.fsdecode(path)] = blob_id
+        # without the list of imported modules, every tracked file of the snapshot is recorded
+        _apply_recorded_diff(files, gitinfo.get(GIT_DIFF_INFO_KEYNAME) or "")
+        lineage["files"].update(files)
+        for path, blob_id in files.items():
+            if path.endswith(".py") and len(blob_id) == 40:
+                content = repo.read_object(blob_id)
+                if content is not None:
+                    lineage["snippets"][blob_id] = extract_snippets(content)
+    codes_tarball_filepath = os.path.join(workspace_dir, CODES_TARBALL_FILENAME)
+    if os.path.isfile(codes_tarball_filepath):
+        contents = {}
+        with tarfile.open(codes_tarball_filepath, "r") as tar:
+            for member in tar:
+                if member.isfile() and member.name != REQUIREMENTS_TXT_FILENAME:
+                    contents[member.name] = tar.extractfile(member).read()
+        tarball_lineage = _lineage_of_contents(contents)
+        lineage["files"].update(tarball_lineage["files"])
+        lineage["snippets"].update(tarball_lineage["snippets"])
+    return lineage
+
+
+def load_workspace_lineage(workspace_dir: str) -> dict:
+    """Returns the lineage record of a workspace, rebuilt from its backup if it has not been recorded."""
+    lineage_filepath = os.path.join(workspace_dir, LINEAGE_FILENAME)
+    if os.path.isfile(lineage_filepath):
+        return json.load(open(lineage_filepath, "r", encoding="utf-8"))
+    return _lineage_from_backup(workspace_dir)
+
+
+def _read_backup_timestamp(workspace_dir: str) -> Optional[float]:
+    tret_attributes_filepath = os.path.join(workspace_dir, TRET_ATTRIBUTES_FILENAME)
+    if not os.path.isfile(tret_attributes_filepath):
+        return None
+    return json.load(open(tret_attributes_filepath, "r", encoding="utf-8")).get("backup_timestamp")
+
+
+def _build_segment(workspace_name: str, workspace_dir: str) -> dict:
+    return {
+        "workspace": workspace_name,
+        "backup_timestamp": _read_backup_timestamp(workspace_dir),
+        **load_workspace_lineage(workspace_dir),
+    }
+
+
+def _write_pending_segment(workspace_basedir: str, segment: dict):
+    pending_dir = os.path.join(workspace_basedir, TRET_LINEAGE_DIRNAME, LINEAGE_PENDING_DIRNAME)
+    os.makedirs(pending_dir, exist_ok=True)
+    with atomic_open(os.path.join(pending_dir, f"{segment['workspace']}.json"), "w", encoding="utf-8") as fout:
+        json.dump(segment, fout, ensure_ascii=False)
+
+
+def add_workspace_to_lineage_index(workspace_basedir: str, workspace_name: str, workspace_dir: str):
+    """
+    Adds a backed up workspace to the lineage index of its base directory. Only a small segment is written,
+    which is merged into the index by the next query, so that concurrent backups never contend for the index.
+    A new backup of the workspace replaces the versions recorded by the previous one.
+    """
+    _write_pending_segment(workspace_basedir, _build_segment(workspace_name, workspace_dir))
+
+
+class _LineageLock:
+    """An exclusive, non-blocking lock on the lineage index. `acquired` is False if another process holds it."""
+    def __init__(self, lineage_dir: str):
+        self.lock_filepath = os.path.join(lineage_dir, LINEAGE_LOCK_FILENAME)
+        self.lock_file = None
+        self.acquired = False
+
+    def __enter__(self):
+        self.lock_file = open(self.lock_filepath, "a")
+        if fcntl is None:
+            self.acquired = True
+            return self
+        try:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.acquired = True
+        except OSError:
+            self.acquired = False
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None and self.acquired:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+        self.lock_file.close()
+
+
+def _shard_key(path: str) -> str:
+    # queries match paths by suffix, which always includes the basename
+    return hashlib.sha1(os.path.basename(path).encode("utf-8")).hexdigest()[:LINEAGE_SHARD_PREFIX_LENGTH]
+
+
+def _load_json(filepath: str, default: dict) -> dict:
+    if not os.path.isfile(filepath):
+        return default
+    return json.load(open(filepath, "r", encoding="utf-8"))
+
+
+def _load_registry(lineage_dir: str) -> dict:
+    return _load_json(os.path.join(lineage_dir, LINEAGE_REGISTRY_FILENAME), {"workspaces": []})
+
+
+def _current_workspace_ids(registry: dict) -> dict:
+    """Maps the name of each indexed workspace to the id of its latest indexed backup."""
+    return {workspace["name"]: workspace_id for workspace_id, workspace in enumerate(registry["workspaces"])}
+
+
+def _load_shard(lineage_dir: str, key: str) -> dict:
+    return _load_json(os.path.join(lineage_dir, LINEAGE_SHARDS_DIRNAME, f"{key}.json"), {"paths": {}, "snippets": {}})
+
+
+def _list_pending_segments(lineage_dir: str) -> list[str]:
+    pending_dir = os.path.join(lineage_dir, LINEAGE_PENDING_DIRNAME)
+    if not os.path.isdir(pending_dir):
+        return []
+    return sorted(
+        os.path.join(pending_dir, filename) for filename in os.listdir(pending_dir)
+        if filename.endswith(".json") and not filename.startswith(".")
+    )
+
+
+def update_lineage_index(workspace_basedir: str) -> int:
+    """
+    Merges the segments written by backups into the lineage index of a base directory.
+    Nothing is done if another process is merging them.
+
+    Returns:
+        int: The number of merged segments.
+    """
+    lineage_dir = os.path.join(workspace_basedir, TRET_LINEAGE_DIRNAME)
+    segment_filepaths = _list_pending_segments(lineage_dir)
+    if not segment_filepaths:
+        return 0
+    with _LineageLock(lineage_dir) as lock:
+        if not lock.acquired:
+            return 0
+        segment_filepaths = _list_pending_segments(lineage_dir)
+        registry = _load_registry(lineage_dir)
+        shards = {}
+        for segment_filepath in segment_filepaths:
+            segment = json.load(open(segment_filepath, "r", encoding="utf-8"))
+            workspace_id = len(registry["workspaces"])
+            registry["workspaces"].append({"name": segment["workspace"], "backup_timestamp": segment.get("backup_timestamp")})
+            for path, blob_id in segment["files"].items():
+                key = _shard_key(path)
+                if key not in shards:
+                    shards[key] = _load_shard(lineage_dir, key)
+                shards[key]["paths"].setdefault(path, {}).setdefault(blob_id, []).append(workspace_id)
+                if blob_id in segment["snippets"]:
+                    shards[key]["snippets"][blob_id] = segment["snippets"][blob_id]
+
+        # ids are reserved before they are referenced, so that a crash never lets two backups share an id
+        with atomic_open(os.path.join(lineage_dir, LINEAGE_REGISTRY_FILENAME), "w", encoding="utf-8") as fout:
+            json.dump(registry, fout, ensure_ascii=False)
+        current_ids = set(_current_workspace_ids(registry).values())
+        os.makedirs(os.path.join(lineage_dir, LINEAGE_SHARDS_DIRNAME), exist_ok=True)
+        for key, shard in shards.items():
+            # versions recorded by replaced backups are dropped whenever their shard is rewritten
+            for path in list(shard["paths"]):
+                versions = {
+                    blob_id: current for blob_id, workspace_ids in shard["paths"][path].items()
+                    if (current := [workspace_id for workspace_id in workspace_ids if workspace_id in current_ids])
+                }
+                if versions:
+                    shard["paths"][path] = versions
+                else:
+                    del shard["paths"][path]
+            referenced_blob_ids = {blob_id for versions in shard["paths"].values() for blob_id in versions}
+            shard["snippets"] = {blob_id: snippets for blob_id, snippets in shard["snippets"].items() if blob_id in referenced_blob_ids}
+            with atomic_open(os.path.join(lineage_dir, LINEAGE_SHARDS_DIRNAME, f"{key}.json"), "w", encoding="utf-8") as fout:
+                json.dump(shard, fout, ensure_ascii=False)
+        for segment_filepath in segment_filepaths:
+            os.remove(segment_filepath)
+    return len(segment_filepaths)
+
+
+def backfill_lineage_index(workspace_basedir: str, max_workers: Optional[int] = None) -> dict:
+    """
+    Adds the workspaces of a base directory which are not in its lineage index yet, e.g. those backed up before
+    lineage was recorded, whose versions are rebuilt from their `.gitinfo` and code tarball in parallel.
+    Packed workspaces are skipped, they are indexed by their next backup.
+
+    Returns:
+        dict: The names of the `indexed` workspaces, and the error of each `failed` one.
+    """
+    lineage_dir = os.path.join(workspace_basedir, TRET_LINEAGE_DIRNAME)
+    indexed_names = set(_current_workspace_ids(_load_registry(lineage_dir)))
+    indexed_names.update(os.path.basename(filepath)[:-len(".json")] for filepath in _list_pending_segments(lineage_dir))
+    workspaces = [
+        (name, os.path.join(workspace_basedir, name)) for name in sorted(os.listdir(workspace_basedir))
+        if not name.startswith(TRET_INTERNAL_PREFIX) and name not in indexed_names
+        and os.path.isfile(os.path.join(workspace_basedir, name, TRET_ATTRIBUTES_FILENAME))
+    ]
+    report = {"indexed": [], "failed": {}}
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count() or 1) as executor:
+        futures = {executor.submit(_build_segment, name, workspace_dir): name for name, workspace_dir in workspaces}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                _write_pending_segment(workspace_basedir, future.result())
+            except Exception as error:
+                report["failed"][name] = str(error)
+                continue
+            report["indexed"].append(name)
+    update_lineage_index(workspace_basedir)
+    report["indexed"].sort()
+    return report
+
+
+def _is_same_version(blob_id: str, query: str) -> bool:
+    # either may be abbreviated
+    return blob_id.startswith(query) or (len(blob_id) >= MIN_HASH_PREFIX_LENGTH and query.startswith(blob_id))
+
+
+def _list_existing_workspaces(workspace_basedir: str) -> set:
+    names = {
+        name for name in os.listdir(workspace_basedir)
+        if not name.startswith(TRET_INTERNAL_PREFIX) and os.path.isdir(os.path.join(workspace_basedir, name))
+    }
+    packs_dir = os.path.join(workspace_basedir, TRET_PACKS_DIRNAME)
+    if os.path.isdir(packs_dir):
+        for filename in os.listdir(packs_dir):
+            if filename.endswith(".json"):
+                names.update(json.load(open(os.path.join(packs_dir, filename), "r", encoding="utf-8")))
+    return names
+
+
+def find_runs(
+    workspace_basedir: str,
+    path: str,
+    blob_id: Optional[str] = None,
+    snippet_hash: Optional[str] = None,
+) -> list[dict]:
+    """
+    Finds the workspaces whose backup contains a version of a code file, from the lineage index of the base directory.
+
+    Args:
+        workspace_basedir (str): The base directory of workspaces.
+        path (str): The path of the file as recorded, i.e. relative to the root of its repository, or to the working directory
+            for files backed up in `codes.tar.gz`. Recorded paths ending with it match too, e.g. `model.py` matches `src/model.py`.
+        blob_id (str, optional): Only match this version of the file, given as a (possibly abbreviated) git blob id,
+            i.e. what `git hash-object` or `git rev-parse <commit>:<path>` prints. Defaults to None, i.e. any version.
+        snippet_hash (str, optional): Only match versions containing a definition with this hash (see `hash_snippet`),
+            whatever the rest of the file. Defaults to None.
+
+    Returns:
+        list[dict]: The `workspace`, `path`, `blob_id` and `backup_timestamp` of each match, from the oldest backup to the newest.
+            Workspaces removed since their backup are omitted.
+    """
+    lineage_dir = os.path.join(workspace_basedir, TRET_LINEAGE_DIRNAME)
+    try:
+        update_lineage_index(workspace_basedir)
+    except OSError as error:
+        # e.g. a read-only base directory, pending segments are then searched as well
+        warnings.warn(f"Failed to update the lineage index of '{workspace_basedir}': {error}")
+    path = os.path.normpath(path)
+
+    def _matches(recorded_path: str, recorded_blob_id: str, snippets: Optional[dict]) -> bool:
+        if recorded_path != path and not recorded_path.endswith(f"/{path}"):
+            return False
+        if blob_id is not None and not _is_same_version(recorded_blob_id, blob_id):
+            return False
+        return snippet_hash is None or any(value.startswith(snippet_hash) for value in (snippets or {}).values())
+
+    registry = _load_registry(lineage_dir)
+    current_ids = _current_workspace_ids(registry)
+    matches = {}
+    shard = _load_shard(lineage_dir, _shard_key(path))
+    for recorded_path, versions in shard["paths"].items():
+        for recorded_blob_id, workspace_ids in versions.items():
+            if not _matches(recorded_path, recorded_blob_id, shard["snippets"].get(recorded_blob_id)):
+                continue
+            for workspace_id in workspace_ids:
+                workspace = registry["workspaces"][workspace_id]
+                if current_ids.get(workspace["name"]) == workspace_id:
+                    matches[(workspace["name"], recorded_path)] = (recorded_blob_id, workspace["backup_timestamp"])
+    for segment_filepath in _list_pending_segments(lineage_dir):
+        segment = json.load(open(segment_filepath, "r", encoding="utf-8"))
+        # a pending segment replaces the indexed versions of its workspace
+        matches = {key: value for key, value in matches.items() if key[0] != segment["workspace"]}
+        for recorded_path, recorded_blob_id in segment["files"].items():
+            if _matches(recorded_path, recorded_blob_id, segment["snippets"].get(recorded_blob_id)):
+                matches[(segment["workspace"], recorded_path)] = (recorded_blob_id, segment.get("backup_timestamp"))
+
+    existing_names = _list_existing_workspaces(workspace_basedir)
+    runs = [
+        {"workspace": name, "path": recorded_path, "blob_id": recorded_blob_id, "backup_timestamp": backup_timestamp}
+        for (name, recorded_path), (recorded_blob_id, backup_timestamp) in matches.items() if name in existing_names
+    ]
+    runs.sort(key=lambda run: (run["backup_timestamp"] or 0, run["workspace"], run["path"]))
+    return runs
@@ -1,5 +1,8 @@
 import os
 import json
+import atexit
+import threading
+import dataclasses
 import warnings
 import datetime
 from ..arguments import TretArguments
@@ -8,12 +11,33 @@ from ..constants import (
     TRET_ATTRIBUTES_FILENAME,
     CURRENT_CODES_TARBALL_FILENAME,
 )
-from .data_backup import backup_data
-from .code_backup_and_restore import (
-    backup_codes,
-    restore_codes,
+from .data_tiering import TieringPolicy
+from .data_restore import restore_data, RESTORE_MODE_HARDLINK
+from .daemon import (
+    request_daemon,
+    run_request_in_process,
+    describe_modules,
 )
-from ..utils.tarball_utils import restore_files_from_tarball
+from .garbage_collection import unpack_workspace
+from .staging import prepare_staging_dir, record_staged_chunks, publish_staged_workspace
+from .storage import get_storage_backend
+from .output_watcher import OutputWatcher
+from .metrics import MetricsLogger, read_metric
+from .lineage import add_workspace_to_lineage_index
+from .file_tracker import OpenedFileTracker
+from .async_api import run_in_io_executor
+from .environment import (
+    add_requirements_to_wheelhouse,
+    read_workspace_requirements,
+    get_wheelhouse_dir,
+)
+from ..utils.file_utils import atomic_open
+from ..utils.tarball_utils import replay_restore_journal
+from ..utils.ignore_utils import load_ignore_matcher
+from ..utils.io_limits import hold_cancellable, check_cancelled
+
+# codes are restored into the working directory of the process, thus by one workspace at a time
+_restore_codes_lock = threading.Lock()
 
 
 class TretWorkspace:
@@ -34,22 +58,102 @@ class TretWorkspace:
         self.workspace_name = self.arguments.workspace_name
         if self.workspace_name is None:
             self.workspace_name = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+        self.staging_dir = self.arguments.staging_dir
+        if self.staging_dir is not None and os.path.isdir(os.path.join(self.workspace_basedir, self.workspace_name)):
+            warnings.warn(
+                f"Workspace '{self.workspace_name}' already exists as a directory in '{self.workspace_basedir}', "
+                "it is written there directly instead of being staged."
+            )
+            self.staging_dir = None
+        if self.staging_dir is not None:
+            prepare_staging_dir(self.staging_dir, self.workspace_basedir)
 
         if os.path.isfile(self.workspace_dir):
             raise FileExistsError(f"'{self.workspace_dir}' is already a file, cannot work as a workspace.")
+        storage_kwargs = {}
+        if self.arguments.storage_url is not None:
+            storage_kwargs = {
+                "endpoint_url": self.arguments.storage_endpoint_url,
+                "max_workers": self.arguments.storage_max_workers,
+            }
+        self.storage = get_storage_backend(self.arguments.storage_url, **storage_kwargs)
+        if not os.path.isdir(self.workspace_dir):
+            # the workspace may have been compacted into a pack by `tret gc` or published by a staged backup,
+            # or only exist in the remote storage
+            unpacked = os.path.isdir(self.workspace_basedir) and unpack_workspace(
+                self.workspace_basedir, self.workspace_name, output_basedir=os.path.dirname(self.workspace_dir),
+            )
+            if not unpacked:
+                self.storage.download_workspace(self.workspace_name, self.workspace_dir)
         if arguments.create_directory:
             os.makedirs(self.workspace_dir, exist_ok=True)
         self.tret_attributes_filepath = os.path.join(self.workspace_dir, TRET_ATTRIBUTES_FILENAME)
+        self._watchers = []
+        self._metrics_logger = None
+        self.file_tracker = None
+        if self.arguments.track_opened_files:
+            # started as early as possible, so that the files read during the whole experiment are recorded
+            self.file_tracker = OpenedFileTracker(exclude_dirs=[self.workspace_basedir, *([self.staging_dir] if self.staging_dir else [])])
+            self.file_tracker.start()
 
     @property
     def workspace_dir(self) -> str:
-        return os.path.join(self.workspace_basedir, self.workspace_name)
+        """The directory of the workspace, inside the staging directory for staged workspaces."""
+        return os.path.join(self.staging_dir or self.workspace_basedir, self.workspace_name)
+
+    def watch(self, paths: list[str], interval: float = 30.0, max_bandwidth: float = None) -> OutputWatcher:
+        """
+        Starts checkpointing the outputs under `paths` into this workspace from a background thread,
+        so that the outputs written so far survive a killed or preempted run.
+
+        Args:
+            paths (list[str]): Files or directories to watch.
+            interval (float, optional): Seconds between checkpoints. Defaults to 30.
+            max_bandwidth (float, optional): Maximum bytes per second read by the watcher. Defaults to None, i.e., no limit.
+
+        Returns:
+            OutputWatcher: The started watcher. It is stopped (after a final checkpoint) on `stop()` or at exit.
+        """
+        os.makedirs(self.workspace_dir, exist_ok=True)
+        watcher = OutputWatcher(self.workspace_dir, paths, interval=interval, max_bandwidth=max_bandwidth)
+        watcher.start()
+        atexit.register(watcher.stop)
+        self._watchers.append(watcher)
+        return watcher
+
+    def log_metrics(self, step: int, **scalars: float):
+        """
+        Logs scalar metrics at `step` into this workspace, e.g., `workspace.log_metrics(step, loss=loss, lr=lr)`.
+        Values are buffered and appended to one columnar file per metric under `metrics/`, so it is cheap enough to be
+        called every training step. Buffered values are written out at each backup and at exit.
+
+        Args:
+            step (int): The step of the values.
+            **scalars (float): The values of the metrics.
+        """
+        if self._metrics_logger is None:
+            self._metrics_logger = MetricsLogger(self.workspace_dir)
+            atexit.register(self._metrics_logger.close)
+        self._metrics_logger.log(step, scalars)
+
+    def read_metric(self, name: str) -> tuple:
+        """Reads the (steps, values) of a metric of this workspace, see `tret.core.metrics.read_metric`."""
+        if self._metrics_logger is not None:
+            self._metrics_logger.flush()
+        return read_metric(self.workspace_dir, name)
 
     def restore_current_codes_from_tarball(self, remove_after_restore: bool = True):
+        """
+        Rolls back the last restore by replaying the journal `current-codes.tar.gz` of this workspace.
+
+        Args:
+            remove_after_restore (bool, optional): Whether to remove the journal after rolling back. Defaults to True.
+        """
         current_codes_tarball_filepath = os.path.join(self.workspace_dir, CURRENT_CODES_TARBALL_FILENAME)
         if not os.path.isfile(current_codes_tarball_filepath):
             warnings.warn(f"'{current_codes_tarball_filepath}' does not exist. Can not restores current codes.")
-        restore_files_from_tarball(current_codes_tarball_filepath)
+            return
+        replay_restore_journal(current_codes_tarball_filepath, output_dir=os.getcwd())
         if remove_after_restore:
             os.remove(current_codes_tarball_filepath)
 
@@ -57,20 +161,22 @@ class TretWorkspace:
         if os.path.isfile(requirements_filepath):
             os.remove(requirements_filepath)
 
-    def restore(self) -> dict:
+    def restore(self, bytecode: str = None) -> dict:
         """
         Restores the codes from the specified workspace directory.
 
         Args:
             workspace_dir (str): The directory where the workspace will be restored from.
+            bytecode (str, optional): "reuse" restores the pycs backed up with `backup_bytecode` and compiles the other
+                restored Python files, "precompile" compiles all of them in a process pool. Defaults to None.
         """
         assert os.path.isdir(self.workspace_dir), f"The workspace directory '{self.workspace_dir}' does not exist."
 
         # first restore from any `current-codes.tar.gz`
         current_codes_tarball_filepaths = []
-        existing_workspace_names = os.listdir(self.workspace_basedir)
+        existing_workspace_names = os.listdir(os.path.dirname(self.workspace_dir))
         for ws_name in existing_workspace_names:
-            ws_dir = os.path.join(self.workspace_basedir, ws_name)
+            ws_dir = os.path.join(os.path.dirname(self.workspace_dir), ws_name)
             tarball_filepath = os.path.join(ws_dir, CURRENT_CODES_TARBALL_FILENAME)
             if os.path.isfile(tarball_filepath):
                 current_codes_tarball_filepaths.append(tarball_filepath)
@@ -81,10 +187,12 @@ class TretWorkspace:
                 f"Found existing 'current-codes.tar.gz' in {current_codes_tarball_filepaths[0]}. "
                 f"Restoring from '{current_codes_tarball_filepaths[0]}' first."
             )
-            restore_files_from_tarball(current_codes_tarball_filepaths[0])
+            replay_restore_journal(current_codes_tarball_filepaths[0], output_dir=os.getcwd())
             os.remove(current_codes_tarball_filepaths[0])
 
-        restore_codes(self.workspace_dir)
+        request = {"op": "restore_codes", "workspace_dir": self.workspace_dir, "bytecode": bytecode}
+        if not self.arguments.use_daemon or request_daemon(request) is None:
+            run_request_in_process(request)
 
         # check the modify time of symlink and the linked file
         # tret_attributes = json.load(open(self.tret_attributes_filepath, "r", encoding="utf-8"))
@@ -107,6 +215,50 @@ class TretWorkspace:
         tret_attributes = json.load(open(self.tret_attributes_filepath, "r", encoding="utf-8"))
         return tret_attributes['metadata']
 
+    def _restore_exclusively(self, bytecode: str = None) -> dict:
+        with hold_cancellable(_restore_codes_lock):
+            return self.restore(bytecode=bytecode)
+
+    async def arestore(self, bytecode: str = None) -> dict:
+        """
+        Coroutine version of `restore`, run in the executor of `tret.core.async_api`. Codes are restored into the
+        working directory, so concurrent restores of codes run one after the other.
+        """
+        return await run_in_io_executor(self._restore_exclusively, bytecode)
+
+    async def arestore_data(self, target_dir: str = None, **restore_kwargs) -> dict:
+        """Coroutine version of `restore_data`, run in the executor of `tret.core.async_api`."""
+        return await run_in_io_executor(self.restore_data, target_dir, **restore_kwargs)
+
+    def restore_data(
+        self,
+        target_dir: str = None,
+        mode: str = RESTORE_MODE_HARDLINK,
+        overwrite: bool = False,
+        verify: bool = True,
+    ) -> dict:
+        """
+        Restores the backed up data of this workspace into `target_dir`. Unlike `restore`, this has to be called explicitly.
+
+        Args:
+            target_dir (str, optional): The directory where the data will be restored. Defaults to the current working directory.
+            mode (str, optional): "hardlink" links copied files to the workspace, "copy" reflinks or copies them,
+                and "extract" only extracts the data tarball and chunked files. Defaults to "hardlink".
+            overwrite (bool, optional): Whether to replace existing files. Defaults to False.
+            verify (bool, optional): Whether to verify the restored data against the recorded sizes and hashes. Defaults to True.
+
+        Returns:
+            dict: The relative paths of the restored `files`, `symlinks`, `tarball` members and `chunks`.
+        """
+        assert os.path.isdir(self.workspace_dir), f"The workspace directory '{self.workspace_dir}' does not exist."
+        return restore_data(
+            self.workspace_dir,
+            target_dir if target_dir is not None else os.getcwd(),
+            mode=mode,
+            overwrite=overwrite,
+            verify=verify,
+        )
+
     def backup(
         self,
         datafiles_to_backup: list[str] = None,
@@ -115,6 +267,12 @@ class TretWorkspace:
         append_data_to_existing_tarball: bool = True,
         additional_codefiles_to_backup: list[str] = [],
         metadata: dict = {},
+        datafiles_to_backup_as_chunks: list[str] = None,
+        exclude_patterns: list[str] = None,
+        datafiles_auto: list[str] = None,
+        tiering_policy: TieringPolicy = None,
+        modules: list = None,
+        git_state: dict = None,
     ):
         """
         Backs up specified files in different formats.
@@ -125,32 +283,95 @@ class TretWorkspace:
             append_data_to_existing_tarball (bool, optional): If data tarball e.g, `data.tar.gz` already exists,
                 whether to append new data to this tarball, or just overwrite it.
             additional_codefiles_to_backup (list[str], optional): List of additional code files to be backed up. Defaults to [].
+            metadata (dict, optional): Metadata recorded in `.tretattributes`. Defaults to {}.
+            datafiles_to_backup_as_chunks (list[str], optional): List of file paths to back up into the deduplicating chunk store,
+                so that backups of slightly changed large files only store their new chunks. Defaults to None.
+            exclude_patterns (list[str], optional): gitignore-style patterns of paths to exclude from the backed up directories,
+                in addition to the `.tretignore` files of the working directory and of the workspace base directory. Defaults to None.
+            datafiles_auto (list[str], optional): List of file paths routed automatically to one of the ways above, according to
+                their sizes and content, e.g., already compressed files are not compressed again. Defaults to None.
+            tiering_policy (TieringPolicy, optional): The size thresholds of `datafiles_auto`. Defaults to None, i.e., `TieringPolicy()`.
+            modules (list, optional): The modules of the experiment as described by `describe_modules`, e.g., those recorded
+                in the process of `tret run`. Defaults to None, i.e., the modules of this process.
+            git_state (dict, optional): The git state recorded by `snapshot_git_state` when the experiment started.
+                Defaults to None, i.e., the git state at backup.
         Returns:
             None
         """
-        backup_codes(
-            self.workspace_dir,
-            additional_codefiles_to_backup=additional_codefiles_to_backup,
-            backup_codes_as_tarball=self.force_backup_codes_as_tarball,
-        )
-        backup_data(
-            workspace_dir=self.workspace_dir,
-            files_to_backup=datafiles_to_backup,
-            files_to_backup_as_tarball=datafiles_to_backup_as_tarball,
-            files_to_backup_as_symlink=datafiles_to_backup_as_symlink,
-            append_data_to_existing_tarball=append_data_to_existing_tarball,
-        )
+        # checkpoint the watched outputs first, so that they are recorded and uploaded with this backup
+        for watcher in self._watchers:
+            watcher.sync()
+        if self._metrics_logger is not None:
+            self._metrics_logger.flush()
+        if self.file_tracker is not None:
+            ignore_matcher = load_ignore_matcher(os.getcwd(), self.workspace_basedir, exclude_patterns)
+            tracked_codefiles, tracked_datafiles = self.file_tracker.split_backup_paths(ignore_matcher)
+            additional_codefiles_to_backup = [*additional_codefiles_to_backup, *tracked_codefiles]
+            if tracked_datafiles:
+                datafiles_to_backup_as_tarball = [*(datafiles_to_backup_as_tarball or []), *tracked_datafiles]
+        request = {
+            "op": "backup",
+            "workspace_dir": self.workspace_dir,
+            "workspace_basedir": self.workspace_basedir,
+            "exclude_patterns": exclude_patterns,
+            "additional_codefiles_to_backup": additional_codefiles_to_backup,
+            "backup_codes_as_tarball": self.force_backup_codes_as_tarball,
+            "backup_bytecode": self.arguments.backup_bytecode,
+            "tiering_policy": dataclasses.asdict(tiering_policy) if tiering_policy is not None else None,
+            "modules": modules,
+            "git_state": git_state,
+            "data_arguments": {
+                "files_to_backup": datafiles_to_backup,
+                "files_to_backup_as_tarball": datafiles_to_backup_as_tarball,
+                "files_to_backup_as_symlink": datafiles_to_backup_as_symlink,
+                "append_data_to_existing_tarball": append_data_to_existing_tarball,
+                "files_to_backup_as_chunks": datafiles_to_backup_as_chunks,
+                "files_to_backup_auto": datafiles_auto,
+            },
+        }
+        # a running tret daemon backs up with its warm indexes, otherwise everything is done in this process
+        response = None
+        if self.arguments.use_daemon:
+            response = request_daemon({**request, "modules": modules if modules is not None else describe_modules()})
+        manifest = response["result"] if response is not None else run_request_in_process(request)
+        if self.staging_dir is not None:
+            # reused chunks were touched when they were chunked, which protects them from gc until now
+            record_staged_chunks(self.workspace_dir, self.workspace_basedir)
+        if self.arguments.add_wheels_to_wheelhouse:
+            missing_requirements = add_requirements_to_wheelhouse(
+                read_workspace_requirements(self.workspace_dir),
+                get_wheelhouse_dir(self.workspace_basedir),
+            )
+            if missing_requirements:
+                warnings.warn(f"Wheels of {missing_requirements} cannot be added to the wheelhouse.")
+        # a backup cancelled through `abackup` until here is not recorded as complete
+        check_cancelled()
         # save attributes
         backup_time = datetime.datetime.now()
         tret_attributes = {
             "backup_timestamp": backup_time.timestamp(),
             "backup_time": backup_time.strftime("%Y-%m-%d %H:%M:%S"),
             "metadata": {**metadata},
+            "manifest": manifest,
         }
 
-        json.dump(
-            tret_attributes,
-            open(self.tret_attributes_filepath, "w", encoding="utf-8"),
-            ensure_ascii=False,
-            indent=4,
-        )
+        with atomic_open(self.tret_attributes_filepath, "w", encoding="utf-8") as fout:
+            json.dump(tret_attributes, fout, ensure_ascii=False, indent=4)
+        add_workspace_to_lineage_index(self.workspace_basedir, self.workspace_name, self.workspace_dir)
+        if self.staging_dir is not None:
+            publish_staged_workspace(self.workspace_dir, self.workspace_basedir)
+        self.storage.upload_workspace(self.workspace_dir, self.workspace_name)
+
+    async def abackup(self, **backup_kwargs):
+        """
+        Coroutine version of `backup`, run in the executor of `tret.core.async_api`, so that many workspaces can be
+        backed up concurrently within the limits set by `configure_async_io`. Cancelling it stops the backup at its next
+        git command, compression or write, before `.tretattributes` is written.
+
+        Args:
+            **backup_kwargs: The arguments of `backup`.
+        """
+        if backup_kwargs.get("modules") is None:
+            # described here, since the threads of other backups may be importing modules meanwhile
+            backup_kwargs["modules"] = describe_modules()
+        return await run_in_io_executor(self.backup, **backup_kwargs)
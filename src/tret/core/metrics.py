@@ -0,0 +1,224 @@
+import os
+import time
+import array
+import struct
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from ..constants import METRICS_DIRNAME
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# every metric is a file of fixed-size little-endian records (int64 step, float64 value), appended in logging order
+METRIC_FILE_SUFFIX = ".metric"
+METRIC_RECORD = struct.Struct("<qd")
+METRIC_RECORD_DTYPE = np.dtype([("step", "<i8"), ("value", "<f8")]) if np is not None else None
+METRIC_REDUCTIONS = ("last", "min", "max", "mean")
+
+# buffered records are written every this many records or seconds, and synced to disk at most every `fsync_interval`
+METRICS_FLUSH_RECORDS = 4096
+METRICS_FLUSH_INTERVAL = 1.0
+METRICS_FSYNC_INTERVAL = 10.0
+
+
+def _metric_filepath(metrics_dir: str, name: str) -> str:
+    # names such as `eval/loss` are quoted into a single file name
+    return os.path.join(metrics_dir, urllib.parse.quote(name, safe="") + METRIC_FILE_SUFFIX)
+
+
+class MetricsLogger:
+    """
+    Appends scalar metrics of a workspace into one columnar file per metric under `metrics/`.
+
+    Logged values are buffered in typed arrays and written with one `write` per metric every `flush_records` records
+    or `flush_interval` seconds, and files are synced to disk at most every `fsync_interval` seconds, so that logging
+    every training step only costs a few array appends. A record torn by a crash is dropped when the file is opened again.
+
+    Args:
+        workspace_dir (str): The workspace directory.
+        flush_records (int, optional): Number of buffered records which triggers a write. Defaults to 4096.
+        flush_interval (float, optional): Maximum seconds records stay buffered, checked when logging. Defaults to 1.
+        fsync_interval (float, optional): Minimum seconds between syncs of the metric files. Defaults to 10.
+    """
+    def __init__(
+        self,
+        workspace_dir: str,
+        flush_records: int = METRICS_FLUSH_RECORDS,
+        flush_interval: float = METRICS_FLUSH_INTERVAL,
+        fsync_interval: float = METRICS_FSYNC_INTERVAL,
+    ):
+        self.metrics_dir = os.path.join(workspace_dir, METRICS_DIRNAME)
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self._buffers = {}
+        self._fds = {}
+        self._num_buffered = 0
+        self._last_flush = self._last_fsync = time.monotonic()
+        self._lock = threading.Lock()
+
+    def log(self, step: int, metrics: dict):
+        """Buffers the values of `metrics` at `step`, writing them out if the buffers are full or old enough."""
+        with self._lock:
+            buffers = self._buffers
+            for name, value in metrics.items():
+                buffer = buffers.get(name)
+                if buffer is None:
+                    buffer = buffers[name] = (array.array("q"), array.array("d"))
+                buffer[0].append(step)
+                buffer[1].append(value)
+            self._num_buffered += len(metrics)
+            if self._num_buffered >= self.flush_records or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush(fsync=False)
+
+    def _open(self, name: str) -> int:
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        fd = os.open(_metric_filepath(self.metrics_dir, name), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        size = os.fstat(fd).st_size
+        if size % METRIC_RECORD.size:
+            os.ftruncate(fd, size - size % METRIC_RECORD.size)
+        self._fds[name] = fd
+        return fd
+
+    def _flush(self, fsync: bool):
+        for name, (steps, values) in self._buffers.items():
+            if not steps:
+                continue
+            fd = self._fds.get(name)
+            if fd is None:
+                fd = self._open(name)
+            if np is not None:
+                records = np.empty(len(steps), dtype=METRIC_RECORD_DTYPE)
+                records["step"] = np.frombuffer(steps, dtype=np.int64)
+                records["value"] = np.frombuffer(values, dtype=np.float64)
+                data = records.tobytes()
+            else:
+                data = b"".join(METRIC_RECORD.pack(step, value) for step, value in zip(steps, values))
+            os.write(fd, data)
+            del steps[:], values[:]
+        self._num_buffered = 0
+        now = time.monotonic()
+        self._last_flush = now
+        if fsync or now - self._last_fsync >= self.fsync_interval:
+            for fd in self._fds.values():
+                os.fsync(fd)
+            self._last_fsync = now
+
+    def flush(self):
+        """Writes out all the buffered records and syncs the metric files to disk."""
+        with self._lock:
+            self._flush(fsync=True)
+
+    def close(self):
+        with self._lock:
+            self._flush(fsync=True)
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds = {}
+
+
+def list_metrics(workspace_dir: str) -> list[str]:
+    """Returns the names of the metrics logged in a workspace."""
+    metrics_dir = os.path.join(workspace_dir, METRICS_DIRNAME)
+    if not os.path.isdir(metrics_dir):
+        return []
+    return sorted(
+        urllib.parse.unquote(filename[:-len(METRIC_FILE_SUFFIX)])
+        for filename in os.listdir(metrics_dir) if filename.endswith(METRIC_FILE_SUFFIX)
+    )
+
+
+def read_metric(workspace_dir: str, name: str) -> tuple:
+    """
+    Reads the steps and values of a metric of a workspace, in logging order.
+
+    With NumPy, the file is memory-mapped and the returned arrays are views of it, so nothing is copied or parsed.
+    Otherwise, they are `array.array`s.
+
+    Returns:
+        tuple: (steps, values), empty if the metric has not been logged.
+    """
+    filepath = _metric_filepath(os.path.join(workspace_dir, METRICS_DIRNAME), name)
+    num_records = os.path.getsize(filepath) // METRIC_RECORD.size if os.path.isfile(filepath) else 0
+    if np is not None:
+        if num_records == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        records = np.memmap(filepath, dtype=METRIC_RECORD_DTYPE, mode="r", shape=(num_records,))
+        return records["step"], records["value"]
+    steps, values = array.array("q"), array.array("d")
+    if num_records:
+        with open(filepath, "rb") as fin:
+            data = fin.read(num_records * METRIC_RECORD.size)
+        for step, value in METRIC_RECORD.iter_unpack(data):
+            steps.append(step)
+            values.append(value)
+    return steps, values
+
+
+def reduce_metric(steps, values, reduction: str = "last", step: Optional[int] = None) -> Optional[dict]:
+    """
+    Reduces the records of a metric into one value.
+
+    Args:
+        steps, values: The records, as returned by `read_metric`.
+        reduction (str, optional): "last" takes the last logged value, "min" and "max" the extreme values with their steps,
+            and "mean" the mean of all values. Defaults to "last".
+        step (int, optional): Only records up to this step are considered, e.g. to compare runs at the same step.
+
+    Returns:
+        dict: The `value`, its `step` (the last step for "mean") and the `count` of records, or None without records.
+    """
+    assert reduction in METRIC_REDUCTIONS, f"Unknown reduction '{reduction}', expected one of {METRIC_REDUCTIONS}."
+    if np is not None:
+        steps, values = np.asarray(steps), np.asarray(values)
+        if step is not None:
+            selected = steps <= step
+            steps, values = steps[selected], values[selected]
+        if len(values) == 0:
+            return None
+        index = {"last": len(values) - 1, "min": np.argmin(values), "max": np.argmax(values), "mean": len(values) - 1}[reduction]
+        value = float(values.mean()) if reduction == "mean" else float(values[index])
+        return {"value": value, "step": int(steps[index]), "count": len(values)}
+    records = [(record_step, value) for record_step, value in zip(steps, values) if step is None or record_step <= step]
+    if not records:
+        return None
+    if reduction == "mean":
+        return {"value": sum(value for _, value in records) / len(records), "step": records[-1][0], "count": len(records)}
+    selector = {"last": lambda: records[-1], "min": lambda: min(records, key=lambda record: record[1]),
+                "max": lambda: max(records, key=lambda record: record[1])}[reduction]
+    record_step, value = selector()
+    return {"value": value, "step": record_step, "count": len(records)}
+
+
+def aggregate_metric(
+    workspace_dirs: list[str],
+    name: str,
+    reduction: str = "last",
+    step: Optional[int] = None,
+    max_workers: Optional[int] = None,
+) -> dict:
+    """
+    Reduces one metric of many workspaces in parallel, e.g. the best eval loss of every run of a sweep.
+
+    Args:
+        workspace_dirs (list[str]): The workspace directories.
+        name (str): The metric name.
+        reduction (str, optional): See `reduce_metric`. Defaults to "last".
+        step (int, optional): See `reduce_metric`. Defaults to None.
+        max_workers (int, optional): Number of threads reading workspaces. Defaults to 4 times the cpu count, up to 32.
+
+    Returns:
+        dict: The result of `reduce_metric` for every workspace directory which has logged the metric.
+    """
+    def _reduce(workspace_dir: str):
+        return reduce_metric(*read_metric(workspace_dir, name), reduction=reduction, step=step)
+
+    # workspaces are mostly read from (network) file systems, so more threads than cores are used
+    max_workers = max_workers or min(32, 4 * (os.cpu_count() or 1))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = dict(zip(workspace_dirs, executor.map(_reduce, workspace_dirs)))
+    return {workspace_dir: result for workspace_dir, result in results.items() if result is not None}
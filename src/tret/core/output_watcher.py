@@ -0,0 +1,272 @@
+import os
+import sys
+import json
+import time
+import select
+import struct
+import hashlib
+import threading
+import warnings
+from typing import Optional
+from ..constants import (
+    OUTPUTS_DIRNAME,
+    OUTPUTS_MANIFEST_FILENAME,
+)
+from ..utils.file_utils import atomic_open
+from ..utils.throttle import BandwidthThrottle
+
+
+class _ChangedWhileReading(Exception):
+    """Raised when a watched file is modified while it is being backed up."""
+
+
+class _InotifyChangeDetector:
+    """
+    Reports changed paths through Linux inotify (via ctypes), so that cycles do not rescan the watched trees.
+    """
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_ISDIR = 0x40000000
+    IN_Q_OVERFLOW = 0x00004000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watch_dirs = {}
+        self.overflowed = False
+
+    def add_tree(self, path: str):
+        directories = [path] if os.path.isdir(path) else [os.path.dirname(path) or "."]
+        if os.path.isdir(path):
+            directories += [os.path.join(dirpath, dirname) for dirpath, dirnames, _ in os.walk(path) for dirname in dirnames]
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        for directory in directories:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+            if wd >= 0:
+                self.watch_dirs[wd] = directory
+
+    def wait(self, timeout: float) -> Optional[set]:
+        """Waits up to `timeout` seconds and returns the changed paths, or None if a full rescan is needed."""
+        changed = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        while readable:
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, name_length = self.EVENT_HEADER.unpack_from(buffer, offset)
+                offset += self.EVENT_HEADER.size
+                name = os.fsdecode(buffer[offset:offset + name_length].rstrip(b"\0"))
+                offset += name_length
+                if mask & self.IN_Q_OVERFLOW:
+                    self.overflowed = True
+                    continue
+                if wd not in self.watch_dirs:
+                    continue
+                changed_path = os.path.join(self.watch_dirs[wd], name)
+                if mask & self.IN_ISDIR:
+                    self.add_tree(changed_path)
+                    # files may have been written before the new directory was watched
+                    for dirpath, _, filenames in os.walk(changed_path):
+                        changed.update(os.path.join(dirpath, filename) for filename in filenames)
+                else:
+                    changed.add(changed_path)
+            readable, _, _ = select.select([self.fd], [], [], 0)
+        if self.overflowed:
+            self.overflowed = False
+            return None
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class OutputWatcher:
+    """
+    Incrementally checkpoints experiment outputs into a workspace from a background thread.
+
+    Every cycle, new or changed files under the watched paths are detected (through inotify when available, otherwise
+    by polling with a stat cache) and backed up: files outside of the workspace are copied into its `outputs` directory,
+    files already inside the workspace are only recorded. The manifest `.tretoutputs` is atomically rewritten after every
+    cycle, so a killed run still leaves a consistent record of its outputs. Files still being written during a cycle are
+    retried in the next one.
+
+    Args:
+        workspace_dir (str): The workspace directory.
+        paths (list[str]): Files or directories to watch.
+        interval (float, optional): Seconds between cycles. Defaults to 30.
+        max_bandwidth (float, optional): Maximum bytes per second read by the watcher. Defaults to None, i.e., no limit.
+        use_inotify (bool, optional): Whether to use inotify when available. Defaults to True.
+    """
+    def __init__(
+        self,
+        workspace_dir: str,
+        paths: list[str],
+        interval: float = 30.0,
+        max_bandwidth: Optional[float] = None,
+        use_inotify: bool = True,
+    ):
+        self.workspace_dir = os.path.abspath(workspace_dir)
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.interval = interval
+        self.throttle = BandwidthThrottle(max_bandwidth)
+        self.outputs_dir = os.path.join(self.workspace_dir, OUTPUTS_DIRNAME)
+        self.manifest_filepath = os.path.join(self.workspace_dir, OUTPUTS_MANIFEST_FILENAME)
+        self.manifest = {}
+        if os.path.isfile(self.manifest_filepath):
+            self.manifest = json.load(open(self.manifest_filepath, "r", encoding="utf-8"))["files"]
+        # stat cache of the files already backed up: path -> (size, mtime_ns)
+        self.stat_cache = {path: tuple(entry["stat"]) for path, entry in self.manifest.items()}
+        self.pending = set()
+
+        self.detector = None
+        if use_inotify and sys.platform.startswith("linux"):
+            try:
+                self.detector = _InotifyChangeDetector()
+                for path in self.paths:
+                    self.detector.add_tree(path)
+            except (OSError, AttributeError):
+                self.detector = None
+
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="tret-output-watcher", daemon=True)
+
+    def start(self) -> "OutputWatcher":
+        self.sync()
+        self.thread.start()
+        return self
+
+    def _iter_watched_files(self):
+        for path in self.paths:
+            if os.path.isfile(path):
+                yield path
+            for dirpath, dirnames, filenames in os.walk(path):
+                # never watch the watcher's own copies
+                dirnames[:] = [name for name in dirnames if os.path.join(dirpath, name) != self.outputs_dir]
+                for filename in filenames:
+                    yield os.path.join(dirpath, filename)
+
+    def _is_watched(self, filepath: str) -> bool:
+        if filepath == self.manifest_filepath or filepath.startswith(self.outputs_dir + os.sep):
+            return False
+        return any(filepath == path or filepath.startswith(path + os.sep) for path in self.paths)
+
+    def _stored_path(self, filepath: str) -> str:
+        if filepath.startswith(self.workspace_dir + os.sep):
+            return os.path.relpath(filepath, self.workspace_dir)
+        return os.path.join(OUTPUTS_DIRNAME, filepath.lstrip(os.sep))
+
+    def _backup_file(self, filepath: str) -> bool:
+        """Backs up one file, returns False if it changed while being read."""
+        stat_before = os.stat(filepath)
+        stored_path = self._stored_path(filepath)
+        hasher = hashlib.sha256()
+
+        def _copy(fout=None):
+            for data in iter(lambda: fin.read(1024 * 1024), b""):
+                self.throttle.consume(len(data))
+                hasher.update(data)
+                if fout is not None:
+                    fout.write(data)
+            stat_after = os.stat(filepath)
+            if (stat_before.st_size, stat_before.st_mtime_ns) != (stat_after.st_size, stat_after.st_mtime_ns):
+                # raised inside `atomic_open`, so that a torn copy never replaces the previous one
+                raise _ChangedWhileReading()
+            return stat_after
+
+        try:
+            with open(filepath, "rb") as fin:
+                if stored_path.startswith(OUTPUTS_DIRNAME + os.sep):
+                    stored_filepath = os.path.join(self.workspace_dir, stored_path)
+                    os.makedirs(os.path.dirname(stored_filepath), exist_ok=True)
+                    with atomic_open(stored_filepath, "wb") as fout:
+                        stat_after = _copy(fout)
+                else:
+                    stat_after = _copy()
+        except _ChangedWhileReading:
+            return False
+        self.manifest[filepath] = {
+            "stored_path": stored_path,
+            "size": stat_after.st_size,
+            "sha256": hasher.hexdigest(),
+            "stat": [stat_after.st_size, stat_after.st_mtime_ns],
+        }
+        self.stat_cache[filepath] = (stat_after.st_size, stat_after.st_mtime_ns)
+        return True
+
+    def _write_manifest(self):
+        with atomic_open(self.manifest_filepath, "w", encoding="utf-8") as fout:
+            json.dump({"last_cycle_timestamp": time.time(), "files": self.manifest}, fout, ensure_ascii=False, indent=4)
+
+    def sync(self, candidates: Optional[set] = None):
+        """
+        Runs one cycle: backs up new or changed files and rewrites the manifest.
+
+        Args:
+            candidates (set, optional): Paths which may have changed. Defaults to None, i.e., rescan all watched paths.
+        """
+        with self.lock:
+            if candidates is None:
+                candidates = set(self._iter_watched_files())
+            candidates = {path for path in candidates | self.pending if self._is_watched(path)}
+            self.pending = set()
+            changed = False
+            for filepath in sorted(candidates):
+                try:
+                    file_stat = os.stat(filepath)
+                except FileNotFoundError:
+                    continue
+                if self.stat_cache.get(filepath) == (file_stat.st_size, file_stat.st_mtime_ns):
+                    continue
+                try:
+                    if self._backup_file(filepath):
+                        changed = True
+                    else:
+                        self.pending.add(filepath)
+                except OSError as error:
+                    warnings.warn(f"Cannot back up '{filepath}': {error}")
+                    self.pending.add(filepath)
+            if changed or not os.path.isfile(self.manifest_filepath):
+                self._write_manifest()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            if self.detector is not None:
+                deadline = time.monotonic() + self.interval
+                candidates = set()
+                while not self.stop_event.is_set() and time.monotonic() < deadline:
+                    changed = self.detector.wait(min(1.0, max(deadline - time.monotonic(), 0)))
+                    if changed is None:
+                        candidates = None
+                        break
+                    candidates |= changed
+                if self.stop_event.is_set():
+                    break
+                self.sync(candidates)
+            else:
+                if self.stop_event.wait(self.interval):
+                    break
+                self.sync()
+
+    def stop(self):
+        """Stops the background thread after a final full cycle."""
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.sync()
+        if self.detector is not None:
+            self.detector.close()
+            self.detector = None
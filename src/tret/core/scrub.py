@@ -0,0 +1,257 @@
+import os
+import gzip
+import json
+import time
+import zlib
+import hashlib
+import tarfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Optional
+from ..constants import (
+    TRET_ATTRIBUTES_FILENAME,
+    CODES_TARBALL_FILENAME,
+    CURRENT_CODES_TARBALL_FILENAME,
+    DATA_TARBALL_FILENAME,
+    TRET_PACKS_DIRNAME,
+    TRET_SCRUB_STATE_FILENAME,
+    GIT_INFO_FILENAME,
+    GIT_REPO_PATH_KEYNAME,
+    GIT_COMMIT_HASH_KEYNAME,
+    GIT_DIFF_INFO_KEYNAME,
+)
+from .chunk_store import (
+    load_chunk_recipes,
+    get_chunk_store_dir,
+    _chunk_filepath,
+)
+from .garbage_collection import list_workspaces
+from ..utils.file_utils import atomic_open
+from ..utils.throttle import BandwidthThrottle, ThrottledReader
+from ..utils.git_utils import get_git_repository
+
+READ_SIZE = 1024 * 1024
+# the state is saved at most this often, so that an interrupted scrub resumes from where it stopped
+STATE_SAVE_INTERVAL = 10.0
+
+
+def scrub_tarball(tarball_path: str, throttle: BandwidthThrottle, expected_members: Optional[dict] = None) -> tuple[list[str], int]:
+    """
+    Validates a tarball by streaming through it once: the tar structure, the gzip CRC and length, and, if given,
+    the sizes and sha256 of its members as recorded in the manifest.
+
+    Returns:
+        tuple[list[str], int]: The problems found, and the number of bytes read.
+    """
+    errors = []
+    with open(tarball_path, "rb") as raw_fileobj:
+        reader = ThrottledReader(raw_fileobj, throttle)
+        fileobj = gzip.GzipFile(fileobj=reader, mode="rb") if tarball_path.endswith((".gz", ".tgz")) else reader
+        seen_members = set()
+        try:
+            with tarfile.open(fileobj=fileobj, mode="r|") as tar:
+                for member in tar:
+                    seen_members.add(member.name)
+                    if not member.isfile():
+                        continue
+                    hasher = hashlib.sha256()
+                    extracted = tar.extractfile(member)
+                    for data in iter(lambda: extracted.read(READ_SIZE), b""):
+                        hasher.update(data)
+                    expected = (expected_members or {}).get(member.name)
+                    if expected is None:
+                        continue
+                    if expected.get("size", member.size) != member.size:
+                        errors.append(f"'{member.name}' in '{tarball_path}' has size {member.size}, {expected['size']} recorded.")
+                    elif expected.get("sha256", hasher.hexdigest()) != hasher.hexdigest():
+                        errors.append(f"'{member.name}' in '{tarball_path}' does not match its recorded sha256.")
+            # gzip only verifies its CRC and length once the end of the stream is read
+            while fileobj.read(READ_SIZE):
+                pass
+        except (tarfile.TarError, OSError, EOFError, zlib.error) as error:
+            errors.append(f"'{tarball_path}' is corrupted: {error}")
+            return errors, reader.bytes_read
+    for name in sorted(set(expected_members or {}) - seen_members):
+        errors.append(f"'{name}' is recorded but missing from '{tarball_path}'.")
+    return errors, reader.bytes_read
+
+
+def _scrub_gitinfo(gitinfo_filepath: str) -> list[str]:
+    try:
+        gitinfo = json.load(open(gitinfo_filepath, "r", encoding="utf-8"))
+    except ValueError as error:
+        return [f"'{gitinfo_filepath}' is not valid JSON: {error}"]
+    missing_keys = [
+        key for key in (GIT_REPO_PATH_KEYNAME, GIT_COMMIT_HASH_KEYNAME, GIT_DIFF_INFO_KEYNAME) if key not in gitinfo
+    ]
+    if missing_keys:
+        return [f"'{gitinfo_filepath}' misses {missing_keys}."]
+    repo_path, commit_hash = gitinfo[GIT_REPO_PATH_KEYNAME], gitinfo[GIT_COMMIT_HASH_KEYNAME]
+    if not os.path.exists(repo_path):
+        return [f"The recorded git repository '{repo_path}' does not exist."]
+    # workspaces of the same repository share one persistent `git cat-file --batch-check` process per worker
+    if get_git_repository(repo_path).object_type(f"{commit_hash}^{{commit}}") != "commit":
+        return [f"The recorded commit {commit_hash} cannot be resolved in '{repo_path}'."]
+    return []
+
+
+def scrub_workspace(workspace_dir: str, max_bandwidth: Optional[float] = None) -> dict:
+    """
+    Checks that a workspace can still be restored: its archives are readable and match the manifest, `.gitinfo` is
+    valid and its commit exists in the recorded repository, symbolic links point to existing targets, and the chunks
+    of chunked files exist in the chunk store.
+
+    Args:
+        workspace_dir (str): The workspace directory.
+        max_bandwidth (float, optional): Maximum bytes per second read from archives. Defaults to None, i.e., no limit.
+
+    Returns:
+        dict: The `errors` found, and the number of `bytes_read`.
+    """
+    throttle = BandwidthThrottle(max_bandwidth)
+    errors, bytes_read = [], 0
+    manifest = {}
+    tret_attributes_filepath = os.path.join(workspace_dir, TRET_ATTRIBUTES_FILENAME)
+    if os.path.isfile(tret_attributes_filepath):
+        try:
+            manifest = json.load(open(tret_attributes_filepath, "r", encoding="utf-8")).get("manifest", {})
+        except ValueError as error:
+            errors.append(f"'{tret_attributes_filepath}' is not valid JSON: {error}")
+
+    data_dir = os.path.join(workspace_dir, "data")
+    tarballs = [
+        (os.path.join(workspace_dir, CODES_TARBALL_FILENAME), manifest.get("codes")),
+        (os.path.join(workspace_dir, CURRENT_CODES_TARBALL_FILENAME), None),
+        (os.path.join(data_dir, DATA_TARBALL_FILENAME), (manifest.get("data") or {}).get("tarball")),
+    ]
+    for tarball_path, expected_members in tarballs:
+        if os.path.isfile(tarball_path):
+            tarball_errors, tarball_bytes_read = scrub_tarball(tarball_path, throttle, expected_members)
+            errors.extend(tarball_errors)
+            bytes_read += tarball_bytes_read
+        elif expected_members:
+            errors.append(f"'{tarball_path}' is recorded but missing.")
+
+    gitinfo_filepath = os.path.join(workspace_dir, GIT_INFO_FILENAME)
+    if os.path.isfile(gitinfo_filepath):
+        errors.extend(_scrub_gitinfo(gitinfo_filepath))
+
+    if os.path.isdir(data_dir):
+        for dirpath, dirnames, filenames in os.walk(data_dir):
+            for name in filenames + dirnames:
+                path = os.path.join(dirpath, name)
+                if os.path.islink(path) and not os.path.exists(path):
+                    errors.append(f"The target '{os.readlink(path)}' of '{path}' does not exist.")
+
+    chunk_store_dir = get_chunk_store_dir(workspace_dir)
+    for relpath, recipe in load_chunk_recipes(data_dir).items():
+        missing_chunks = [chunk_hash for chunk_hash, _ in recipe["chunks"] if not os.path.isfile(_chunk_filepath(chunk_store_dir, chunk_hash))]
+        if missing_chunks:
+            errors.append(f"{len(missing_chunks)} chunks of '{relpath}' are missing from '{chunk_store_dir}'.")
+    return {"errors": errors, "bytes_read": bytes_read}
+
+
+def _scrub_pack(pack_filepath: str, max_bandwidth: Optional[float] = None) -> dict:
+    errors, bytes_read = scrub_tarball(pack_filepath, BandwidthThrottle(max_bandwidth))
+    return {"errors": errors, "bytes_read": bytes_read}
+
+
+def _load_scrub_state(workspace_basedir: str) -> dict:
+    state_filepath = os.path.join(workspace_basedir, TRET_SCRUB_STATE_FILENAME)
+    if not os.path.isfile(state_filepath):
+        return {"workspaces": {}}
+    try:
+        return json.load(open(state_filepath, "r", encoding="utf-8"))
+    except ValueError:
+        return {"workspaces": {}}
+
+
+def _save_scrub_state(workspace_basedir: str, state: dict):
+    state_filepath = os.path.join(workspace_basedir, TRET_SCRUB_STATE_FILENAME)
+    with atomic_open(state_filepath, "w", encoding="utf-8") as fout:
+        json.dump(state, fout, ensure_ascii=False)
+
+
+def scrub(
+    workspace_basedir: str,
+    max_workers: Optional[int] = None,
+    max_bandwidth: Optional[float] = None,
+    reverify_after: Optional[float] = 30 * 24 * 60 * 60,
+    full: bool = False,
+) -> dict:
+    """
+    Verifies the integrity of all the workspaces (and packs of compacted workspaces) in a base directory in parallel.
+
+    The last verification of every workspace is recorded in `.tret-scrub-state.json`, so that later runs only verify
+    workspaces which have changed, failed, or not been verified for `reverify_after` seconds, and interrupted runs
+    resume where they stopped.
+
+    Args:
+        workspace_basedir (str): The base directory of workspaces.
+        max_workers (int, optional): Number of worker processes. Defaults to the cpu count.
+        max_bandwidth (float, optional): Maximum bytes per second read by all workers together. Defaults to None, i.e., no limit.
+        reverify_after (float, optional): Seconds after which verified workspaces are verified again. Defaults to 30 days.
+        full (bool, optional): Verify every workspace regardless of previous runs. Defaults to False.
+
+    Returns:
+        dict: The `errors` of every failed workspace, the names of the `verified` and `skipped` workspaces,
+            and the number of `bytes_read`.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    # the bandwidth is shared evenly by the workers, which run in separate processes
+    worker_bandwidth = max_bandwidth / max_workers if max_bandwidth else None
+    state = _load_scrub_state(workspace_basedir)
+    now = time.time()
+
+    units = []
+    for workspace in list_workspaces(workspace_basedir):
+        if not workspace["unpacked"]:
+            # verified with its pack below
+            continue
+        units.append((workspace["name"], scrub_workspace, workspace["dir"], [workspace["size"], workspace["mtime"]]))
+    packs_dir = os.path.join(workspace_basedir, TRET_PACKS_DIRNAME)
+    if os.path.isdir(packs_dir):
+        for filename in sorted(os.listdir(packs_dir)):
+            if filename.endswith(".tar"):
+                pack_filepath = os.path.join(packs_dir, filename)
+                pack_stat = os.stat(pack_filepath)
+                units.append((f"{TRET_PACKS_DIRNAME}/{filename}", _scrub_pack, pack_filepath, [pack_stat.st_size, pack_stat.st_mtime]))
+
+    report = {"errors": {}, "verified": [], "skipped": [], "bytes_read": 0}
+    pending = []
+    for name, scrub_function, path, fingerprint in units:
+        previous = state["workspaces"].get(name)
+        if (
+            not full and previous is not None and previous["fingerprint"] == fingerprint and not previous["errors"]
+            and (reverify_after is None or now - previous["last_verified"] < reverify_after)
+        ):
+            report["skipped"].append(name)
+            continue
+        pending.append((name, scrub_function, path, fingerprint))
+
+    last_saved = time.monotonic()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(scrub_function, path, worker_bandwidth): (name, fingerprint)
+            for name, scrub_function, path, fingerprint in pending
+        }
+        for future in as_completed(futures):
+            name, fingerprint = futures[future]
+            try:
+                result = future.result()
+            except Exception as error:
+                result = {"errors": [f"Failed to scrub '{name}': {error}"], "bytes_read": 0}
+            state["workspaces"][name] = {"last_verified": time.time(), "fingerprint": fingerprint, "errors": result["errors"]}
+            report["verified"].append(name)
+            report["bytes_read"] += result["bytes_read"]
+            if result["errors"]:
+                report["errors"][name] = result["errors"]
+            if time.monotonic() - last_saved > STATE_SAVE_INTERVAL:
+                _save_scrub_state(workspace_basedir, state)
+                last_saved = time.monotonic()
+
+    # forget workspaces which have been removed since
+    existing_names = {name for name, _, _, _ in units}
+    state["workspaces"] = {name: entry for name, entry in state["workspaces"].items() if name in existing_names}
+    if os.path.isdir(workspace_basedir):
+        _save_scrub_state(workspace_basedir, state)
+    return report
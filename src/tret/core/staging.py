@@ -0,0 +1,76 @@
+import os
+import json
+from ..constants import (
+    TRET_ATTRIBUTES_FILENAME,
+    TRET_PACKS_DIRNAME,
+    TRET_STAGED_CHUNKS_DIRNAME,
+    CHUNK_STORE_DIRNAME,
+)
+from ..utils.file_utils import atomic_open
+from .garbage_collection import _pack_workspaces, _get_referenced_chunks
+
+# staged workspaces are published into `.tret-packs/staged-<workspace name>.tar`, which every backup replaces
+STAGED_PACK_PREFIX = "staged-"
+
+
+def prepare_staging_dir(staging_dir: str, workspace_basedir: str):
+    """
+    Prepares a node-local staging directory for the workspaces of `workspace_basedir`. Its chunk store is a symbolic link
+    to the chunk store of the base directory, since chunks are large files shared by all workspaces anyway.
+    """
+    os.makedirs(staging_dir, exist_ok=True)
+    chunk_store_link = os.path.join(staging_dir, CHUNK_STORE_DIRNAME)
+    if not os.path.islink(chunk_store_link):
+        chunk_store_dir = os.path.join(os.path.abspath(workspace_basedir), CHUNK_STORE_DIRNAME)
+        os.makedirs(chunk_store_dir, exist_ok=True)
+        os.symlink(chunk_store_dir, chunk_store_link, target_is_directory=True)
+
+
+def record_staged_chunks(staged_workspace_dir: str, workspace_basedir: str):
+    """
+    Records the chunks referenced by a workspace in a staging directory into `workspace_basedir`, where gc can see them,
+    so that chunks reused by the backup are not collected before the workspace is published. The record is removed
+    when the workspace is published.
+    """
+    chunks = _get_referenced_chunks(staged_workspace_dir)
+    if not chunks:
+        return
+    workspace_name = os.path.basename(os.path.normpath(staged_workspace_dir))
+    records_dir = os.path.join(workspace_basedir, TRET_STAGED_CHUNKS_DIRNAME)
+    os.makedirs(records_dir, exist_ok=True)
+    with atomic_open(os.path.join(records_dir, f"{workspace_name}.json"), "w", encoding="utf-8") as fout:
+        json.dump(sorted(chunks), fout)
+
+
+def publish_staged_workspace(staged_workspace_dir: str, workspace_basedir: str) -> str:
+    """
+    Publishes a workspace built in a staging directory into `workspace_basedir`, as a single uncompressed pack with
+    an index in `.tret-packs`, so that a backup only costs a few metadata operations on the shared file system instead of
+    a few per file. The pack and then its index atomically replace those of the previous backup of the workspace.
+    Published workspaces are unpacked on demand like workspaces compacted by gc, and verified by `tret scrub`.
+
+    Args:
+        staged_workspace_dir (str): The workspace in the staging directory, whose backup has completed.
+        workspace_basedir (str): The shared base directory of workspaces.
+
+    Returns:
+        str: The path of the pack.
+    """
+    workspace_name = os.path.basename(os.path.normpath(staged_workspace_dir))
+    tret_attributes = json.load(open(os.path.join(staged_workspace_dir, TRET_ATTRIBUTES_FILENAME), "r", encoding="utf-8"))
+    pack_name = f"{STAGED_PACK_PREFIX}{workspace_name}"
+    _pack_workspaces(
+        [{
+            "name": workspace_name,
+            "dir": staged_workspace_dir,
+            "backup_timestamp": tret_attributes.get("backup_timestamp"),
+            "metadata": tret_attributes.get("metadata", {}),
+        }],
+        workspace_basedir,
+        pack_name=pack_name,
+    )
+    # the chunks are referenced by the index of the pack from now on
+    record_filepath = os.path.join(workspace_basedir, TRET_STAGED_CHUNKS_DIRNAME, f"{workspace_name}.json")
+    if os.path.isfile(record_filepath):
+        os.remove(record_filepath)
+    return os.path.join(workspace_basedir, TRET_PACKS_DIRNAME, f"{pack_name}.tar")
@@ -0,0 +1,340 @@
+import os
+import json
+import time
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from ..constants import TRET_INTERNAL_PREFIX
+
+
+class StorageBackend:
+    """
+    The storage where workspaces are persisted.
+    Workspaces are always built in the local `workspace_basedir`, which works as a staging cache for remote backends.
+    """
+    def upload_workspace(self, local_workspace_dir: str, workspace_name: str):
+        """Persists a local workspace into the storage."""
+        raise NotImplementedError
+
+    def download_workspace(self, workspace_name: str, local_workspace_dir: str) -> bool:
+        """Fetches a workspace from the storage into the local cache. Returns False if the storage does not have it."""
+        raise NotImplementedError
+
+
+class LocalStorageBackend(StorageBackend):
+    """
+    The default backend, where the local `workspace_basedir` is the storage itself, so nothing needs to be transferred.
+    """
+    def upload_workspace(self, local_workspace_dir: str, workspace_name: str):
+        return
+
+    def download_workspace(self, workspace_name: str, local_workspace_dir: str) -> bool:
+        return False
+
+
+class _ByteBudget:
+    """Bounds the number of bytes held by in-flight transfers."""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.inflight_bytes = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, nbytes: int):
+        with self.condition:
+            # a single transfer larger than the budget is still allowed when nothing else is in flight
+            while self.inflight_bytes > 0 and self.inflight_bytes + nbytes > self.max_bytes:
+                self.condition.wait()
+            self.inflight_bytes += nbytes
+
+    def release(self, nbytes: int):
+        with self.condition:
+            self.inflight_bytes -= nbytes
+            self.condition.notify_all()
+
+
+SYMLINK_METADATA_KEY = "tret-symlink-target"
+# the files of the last upload of a workspace, which the next upload is compared against
+STORAGE_MANIFEST_NAME = ".tret-storage-manifest.json"
+# the maximum number of keys of one `delete_objects` request
+DELETE_BATCH_SIZE = 1000
+
+
+def _build_local_manifest(local_workspace_dir: str) -> dict:
+    """Describes every file of a workspace by its size and mtime, and every symbolic link by its target."""
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(local_workspace_dir):
+        for filename in filenames + dirnames:
+            filepath = os.path.join(dirpath, filename)
+            relpath = os.path.relpath(filepath, local_workspace_dir).replace(os.sep, "/")
+            if os.path.islink(filepath):
+                manifest[relpath] = {"symlink": os.readlink(filepath)}
+            elif filename in filenames:
+                file_stat = os.stat(filepath)
+                manifest[relpath] = {"size": file_stat.st_size, "mtime_ns": file_stat.st_mtime_ns}
+    manifest.pop(STORAGE_MANIFEST_NAME, None)
+    return manifest
+
+
+def _local_filepath(local_workspace_dir: str, relpath: str) -> str:
+    """Returns where an object is downloaded, refusing keys which would lead outside of the workspace."""
+    parts = relpath.split("/")
+    if any(part in ("", os.curdir, os.pardir) or os.sep in part for part in parts):
+        raise ValueError(f"'{relpath}' cannot be downloaded into the workspace '{local_workspace_dir}'.")
+    return os.path.join(local_workspace_dir, *parts)
+
+
+class S3StorageBackend(StorageBackend):
+    """
+    Stores workspaces in an S3-compatible object storage, under `<prefix>/<workspace_name>/`.
+
+    Large files are uploaded through parallel multipart uploads and downloaded through parallel ranged requests.
+    Each upload records a manifest of the workspace, so that the next upload of the workspace only sends the files which
+    have changed since, and deletes the objects of the files which have been removed.
+    Each part is retried with exponential backoff, and the bytes read into memory by in-flight parts are bounded by
+    `max_inflight_bytes`. Symbolic links are stored as empty objects recording their target in the object metadata.
+
+    Args:
+        bucket (str): The bucket name.
+        prefix (str, optional): The key prefix of all workspaces. Defaults to "".
+        endpoint_url (str, optional): The endpoint of S3-compatible services such as MinIO. Defaults to None.
+        part_size (int, optional): Size in bytes of multipart parts and ranged requests. Defaults to 64MiB.
+        max_workers (int, optional): Number of concurrent requests. Defaults to 8.
+        max_inflight_bytes (int, optional): Maximum bytes held by in-flight requests. Defaults to 512MiB.
+        max_retries (int, optional): Maximum attempts of each request. Defaults to 5.
+        client (optional): A boto3 S3 client to use instead of creating one.
+    """
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: Optional[str] = None,
+        part_size: int = 64 * 1024 * 1024,
+        max_workers: int = 8,
+        max_inflight_bytes: int = 512 * 1024 * 1024,
+        max_retries: int = 5,
+        client=None,
+    ):
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise ImportError(
+                    "The boto3 package is required for S3 storage backends. "
+                    "Please install it via `pip install boto3`."
+                )
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        # S3 requires every part except the last one to be at least 5MiB
+        assert part_size >= 5 * 1024 * 1024, "`part_size` must be at least 5MiB."
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.part_size = part_size
+        self.max_workers = max_workers
+        self.max_inflight_bytes = max_inflight_bytes
+        self.max_retries = max_retries
+
+    def _workspace_prefix(self, workspace_name: str) -> str:
+        return f"{self.prefix}/{workspace_name}/" if self.prefix else f"{workspace_name}/"
+
+    def _with_retries(self, func, *args, **kwargs):
+        for attempt in range(self.max_retries):
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                if attempt == self.max_retries - 1:
+                    raise
+                time.sleep(min(0.1 * 2 ** attempt, 5.0))
+
+    def _put_object(self, budget: _ByteBudget, key: str, data: bytes, metadata: dict = None):
+        try:
+            self._with_retries(self.client.put_object, Bucket=self.bucket, Key=key, Body=data, Metadata=metadata or {})
+        finally:
+            budget.release(len(data))
+
+    def _upload_part(self, budget: _ByteBudget, key: str, upload_id: str, part_number: int, data: bytes) -> dict:
+        try:
+            response = self._with_retries(
+                self.client.upload_part,
+                Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=data,
+            )
+        finally:
+            budget.release(len(data))
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+    def _load_remote_manifest(self, workspace_prefix: str) -> Optional[dict]:
+        def _get_manifest():
+            try:
+                response = self.client.get_object(Bucket=self.bucket, Key=workspace_prefix + STORAGE_MANIFEST_NAME)
+            except self.client.exceptions.NoSuchKey:
+                return None
+            return json.loads(response["Body"].read())
+        return self._with_retries(_get_manifest)
+
+    def upload_workspace(self, local_workspace_dir: str, workspace_name: str):
+        budget = _ByteBudget(self.max_inflight_bytes)
+        workspace_prefix = self._workspace_prefix(workspace_name)
+        manifest = _build_local_manifest(local_workspace_dir)
+        remote_manifest = self._load_remote_manifest(workspace_prefix) or {}
+        futures, multipart_uploads = [], []
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for relpath, entry in manifest.items():
+                    if remote_manifest.get(relpath) == entry:
+                        continue
+                    filepath = os.path.join(local_workspace_dir, *relpath.split("/"))
+                    key = workspace_prefix + relpath
+                    if "symlink" in entry:
+                        futures.append(executor.submit(
+                            self._put_object, budget, key, b"", {SYMLINK_METADATA_KEY: entry["symlink"]}
+                        ))
+                        continue
+
+                    with open(filepath, "rb") as fin:
+                        if os.path.getsize(filepath) <= self.part_size:
+                            data = fin.read()
+                            budget.acquire(len(data))
+                            futures.append(executor.submit(self._put_object, budget, key, data))
+                            continue
+
+                        upload_id = self._with_retries(
+                            self.client.create_multipart_upload, Bucket=self.bucket, Key=key
+                        )["UploadId"]
+                        part_futures = []
+                        multipart_uploads.append((key, upload_id, part_futures))
+                        part_number = 1
+                        while True:
+                            budget.acquire(self.part_size)
+                            data = fin.read(self.part_size)
+                            if not data:
+                                budget.release(self.part_size)
+                                break
+                            # the budget reserved a whole part, only keep what has been actually read
+                            budget.release(self.part_size - len(data))
+                            part_futures.append(executor.submit(
+                                self._upload_part, budget, key, upload_id, part_number, data
+                            ))
+                            part_number += 1
+
+                for future in futures:
+                    future.result()
+                for key, upload_id, part_futures in multipart_uploads:
+                    parts = [future.result() for future in part_futures]
+                    self._with_retries(
+                        self.client.complete_multipart_upload,
+                        Bucket=self.bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts},
+                    )
+        except BaseException:
+            for key, upload_id, _ in multipart_uploads:
+                try:
+                    self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+                except Exception:
+                    pass
+            raise
+
+        # the manifest is replaced once every file it lists has been uploaded, then the removed files are deleted
+        self._with_retries(
+            self.client.put_object,
+            Bucket=self.bucket, Key=workspace_prefix + STORAGE_MANIFEST_NAME,
+            Body=json.dumps(manifest, ensure_ascii=False).encode("utf-8"),
+        )
+        stale_keys = [
+            obj["Key"] for obj in self._list_objects(workspace_prefix)
+            if obj["Key"][len(workspace_prefix):] not in manifest and obj["Key"][len(workspace_prefix):] != STORAGE_MANIFEST_NAME
+        ]
+        for start in range(0, len(stale_keys), DELETE_BATCH_SIZE):
+            self._with_retries(
+                self.client.delete_objects,
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": key} for key in stale_keys[start:start + DELETE_BATCH_SIZE]], "Quiet": True},
+            )
+
+    def _list_objects(self, prefix: str) -> list[dict]:
+        objects = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            objects.extend(page.get("Contents", []))
+        return objects
+
+    def _download_range(self, key: str, filepath: str, start: int, end: int):
+        response = self._with_retries(self.client.get_object, Bucket=self.bucket, Key=key, Range=f"bytes={start}-{end}")
+        data = response["Body"].read()
+        with open(filepath, "r+b") as fout:
+            fout.seek(start)
+            fout.write(data)
+
+    def _download_object(self, key: str, filepath: str, size: int, executor: ThreadPoolExecutor) -> list:
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        if size == 0:
+            metadata = self._with_retries(self.client.head_object, Bucket=self.bucket, Key=key).get("Metadata", {})
+            if SYMLINK_METADATA_KEY in metadata:
+                os.symlink(metadata[SYMLINK_METADATA_KEY], filepath)
+            else:
+                open(filepath, "wb").close()
+            return []
+        with open(filepath, "wb") as fout:
+            fout.truncate(size)
+        return [
+            executor.submit(self._download_range, key, filepath, start, min(start + self.part_size, size) - 1)
+            for start in range(0, size, self.part_size)
+        ]
+
+    def download_workspace(self, workspace_name: str, local_workspace_dir: str) -> bool:
+        workspace_prefix = self._workspace_prefix(workspace_name)
+        objects = self._list_objects(workspace_prefix)
+        if not objects:
+            return False
+        # objects which are not in the manifest are left by an interrupted upload, or are about to be deleted
+        manifest = self._load_remote_manifest(workspace_prefix)
+        # the workspace is downloaded next to its final place, which it only replaces once complete,
+        # so that an interrupted download is never taken for a complete workspace
+        local_workspace_dir = os.path.abspath(local_workspace_dir)
+        download_dir = os.path.join(
+            os.path.dirname(local_workspace_dir),
+            f"{TRET_INTERNAL_PREFIX}download-{os.path.basename(local_workspace_dir)}-{os.getpid()}",
+        )
+        if os.path.lexists(download_dir):
+            shutil.rmtree(download_dir)
+        os.makedirs(download_dir)
+        try:
+            downloaded = {}
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = []
+                for obj in objects:
+                    relpath = obj["Key"][len(workspace_prefix):]
+                    if relpath == STORAGE_MANIFEST_NAME or manifest is not None and relpath not in manifest:
+                        continue
+                    filepath = downloaded[relpath] = _local_filepath(download_dir, relpath)
+                    futures.extend(self._download_object(obj["Key"], filepath, obj["Size"], executor))
+                for future in futures:
+                    future.result()
+            # the mtimes are those of the uploaded files, so that uploading the workspace again sends nothing
+            for relpath, filepath in downloaded.items():
+                mtime_ns = (manifest or {}).get(relpath, {}).get("mtime_ns")
+                if mtime_ns is not None and not os.path.islink(filepath):
+                    os.utime(filepath, ns=(mtime_ns, mtime_ns))
+            os.replace(download_dir, local_workspace_dir)
+        except BaseException:
+            shutil.rmtree(download_dir, ignore_errors=True)
+            raise
+        return True
+
+
+def get_storage_backend(storage_url: Optional[str] = None, **kwargs) -> StorageBackend:
+    """
+    Creates the storage backend for a storage url.
+
+    Args:
+        storage_url (str, optional): `s3://<bucket>/<prefix>` for S3-compatible storages.
+            Defaults to None, i.e., workspaces are only stored in the local `workspace_basedir`.
+        **kwargs: Additional arguments of the backend.
+
+    Returns:
+        StorageBackend: The storage backend.
+    """
+    if storage_url is None:
+        return LocalStorageBackend()
+    if storage_url.startswith("s3://"):
+        bucket, _, prefix = storage_url[len("s3://"):].partition("/")
+        return S3StorageBackend(bucket=bucket, prefix=prefix, **kwargs)
+    raise ValueError(f"Unsupported storage url '{storage_url}'.")
@@ -0,0 +1,246 @@
+import os
+import json
+import difflib
+import hashlib
+import importlib.metadata
+from ..constants import (
+    REQUIREMENTS_TXT_FILENAME,
+    TRET_ATTRIBUTES_FILENAME,
+    CODES_TARBALL_FILENAME,
+    GIT_INFO_FILENAME,
+    GIT_REPO_PATH_KEYNAME,
+    GIT_DIFF_INFO_KEYNAME,
+    GIT_COMMIT_HASH_KEYNAME,
+)
+from ..utils.tarball_utils import (
+    get_tarball_manifest,
+    read_members_from_tarball,
+    hash_fileobj,
+)
+from ..utils.git_utils import get_git_repository
+
+
+class _WorkspaceSnapshot:
+    """
+    A lightweight view of a workspace built from its recorded manifests.
+    File contents are only read on demand, through `read_codes`.
+    """
+    def __init__(self, workspace_dir: str):
+        self.workspace_dir = workspace_dir
+        self.codes_tarball_filepath = os.path.join(workspace_dir, CODES_TARBALL_FILENAME)
+        self.requirements_filepath = os.path.join(workspace_dir, REQUIREMENTS_TXT_FILENAME)
+
+        git_info_filepath = os.path.join(workspace_dir, GIT_INFO_FILENAME)
+        self.gitinfo = None
+        if os.path.isfile(git_info_filepath):
+            self.gitinfo = json.load(open(git_info_filepath, "r", encoding="utf-8"))
+
+        tret_attributes = {}
+        tret_attributes_filepath = os.path.join(workspace_dir, TRET_ATTRIBUTES_FILENAME)
+        if os.path.isfile(tret_attributes_filepath):
+            tret_attributes = json.load(open(tret_attributes_filepath, "r", encoding="utf-8"))
+        self.metadata = tret_attributes.get("metadata", {})
+        manifest = tret_attributes.get("manifest")
+        self.data = manifest["data"] if manifest else None
+
+        if manifest is not None:
+            self.codes = dict(manifest["codes"])
+        elif os.path.isfile(self.codes_tarball_filepath):
+            # workspaces backed up before manifests were recorded, the code tarball is small enough to be indexed here.
+            self.codes = get_tarball_manifest(self.codes_tarball_filepath)
+        else:
+            self.codes = {}
+        if os.path.isfile(self.requirements_filepath):
+            # with git, requirements are stored as a plain file in the workspace instead of inside the code tarball
+            with open(self.requirements_filepath, "rb") as fin:
+                self.codes[REQUIREMENTS_TXT_FILENAME] = {
+                    "size": os.path.getsize(self.requirements_filepath),
+                    "sha256": hash_fileobj(fin),
+                }
+
+    def read_codes(self, names: list[str]) -> dict:
+        names = [name for name in names if name in self.codes]
+        contents = {}
+        if REQUIREMENTS_TXT_FILENAME in names and os.path.isfile(self.requirements_filepath):
+            with open(self.requirements_filepath, "rb") as fin:
+                contents[REQUIREMENTS_TXT_FILENAME] = fin.read()
+        names = [name for name in names if name not in contents]
+        if names and os.path.isfile(self.codes_tarball_filepath):
+            contents.update(read_members_from_tarball(self.codes_tarball_filepath, names))
+        return contents
+
+
+class _WorktreeSnapshot:
+    """
+    A view of the current working tree, restricted to the files recorded by a reference workspace.
+    """
+    def __init__(self, reference: _WorkspaceSnapshot):
+        self.working_directory = os.getcwd()
+        self.metadata = None
+        self.data = None
+
+        self.codes = {}
+        for name, entry in reference.codes.items():
+            if name == REQUIREMENTS_TXT_FILENAME:
+                continue
+            filepath = os.path.join(self.working_directory, name)
+            if not os.path.isfile(filepath):
+                continue
+            size = os.path.getsize(filepath)
+            if size != entry["size"]:
+                # sizes differ, so the content hash is not needed to know that the file has changed
+                self.codes[name] = {"size": size, "sha256": None}
+                continue
+            with open(filepath, "rb") as fin:
+                self.codes[name] = {"size": size, "sha256": hash_fileobj(fin)}
+
+        self.requirements = None
+        if REQUIREMENTS_TXT_FILENAME in reference.codes:
+            recorded_requirements = reference.read_codes([REQUIREMENTS_TXT_FILENAME]).get(REQUIREMENTS_TXT_FILENAME, b"")
+            installed_requirements = []
+            for requirement in recorded_requirements.decode("utf-8").splitlines():
+                distribution_name = requirement.split("==")[0].strip()
+                try:
+                    installed_requirements.append(f"{distribution_name}=={importlib.metadata.version(distribution_name)}")
+                except Exception:
+                    continue
+            self.requirements = "\n".join(installed_requirements).encode("utf-8")
+            self.codes[REQUIREMENTS_TXT_FILENAME] = {
+                "size": len(self.requirements),
+                "sha256": hashlib.sha256(self.requirements).hexdigest(),
+            }
+
+        self.gitinfo = None
+        if reference.gitinfo is not None:
+            try:
+                repo = get_git_repository(reference.gitinfo[GIT_REPO_PATH_KEYNAME])
+                commit_hash = repo.head_commit()
+                self.gitinfo = {
+                    GIT_REPO_PATH_KEYNAME: repo.git_dir,
+                    GIT_COMMIT_HASH_KEYNAME: commit_hash,
+                    GIT_DIFF_INFO_KEYNAME: repo.diff(commit_hash),
+                }
+            except Exception:
+                self.gitinfo = None
+
+    def read_codes(self, names: list[str]) -> dict:
+        contents = {}
+        for name in names:
+            if name not in self.codes:
+                continue
+            if name == REQUIREMENTS_TXT_FILENAME:
+                contents[name] = self.requirements
+                continue
+            with open(os.path.join(self.working_directory, name), "rb") as fin:
+                contents[name] = fin.read()
+        return contents
+
+
+def _unified_diff(content_a: bytes, content_b: bytes, name_a: str, name_b: str) -> list[str]:
+    try:
+        lines_a = content_a.decode("utf-8").splitlines() if content_a is not None else []
+        lines_b = content_b.decode("utf-8").splitlines() if content_b is not None else []
+    except UnicodeDecodeError:
+        return [f"Binary files {name_a} and {name_b} differ"]
+    return list(difflib.unified_diff(lines_a, lines_b, fromfile=name_a, tofile=name_b, lineterm=""))
+
+
+def _diff_gitinfo(gitinfo_a: dict, gitinfo_b: dict, summary: bool) -> list[str]:
+    if gitinfo_a is None and gitinfo_b is None:
+        return []
+    if gitinfo_a is None or gitinfo_b is None:
+        return [f"git: {'recorded' if gitinfo_a else 'none'} -> {'recorded' if gitinfo_b else 'none'}"]
+
+    lines = []
+    commit_a, commit_b = gitinfo_a[GIT_COMMIT_HASH_KEYNAME], gitinfo_b[GIT_COMMIT_HASH_KEYNAME]
+    if commit_a != commit_b:
+        lines.append(f"commit: {commit_a} -> {commit_b}")
+        if not summary:
+            try:
+                lines.extend(get_git_repository(gitinfo_b[GIT_REPO_PATH_KEYNAME]).diff(commit_a, commit_b).splitlines())
+            except Exception:
+                lines.append("(commits are not available in the recorded git repository)")
+    if gitinfo_a[GIT_DIFF_INFO_KEYNAME] != gitinfo_b[GIT_DIFF_INFO_KEYNAME]:
+        lines.append("uncommitted changes differ")
+        if not summary:
+            lines.extend(_unified_diff(
+                gitinfo_a[GIT_DIFF_INFO_KEYNAME].encode("utf-8", errors="surrogateescape"),
+                gitinfo_b[GIT_DIFF_INFO_KEYNAME].encode("utf-8", errors="surrogateescape"),
+                f"a/{GIT_INFO_FILENAME}:{GIT_DIFF_INFO_KEYNAME}",
+                f"b/{GIT_INFO_FILENAME}:{GIT_DIFF_INFO_KEYNAME}",
+            ))
+    return lines
+
+
+def _diff_codes(snapshot_a, snapshot_b, summary: bool) -> list[str]:
+    codes_a, codes_b = snapshot_a.codes, snapshot_b.codes
+    added = sorted(set(codes_b) - set(codes_a))
+    removed = sorted(set(codes_a) - set(codes_b))
+    modified = sorted(
+        name for name in set(codes_a) & set(codes_b)
+        if codes_a[name]["size"] != codes_b[name]["size"] or codes_a[name]["sha256"] != codes_b[name]["sha256"]
+    )
+    if summary:
+        return (
+            [f"A {name}" for name in added]
+            + [f"D {name}" for name in removed]
+            + [f"M {name}" for name in modified]
+        )
+
+    # only the members that actually differ are read from the tarballs
+    contents_a = snapshot_a.read_codes(removed + modified)
+    contents_b = snapshot_b.read_codes(added + modified)
+    lines = []
+    for name in sorted(added + removed + modified):
+        lines.extend(_unified_diff(contents_a.get(name), contents_b.get(name), f"a/{name}", f"b/{name}"))
+    return lines
+
+
+def _diff_dicts(dict_a: dict, dict_b: dict, prefix: str) -> list[str]:
+    lines = []
+    for key in sorted(set(dict_a) | set(dict_b), key=str):
+        value_a, value_b = dict_a.get(key), dict_b.get(key)
+        if value_a != value_b:
+            lines.append(f"{prefix}{key}: {json.dumps(value_a, ensure_ascii=False)} -> {json.dumps(value_b, ensure_ascii=False)}")
+    return lines
+
+
+def _diff_data(data_a: dict, data_b: dict) -> list[str]:
+    if data_a is None or data_b is None:
+        return []
+    lines = []
+    for section in ["files", "tarball", "symlinks", "chunks"]:
+        lines.extend(_diff_dicts(data_a.get(section, {}), data_b.get(section, {}), prefix=f"data.{section}."))
+    return lines
+
+
+def diff_workspaces(workspace_dir_a: str, workspace_dir_b: str = None, summary: bool = False) -> str:
+    """
+    Compares two workspaces, or a workspace against the current working tree.
+
+    Commit hashes and the recorded manifests are compared first, then only the code files that actually differ
+    are read from the code tarballs. Data is compared through the manifests only, so data tarballs are never decompressed.
+
+    Args:
+        workspace_dir_a (str): The directory of the first workspace.
+        workspace_dir_b (str, optional): The directory of the second workspace.
+            Defaults to None, i.e., compares against the current working tree.
+        summary (bool, optional): If True, outputs a summary of changed items instead of a unified diff. Defaults to False.
+
+    Returns:
+        str: The differences, empty if nothing differs.
+    """
+    assert os.path.isdir(workspace_dir_a), f"The workspace directory '{workspace_dir_a}' does not exist."
+    snapshot_a = _WorkspaceSnapshot(workspace_dir_a)
+    if workspace_dir_b is None:
+        snapshot_b = _WorktreeSnapshot(snapshot_a)
+    else:
+        assert os.path.isdir(workspace_dir_b), f"The workspace directory '{workspace_dir_b}' does not exist."
+        snapshot_b = _WorkspaceSnapshot(workspace_dir_b)
+
+    lines = _diff_gitinfo(snapshot_a.gitinfo, snapshot_b.gitinfo, summary=summary)
+    lines.extend(_diff_codes(snapshot_a, snapshot_b, summary=summary))
+    if snapshot_a.metadata is not None and snapshot_b.metadata is not None:
+        lines.extend(_diff_dicts(snapshot_a.metadata, snapshot_b.metadata, prefix="metadata."))
+    lines.extend(_diff_data(snapshot_a.data, snapshot_b.data))
+    return "\n".join(lines)
@@ -2,6 +2,25 @@ import os
 import click
 from .core import TretWorkspace
 from .arguments import TretArguments
+from .constants import DEFAULT_WORKSPACE_DIR, TRET_INTERNAL_PREFIX
+from .core.workspace_diff import diff_workspaces
+from .core.garbage_collection import collect_garbage
+from .core.scrub import scrub as scrub_workspaces
+from .core.data_restore import RESTORE_MODES, RESTORE_MODE_HARDLINK
+from .core.code_backup_and_restore import BYTECODE_RESTORE_MODES
+from .core.bundle import export_bundle, import_bundle
+from .core.metrics import aggregate_metric, METRIC_REDUCTIONS
+from .core.launcher import run_experiment
+from .core.lineage import find_runs, backfill_lineage_index, extract_snippets
+from .core.daemon import (
+    TretDaemon,
+    stop_daemon,
+)
+from .core.environment import (
+    build_environment,
+    get_wheelhouse_dir,
+    get_environments_dir,
+)
 
 RESTORE_OPTION_NAME_DOC = r"""Name of the workspace you want to restore from.
 Note that this option is used only when the workspace is stored in the DEFAULT workspace base directory (`tret-workspaces`).
@@ -14,6 +33,75 @@ RESTORE_OPTION_CURRENT = r"""If restore codes in `current-codes.tar.gz` from the
 If `--current` flag is set, tret will restore `current-codes.tar.gz`, else restore `codes.tar.gz`.
 """
 
+RESTORE_OPTION_DATA = r"""Restore the backed up data of the workspace instead of the codes.
+The data are restored into `--target`, and existing files are never overwritten unless `--overwrite` is set.
+"""
+
+RESTORE_OPTION_MODE = r"""How copied data files are restored: `hardlink` links them to the workspace, `copy` reflinks or copies them,
+and `extract` only extracts the data tarball and chunked files. Defaults to `hardlink`.
+"""
+
+RESTORE_OPTION_BYTECODE = r"""`reuse` restores the pycs backed up with `backup_bytecode` for this interpreter and compiles the other restored
+Python files, `precompile` compiles all of them in a process pool. Both remove pycs whose source does not exist anymore.
+"""
+
+DIFF_OPTION_WORKTREE = r"""Compare the workspace against the current working tree instead of another workspace.
+"""
+
+DIFF_OPTION_SUMMARY = r"""Only output a summary of changed items instead of a unified diff.
+"""
+
+GC_OPTION_BASEDIR_DOC = r"""The workspace base directory to collect garbage in. Defaults to `tret-workspaces`.
+"""
+
+GC_OPTION_KEEP_IF_DOC = r"""Keep workspaces whose metadata has KEY equal to VALUE (compared as strings). Can be repeated.
+"""
+
+DAEMON_OPTION_SOCKET_DOC = r"""The Unix socket to listen on. Defaults to a socket specific to the current Python environment,
+which `TretWorkspace` connects to automatically.
+"""
+
+EXPORT_OPTION_OUTPUT_DOC = r"""The path of the bundle, or `-` to write it to the standard output, e.g. to pipe it to `ssh node tret import -`.
+An interrupted export into a file resumes from `OUTPUT.partial`.
+"""
+
+IMPORT_OPTION_GIT_REPO_DOC = r"""A clone of the project to fetch the snapshot commits of the workspaces into, which their `.gitinfo` then records.
+Defaults to the recorded repositories if they exist here.
+"""
+
+METRICS_OPTION_REDUCE_DOC = r"""How the values of each workspace are reduced: `last` logged value, `min`, `max` (with their steps) or `mean`.
+Defaults to `last`.
+"""
+
+METRICS_OPTION_STEP_DOC = r"""Only consider values logged up to this step, e.g. to compare runs of different lengths at the same step.
+"""
+
+WHICH_RUNS_OPTION_CONTAINS_DOC = r"""Only match versions of FILE containing this definition, given as a qualified name such as `Model.forward`,
+which is hashed from the current FILE.
+"""
+
+RUN_OPTION_DATA_DOC = r"""Data files or directories backed up after COMMAND exits, routed automatically by their sizes and content
+like `datafiles_auto`. Can be repeated.
+"""
+
+SECONDS_PER_DAY = 24 * 60 * 60
+SIZE_UNITS = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def _parse_size(size: str) -> int:
+    """Parses sizes such as `512M` or `10G` into bytes."""
+    size = size.strip().upper().rstrip("B")
+    if size and size[-1] in SIZE_UNITS:
+        return int(float(size[:-1]) * SIZE_UNITS[size[-1]])
+    return int(size)
+
+
+def _resolve_workspace_dir(workspace: str) -> str:
+    """Treats `workspace` as a directory path if it exists, otherwise as a workspace name in the default base directory."""
+    if os.path.isdir(workspace):
+        return workspace
+    return os.path.join(DEFAULT_WORKSPACE_DIR, workspace)
+
 
 @click.group(name="tret")
 def main_cli():
@@ -24,7 +112,23 @@ def main_cli():
 @click.option("-n", "--wsname", metavar='WORKSPACE-NAME', help=RESTORE_OPTION_NAME_DOC)
 @click.option("-d", "--wsdir", metavar="WORKSPACE-DIR", help=RESTORE_OPTION_DIR_DOC)
 @click.option("--current", is_flag=True, help=RESTORE_OPTION_CURRENT)
-def restore(wsname: str = None, wsdir: str = None, current: bool = None):
+@click.option("--data", is_flag=True, help=RESTORE_OPTION_DATA)
+@click.option("--target", default=".", help="The directory where the data are restored. Defaults to the current directory.")
+@click.option("--mode", type=click.Choice(RESTORE_MODES), default=RESTORE_MODE_HARDLINK, help=RESTORE_OPTION_MODE)
+@click.option("--overwrite", is_flag=True, help="Replace existing files when restoring data.")
+@click.option("--no-verify", is_flag=True, help="Do not verify the restored data against the recorded sizes and hashes.")
+@click.option("--bytecode", type=click.Choice(BYTECODE_RESTORE_MODES), default=None, help=RESTORE_OPTION_BYTECODE)
+def restore(
+    wsname: str = None,
+    wsdir: str = None,
+    current: bool = None,
+    data: bool = None,
+    target: str = ".",
+    mode: str = RESTORE_MODE_HARDLINK,
+    overwrite: bool = None,
+    no_verify: bool = None,
+    bytecode: str = None,
+):
     workspace_name, workspace_dir = wsname, wsdir
     if workspace_name is None and workspace_dir is None:
         click.echo(click.get_current_context().get_help())
@@ -45,8 +149,274 @@ def restore(wsname: str = None, wsdir: str = None, current: bool = None):
         )
     workspace = TretWorkspace(arguments)
 
-    click.echo(f"Restoring from Workspace {workspace_dir}.", err=True)
-    if current:
+    click.echo(f"Restoring from Workspace {workspace.workspace_dir}.", err=True)
+    if data:
+        restored = workspace.restore_data(target, mode=mode, overwrite=overwrite, verify=not no_verify)
+        click.echo(
+            f"Restored {len(restored['files'])} files, {len(restored['symlinks'])} symbolic links, "
+            f"{len(restored['tarball'])} tarball members and {len(restored['chunks'])} chunked files into '{target}'.",
+            err=True,
+        )
+    elif current:
         workspace.restore_current_codes_from_tarball(remove_after_restore=True)
     else:
-        workspace.restore()
+        workspace.restore(bytecode=bytecode)
+
+
+@main_cli.command()
+@click.argument("workspace_a", metavar="WORKSPACE-A")
+@click.argument("workspace_b", metavar="[WORKSPACE-B]", required=False)
+@click.option("--worktree", is_flag=True, help=DIFF_OPTION_WORKTREE)
+@click.option("--summary", is_flag=True, help=DIFF_OPTION_SUMMARY)
+def diff(workspace_a: str, workspace_b: str = None, worktree: bool = None, summary: bool = None):
+    """Show differences between two workspaces, or between a workspace and the working tree."""
+    assert (workspace_b is None) == bool(worktree), "Exactly one of `WORKSPACE-B` or `--worktree` must be provided."
+    output = diff_workspaces(
+        _resolve_workspace_dir(workspace_a),
+        _resolve_workspace_dir(workspace_b) if workspace_b is not None else None,
+        summary=summary,
+    )
+    if output:
+        click.echo(output)
+
+
+@main_cli.command()
+@click.option("--basedir", default=DEFAULT_WORKSPACE_DIR, help=GC_OPTION_BASEDIR_DOC)
+@click.option("--keep-last", type=int, default=None, help="Keep the N newest workspaces.")
+@click.option("--keep-tagged", is_flag=True, help="Keep workspaces with non-empty `tags` in their metadata.")
+@click.option("--keep-if", multiple=True, metavar="KEY=VALUE", help=GC_OPTION_KEEP_IF_DOC)
+@click.option("--max-age", type=float, default=None, help="Remove unprotected workspaces older than this many days.")
+@click.option("--max-total-size", default=None, help="Remove the oldest unprotected workspaces until the total size fits, e.g. `500G`.")
+@click.option("--journal-max-age", type=float, default=None, help="Remove `current-codes.tar.gz` older than this many days.")
+@click.option("--compact-older-than", type=float, default=None, help="Compact small workspaces older than this many days into a pack.")
+@click.option("--dry-run", is_flag=True, help="Only report what would be done and how many bytes would be reclaimed.")
+def gc(
+    basedir: str,
+    keep_last: int = None,
+    keep_tagged: bool = None,
+    keep_if: tuple = (),
+    max_age: float = None,
+    max_total_size: str = None,
+    journal_max_age: float = None,
+    compact_older_than: float = None,
+    dry_run: bool = None,
+):
+    """Reclaim disk space in a workspace base directory according to retention policies."""
+    keep_conditions = [condition.split("=", 1) for condition in keep_if]
+    keep_predicate = None
+    if keep_conditions:
+        def keep_predicate(metadata: dict) -> bool:
+            return any(key in metadata and str(metadata[key]) == value for key, value in keep_conditions)
+
+    report = collect_garbage(
+        basedir,
+        keep_last=keep_last,
+        keep_tagged=keep_tagged,
+        max_age=max_age * SECONDS_PER_DAY if max_age is not None else None,
+        max_total_size=_parse_size(max_total_size) if max_total_size is not None else None,
+        keep_predicate=keep_predicate,
+        journal_max_age=journal_max_age * SECONDS_PER_DAY if journal_max_age is not None else None,
+        compact_older_than=compact_older_than * SECONDS_PER_DAY if compact_older_than is not None else None,
+        dry_run=dry_run,
+    )
+    for action in report["actions"]:
+        click.echo(f"{action['action']:<15} {action['bytes']:>14} {action['path']}")
+    prefix = "Would reclaim" if dry_run else "Reclaimed"
+    click.echo(f"{prefix} {report['reclaimed_bytes']} bytes.", err=True)
+
+
+@main_cli.command()
+@click.option("--basedir", default=DEFAULT_WORKSPACE_DIR, help="The workspace base directory to verify. Defaults to `tret-workspaces`.")
+@click.option("--workers", type=int, default=None, help="Number of worker processes. Defaults to the cpu count.")
+@click.option("--max-bandwidth", default=None, help="Maximum read rate of all workers together per second, e.g. `100M`.")
+@click.option("--reverify-after", type=float, default=30, help="Verify unchanged workspaces again after this many days. Defaults to 30.")
+@click.option("--full", is_flag=True, help="Verify every workspace, regardless of previous runs.")
+def scrub(basedir: str, workers: int = None, max_bandwidth: str = None, reverify_after: float = 30, full: bool = None):
+    """Verify that the archives, git commits and symbolic links of all workspaces are still intact."""
+    report = scrub_workspaces(
+        basedir,
+        max_workers=workers,
+        max_bandwidth=_parse_size(max_bandwidth) if max_bandwidth is not None else None,
+        reverify_after=reverify_after * SECONDS_PER_DAY,
+        full=full,
+    )
+    for name, errors in sorted(report["errors"].items()):
+        for error in errors:
+            click.echo(f"{name}: {error}")
+    click.echo(
+        f"Verified {len(report['verified'])} workspaces ({report['bytes_read']} bytes read), "
+        f"skipped {len(report['skipped'])} verified ones, {len(report['errors'])} failed.",
+        err=True,
+    )
+    if report["errors"]:
+        raise SystemExit(1)
+
+
+@main_cli.command(name="export")
+@click.argument("workspaces", nargs=-1, required=True, metavar="WORKSPACE...")
+@click.option("-o", "--output", required=True, help=EXPORT_OPTION_OUTPUT_DOC)
+@click.option("--restart", is_flag=True, help="Discard a partially written bundle instead of resuming it.")
+def export_(workspaces: tuple, output: str, restart: bool = None):
+    """Export WORKSPACE... into a single bundle file, together with their git commits and chunks."""
+    report = export_bundle([_resolve_workspace_dir(workspace) for workspace in workspaces], output, resume=not restart)
+    click.echo(
+        f"Exported {len(report['workspaces'])} workspaces into {report['bytes']} bytes "
+        f"({report['reused_bytes']} bytes reused from a partial bundle).",
+        err=True,
+    )
+
+
+@main_cli.command(name="import")
+@click.argument("bundle", metavar="BUNDLE")
+@click.option("--basedir", default=DEFAULT_WORKSPACE_DIR, help="The workspace base directory to import into. Defaults to `tret-workspaces`.")
+@click.option("--git-repo", default=None, help=IMPORT_OPTION_GIT_REPO_DOC)
+def import_(bundle: str, basedir: str = DEFAULT_WORKSPACE_DIR, git_repo: str = None):
+    """Import the workspaces of BUNDLE (`-` for the standard input), resuming a previous partial import."""
+    os.makedirs(basedir, exist_ok=True)
+    report = import_bundle(bundle, basedir, git_repo=git_repo)
+    if not report["complete"]:
+        click.echo(
+            f"The bundle ends after {report['offset']} bytes, import it again once it has been completely transferred "
+            "to resume from there.",
+            err=True,
+        )
+        raise SystemExit(1)
+    click.echo(f"Imported {len(report['workspaces'])} workspaces into '{basedir}'.", err=True)
+
+
+@main_cli.command(context_settings={"ignore_unknown_options": True, "allow_interspersed_args": False})
+@click.option("--ws", "workspace_name", default=None, metavar="NAME", help="Name of the workspace. Defaults to the current datetime.")
+@click.option("--basedir", default=DEFAULT_WORKSPACE_DIR, help="The workspace base directory. Defaults to `tret-workspaces`.")
+@click.option("--tarball", is_flag=True, help="Back up the codes as a tarball even inside a git repository.")
+@click.option("--data", "datafiles", multiple=True, help=RUN_OPTION_DATA_DOC)
+@click.argument("command", nargs=-1, required=True, type=click.UNPROCESSED, metavar="-- COMMAND...")
+def run(command: tuple, workspace_name: str = None, basedir: str = DEFAULT_WORKSPACE_DIR, tarball: bool = None, datafiles: tuple = ()):
+    """Run COMMAND, e.g. `tret run --ws NAME -- python train.py`, and back it up into a workspace once it exits."""
+    workspace = TretWorkspace(TretArguments(
+        workspace_basedir=basedir,
+        workspace_name=workspace_name,
+        force_backup_codes_as_tarball=tarball,
+    ))
+    returncode = run_experiment(list(command), workspace, datafiles_auto=list(datafiles) or None)
+    click.echo(f"Backed up into '{workspace.workspace_dir}'.", err=True)
+    # like shells, commands killed by a signal exit with 128 + the signal number
+    raise SystemExit(returncode if returncode >= 0 else 128 - returncode)
+
+
+@main_cli.command()
+@click.argument("metric", metavar="METRIC")
+@click.argument("workspaces", nargs=-1, metavar="[WORKSPACE...]")
+@click.option("--basedir", default=DEFAULT_WORKSPACE_DIR, help="The workspace base directory queried without WORKSPACE. Defaults to `tret-workspaces`.")
+@click.option("--reduce", "reduction", type=click.Choice(METRIC_REDUCTIONS), default="last", help=METRICS_OPTION_REDUCE_DOC)
+@click.option("--step", type=int, default=None, help=METRICS_OPTION_STEP_DOC)
+@click.option("--workers", type=int, default=None, help="Number of threads reading workspaces.")
+@click.option("--sort", "sort_by_value", is_flag=True, help="Sort workspaces by value instead of by name.")
+def metrics(
+    metric: str,
+    workspaces: tuple,
+    basedir: str = DEFAULT_WORKSPACE_DIR,
+    reduction: str = "last",
+    step: int = None,
+    workers: int = None,
+    sort_by_value: bool = None,
+):
+    """Aggregate METRIC logged by `TretWorkspace.log_metrics` across workspaces, by default all those of the base directory."""
+    if workspaces:
+        workspace_dirs = [_resolve_workspace_dir(workspace) for workspace in workspaces]
+    else:
+        workspace_dirs = [
+            os.path.join(basedir, name) for name in sorted(os.listdir(basedir)) if not name.startswith(TRET_INTERNAL_PREFIX)
+        ] if os.path.isdir(basedir) else []
+    results = aggregate_metric(workspace_dirs, metric, reduction=reduction, step=step, max_workers=workers)
+    rows = sorted(results.items(), key=lambda item: item[1]["value"] if sort_by_value else os.path.basename(item[0]))
+    for workspace_dir, result in rows:
+        click.echo(f"{os.path.basename(os.path.normpath(workspace_dir))}\t{result['step']}\t{result['value']:.6g}\t{result['count']}")
+    click.echo(f"{len(results)} of {len(workspace_dirs)} workspaces have logged '{metric}'.", err=True)
+
+
+def _is_hash(value: str) -> bool:
+    return len(value) >= 4 and all(char in "0123456789abcdef" for char in value.lower())
+
+
+@main_cli.command(name="which-runs")
+@click.argument("file", metavar="FILE[@HASH]")
+@click.option("--contains", default=None, metavar="SNIPPET", help=WHICH_RUNS_OPTION_CONTAINS_DOC)
+@click.option("--contains-hash", default=None, metavar="HASH", help="Like `--contains`, with the hash printed by `--show-definitions`.")
+@click.option("--basedir", default=DEFAULT_WORKSPACE_DIR, help="The workspace base directory to search. Defaults to `tret-workspaces`.")
+@click.option("--backfill", is_flag=True, help="First index the workspaces backed up before their code versions were recorded.")
+@click.option("--workers", type=int, default=None, help="Number of worker processes of `--backfill`. Defaults to the cpu count.")
+@click.option("--show-definitions", is_flag=True, help="Print the hashes of the definitions of the current FILE instead.")
+def which_runs(
+    file: str,
+    contains: str = None,
+    contains_hash: str = None,
+    basedir: str = DEFAULT_WORKSPACE_DIR,
+    backfill: bool = None,
+    workers: int = None,
+    show_definitions: bool = None,
+):
+    """List the workspaces which ran a version of FILE, e.g. `model.py@3f2a9c1` with a git blob id, or any version."""
+    path, _, blob_id = file.rpartition("@")
+    if not path or not _is_hash(blob_id):
+        path, blob_id = file, None
+    if contains is not None and contains_hash is not None:
+        raise click.BadParameter("cannot be given together with `--contains`.", param_hint="--contains-hash")
+    if show_definitions or contains is not None:
+        with open(path, "rb") as fin:
+            snippets = extract_snippets(fin.read())
+        if show_definitions:
+            for qualname, snippet_hash in snippets.items():
+                click.echo(f"{snippet_hash}\t{qualname}")
+            return
+        if contains not in snippets:
+            raise click.BadParameter(f"'{path}' has no definition named '{contains}'.", param_hint="--contains")
+        contains_hash = snippets[contains]
+    if not os.path.isdir(basedir):
+        raise click.BadParameter(f"'{basedir}' does not exist.", param_hint="--basedir")
+    if backfill:
+        report = backfill_lineage_index(basedir, max_workers=workers)
+        for name, error in sorted(report["failed"].items()):
+            click.echo(f"Failed to index '{name}': {error}", err=True)
+        click.echo(f"Indexed {len(report['indexed'])} workspaces.", err=True)
+    runs = find_runs(basedir, os.path.relpath(path) if os.path.isabs(path) else path, blob_id=blob_id, snippet_hash=contains_hash)
+    for run in runs:
+        click.echo(f"{run['workspace']}\t{run['path']}\t{run['blob_id']}")
+    click.echo(f"{len({run['workspace'] for run in runs})} workspaces.", err=True)
+
+
+@main_cli.group()
+def env():
+    """Manage the python environments recorded in workspaces."""
+    pass
+
+
+@env.command()
+@click.argument("workspace", metavar="WORKSPACE")
+@click.option("--wheelhouse", default=None, help="The local wheelhouse. Defaults to `.tret-wheelhouse` in the workspace base directory.")
+@click.option("--target", default=None, help="Materialize the environment at this path through hard links.")
+def build(workspace: str, wheelhouse: str = None, target: str = None):
+    """Build a virtual environment from the requirements of WORKSPACE without network access."""
+    workspace_dir = _resolve_workspace_dir(workspace)
+    workspace_basedir = os.path.dirname(os.path.abspath(workspace_dir))
+    environment_dir = build_environment(
+        workspace_dir,
+        wheelhouse_dir=wheelhouse or get_wheelhouse_dir(workspace_basedir),
+        environments_dir=get_environments_dir(workspace_basedir),
+        target_dir=target,
+    )
+    click.echo(environment_dir)
+
+
+@main_cli.command()
+@click.option("--socket", "socket_path", default=None, help=DAEMON_OPTION_SOCKET_DOC)
+@click.option("--max-workers", type=int, default=None, help="Maximum number of concurrent requests. Defaults to the cpu count.")
+@click.option("--stop", is_flag=True, help="Stop the running daemon after its running requests are finished.")
+def daemon(socket_path: str = None, max_workers: int = None, stop: bool = None):
+    """Serve backups and restores of this environment with warm indexes, until interrupted."""
+    if stop:
+        if not stop_daemon(socket_path):
+            raise click.ClickException("No tret daemon is running.")
+        return
+    tret_daemon = TretDaemon(socket_path=socket_path, max_workers=max_workers)
+    click.echo(f"tret daemon listening on {tret_daemon.socket_path}")
+    tret_daemon.serve_forever()
@@ -0,0 +1,171 @@
+import os
+import sys
+import struct
+import marshal
+import py_compile
+import tarfile
+import importlib.util
+from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
+from .file_utils import atomic_open
+from .io_limits import LimitedWriter, compression_slot
+from .tarball_utils import add_bytes_to_tarball, _member_filepath
+
+# pyc flags of PEP 552: hash-based, and checked against the source on import
+PYC_FLAGS_CHECKED_HASH = 0b11
+PYC_HEADER = struct.Struct("<4sIII")
+PRECOMPILE_CHUNKSIZE = 32
+
+
+def get_cache_tag() -> Optional[str]:
+    """The tag of the bytecode of this interpreter, e.g. `cpython-311`, or None if it does not cache bytecode."""
+    return sys.implementation.cache_tag
+
+
+def _read_valid_timestamp_pyc(source_filepath: str, source_stat: os.stat_result) -> Optional[bytes]:
+    """Returns the code of the cached pyc of a source file, if it is a timestamp pyc which is still valid."""
+    try:
+        with open(importlib.util.cache_from_source(source_filepath), "rb") as fin:
+            data = fin.read()
+    except OSError:
+        return None
+    if len(data) < PYC_HEADER.size:
+        return None
+    magic, flags, mtime, size = PYC_HEADER.unpack_from(data)
+    if (
+        magic != importlib.util.MAGIC_NUMBER or flags != 0
+        or mtime != int(source_stat.st_mtime) & 0xFFFFFFFF or size != source_stat.st_size & 0xFFFFFFFF
+    ):
+        return None
+    return data[PYC_HEADER.size:]
+
+
+def build_hash_based_pyc(source_filepath: str) -> bytes:
+    """
+    Builds a checked hash-based pyc of a source file, which stays valid after the source is restored elsewhere or with
+    another mtime, as long as its content is the same. The code of a valid cached pyc is reused instead of compiling again.
+    """
+    with open(source_filepath, "rb") as fin:
+        source = fin.read()
+    code = _read_valid_timestamp_pyc(source_filepath, os.stat(source_filepath))
+    if code is None:
+        code = marshal.dumps(compile(source, source_filepath, "exec", dont_inherit=True))
+    return (
+        importlib.util.MAGIC_NUMBER
+        + struct.pack("<I", PYC_FLAGS_CHECKED_HASH)
+        + importlib.util.source_hash(source)
+        + code
+    )
+
+
+def create_bytecode_tarball(source_filepaths: list[str], output: str, working_directory: str) -> list[str]:
+    """
+    Writes the hash-based pycs of Python source files into a tarball, named after their `__pycache__` paths relative to
+    `working_directory`. Files which do not compile are skipped, like Python does when importing them fails,
+    and so are files outside of `working_directory`, whose pycs would not be restored.
+
+    Returns:
+        list[str]: The names of the written pycs.
+    """
+    names = []
+    with compression_slot(), atomic_open(output, "wb") as fout, \
+            tarfile.open(fileobj=LimitedWriter(fout), mode="w:gz", compresslevel=6) as tar:
+        for source_filepath in sorted(set(source_filepaths)):
+            name = os.path.relpath(importlib.util.cache_from_source(source_filepath), working_directory)
+            if name.split(os.sep, 1)[0] == os.pardir:
+                continue
+            try:
+                pyc = build_hash_based_pyc(source_filepath)
+            except (SyntaxError, ValueError, OSError):
+                continue
+            add_bytes_to_tarball(tar, name, pyc)
+            names.append(name)
+    return names
+
+
+def restore_bytecode_from_tarball(tarball_path: str, output_dir: str) -> list[str]:
+    """
+    Restores the pycs of a bytecode tarball whose source files exist in `output_dir`.
+    Pycs are checked against their source on import, so the pycs of sources which have changed since are never used.
+
+    Raises:
+        tarfile.TarError: If a member has an absolute name or a name leading outside of `output_dir`.
+
+    Returns:
+        list[str]: The source files whose pycs have been restored.
+    """
+    restored = []
+    dest_path = os.path.realpath(output_dir)
+    with tarfile.open(tarball_path, "r") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            if os.path.pardir in member.name.split("/"):
+                raise tarfile.TarError(f"'{member.name}' would be written outside of '{dest_path}'.")
+            pyc_filepath = _member_filepath(dest_path, member.name)
+            try:
+                source_filepath = importlib.util.source_from_cache(pyc_filepath)
+            except ValueError:
+                continue
+            if not os.path.isfile(source_filepath):
+                continue
+            os.makedirs(os.path.dirname(pyc_filepath), exist_ok=True)
+            with atomic_open(pyc_filepath, "wb") as fout:
+                fout.write(tar.extractfile(member).read())
+            restored.append(source_filepath)
+    return restored
+
+
+def _compile_files(source_filepaths: list[str]) -> int:
+    compiled = 0
+    for source_filepath in source_filepaths:
+        try:
+            py_compile.compile(source_filepath, doraise=True)
+            compiled += 1
+        except (py_compile.PyCompileError, OSError):
+            pass
+    return compiled
+
+
+def precompile_files(source_filepaths: list[str], max_workers: Optional[int] = None) -> int:
+    """
+    Compiles Python source files into their `__pycache__` in a process pool, so that the first imports of restored
+    codes do not compile them one by one.
+
+    Returns:
+        int: The number of compiled files.
+    """
+    source_filepaths = sorted(set(source_filepaths))
+    if not source_filepaths:
+        return 0
+    chunks = [source_filepaths[i:i + PRECOMPILE_CHUNKSIZE] for i in range(0, len(source_filepaths), PRECOMPILE_CHUNKSIZE)]
+    max_workers = min(max_workers or os.cpu_count() or 1, len(chunks))
+    if max_workers == 1:
+        return sum(_compile_files(chunk) for chunk in chunks)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return sum(executor.map(_compile_files, chunks))
+
+
+def remove_orphan_bytecode(directories: list[str]) -> list[str]:
+    """
+    Removes the pycs in the `__pycache__` of `directories` whose source file does not exist anymore, e.g. after
+    restoring a workspace where a module had been removed or renamed.
+
+    Returns:
+        list[str]: The removed pycs.
+    """
+    removed = []
+    for directory in sorted(set(directories)):
+        pycache_dir = os.path.join(directory, "__pycache__")
+        if not os.path.isdir(pycache_dir):
+            continue
+        for filename in os.listdir(pycache_dir):
+            pyc_filepath = os.path.join(pycache_dir, filename)
+            try:
+                source_filepath = importlib.util.source_from_cache(pyc_filepath)
+            except ValueError:
+                continue
+            if not os.path.exists(source_filepath):
+                os.remove(pyc_filepath)
+                removed.append(pyc_filepath)
+    return removed
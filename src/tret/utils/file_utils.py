@@ -0,0 +1,32 @@
+import os
+import tempfile
+import contextlib
+
+
+@contextlib.contextmanager
+def atomic_open(filepath: str, mode: str = "w", **kwargs):
+    """
+    Opens a temporary file next to `filepath`, which atomically replaces `filepath` once it has been completely written.
+    If writing fails, the temporary file is removed and `filepath` is left untouched.
+
+    Args:
+        filepath (str): The path of the output file.
+        mode (str, optional): The mode to open the temporary file with. Defaults to "w".
+        **kwargs: Additional arguments of `open`, e.g. `encoding`.
+
+    Yields:
+        The opened temporary file.
+    """
+    dirname = os.path.dirname(os.path.abspath(filepath))
+    fd, temp_filepath = tempfile.mkstemp(prefix=f".{os.path.basename(filepath)}.", suffix=".tmp", dir=dirname)
+    try:
+        # `mkstemp` creates files only readable by the owner, keep the permissions of a regularly created file instead
+        file_mode = os.stat(filepath).st_mode & 0o777 if os.path.isfile(filepath) else 0o644
+        os.chmod(temp_filepath, file_mode)
+        with os.fdopen(fd, mode, **kwargs) as fout:
+            yield fout
+        os.replace(temp_filepath, filepath)
+    except BaseException:
+        if os.path.exists(temp_filepath):
+            os.remove(temp_filepath)
+        raise
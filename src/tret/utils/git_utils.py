@@ -0,0 +1,336 @@
+import os
+import re
+import json
+import atexit
+import struct
+import threading
+import subprocess
+from typing import Optional
+from .io_limits import git_process_slot
+from .file_utils import atomic_open
+
+HEX_OBJECT_NAME_REGEX = re.compile(r"^(?:[0-9a-f]{40}|[0-9a-f]{64})$")
+# symbolic references are followed at most this many times, like `git` itself does
+MAX_SYMREF_DEPTH = 5
+
+# start directory -> root of the working tree found from it, kept for the lifetime of the process.
+# Cached roots are only used while their `.git` exists, but repositories created between the start directory
+# and a cached root later on are not noticed.
+_worktree_cache = {}
+# absolute path of a working tree or git directory -> `GitRepository`
+_repositories = {}
+_repositories_lock = threading.Lock()
+
+
+def find_git_worktree(start_dir: str) -> Optional[str]:
+    """
+    Finds the root of the working tree containing `start_dir`, by walking up the directories until one of them
+    contains `.git` (a directory, or a file pointing to the git directory of linked worktrees and submodules).
+
+    Args:
+        start_dir (str): The directory to start from.
+
+    Returns:
+        str: The root of the working tree, or None if `start_dir` is not inside a git repository.
+    """
+    start_dir = os.path.abspath(start_dir)
+    worktree_dir = _worktree_cache.get(start_dir)
+    if worktree_dir is not None and os.path.exists(os.path.join(worktree_dir, ".git")):
+        return worktree_dir
+    path = start_dir
+    while True:
+        if os.path.exists(os.path.join(path, ".git")):
+            _worktree_cache[start_dir] = path
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def _read_text(filepath: str) -> Optional[str]:
+    try:
+        with open(filepath, "r", encoding="utf-8") as fin:
+            return fin.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def _read_offset_varint(data: bytes, pos: int) -> tuple[int, int]:
+    """Reads the variable-length integers of index version 4, see `decode_varint` of git."""
+    byte = data[pos]
+    pos += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        byte = data[pos]
+        pos += 1
+        value = ((value + 1) << 7) | (byte & 0x7F)
+    return value, pos
+
+
+def read_index_paths(index_filepath: str) -> Optional[list[str]]:
+    """
+    Reads the paths of the entries of a git index file (versions 2 to 4).
+
+    Returns:
+        list[str]: The paths relative to the root of the working tree, or None if the index uses features which are
+            not understood here (split or sparse indexes), or does not exist.
+    """
+    try:
+        with open(index_filepath, "rb") as fin:
+            data = fin.read()
+    except OSError:
+        return None
+    if len(data) < 12 or data[:4] != b"DIRC":
+        return None
+    version, num_entries = struct.unpack_from(">II", data, 4)
+    if version not in (2, 3, 4):
+        return None
+
+    paths, previous_path, offset = [], b"", 12
+    try:
+        for _ in range(num_entries):
+            mode = struct.unpack_from(">I", data, offset + 24)[0]
+            if mode & 0o170000 == 0o040000:
+                # sparse directory entries of sparse indexes
+                return None
+            flags = struct.unpack_from(">H", data, offset + 60)[0]
+            header_size = 64 if version >= 3 and flags & 0x4000 else 62
+            pos = offset + header_size
+            if version == 4:
+                # paths are prefix-compressed against the previous entry, and entries are not padded
+                strip_length, pos = _read_offset_varint(data, pos)
+                end = data.index(b"\0", pos)
+                path = previous_path[:len(previous_path) - strip_length] + data[pos:end]
+                offset = end + 1
+            else:
+                end = data.index(b"\0", pos)
+                path = data[pos:end]
+                offset += (header_size + len(path) + 8) & ~7
+            paths.append(path)
+            previous_path = path
+
+        # extensions follow the entries, up to the trailing checksum (SHA-1 or SHA-256)
+        for hash_size in (20, 32):
+            pos = offset
+            signatures = []
+            while pos + 8 <= len(data) - hash_size:
+                signature, size = data[pos:pos + 4], struct.unpack_from(">I", data, pos + 4)[0]
+                signatures.append(signature)
+                pos += 8 + size
+            if pos == len(data) - hash_size:
+                break
+        else:
+            return None
+    except (struct.error, ValueError, IndexError):
+        return None
+    if b"link" in signatures or b"sdir" in signatures:
+        # the entries of split indexes are partly stored in a shared index file
+        return None
+    return list(dict.fromkeys(os.fsdecode(path) for path in paths))
+
+
+class _CatFileProcess:
+    """A persistent `git cat-file --batch` or `--batch-check` process, answering queries over its pipes."""
+    def __init__(self, git_dir: str, option: str):
+        self.process = subprocess.Popen(
+            ["git", "--git-dir", git_dir, "cat-file", option],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        )
+        self.with_contents = option == "--batch"
+        self.lock = threading.Lock()
+
+    def query(self, rev: str) -> Optional[tuple[str, str, bytes]]:
+        """Returns the object name, type and (with `--batch`) content of `rev`, or None if it does not exist."""
+        if "\n" in rev:
+            raise ValueError(f"Invalid revision {rev!r}.")
+        with self.lock:
+            self.process.stdin.write(rev.encode("utf-8") + b"\n")
+            self.process.stdin.flush()
+            header = self.process.stdout.readline()
+            if not header:
+                raise RuntimeError("`git cat-file` exited unexpectedly.")
+            fields = header.decode("utf-8").split()
+            if len(fields) != 3:
+                # `<rev> missing` or `<rev> ambiguous`
+                return None
+            object_name, object_type, size = fields[0], fields[1], int(fields[2])
+            content = b""
+            if self.with_contents:
+                content = self.process.stdout.read(size + 1)[:-1]
+            return object_name, object_type, content
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+
+
+class GitRepository:
+    """
+    A git repository, whose HEAD, references and index are read directly from disk when their format is understood,
+    and which answers object queries through persistent `git cat-file` processes, so that only commands which
+    compute something (e.g. `diff`) start a new `git` process. Falls back to `git` commands in all other cases.
+
+    Args:
+        worktree_dir (str): The root of the working tree.
+        git_dir (str): The git directory. Defaults to `.git` of `worktree_dir`, following `gitdir:` files.
+    """
+    def __init__(self, worktree_dir: Optional[str] = None, git_dir: Optional[str] = None):
+        assert worktree_dir is not None or git_dir is not None, "Either `worktree_dir` or `git_dir` must be given."
+        if git_dir is None:
+            git_dir = os.path.join(worktree_dir, ".git")
+            if os.path.isfile(git_dir):
+                # linked worktrees and submodules
+                gitdir_line = (_read_text(git_dir) or "").strip()
+                assert gitdir_line.startswith("gitdir:"), f"'{git_dir}' is not a valid gitdir file."
+                git_dir = os.path.join(worktree_dir, gitdir_line[len("gitdir:"):].strip())
+        git_dir = os.path.abspath(git_dir)
+        if worktree_dir is None:
+            gitdir_filepath = os.path.join(git_dir, "gitdir")
+            if os.path.isfile(gitdir_filepath):
+                # the git directory of a linked worktree records the `.git` file of its working tree
+                worktree_dir = os.path.dirname((_read_text(gitdir_filepath) or "").strip())
+            else:
+                worktree_dir = os.path.dirname(git_dir)
+        self.worktree_dir = os.path.abspath(worktree_dir)
+        self.git_dir = git_dir
+        commondir = _read_text(os.path.join(git_dir, "commondir"))
+        self.common_dir = os.path.normpath(os.path.join(git_dir, commondir.strip())) if commondir else git_dir
+        self._cat_file_processes = {}
+        self._pid = os.getpid()
+
+    def run(self, *args: str, input: Optional[bytes] = None, check: bool = True) -> subprocess.CompletedProcess:
+        """Runs a git command in the working tree, within the `max_git_processes` limit of `set_io_limits`."""
+        with git_process_slot():
+            return subprocess.run(
+                ["git", "--git-dir", self.git_dir, "--work-tree", self.worktree_dir, *args],
+                cwd=self.worktree_dir, input=input, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=check,
+            )
+
+    def _read_ref(self, ref: str) -> Optional[str]:
+        # per-worktree references such as HEAD are in the git directory, shared ones in the common directory
+        for base_dir in dict.fromkeys([self.git_dir, self.common_dir]):
+            value = _read_text(os.path.join(base_dir, ref))
+            if value is not None:
+                return value.strip()
+        packed_refs = _read_text(os.path.join(self.common_dir, "packed-refs"))
+        for line in (packed_refs or "").splitlines():
+            if line and line[0] not in "#^":
+                object_name, _, name = line.partition(" ")
+                if name == ref:
+                    return object_name
+        return None
+
+    def resolve_ref(self, ref: str = "HEAD") -> Optional[str]:
+        """
+        Resolves a reference (e.g. `HEAD` or `refs/heads/main`) to its object name from the files of the repository.
+
+        Returns:
+            str: The object name, or None if the reference cannot be resolved from disk, e.g. with reftable storage.
+        """
+        if os.path.exists(os.path.join(self.common_dir, "reftable")):
+            return None
+        value = ref
+        for _ in range(MAX_SYMREF_DEPTH):
+            value = self._read_ref(value)
+            if value is None:
+                return None
+            if HEX_OBJECT_NAME_REGEX.match(value):
+                return value
+            if not value.startswith("ref:"):
+                return None
+            value = value[len("ref:"):].strip()
+        return None
+
+    def head_commit(self) -> str:
+        """
+        Returns the commit hash of HEAD.
+
+        Raises:
+            ValueError: If HEAD does not point to a commit yet.
+        """
+        commit_hash = self.resolve_ref("HEAD")
+        if commit_hash is not None:
+            return commit_hash
+        result = self.run("rev-parse", "--verify", "--quiet", "HEAD^{commit}", check=False)
+        if result.returncode != 0:
+            raise ValueError(f"HEAD of '{self.worktree_dir}' does not point to any commit.")
+        return result.stdout.decode("utf-8").strip()
+
+    def tracked_files(self) -> list[str]:
+        """Returns the paths in the index, relative to the root of the working tree."""
+        paths = read_index_paths(os.path.join(self.git_dir, "index"))
+        if paths is None:
+            output = self.run("ls-files", "-z").stdout
+            paths = [os.fsdecode(path) for path in output.split(b"\0") if path]
+        return paths
+
+    def diff(self, *revs: str) -> str:
+        """
+        Returns the output of `git diff`, without its trailing newline, as GitPython returned it before,
+        so that recorded diffs are unchanged. Bytes which are not UTF-8, e.g. of files in other encodings, are kept as
+        surrogate escapes, so that `diff.encode("utf-8", errors="surrogateescape")` gives back the exact patch.
+        """
+        output = self.run("diff", *revs).stdout.decode("utf-8", errors="surrogateescape")
+        return output[:-1] if output.endswith("\n") else output
+
+    def _cat_file(self, option: str) -> _CatFileProcess:
+        if self._pid != os.getpid():
+            # the pipes of processes started before `fork` are shared with the parent process
+            self._cat_file_processes, self._pid = {}, os.getpid()
+        if option not in self._cat_file_processes:
+            self._cat_file_processes[option] = _CatFileProcess(self.git_dir, option)
+        return self._cat_file_processes[option]
+
+    def object_type(self, rev: str) -> Optional[str]:
+        """Returns the type of the object `rev` refers to, or None if it does not exist."""
+        result = self._cat_file("--batch-check").query(rev)
+        return result[1] if result is not None else None
+
+    def read_object(self, rev: str) -> Optional[bytes]:
+        """Returns the content of the object `rev` refers to, e.g. `<commit>:<path>`, or None if it does not exist."""
+        result = self._cat_file("--batch").query(rev)
+        return result[2] if result is not None else None
+
+    def close(self):
+        if self._pid == os.getpid():
+            for process in self._cat_file_processes.values():
+                process.close()
+        self._cat_file_processes = {}
+
+
+def write_gitinfo(filepath: str, gitinfo: dict):
+    """
+    Writes a `.gitinfo`. Non-ASCII characters are written as they are, unless the diff holds surrogate escapes
+    (see `GitRepository.diff`), which JSON can only keep escaped.
+    """
+    try:
+        content = json.dumps(gitinfo, ensure_ascii=False, indent=4).encode("utf-8")
+    except UnicodeEncodeError:
+        content = json.dumps(gitinfo, indent=4).encode("utf-8")
+    with atomic_open(filepath, "wb") as fout:
+        fout.write(content)
+
+
+def get_git_repository(path: str) -> GitRepository:
+    """
+    Returns the repository of a working tree root or a git directory, shared by all callers in this process,
+    so that its `git cat-file` processes are reused.
+    """
+    path = os.path.abspath(path)
+    with _repositories_lock:
+        repository = _repositories.get(path)
+        if repository is None or not os.path.exists(repository.git_dir):
+            if os.path.exists(os.path.join(path, ".git")):
+                repository = GitRepository(worktree_dir=path)
+            else:
+                repository = GitRepository(git_dir=path)
+            _repositories[path] = repository
+        return repository
+
+
+@atexit.register
+def _close_repositories():
+    for repository in list(_repositories.values()):
+        repository.close()
@@ -0,0 +1,198 @@
+import os
+import re
+from typing import Optional
+from ..constants import TRETIGNORE_FILENAME
+
+# always excluded from backups, which is the behavior before `.tretignore` was introduced
+DEFAULT_IGNORE_PATTERNS = ["__pycache__/"]
+
+
+def _translate_glob(glob: str) -> str:
+    """Translates a gitignore glob (without anchoring or trailing slash) into a regular expression."""
+    regex = ""
+    i = 0
+    while i < len(glob):
+        char = glob[i]
+        if glob.startswith("**/", i):
+            # matches zero or more directories
+            regex += "(?:.*/)?"
+            i += 3
+            continue
+        if glob.startswith("/**", i) and i + 3 == len(glob):
+            # matches everything inside
+            regex += "/.*"
+            i += 3
+            continue
+        if glob.startswith("**", i):
+            regex += ".*"
+            i += 2
+            continue
+        if char == "*":
+            regex += "[^/]*"
+        elif char == "?":
+            regex += "[^/]"
+        elif char == "\\" and i + 1 < len(glob):
+            i += 1
+            regex += re.escape(glob[i])
+        elif char == "[":
+            # a `]` right after the opening bracket (or its negation) is part of the set
+            negated_set = glob.startswith("[!", i) or glob.startswith("[^", i)
+            end = glob.find("]", i + (3 if negated_set else 2))
+            if end == -1:
+                regex += re.escape(char)
+            else:
+                body = glob[i + (2 if negated_set else 1):end].replace("\\", "\\\\")
+                regex += ("[^" if negated_set else "[") + body + "]"
+                i = end
+        else:
+            regex += re.escape(char)
+        i += 1
+    return regex
+
+
+def compile_ignore_pattern(pattern: str) -> Optional[tuple[str, bool, bool]]:
+    """
+    Compiles a line of `.tretignore` with gitignore semantics.
+
+    Returns:
+        tuple[str, bool, bool]: The regular expression, whether the pattern is negated and whether it only matches
+            directories, or None for blank lines and comments.
+    """
+    pattern = pattern.rstrip("\n")
+    # trailing spaces are ignored unless escaped
+    while pattern.endswith(" ") and not pattern.endswith("\\ "):
+        pattern = pattern[:-1]
+    if not pattern or pattern.startswith("#"):
+        return None
+    negated = pattern.startswith("!")
+    if negated:
+        pattern = pattern[1:]
+    elif pattern.startswith("\\!") or pattern.startswith("\\#"):
+        pattern = pattern[1:]
+    directory_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    if not pattern:
+        return None
+    # patterns with a slash at the beginning or in the middle are relative to the root, others match at any level
+    anchored = "/" in pattern
+    regex = _translate_glob(pattern.lstrip("/"))
+    if not anchored:
+        regex = "(?:.*/)?" + regex
+    return regex, negated, directory_only
+
+
+class IgnoreMatcher:
+    """
+    Decides which paths are excluded from backups, with the semantics of gitignore: patterns are matched against
+    paths relative to `root_dir` in order, and the last matching pattern wins.
+
+    All the patterns are compiled once. Without negated patterns, they are merged into a single regular expression,
+    so that a path is tested with one match. Excluded directories are pruned as a whole by `walk` and `filter_names`,
+    so their contents are never visited.
+
+    Args:
+        patterns (list[str]): Lines of gitignore patterns.
+        root_dir (str, optional): The directory anchored patterns are relative to. Defaults to the current working directory.
+    """
+    def __init__(self, patterns: list[str], root_dir: Optional[str] = None):
+        self.root_dir = os.path.abspath(root_dir or os.getcwd())
+        self.rules = [
+            (re.compile(regex, re.DOTALL), negated, directory_only)
+            for regex, negated, directory_only in filter(None, map(compile_ignore_pattern, patterns))
+        ]
+        self.merged = not any(negated for _, negated, _ in self.rules)
+        if self.merged:
+            self.file_regex = self._merge([rule.pattern for rule, _, directory_only in self.rules if not directory_only])
+            self.directory_regex = self._merge([rule.pattern for rule, _, _ in self.rules])
+
+    @staticmethod
+    def _merge(regexes: list[str]):
+        if not regexes:
+            return None
+        return re.compile("|".join(f"(?:{regex})" for regex in regexes), re.DOTALL)
+
+    def match(self, relpath: str, is_dir: bool = False) -> bool:
+        """Whether a path relative to the root (with `/` as separator) is excluded. Its parents are not checked."""
+        if self.merged:
+            regex = self.directory_regex if is_dir else self.file_regex
+            return regex is not None and regex.fullmatch(relpath) is not None
+        for rule, negated, directory_only in reversed(self.rules):
+            if directory_only and not is_dir:
+                continue
+            if rule.fullmatch(relpath):
+                return not negated
+        return False
+
+    def relpath(self, path: str, top: str) -> str:
+        """
+        The path matched against the patterns: relative to the root if `path` is inside it,
+        otherwise relative to the parent directory of `top`, the backed up path containing `path`.
+        """
+        path = os.path.abspath(path)
+        if path == self.root_dir or path.startswith(self.root_dir + os.sep):
+            relpath = os.path.relpath(path, self.root_dir)
+        else:
+            relpath = os.path.relpath(path, os.path.dirname(os.path.abspath(top)))
+        return relpath.replace(os.sep, "/")
+
+    def is_ignored(self, path: str, top: str) -> bool:
+        """
+        Whether `path`, found inside the backed up path `top`, is excluded.
+        `top` itself is never excluded, since it has been explicitly requested.
+        """
+        if os.path.abspath(path) == os.path.abspath(top):
+            return False
+        is_dir = os.path.isdir(path) and not os.path.islink(path)
+        return self.match(self.relpath(path, top), is_dir=is_dir)
+
+    def filter_names(self, top: str, dirpath: str, names: list[str]) -> set[str]:
+        """Returns the ignored names of a directory, usable as the `ignore` argument of `shutil.copytree`."""
+        return {name for name in names if self.is_ignored(os.path.join(dirpath, name), top)}
+
+    def walk(self, top: str):
+        """Like `os.walk`, but excluded directories are pruned and excluded files are left out."""
+        for dirpath, dirnames, filenames in os.walk(top):
+            # `os.walk` already tells directories from files, so files are matched without any `stat`
+            prefix = self.relpath(dirpath, top) + "/"
+            if prefix == "./":
+                prefix = ""
+            # symbolic links to directories are not followed, thus matched as files
+            dirnames[:] = [
+                name for name in dirnames
+                if not self.match(prefix + name, is_dir=not os.path.islink(os.path.join(dirpath, name)))
+            ]
+            filenames = [name for name in filenames if not self.match(prefix + name)]
+            yield dirpath, dirnames, filenames
+
+
+def read_ignore_file(filepath: str) -> list[str]:
+    if not os.path.isfile(filepath):
+        return []
+    with open(filepath, "r", encoding="utf-8") as fin:
+        return fin.read().splitlines()
+
+
+def load_ignore_matcher(
+    project_dir: Optional[str] = None,
+    workspace_basedir: Optional[str] = None,
+    exclude_patterns: Optional[list[str]] = None,
+) -> IgnoreMatcher:
+    """
+    Builds the matcher from the default patterns, the `.tretignore` files of the project directory and of the
+    workspace base directory, and additional patterns, in this order (later patterns take precedence).
+
+    Args:
+        project_dir (str, optional): The project root. Defaults to the current working directory.
+        workspace_basedir (str, optional): The workspace base directory. Defaults to None.
+        exclude_patterns (list[str], optional): Additional gitignore patterns. Defaults to None.
+
+    Returns:
+        IgnoreMatcher: The compiled matcher, with paths relative to the project root.
+    """
+    project_dir = project_dir or os.getcwd()
+    patterns = list(DEFAULT_IGNORE_PATTERNS)
+    patterns += read_ignore_file(os.path.join(project_dir, TRETIGNORE_FILENAME))
+    if workspace_basedir is not None:
+        patterns += read_ignore_file(os.path.join(workspace_basedir, TRETIGNORE_FILENAME))
+    patterns += exclude_patterns or []
+    return IgnoreMatcher(patterns, root_dir=project_dir)
@@ -0,0 +1,118 @@
+import os
+import shutil
+import threading
+import contextlib
+import concurrent.futures
+from typing import Optional
+from .throttle import BandwidthThrottle
+
+# process-wide limits shared by every backup and restore running in this process, set by `set_io_limits`
+_compression_semaphore = None
+_git_process_semaphore = None
+_disk_throttle = BandwidthThrottle(None)
+_io_limits = {"max_compressions": None, "max_disk_bandwidth": None, "max_git_processes": None}
+# the cancellation event of the operation running in the current thread, see `cancellation_scope`
+_local = threading.local()
+
+
+def set_io_limits(
+    max_compressions: Optional[int] = None,
+    max_disk_bandwidth: Optional[float] = None,
+    max_git_processes: Optional[int] = None,
+):
+    """
+    Sets the limits shared by all the backups and restores of this process, e.g. when many of them run concurrently
+    through `tret.core.async_api`. Operations which are already running keep the limits they started with.
+
+    Args:
+        max_compressions (int, optional): Maximum number of tarballs or chunks compressed at the same time. Defaults to None, i.e., no limit.
+        max_disk_bandwidth (float, optional): Maximum bytes per second written by tarballs, data copies and chunks. Defaults to None, i.e., no limit.
+        max_git_processes (int, optional): Maximum number of git commands run at the same time. Defaults to None, i.e., no limit.
+    """
+    global _compression_semaphore, _git_process_semaphore, _disk_throttle
+    for name, value in [("max_compressions", max_compressions), ("max_git_processes", max_git_processes)]:
+        assert value is None or value >= 1, f"`{name}` should be at least 1, got {value}."
+    _compression_semaphore = threading.BoundedSemaphore(max_compressions) if max_compressions else None
+    _git_process_semaphore = threading.BoundedSemaphore(max_git_processes) if max_git_processes else None
+    _disk_throttle = BandwidthThrottle(max_disk_bandwidth)
+    _io_limits.update(max_compressions=max_compressions, max_disk_bandwidth=max_disk_bandwidth, max_git_processes=max_git_processes)
+
+
+def get_io_limits() -> dict:
+    """Returns the limits set by `set_io_limits`."""
+    return dict(_io_limits)
+
+
+@contextlib.contextmanager
+def cancellation_scope(event: threading.Event):
+    """Makes `check_cancelled` in the current thread raise once `event` is set, until the scope exits."""
+    previous_event = getattr(_local, "cancel_event", None)
+    _local.cancel_event = event
+    try:
+        yield
+    finally:
+        _local.cancel_event = previous_event
+
+
+def check_cancelled():
+    """
+    A cancellation point: raises `concurrent.futures.CancelledError` if the operation running in this thread has been
+    cancelled. Files are written through `atomic_open`, so a cancelled operation never leaves them half-written.
+    """
+    event = getattr(_local, "cancel_event", None)
+    if event is not None and event.is_set():
+        raise concurrent.futures.CancelledError()
+
+
+@contextlib.contextmanager
+def hold_cancellable(semaphore):
+    """Holds a lock or semaphore (none if None), waiting for it at cancellation points."""
+    check_cancelled()
+    if semaphore is None:
+        yield
+        return
+    # waits in short steps, so that an operation cancelled while queued for a slot does not wait for it
+    while not semaphore.acquire(timeout=0.1):
+        check_cancelled()
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+def compression_slot():
+    """Waits for one of the `max_compressions` slots, to be held while compressing."""
+    return hold_cancellable(_compression_semaphore)
+
+
+def git_process_slot():
+    """Waits for one of the `max_git_processes` slots, to be held while a git command runs."""
+    return hold_cancellable(_git_process_semaphore)
+
+
+def consume_disk_bandwidth(nbytes: int):
+    """Accounts `nbytes` written to disk against `max_disk_bandwidth`, blocking as long as the rate is exceeded."""
+    check_cancelled()
+    _disk_throttle.consume(nbytes)
+
+
+class LimitedWriter:
+    """Wraps a binary file object, so that writing to it is limited by `max_disk_bandwidth` and can be cancelled."""
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def write(self, data) -> int:
+        consume_disk_bandwidth(len(data))
+        return self.fileobj.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+
+def limited_copy(src: str, dst: str, copy_function=shutil.copy2, **kwargs):
+    """Copies a file with `copy_function`, accounting its size against `max_disk_bandwidth`. Usable by `shutil.copytree`."""
+    check_cancelled()
+    result = copy_function(src, dst, **kwargs)
+    if not os.path.islink(dst):
+        consume_disk_bandwidth(os.path.getsize(dst))
+    return result
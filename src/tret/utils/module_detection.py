@@ -1,7 +1,9 @@
 import os
+import re
 import sys
 import site
 import types
+import functools
 
 python_version = sys.version_info
 assert python_version.major == 3, "Tret only supports Python3."
@@ -44,6 +46,11 @@ def is_local_module(module: types.ModuleType):
     return os.path.abspath(module_path).startswith(os.getcwd())
 
 
+@functools.lru_cache(maxsize=None)
+def _get_site_package_directories() -> tuple[str, ...]:
+    return tuple(site.getsitepackages())
+
+
 def is_external_module(module: types.ModuleType):
     """
     Determines if a given module is an external module installed in the site-packages directory.
@@ -54,7 +61,7 @@ def is_external_module(module: types.ModuleType):
     Returns:
         bool: True if the module is located in one of the site-packages directories, False otherwise.
     """
-    site_package_directories = site.getsitepackages()
+    site_package_directories = _get_site_package_directories()
     module_path = module.__file__
     return any(
         module_path.startswith(site_package_dir)
@@ -62,8 +69,34 @@ def is_external_module(module: types.ModuleType):
     )
 
 
+# normalized distribution name -> version, built by `build_distribution_index` in long-running processes
+_distribution_index = None
+
+
+def _normalize_distribution_name(name: str) -> str:
+    return re.sub(r"[-_.]+", "_", name).lower()
+
+
+def build_distribution_index() -> dict:
+    """
+    Scans the metadata of all installed distributions once, so that looking up versions no longer scans site-packages.
+    Used by the tret daemon, which serves many backups from the same environment.
+    """
+    global _distribution_index
+    index = {}
+    for distribution in importlib.metadata.distributions():
+        name = distribution.metadata["Name"]
+        # the first distribution on `sys.path` wins, as in `importlib.metadata.version`
+        if name and _normalize_distribution_name(name) not in index:
+            index[_normalize_distribution_name(name)] = distribution.version
+    _distribution_index = index
+    return index
+
+
 def get_external_module_version(module: types.ModuleType):
     """get the version of an external module"""
+    if _distribution_index is not None:
+        return _distribution_index.get(_normalize_distribution_name(module.__name__))
     try:
         module_version = importlib.metadata.version(module.__name__)
     except Exception:
@@ -71,17 +104,21 @@ def get_external_module_version(module: types.ModuleType):
     return module_version
 
 
-def detect_all_modules():
+def detect_all_modules(modules: dict = None):
     """
     Detect and classify all currently loaded modules into standard libraries, local modules, and external modules.
 
+    Args:
+        modules (dict, optional): Mapping from module names to modules, or to objects with the same `__name__`
+            and `__file__`. Defaults to None, i.e., `sys.modules`.
+
     Returns:
         dict: A dictionary with three keys:
             - "standard_libs": A list of modules that are part of the Python standard library or built-in modules.
             - "local_modules": A list of modules that are part of the local project (i.e., not installed via pip or conda).
             - "external_modules": A list of modules that are installed via pip or conda.
     """
-    modules = sys.modules
+    modules = sys.modules if modules is None else modules
     classified_modules = {
         "standard_libs": [],
         "local_modules": [],
@@ -1,27 +1,78 @@
+import io
 import os
+import copy
+import contextlib
+import functools
+import json
+import hashlib
+import time
+import shutil
 import tarfile
+import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .file_utils import atomic_open
+from .io_limits import LimitedWriter, compression_slot, consume_disk_bandwidth
+from .ignore_utils import IgnoreMatcher, load_ignore_matcher
+from ..constants import RESTORE_JOURNAL_MEMBERNAME
+
+
+class _HashingReader:
+    """Wraps a binary file object, hashing what is read from it."""
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hasher = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        self.hasher.update(data)
+        return data
 
 
 def create_tarball_from_files(
     filepaths: list[str],
     output: str,
     arcpaths: list[str] = None,
-    append_data_to_existing_tarball: bool = True
+    append_data_to_existing_tarball: bool = True,
+    members_from_memory: dict = None,
+    ignore_matcher: IgnoreMatcher = None,
+    manifest: dict = None,
 ):
     """
     Create a tarball from a list of files.
 
+    The tarball is written into a temporary file which replaces `output` once complete, so `output` is never left half-written.
+    When appending, members of the existing tarball are streamed into the new one in a single pass.
+
     Args:
         filepaths (list[str]): List of file paths to include in the tarball.
         output (str): The output tarball file path.
         arcpaths (list[str], optional): List of archive paths for the files inside the tarball. Defaults to None.
         append_data_to_existing_tarball (bool, optional): If True, append data to an existing tarball if it exists. Defaults to True.
+        members_from_memory (dict, optional): Mapping from archive paths to bytes, added to the tarball without being
+            written to disk first. Defaults to None.
+        ignore_matcher (IgnoreMatcher, optional): Excludes paths inside the given directories, and prunes excluded
+            directories without visiting them. Defaults to None, i.e., the `.tretignore` of the working directory.
+        manifest (dict, optional): Filled with the size and sha256 content hash of every regular file of the tarball,
+            as `get_tarball_manifest` returns them, computed while the files are written. Defaults to None.
 
     Returns:
-        None
+        list[tarfile.TarInfo]: All the members of the written tarball, including the appended ones.
     """
-    def _filter_pycaches(tarinfo: tarfile.TarInfo) -> tarfile.TarInfo:
-        return tarinfo if "__pycache__" not in tarinfo.name else None
+    if ignore_matcher is None:
+        ignore_matcher = load_ignore_matcher()
+
+    def _make_filter(filepath: str, arcpath: str):
+        # `tarfile` strips leading slashes from member names, the remaining part is the path inside `filepath`
+        top_name = (arcpath if arcpath else filepath).replace(os.sep, "/").lstrip("/")
+
+        def _filter(tarinfo: tarfile.TarInfo) -> tarfile.TarInfo:
+            if tarinfo.name == top_name:
+                return tarinfo
+            path = os.path.join(filepath, *tarinfo.name[len(top_name) + 1:].split("/"))
+            # directories which are filtered out are not recursed into by `tarfile`
+            return None if ignore_matcher.match(ignore_matcher.relpath(path, filepath), tarinfo.isdir()) else tarinfo
+        return _filter
 
     compression = output.endswith(".gz") or output.endswith(".tgz")
     mode = "w:gz" if compression else "w"
@@ -29,45 +80,244 @@ def create_tarball_from_files(
 
     if arcpaths is None:
         arcpaths = [None] * len(filepaths)
+    members_from_memory = members_from_memory or {}
 
-    if not os.path.isfile(output) or not append_data_to_existing_tarball:
-        with tarfile.open(output, mode, **kwargs) as tar:
-            for filepath, arcpath in zip(filepaths, arcpaths):
-                tar.add(name=filepath, arcname=arcpath, recursive=True, filter=_filter_pycaches)
-    else:
-        # append new data to existing tarball
-        existing_filenames = set()
-        filename = os.path.basename(output)
-        old_tarball_filepath = os.path.join(os.path.dirname(output), f"old-{filename}")
-        os.replace(output, old_tarball_filepath)
-        with tarfile.open(output, mode, **kwargs) as tar:
-            with tarfile.open(old_tarball_filepath, "r") as old_tar:
-                for member in old_tar.getmembers():
-                    tar.addfile(member, old_tar.extractfile(member))
-                    existing_filenames.add(member.name)
+    existing_filenames = set()
+    with compression_slot() if compression else contextlib.nullcontext(), atomic_open(output, "wb") as fout:
+        with tarfile.open(name=output, mode=mode, fileobj=LimitedWriter(fout), **kwargs) as tar:
+            if manifest is not None:
+                addfile = tar.addfile
+
+                def _addfile(tarinfo: tarfile.TarInfo, fileobj=None):
+                    # `tar.add` hands every file to `addfile`, whose body is hashed as it is copied
+                    if not tarinfo.isreg() or fileobj is None:
+                        return addfile(tarinfo, fileobj)
+                    reader = _HashingReader(fileobj)
+                    addfile(tarinfo, reader)
+                    manifest[tarinfo.name] = {"size": tarinfo.size, "sha256": reader.hasher.hexdigest()}
+                tar.addfile = _addfile
+            if os.path.isfile(output) and append_data_to_existing_tarball:
+                # append new data to existing tarball
+                with tarfile.open(output, "r") as old_tar:
+                    for member in old_tar:
+                        tar.addfile(member, old_tar.extractfile(member) if member.isfile() else None)
+                        existing_filenames.add(member.name)
 
             for filepath, arcpath in zip(filepaths, arcpaths):
                 filename_in_tarball = arcpath if arcpath else filepath
                 # skip files whose name are already in the tarball
                 if filename_in_tarball in existing_filenames:
                     continue
-                tar.add(name=filepath, arcname=arcpath, recursive=True, filter=_filter_pycaches)
-        os.remove(old_tarball_filepath)
+                tar.add(name=filepath, arcname=arcpath, recursive=True, filter=_make_filter(filepath, arcpath))
+            for arcpath, content in members_from_memory.items():
+                if arcpath in existing_filenames:
+                    continue
+                add_bytes_to_tarball(tar, arcpath, content)
+            members = list(tar.members)
+    return members
+
+
+def add_bytes_to_tarball(tar: tarfile.TarFile, arcpath: str, content: bytes):
+    """Adds an in-memory file to an opened tarball."""
+    tarinfo = tarfile.TarInfo(arcpath)
+    tarinfo.size = len(content)
+    tarinfo.mode = 0o644
+    tarinfo.mtime = int(time.time())
+    tar.addfile(tarinfo, io.BytesIO(content))
+
 
+# bodies of small members are read into memory and written by the writer pool, larger ones are streamed to disk
+EXTRACT_STREAM_THRESHOLD = 8 * 1024 * 1024
+EXTRACT_MAX_PENDING_BYTES = 64 * 1024 * 1024
+# small files are handed to the writer pool in batches, so that the pool overhead is paid once per batch
+EXTRACT_BATCH_FILES = 64
+EXTRACT_BATCH_BYTES = 1024 * 1024
 
-def restore_files_from_tarball(tarball_path: str, output_dir: str):
+
+def _is_inside(dest_path: str, path: str) -> bool:
+    return path == dest_path or path.startswith(dest_path + os.sep)
+
+
+def _data_filter(member: tarfile.TarInfo, dest_path: str, resolve_dir) -> tarfile.TarInfo:
+    """
+    Applies the semantics of `tarfile.data_filter` to a member, raising `tarfile.TarError` for refused members.
+    `resolve_dir` is a cached `os.path.realpath` of directories, which is valid as long as no links are created,
+    so that the checks do not resolve every path from the root again.
+    """
+    # leading slashes are stripped, the way `tarfile` does when writing members
+    name = member.name.lstrip("/" + os.sep)
+    if os.path.isabs(name):
+        raise tarfile.TarError(f"'{member.name}' is an absolute path.")
+    if member.isdir():
+        target_path = resolve_dir(os.path.join(dest_path, name))
+    else:
+        dirname, basename = os.path.split(os.path.join(dest_path, name))
+        target_path = os.path.join(resolve_dir(dirname), basename)
+    if not _is_inside(dest_path, target_path) or target_path == dest_path and not member.isdir():
+        raise tarfile.TarError(f"'{member.name}' would be extracted outside of the destination.")
+    if member.issym() or member.islnk():
+        if os.path.isabs(member.linkname):
+            raise tarfile.TarError(f"'{member.name}' links to the absolute path '{member.linkname}'.")
+        link_base = os.path.dirname(target_path) if member.issym() else dest_path
+        if not _is_inside(dest_path, os.path.realpath(os.path.join(link_base, member.linkname))):
+            raise tarfile.TarError(f"'{member.name}' links to '{member.linkname}' outside of the destination.")
+    elif not (member.isfile() or member.isdir()):
+        raise tarfile.TarError(f"'{member.name}' is a special file.")
+    mode = member.mode
+    if member.isfile() or member.islnk():
+        # no setuid, setgid, sticky or group/other write bits, executable only if the owner could execute
+        mode &= 0o755
+        if not mode & 0o100:
+            mode &= ~0o111
+        mode |= 0o600
+    else:
+        mode = None
+    filtered = copy.copy(member)
+    filtered.name = name
+    filtered.mode, filtered.uid, filtered.gid, filtered.uname, filtered.gname = mode, None, None, None, None
+    return filtered
+
+
+# links are extracted by `tarfile` itself, which checks them against the final state of the destination again
+_EXTRACT_KWARGS = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+
+
+def _find_selecting_name(name: str, selected_names: set) -> str:
+    """Returns the selected name which is `name` itself or one of its parent directories, or None."""
+    while name not in selected_names:
+        if "/" not in name:
+            return None
+        name = name.rsplit("/", 1)[0]
+    return name
+
+
+def _read_member(tar: tarfile.TarFile, member: tarfile.TarInfo) -> bytes:
+    if member.sparse is not None:
+        return tar.extractfile(member).read()
+    # the body follows the header which has just been read, so this does not seek backwards in compressed streams
+    tar.fileobj.seek(member.offset_data)
+    data = tar.fileobj.read(member.size)
+    if len(data) != member.size:
+        raise tarfile.ReadError(f"Unexpected end of data of '{member.name}'.")
+    return data
+
+
+def _write_extracted_files(batch: list[tuple]):
+    for member, data, filepath in batch:
+        if os.path.islink(filepath):
+            os.remove(filepath)
+        with open(filepath, "wb") as fout:
+            fout.write(data)
+        os.chmod(filepath, member.mode)
+        os.utime(filepath, (member.mtime, member.mtime))
+
+
+def restore_files_from_tarball(
+    tarball_path: str,
+    output_dir: str,
+    members: list[str] = None,
+    max_workers: int = None,
+    max_pending_bytes: int = EXTRACT_MAX_PENDING_BYTES,
+) -> list[str]:
     """
     Restore files from a tarball archive.
 
+    The tarball is decompressed sequentially on the calling thread, which creates the directories of every member
+    before handing its body to a pool of writer threads, so writers never wait for each other and decompression
+    overlaps with the writes. The bytes held by pending writes are bounded by `max_pending_bytes`.
+    Links are created after all the regular files, and the mode and mtime of directories are set last.
+
+    Members are extracted with the semantics of the `data` extraction filter: absolute paths, paths and links
+    leading outside of `output_dir` and special files are refused with an error, and owners and unsafe mode bits
+    are dropped.
+
     Args:
         tarball_path (str): The path to the tarball archive.
         output_dir (str): The directory where the files will be extracted.
+        members (list[str], optional): Names of the members to restore. A directory name restores everything below it.
+            Defaults to None, i.e., all members.
+        max_workers (int, optional): Number of writer threads. Defaults to the cpu count, at most 16.
+        max_pending_bytes (int, optional): Maximum bytes read into memory but not written yet. Defaults to 64MiB.
 
     Returns:
-        None
+        list[str]: Names of the extracted members.
     """
-    with tarfile.open(tarball_path, "r") as tar:
-        tar.extractall(path=output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    dest_path = os.path.realpath(output_dir)
+    resolve_dir = functools.lru_cache(maxsize=None)(os.path.realpath)
+    selected_names = {name.rstrip("/") for name in members} if members is not None else None
+    found_names = set()
+    created_dirs = {dest_path}
+    extracted_names, directories, links = [], [], []
+    pending = deque()
+    batch, batch_bytes, pending_bytes = [], 0, 0
+
+    def _makedirs(dirpath: str):
+        if dirpath not in created_dirs:
+            os.makedirs(dirpath, exist_ok=True)
+            created_dirs.add(dirpath)
+
+    def _submit_batch():
+        nonlocal batch, batch_bytes, pending_bytes
+        if batch:
+            consume_disk_bandwidth(batch_bytes)
+            pending.append((executor.submit(_write_extracted_files, batch), batch_bytes))
+            pending_bytes += batch_bytes
+            batch, batch_bytes = [], 0
+        while pending_bytes > max_pending_bytes:
+            future, nbytes = pending.popleft()
+            future.result()
+            pending_bytes -= nbytes
+
+    max_workers = max_workers or min(16, os.cpu_count() or 1)
+    with tarfile.open(tarball_path, "r") as tar, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for member in tar:
+            if selected_names is not None:
+                selecting_name = _find_selecting_name(member.name.rstrip("/"), selected_names)
+                if selecting_name is None:
+                    continue
+                found_names.add(selecting_name)
+            member = _data_filter(member, dest_path, resolve_dir)
+            filepath = os.path.join(dest_path, member.name)
+            if member.isdir():
+                _makedirs(filepath)
+                directories.append((member, filepath))
+            elif member.isfile():
+                _makedirs(os.path.dirname(filepath))
+                if member.size > EXTRACT_STREAM_THRESHOLD:
+                    if os.path.islink(filepath):
+                        os.remove(filepath)
+                    with open(filepath, "wb") as fout:
+                        shutil.copyfileobj(tar.extractfile(member), LimitedWriter(fout), 1 << 20)
+                    os.chmod(filepath, member.mode)
+                    os.utime(filepath, (member.mtime, member.mtime))
+                else:
+                    data = _read_member(tar, member)
+                    batch.append((member, data, filepath))
+                    batch_bytes += len(data)
+                    if len(batch) >= EXTRACT_BATCH_FILES or batch_bytes >= EXTRACT_BATCH_BYTES:
+                        _submit_batch()
+            else:
+                # links are created once their targets have been written
+                _makedirs(os.path.dirname(filepath))
+                links.append(member)
+            extracted_names.append(member.name)
+        _submit_batch()
+        for future, _ in pending:
+            future.result()
+
+        for member in links:
+            tar.extract(member, path=dest_path, set_attrs=False, **_EXTRACT_KWARGS)
+
+    # directories are set up deepest first, so that their mtimes are not changed by writing their children
+    for member, dirpath in sorted(directories, key=lambda item: item[1], reverse=True):
+        if member.mode is not None:
+            os.chmod(dirpath, member.mode)
+        os.utime(dirpath, (member.mtime, member.mtime))
+
+    if selected_names is not None and found_names != selected_names:
+        warnings.warn(f"{sorted(selected_names - found_names)} are not found in '{tarball_path}'.")
+    return extracted_names
 
 
 def get_filepaths_in_tarball(tarball_path: str):
@@ -76,3 +326,255 @@ def get_filepaths_in_tarball(tarball_path: str):
         for member in tar.getmembers():
             filepaths.append(member.name)
     return filepaths
+
+
+def get_tarball_manifest(tarball_path: str) -> dict:
+    """
+    Builds a manifest of the regular files inside a tarball.
+
+    Args:
+        tarball_path (str): The path to the tarball archive.
+
+    Returns:
+        dict: A mapping from member name to its size and sha256 content hash.
+    """
+    manifest = {}
+    with tarfile.open(tarball_path, "r") as tar:
+        for member in tar:
+            if member.isfile():
+                manifest[member.name] = {
+                    "size": member.size,
+                    "sha256": hash_fileobj(tar.extractfile(member)),
+                }
+    return manifest
+
+
+def read_members_from_tarball(tarball_path: str, names: list[str]) -> dict:
+    """
+    Reads the content of the given members from a tarball.
+    The tarball is scanned sequentially and the scan stops as soon as all the requested members are found,
+    so only the members before the last requested one are decompressed.
+
+    Args:
+        tarball_path (str): The path to the tarball archive.
+        names (list[str]): Names of the members to read.
+
+    Returns:
+        dict: A mapping from member name to its content. Missing members are omitted.
+    """
+    remaining_names = set(names)
+    contents = {}
+    if not remaining_names:
+        return contents
+    with tarfile.open(tarball_path, "r") as tar:
+        for member in tar:
+            if member.name in remaining_names and member.isfile():
+                contents[member.name] = tar.extractfile(member).read()
+                remaining_names.discard(member.name)
+                if not remaining_names:
+                    break
+    return contents
+
+
+def hash_fileobj(fileobj, chunk_size: int = 1 << 20) -> str:
+    """Computes the sha256 hex digest of a binary file object by reading it in chunks."""
+    hasher = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(chunk_size), b""):
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _member_filepath(dest_path: str, name: str) -> str:
+    """
+    Returns the path of a member inside the (resolved) directory `dest_path`, refusing absolute names and names which
+    lead outside of it, also through symbolic links to directories, with `tarfile.TarError`.
+    """
+    filepath = os.path.join(dest_path, name)
+    dirname, basename = os.path.split(filepath)
+    if os.path.isabs(name) or basename in ("", os.curdir, os.pardir) \
+            or not _is_inside(dest_path, os.path.join(os.path.realpath(dirname), basename)):
+        raise tarfile.TarError(f"'{name}' would be written outside of '{dest_path}'.")
+    return filepath
+
+
+def _is_unchanged(tar: tarfile.TarFile, member: tarfile.TarInfo, filepath: str) -> bool:
+    """Compares a member with its counterpart on disk, the size first and the content hash afterwards."""
+    if member.issym():
+        return os.path.islink(filepath) and os.readlink(filepath) == member.linkname
+    if not member.isfile() or not os.path.isfile(filepath) or os.path.islink(filepath):
+        return False
+    if os.path.getsize(filepath) != member.size:
+        return False
+    with open(filepath, "rb") as fin:
+        return hash_fileobj(fin) == hash_fileobj(tar.extractfile(member))
+
+
+def _write_member(member: tarfile.TarInfo, fileobj, filepath: str):
+    os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+    if os.path.islink(filepath):
+        os.remove(filepath)
+    with open(filepath, "wb") as fout:
+        shutil.copyfileobj(fileobj, fout, 1 << 20)
+    os.chmod(filepath, member.mode & 0o777)
+    os.utime(filepath, (member.mtime, member.mtime))
+
+
+def _read_restore_journal_record(journal_path: str) -> tuple[set, list]:
+    """
+    Reads which paths a restore journal records.
+
+    Returns:
+        tuple: (names of the saved files and links, list of files created by the restore)
+    """
+    saved_names, created_files = set(), []
+    if not os.path.isfile(journal_path):
+        return saved_names, created_files
+    with tarfile.open(journal_path, "r") as tar:
+        for member in tar:
+            if member.name == RESTORE_JOURNAL_MEMBERNAME:
+                created_files = json.load(tar.extractfile(member))["created"]
+            else:
+                saved_names.add(member.name)
+    return saved_names, created_files
+
+
+def _write_restore_journal(journal_path: str, dest_path: str, saved_names: list[str], created_files: list[str]):
+    """
+    Writes a restore journal with the members of the existing journal, and the current version of the files and links
+    `saved_names`. Every member is streamed, none of them is read into memory.
+    """
+    compression = journal_path.endswith(".gz") or journal_path.endswith(".tgz")
+    mode = "w:gz" if compression else "w"
+    kwargs = {"compresslevel": 6} if compression else {}
+    with atomic_open(journal_path, "wb") as fout, tarfile.open(name=journal_path, mode=mode, fileobj=fout, **kwargs) as tar:
+        journal = json.dumps({"created": created_files}, ensure_ascii=False).encode("utf-8")
+        add_bytes_to_tarball(tar, RESTORE_JOURNAL_MEMBERNAME, journal)
+        if os.path.isfile(journal_path):
+            with tarfile.open(journal_path, "r") as old_tar:
+                for member in old_tar:
+                    if member.name != RESTORE_JOURNAL_MEMBERNAME:
+                        tar.addfile(member, old_tar.extractfile(member) if member.isfile() else None)
+        for name in saved_names:
+            tar.add(os.path.join(dest_path, name), arcname=name, recursive=False)
+
+
+def restore_changed_files_from_tarball(
+    tarball_path: str,
+    output_dir: str,
+    journal_path: str = None,
+    excluded_members: list[str] = None,
+):
+    """
+    Restore files from a tarball archive, writing only the files and links that differ from those in `output_dir`.
+
+    Each member is first checked with the semantics of the `data` extraction filter (see `restore_files_from_tarball`),
+    so nothing is written if any of them is refused. Regular files are compared with their counterpart in `output_dir`
+    (size first, then content hash) and symbolic links with their target.
+    If `journal_path` is given, the current version of every file or link that is about to change is saved into a rollback
+    journal before anything is written, and paths that do not exist yet are recorded as created.
+    The journal can be replayed through `replay_restore_journal`.
+    If the journal already exists, new entries are merged into it so that it always records the state before the first restore.
+    Members are streamed, the tarball is decompressed once to compare them and once more to write the changed ones.
+
+    Args:
+        tarball_path (str): The path to the tarball archive.
+        output_dir (str): The directory where the files will be restored.
+        journal_path (str, optional): The path of the rollback journal. Defaults to None, i.e., no journal is kept.
+        excluded_members (list[str], optional): Names of tarball members which should not be restored. Defaults to None.
+
+    Returns:
+        list[str]: Names of the members that have been written.
+
+    Raises:
+        tarfile.TarError: If a member is refused by the `data` filter.
+    """
+    excluded_members = set(excluded_members or [])
+    os.makedirs(output_dir, exist_ok=True)
+    dest_path = os.path.realpath(output_dir)
+    resolve_dir = functools.lru_cache(maxsize=None)(os.path.realpath)
+    changed_names = []
+    with tarfile.open(tarball_path, "r") as tar:
+        for member in tar:
+            if member.name in excluded_members:
+                continue
+            filtered = _data_filter(member, dest_path, resolve_dir)
+            if not filtered.isdir() and not _is_unchanged(tar, filtered, os.path.join(dest_path, filtered.name)):
+                changed_names.append(filtered.name)
+
+    if journal_path is not None and changed_names:
+        saved_names, created_files = _read_restore_journal_record(journal_path)
+        journaled_names = saved_names | set(created_files)
+        new_saved_names = []
+        for name in dict.fromkeys(changed_names):
+            if name in journaled_names:
+                continue
+            filepath = os.path.join(dest_path, name)
+            if os.path.islink(filepath) or os.path.isfile(filepath):
+                new_saved_names.append(name)
+            else:
+                created_files.append(name)
+        _write_restore_journal(journal_path, dest_path, new_saved_names, created_files)
+
+    remaining_names = set(changed_names)
+    with tarfile.open(tarball_path, "r") as tar:
+        for member in tar:
+            if not remaining_names:
+                break
+            if member.name in excluded_members:
+                continue
+            filtered = _data_filter(member, dest_path, resolve_dir)
+            if filtered.name not in remaining_names:
+                continue
+            filepath = os.path.join(dest_path, filtered.name)
+            if filtered.isfile():
+                _write_member(filtered, tar.extractfile(member), filepath)
+            else:
+                os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                if os.path.islink(filepath) or os.path.isfile(filepath):
+                    os.remove(filepath)
+                # links are checked by `tarfile` itself against the final state of the destination again
+                tar.extract(member, path=dest_path, set_attrs=False, **_EXTRACT_KWARGS)
+            remaining_names.discard(filtered.name)
+    return changed_names
+
+
+def replay_restore_journal(journal_path: str, output_dir: str):
+    """
+    Rolls back a restore by replaying its journal: saved files and links are written back and created files are removed.
+    Tarballs without a journal record (i.e., plain tarballs of the current codes) are simply extracted.
+
+    Args:
+        journal_path (str): The path of the rollback journal.
+        output_dir (str): The directory where the restore happened.
+
+    Returns:
+        None
+
+    Raises:
+        tarfile.TarError: If a member of the journal would be written outside of `output_dir`.
+    """
+    with tarfile.open(journal_path, "r") as tar:
+        is_journal = RESTORE_JOURNAL_MEMBERNAME in tar.getnames()
+    if not is_journal:
+        restore_files_from_tarball(journal_path, output_dir)
+        return
+    dest_path = os.path.realpath(output_dir)
+    created_files = []
+    with tarfile.open(journal_path, "r") as tar:
+        for member in tar:
+            if member.name == RESTORE_JOURNAL_MEMBERNAME:
+                created_files = json.load(tar.extractfile(member))["created"]
+                continue
+            filepath = _member_filepath(dest_path, member.name)
+            if member.isfile():
+                _write_member(member, tar.extractfile(member), filepath)
+            elif member.issym():
+                # the links saved from `output_dir` are restored as they were, wherever they point to
+                os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                if os.path.islink(filepath) or os.path.isfile(filepath):
+                    os.remove(filepath)
+                os.symlink(member.linkname, filepath)
+    for filename in created_files:
+        filepath = _member_filepath(dest_path, filename)
+        if os.path.isfile(filepath) or os.path.islink(filepath):
+            os.remove(filepath)
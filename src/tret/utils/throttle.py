@@ -0,0 +1,51 @@
+import time
+import threading
+from typing import Optional
+
+
+class BandwidthThrottle:
+    """
+    Limits the rate of I/O to `max_bytes_per_second` with a token bucket, shared by all the threads using it.
+
+    Args:
+        max_bytes_per_second (float, optional): The maximum rate. Defaults to None, i.e., no limit.
+        burst_seconds (float, optional): How many seconds of unused bandwidth can be saved up. Defaults to 1.
+    """
+    def __init__(self, max_bytes_per_second: Optional[float] = None, burst_seconds: float = 1.0):
+        self.max_bytes_per_second = max_bytes_per_second
+        self.capacity = max_bytes_per_second * burst_seconds if max_bytes_per_second else 0
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, nbytes: int):
+        """Blocks until `nbytes` can be transferred without exceeding the rate."""
+        if not self.max_bytes_per_second:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.max_bytes_per_second)
+            self.last_refill = now
+            self.tokens -= nbytes
+            # tokens may go negative, the debt is paid by sleeping
+            wait = -self.tokens / self.max_bytes_per_second if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+
+class ThrottledReader:
+    """Wraps a binary file object, so that reading from it is limited by a `BandwidthThrottle`."""
+    def __init__(self, fileobj, throttle: BandwidthThrottle):
+        self.fileobj = fileobj
+        self.throttle = throttle
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        self.throttle.consume(len(data))
+        self.bytes_read += len(data)
+        return data
+
+    def readable(self) -> bool:
+        return True
@@ -0,0 +1,95 @@
+import os
+import time
+import pytest
+import asyncio
+import tempfile
+import threading
+from tret import TretArguments, TretWorkspace
+from tret.constants import TRET_ATTRIBUTES_FILENAME, CODES_TARBALL_FILENAME
+from tret.core.async_api import configure_async_io, run_in_io_executor, alist, aread_attributes
+from tret.utils.io_limits import get_io_limits, compression_slot
+
+tempdir_kwargs = {
+    "prefix": "tret-workspace-",
+    "dir": os.path.dirname(__file__),
+}
+
+
+@pytest.fixture
+def project_dir():
+    temp_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    project_dir = os.path.join(temp_dir.name, "project")
+    os.makedirs(os.path.join(project_dir, "dataset"))
+    for i in range(5):
+        with open(os.path.join(project_dir, "dataset", f"sample{i}.json"), "w") as fout:
+            fout.write(f"{{\"id\": {i}}}")
+    yield project_dir
+    temp_dir.cleanup()
+    configure_async_io()
+
+
+def _workspace(project_dir, name):
+    return TretWorkspace(TretArguments(
+        workspace_basedir=os.path.join(project_dir, "tret-workspaces"),
+        workspace_name=name,
+        force_backup_codes_as_tarball=True,
+        use_daemon=False,
+    ))
+
+
+def test_concurrent_backups_within_limits(project_dir, monkeypatch):
+    monkeypatch.chdir(project_dir)
+    configure_async_io(max_workers=3, max_compressions=1, max_git_processes=1)
+    assert get_io_limits()["max_compressions"] == 1
+    workspaces = [_workspace(project_dir, f"run{i}") for i in range(3)]
+
+    async def _backup_all():
+        await asyncio.gather(*[
+            workspace.abackup(datafiles_to_backup_as_tarball=["dataset"], metadata={"run": i})
+            for i, workspace in enumerate(workspaces)
+        ])
+        return await alist(os.path.join(project_dir, "tret-workspaces")), await aread_attributes(workspaces[1].workspace_dir)
+
+    listed, attributes = asyncio.run(_backup_all())
+    assert sorted(workspace["name"] for workspace in listed) == ["run0", "run1", "run2"]
+    assert all(workspace["complete"] for workspace in listed)
+    assert attributes["metadata"] == {"run": 1}
+    assert os.path.isfile(os.path.join(workspaces[0].workspace_dir, CODES_TARBALL_FILENAME))
+
+
+def test_cancelled_backup_is_not_recorded(project_dir, monkeypatch):
+    monkeypatch.chdir(project_dir)
+    configure_async_io(max_compressions=1)
+    workspace = _workspace(project_dir, "cancelled")
+
+    async def _cancel_backup():
+        task = asyncio.create_task(workspace.abackup(datafiles_to_backup_as_tarball=["dataset"]))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    # the only compression slot is taken, so the backup waits for it until it is cancelled
+    with compression_slot():
+        asyncio.run(_cancel_backup())
+    assert not os.path.exists(os.path.join(workspace.workspace_dir, TRET_ATTRIBUTES_FILENAME))
+    assert not [filename for filename in os.listdir(workspace.workspace_dir) if filename.endswith(".tmp")]
+
+
+def test_cancelled_queued_operation_never_runs(project_dir):
+    configure_async_io(max_workers=1)
+    release, calls = threading.Event(), []
+
+    async def _cancel_queued():
+        blocking = asyncio.ensure_future(run_in_io_executor(release.wait))
+        queued = asyncio.ensure_future(run_in_io_executor(calls.append, "queued"))
+        await asyncio.sleep(0.05)
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        release.set()
+        await blocking
+
+    asyncio.run(_cancel_queued())
+    time.sleep(0.05)
+    assert calls == []
@@ -0,0 +1,151 @@
+import os
+import json
+import pytest
+import tempfile
+import subprocess
+from tret.core import bundle
+from tret.core.bundle import export_bundle, import_bundle
+from tret.core.data_backup import backup_data
+from tret.core.chunk_store import restore_files_from_chunks, get_chunk_store_dir
+from tret.constants import (
+    TRET_ATTRIBUTES_FILENAME,
+    GIT_INFO_FILENAME,
+    GIT_REPO_PATH_KEYNAME,
+    GIT_COMMIT_HASH_KEYNAME,
+    GIT_DIFF_INFO_KEYNAME,
+)
+
+tempdir_kwargs = {
+    "prefix": "tret-workspace-",
+    "dir": os.path.dirname(__file__),
+}
+
+
+def _git(repo_dir, *args):
+    return subprocess.run(
+        ["git", "-c", "user.name=tret", "-c", "user.email=tret@example.com", *args],
+        cwd=repo_dir, check=True, stdout=subprocess.PIPE,
+    ).stdout.decode("utf-8").strip()
+
+
+@pytest.fixture
+def temp_dir():
+    temp_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    yield temp_dir.name
+    temp_dir.cleanup()
+
+
+@pytest.fixture
+def workspace_dirs(temp_dir):
+    repo_dir = os.path.join(temp_dir, "repo")
+    os.makedirs(repo_dir)
+    _git(repo_dir, "init", "-q")
+    with open(os.path.join(repo_dir, "main.py"), "w") as fout:
+        fout.write("print('main')\n")
+    _git(repo_dir, "add", ".")
+    _git(repo_dir, "commit", "-q", "-m", "snapshot")
+    commit_hash = _git(repo_dir, "rev-parse", "HEAD")
+
+    with open(os.path.join(temp_dir, "weights.bin"), "wb") as fout:
+        fout.write(os.urandom(3 * 1024 * 1024))
+    basedir = os.path.join(temp_dir, "workspaces")
+    workspace_dirs = []
+    for name in ["run-a", "run-b"]:
+        workspace_dir = os.path.join(basedir, name)
+        os.makedirs(workspace_dir)
+        with open(os.path.join(workspace_dir, GIT_INFO_FILENAME), "w", encoding="utf-8") as fout:
+            json.dump({
+                GIT_REPO_PATH_KEYNAME: os.path.join(repo_dir, ".git"),
+                GIT_COMMIT_HASH_KEYNAME: commit_hash,
+                GIT_DIFF_INFO_KEYNAME: "",
+            }, fout)
+        with open(os.path.join(workspace_dir, "tret-requirements.txt"), "w") as fout:
+            fout.write("numpy==2.0.0")
+        manifest = backup_data(
+            workspace_dir,
+            files_to_backup_as_chunks=[os.path.join(temp_dir, "weights.bin")],
+            files_to_backup_as_symlink=[os.path.join(temp_dir, "weights.bin")],
+        )
+        with open(os.path.join(workspace_dir, TRET_ATTRIBUTES_FILENAME), "w", encoding="utf-8") as fout:
+            json.dump({"manifest": {"codes": {}, "data": manifest}, "metadata": {"name": name}}, fout)
+        workspace_dirs.append(workspace_dir)
+    return workspace_dirs
+
+
+def test_export_and_import_bundle(workspace_dirs, temp_dir):
+    bundle_filepath = os.path.join(temp_dir, "runs.tret")
+    report = export_bundle(workspace_dirs, bundle_filepath)
+    assert report["workspaces"] == ["run-a", "run-b"] and report["reused_bytes"] == 0
+    assert not os.path.exists(f"{bundle_filepath}.partial")
+    # chunks referenced by both workspaces and identical files are only stored once
+    assert os.path.getsize(bundle_filepath) < 4 * 1024 * 1024
+
+    # the commit has never been pushed anywhere, it is only available through the bundle
+    clone_dir = os.path.join(temp_dir, "clone")
+    os.makedirs(clone_dir)
+    _git(clone_dir, "init", "-q")
+    basedir = os.path.join(temp_dir, "imported")
+    os.makedirs(basedir)
+    report = import_bundle(bundle_filepath, basedir, git_repo=clone_dir)
+    assert report["complete"] and sorted(os.listdir(basedir)) == [".tret-chunks", "run-a", "run-b"]
+
+    gitinfo = json.load(open(os.path.join(basedir, "run-a", GIT_INFO_FILENAME), "r", encoding="utf-8"))
+    assert gitinfo[GIT_REPO_PATH_KEYNAME] == os.path.join(clone_dir, ".git")
+    assert _git(clone_dir, "cat-file", "-t", gitinfo[GIT_COMMIT_HASH_KEYNAME]) == "commit"
+    assert os.path.samefile(
+        os.path.join(basedir, "run-a", "tret-requirements.txt"), os.path.join(basedir, "run-b", "tret-requirements.txt")
+    )
+    assert os.readlink(os.path.join(basedir, "run-b", "data", "symlinks", "weights.bin")) == os.path.join(temp_dir, "weights.bin")
+    restored_dir = os.path.join(temp_dir, "restored")
+    imported_workspace_dir = os.path.join(basedir, "run-b")
+    restore_files_from_chunks(os.path.join(imported_workspace_dir, "data"), get_chunk_store_dir(imported_workspace_dir), restored_dir)
+    with open(os.path.join(restored_dir, "weights.bin"), "rb") as fin, open(os.path.join(temp_dir, "weights.bin"), "rb") as fin_original:
+        assert fin.read() == fin_original.read()
+
+    with pytest.raises(FileExistsError):
+        import_bundle(bundle_filepath, basedir)
+
+
+def test_resume_export_and_import(workspace_dirs, temp_dir, monkeypatch):
+    monkeypatch.setattr(bundle, "BUNDLE_BLOCK_SIZE", 64 * 1024)
+    bundle_filepath = os.path.join(temp_dir, "runs.tret")
+    export_bundle(workspace_dirs, bundle_filepath)
+    with open(bundle_filepath, "rb") as fin:
+        content = fin.read()
+
+    # an interrupted export keeps the frames written so far
+    with open(f"{bundle_filepath}.partial", "wb") as fout:
+        fout.write(content[:len(content) // 2])
+    report = export_bundle(workspace_dirs, bundle_filepath)
+    assert 0 < report["reused_bytes"] < len(content) // 2
+    with open(bundle_filepath, "rb") as fin:
+        assert fin.read() == content
+
+    # a partly transferred bundle is imported up to its last complete item, and resumed from there
+    partial_filepath = os.path.join(temp_dir, "transferred.tret")
+    with open(partial_filepath, "wb") as fout:
+        fout.write(content[:len(content) * 2 // 3])
+    basedir = os.path.join(temp_dir, "imported")
+    os.makedirs(basedir)
+    report = import_bundle(partial_filepath, basedir)
+    assert not report["complete"] and 0 < report["offset"] < len(content) * 2 // 3
+    assert [name for name in os.listdir(basedir) if not name.startswith(".tret-")] == []
+    with open(partial_filepath, "wb") as fout:
+        fout.write(content)
+    assert import_bundle(partial_filepath, basedir)["complete"]
+    assert sorted(os.listdir(basedir)) == [".tret-chunks", "run-a", "run-b"]
+
+
+def test_import_rejects_corrupted_bundle(workspace_dirs, temp_dir):
+    bundle_filepath = os.path.join(temp_dir, "runs.tret")
+    export_bundle(workspace_dirs[:1], bundle_filepath)
+    with open(bundle_filepath, "r+b") as fout:
+        fout.seek(os.path.getsize(bundle_filepath) // 2)
+        byte = fout.read(1)
+        fout.seek(-1, os.SEEK_CUR)
+        fout.write(bytes([byte[0] ^ 0xFF]))
+    basedir = os.path.join(temp_dir, "imported")
+    os.makedirs(basedir)
+    with pytest.raises(ValueError, match="corrupted"):
+        import_bundle(bundle_filepath, basedir)
+    assert not os.path.exists(os.path.join(basedir, "run-a"))
@@ -0,0 +1,96 @@
+import io
+import os
+import sys
+import time
+import pytest
+import tarfile
+import tempfile
+import importlib
+import importlib.util
+from tret.utils.bytecode_utils import (
+    PYC_FLAGS_CHECKED_HASH,
+    build_hash_based_pyc,
+    create_bytecode_tarball,
+    restore_bytecode_from_tarball,
+    precompile_files,
+    remove_orphan_bytecode,
+)
+
+tempdir_kwargs = {
+    "prefix": "tret-workspace-",
+    "dir": os.path.dirname(__file__),
+}
+
+
+@pytest.fixture
+def package_dir():
+    temp_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    package_dir = os.path.join(temp_dir.name, "bytecode_package")
+    os.makedirs(package_dir)
+    for name, content in [("__init__.py", ""), ("first.py", "VALUE = 1\n"), ("second.py", "def f():\n    return 2\n")]:
+        with open(os.path.join(package_dir, name), "w") as fout:
+            fout.write(content)
+    yield package_dir
+    temp_dir.cleanup()
+    for name in [name for name in sys.modules if name.startswith("bytecode_package")]:
+        del sys.modules[name]
+
+
+def test_hash_based_pycs_survive_restores(package_dir):
+    source_filepaths = [os.path.join(package_dir, name) for name in ["__init__.py", "first.py", "second.py"]]
+    working_directory = os.path.dirname(package_dir)
+    tarball_filepath = os.path.join(working_directory, "bytecode.tar.gz")
+    names = create_bytecode_tarball(source_filepaths, tarball_filepath, working_directory)
+    assert names[1] == os.path.join("bytecode_package", "__pycache__", f"first.{sys.implementation.cache_tag}.pyc")
+    assert int.from_bytes(build_hash_based_pyc(source_filepaths[1])[4:8], "little") == PYC_FLAGS_CHECKED_HASH
+
+    # restored sources get new mtimes, which do not invalidate hash-based pycs
+    future = time.time() + 1000
+    for source_filepath in source_filepaths:
+        os.utime(source_filepath, (future, future))
+    with open(source_filepaths[2], "w") as fout:
+        fout.write("def f():\n    return 3\n")
+    assert len(restore_bytecode_from_tarball(tarball_filepath, working_directory)) == 3
+    pyc_filepath = importlib.util.cache_from_source(source_filepaths[1])
+    restored_pyc = open(pyc_filepath, "rb").read()
+
+    sys.path.insert(0, working_directory)
+    try:
+        assert importlib.import_module("bytecode_package.first").VALUE == 1
+        # the pyc of a changed source is not used
+        assert importlib.import_module("bytecode_package.second").f() == 3
+    finally:
+        sys.path.remove(working_directory)
+    assert open(pyc_filepath, "rb").read() == restored_pyc
+
+
+@pytest.mark.parametrize("member_name", ["../outside/__pycache__/module.{}.pyc", "/outside/__pycache__/module.{}.pyc"])
+def test_restore_refuses_pycs_outside_of_output_dir(package_dir, member_name):
+    member_name = member_name.format(sys.implementation.cache_tag)
+    working_directory = os.path.dirname(package_dir)
+    tarball_filepath = os.path.join(working_directory, "bytecode.tar.gz")
+    # sources outside of the working directory are not backed up
+    with tempfile.TemporaryDirectory(**tempdir_kwargs) as outside_dir:
+        with open(os.path.join(outside_dir, "module.py"), "w") as fout:
+            fout.write("VALUE = 1\n")
+        assert create_bytecode_tarball([os.path.join(outside_dir, "module.py")], tarball_filepath, working_directory) == []
+
+    pyc = build_hash_based_pyc(os.path.join(package_dir, "first.py"))
+    with tarfile.open(tarball_filepath, "w:gz") as tar:
+        tarinfo = tarfile.TarInfo(member_name)
+        tarinfo.size = len(pyc)
+        tar.addfile(tarinfo, io.BytesIO(pyc))
+    with pytest.raises(tarfile.TarError):
+        restore_bytecode_from_tarball(tarball_filepath, working_directory)
+    assert not os.path.exists(os.path.join(os.path.dirname(working_directory), "outside"))
+
+
+def test_precompile_and_remove_orphans(package_dir):
+    source_filepaths = [os.path.join(package_dir, name) for name in ["first.py", "second.py"]]
+    assert precompile_files(source_filepaths, max_workers=2) == 2
+    assert all(os.path.isfile(importlib.util.cache_from_source(filepath)) for filepath in source_filepaths)
+
+    os.remove(source_filepaths[1])
+    removed = remove_orphan_bytecode([package_dir])
+    assert removed == [importlib.util.cache_from_source(source_filepaths[1])]
+    assert os.path.isfile(importlib.util.cache_from_source(source_filepaths[0]))
@@ -0,0 +1,75 @@
+import io
+import os
+import random
+import pytest
+import tempfile
+from tret.core import chunk_store
+from tret.core.chunk_store import (
+    iter_chunks,
+    backup_files_as_chunks,
+    restore_files_from_chunks,
+)
+
+tempdir_kwargs = {
+    "prefix": "tret-workspace-",
+    "dir": os.path.dirname(__file__),
+}
+
+
+@pytest.fixture
+def temp_workspace():
+    temp_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    yield temp_dir.name
+    temp_dir.cleanup()
+
+
+def _random_bytes(size: int, seed: int = 0) -> bytes:
+    return random.Random(seed).randbytes(size)
+
+
+def test_numpy_and_python_candidates_are_identical():
+    pytest.importorskip("numpy")
+    data = _random_bytes(1 << 20)
+    window = chunk_store.CHUNK_HASH_WINDOW
+    assert chunk_store._find_candidates_numpy(data, window) == chunk_store._find_candidates_python(data, window)
+
+
+def test_iter_chunks_is_content_defined():
+    data = _random_bytes(12 << 20)
+    chunks = list(iter_chunks(io.BytesIO(data), read_size=chunk_store.CHUNK_MAX_SIZE))
+    assert b"".join(chunks) == data
+    assert all(len(chunk) <= chunk_store.CHUNK_MAX_SIZE for chunk in chunks)
+    # boundaries do not depend on how the stream is read
+    assert chunks == list(iter_chunks(io.BytesIO(data)))
+
+    edited = data[:6 << 20] + b"inserted bytes" + data[6 << 20:]
+    edited_chunks = list(iter_chunks(io.BytesIO(edited)))
+    assert len(set(chunks) & set(edited_chunks)) >= len(chunks) - 2
+
+
+def test_backup_and_restore_files_as_chunks(temp_workspace):
+    chunk_store_dir = os.path.join(temp_workspace, ".tret-chunks")
+    source_filepath = os.path.join(temp_workspace, "log.jsonl")
+    data = _random_bytes(8 << 20)
+    with open(source_filepath, "wb") as fout:
+        fout.write(data)
+
+    first_data_dir = os.path.join(temp_workspace, "ws1", "data")
+    recipes = backup_files_as_chunks([source_filepath], first_data_dir, chunk_store_dir)
+    num_chunks = sum(len(filenames) for _, _, filenames in os.walk(chunk_store_dir))
+    assert num_chunks == len(recipes["log.jsonl"]["chunks"])
+
+    with open(source_filepath, "ab") as fout:
+        fout.write(b"appended line\n")
+    second_data_dir = os.path.join(temp_workspace, "ws2", "data")
+    backup_files_as_chunks([source_filepath], second_data_dir, chunk_store_dir)
+    num_new_chunks = sum(len(filenames) for _, _, filenames in os.walk(chunk_store_dir)) - num_chunks
+    assert num_new_chunks <= 1
+
+    restore_dir = os.path.join(temp_workspace, "restored")
+    restore_files_from_chunks(first_data_dir, chunk_store_dir, restore_dir)
+    with open(os.path.join(restore_dir, "log.jsonl"), "rb") as fin:
+        assert fin.read() == data
+    restore_files_from_chunks(second_data_dir, chunk_store_dir, restore_dir)
+    with open(os.path.join(restore_dir, "log.jsonl"), "rb") as fin:
+        assert fin.read() == data + b"appended line\n"
@@ -1,19 +1,23 @@
 import os
+import sys
 import shutil
 import pytest
 import tempfile
 import importlib
+import importlib.util
 from git import Repo
 from tret.core.code_backup_and_restore import (
     backup_codes,
     restore_codes,
-    get_git_repo_path,
     _start_point_for_finding_git_repo,
 )
 from tret.constants import (
     CODES_TARBALL_FILENAME,
+    CURRENT_CODES_TARBALL_FILENAME,
     GIT_INFO_FILENAME,
+    BYTECODE_TARBALL_FILENAME_TEMPLATE,
 )
+from tret.utils.tarball_utils import replay_restore_journal
 
 tempdir_kwargs = {
     "prefix": "tret-workspace-",
@@ -21,10 +25,6 @@ tempdir_kwargs = {
 }
 
 
-def test_get_git_repo_path_None():
-    assert get_git_repo_path("/") is None
-
-
 def test_start_point_for_finding_git_repo():
     assert _start_point_for_finding_git_repo("/") == os.getcwd()
 
@@ -174,3 +174,59 @@ def test_backup_and_restore_additional_files(temp_workspace, temp_local_module):
 
     with open(additional_file, "r", encoding="utf-8") as fin:
         assert fin.read() == "print('Additional file')"
+
+
+def test_restore_codes_journal_rollback(temp_workspace, temp_local_module):
+    workspace_dir = temp_workspace
+
+    with open(os.path.join(temp_local_module, "__init__.py"), "w", encoding="utf-8") as fout:
+        fout.close()
+
+    test_file = os.path.join(temp_local_module, "test_file.py")
+    with open(test_file, "w", encoding="utf-8") as fout:
+        fout.write("print('Hello, World!')")
+
+    backup_codes(workspace_dir, additional_codefiles_to_backup=[test_file], backup_codes_as_tarball=True)
+    with open(test_file, "w", encoding="utf-8") as fout:
+        fout.write("print('Hello, Universe!')")
+
+    restore_codes(workspace_dir)
+    with open(test_file, "r", encoding="utf-8") as fin:
+        assert fin.read() == "print('Hello, World!')"
+    assert not os.path.isfile(os.path.join(os.getcwd(), "tret-requirements.txt"))
+
+    replay_restore_journal(os.path.join(workspace_dir, CURRENT_CODES_TARBALL_FILENAME), output_dir=os.getcwd())
+    with open(test_file, "r", encoding="utf-8") as fin:
+        assert fin.read() == "print('Hello, Universe!')"
+
+
+def test_restore_codes_with_bytecode(temp_workspace, temp_local_module):
+    workspace_dir = temp_workspace
+
+    with open(os.path.join(temp_local_module, "__init__.py"), "w", encoding="utf-8") as fout:
+        fout.close()
+
+    test_file = os.path.join(temp_local_module, "bytecode_file.py")
+    with open(test_file, "w", encoding="utf-8") as fout:
+        fout.write("VALUE = 1\n")
+
+    backup_codes(workspace_dir, additional_codefiles_to_backup=[test_file], backup_codes_as_tarball=True, backup_bytecode=True)
+    bytecode_tarball_filepath = os.path.join(
+        workspace_dir, BYTECODE_TARBALL_FILENAME_TEMPLATE.format(cache_tag=sys.implementation.cache_tag)
+    )
+    assert os.path.isfile(bytecode_tarball_filepath)
+
+    # a pyc whose module has been removed since is an orphan
+    orphan_pyc = importlib.util.cache_from_source(os.path.join(temp_local_module, "removed_file.py"))
+    os.makedirs(os.path.dirname(orphan_pyc), exist_ok=True)
+    with open(orphan_pyc, "wb") as fout:
+        fout.write(b"")
+    pyc_filepath = importlib.util.cache_from_source(test_file)
+    if os.path.exists(pyc_filepath):
+        os.remove(pyc_filepath)
+
+    restore_codes(workspace_dir, bytecode="reuse")
+    assert not os.path.exists(orphan_pyc)
+    with open(pyc_filepath, "rb") as fin:
+        # checked hash-based pyc
+        assert fin.read()[4:8] == b"\x03\x00\x00\x00"
@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+import stat
+import pytest
+import socket
+import tarfile
+import tempfile
+import subprocess
+import tret
+from tret.core.daemon import (
+    request_daemon,
+    stop_daemon,
+    describe_modules,
+    _peer_uid,
+)
+from tret.constants import (
+    CODES_TARBALL_FILENAME,
+    REQUIREMENTS_TXT_FILENAME,
+)
+
+tempdir_kwargs = {
+    "prefix": "tret-workspace-",
+    "dir": os.path.dirname(__file__),
+}
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="The tret daemon requires `fork`.")
+
+
+@pytest.fixture
+def temp_dir():
+    temp_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    yield temp_dir.name
+    temp_dir.cleanup()
+
+
+@pytest.fixture
+def running_daemon(temp_dir):
+    socket_path = os.path.join(temp_dir, "daemon.sock")
+    environment = {**os.environ, "PYTHONPATH": os.path.dirname(os.path.dirname(tret.__file__))}
+    process = subprocess.Popen([
+        sys.executable, "-c",
+        f"from tret.core.daemon import TretDaemon; TretDaemon(socket_path={socket_path!r}, max_workers=2).serve_forever()",
+    ], env=environment)
+    deadline = time.monotonic() + 30
+    while request_daemon({"op": "ping"}, socket_path=socket_path) is None:
+        assert process.poll() is None and time.monotonic() < deadline, "The daemon failed to start."
+        time.sleep(0.1)
+    yield socket_path
+    if process.poll() is None:
+        process.terminate()
+    process.wait(timeout=30)
+
+
+def test_no_daemon(temp_dir):
+    assert request_daemon({"op": "ping"}, socket_path=os.path.join(temp_dir, "missing.sock")) is None
+
+
+def test_daemon_is_only_accessible_to_its_user(running_daemon):
+    assert stat.S_IMODE(os.stat(running_daemon).st_mode) == 0o600
+    client, server = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    with client, server:
+        assert _peer_uid(server) in (os.getuid(), None)
+
+
+def test_backup_through_daemon(running_daemon, temp_dir):
+    code_filepath = os.path.join(temp_dir, "experiment.py")
+    with open(code_filepath, "w") as fout:
+        fout.write("print('hello')\n")
+    workspace_dir = os.path.join(temp_dir, "workspace")
+    os.makedirs(workspace_dir)
+
+    response = request_daemon({
+        "op": "backup",
+        "workspace_dir": workspace_dir,
+        "workspace_basedir": temp_dir,
+        "additional_codefiles_to_backup": [code_filepath],
+        "backup_codes_as_tarball": True,
+        "modules": describe_modules(),
+        "data_arguments": {"files_to_backup": [code_filepath]},
+    }, socket_path=running_daemon)
+    with tarfile.open(os.path.join(workspace_dir, CODES_TARBALL_FILENAME), "r") as tar:
+        names = tar.getnames()
+    relpath = os.path.relpath(code_filepath, os.getcwd())
+    assert relpath in names and REQUIREMENTS_TXT_FILENAME in names
+    assert relpath in response["result"]["codes"]
+    assert "experiment.py" in response["result"]["data"]["files"]
+
+    # errors of the worker are raised in the client
+    with pytest.raises(FileNotFoundError):
+        request_daemon({
+            "op": "backup",
+            "workspace_dir": workspace_dir,
+            "workspace_basedir": temp_dir,
+            "backup_codes_as_tarball": True,
+            "modules": [],
+            "data_arguments": {"files_to_backup": [os.path.join(temp_dir, "missing.bin")]},
+        }, socket_path=running_daemon)
+
+    assert stop_daemon(running_daemon)
+    assert not os.path.exists(running_daemon)
@@ -1,7 +1,7 @@
 import os
 import pytest
 import tempfile
-from unittest.mock import patch
+from unittest.mock import ANY, patch
 from tret.core.data_backup import backup_data
 from tret.constants import DATA_TARBALL_FILENAME
 
@@ -59,6 +59,8 @@ def test_backup_data_files_to_backup_as_tarball(temp_workspace):
             filepaths=[test_file],
             output=data_tarball_filepath,
             append_data_to_existing_tarball=True,
+            ignore_matcher=ANY,
+            manifest={},
         )
 
 
@@ -0,0 +1,101 @@
+import io
+import os
+import json
+import pytest
+import tarfile
+import tempfile
+from tret.core.data_backup import backup_data
+from tret.core.data_restore import restore_data
+from tret.constants import TRET_ATTRIBUTES_FILENAME, DATA_TARBALL_FILENAME
+
+tempdir_kwargs = {
+    "prefix": "tret-workspace-",
+    "dir": os.path.dirname(__file__),
+}
+
+
+@pytest.fixture
+def temp_dir():
+    temp_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    yield temp_dir.name
+    temp_dir.cleanup()
+
+
+@pytest.fixture
+def workspace_dir(temp_dir):
+    source_dir = os.path.join(temp_dir, "source")
+    os.makedirs(os.path.join(source_dir, "dataset", "split"))
+    for relpath, content in [("dataset/split/train.txt", "train"), ("config.json", "{}"), ("archive.txt", "archived" * 100),
+                             ("linked.bin", "linked"), ("chunked.bin", "chunked" * 1000)]:
+        with open(os.path.join(source_dir, relpath), "w") as fout:
+            fout.write(content)
+
+    workspace_dir = os.path.join(temp_dir, "workspace")
+    os.makedirs(workspace_dir)
+    cwd = os.getcwd()
+    os.chdir(source_dir)
+    try:
+        manifest = backup_data(
+            workspace_dir,
+            files_to_backup=[os.path.join(source_dir, "dataset"), os.path.join(source_dir, "config.json")],
+            files_to_backup_as_tarball=["archive.txt"],
+            files_to_backup_as_symlink=[os.path.join(source_dir, "linked.bin")],
+            files_to_backup_as_chunks=[os.path.join(source_dir, "chunked.bin")],
+        )
+    finally:
+        os.chdir(cwd)
+    with open(os.path.join(workspace_dir, TRET_ATTRIBUTES_FILENAME), "w", encoding="utf-8") as fout:
+        json.dump({"manifest": {"codes": {}, "data": manifest}}, fout)
+    return workspace_dir
+
+
+def test_restore_data_through_hardlinks(workspace_dir, temp_dir):
+    target_dir = os.path.join(temp_dir, "target")
+    restored = restore_data(workspace_dir, target_dir)
+    assert sorted(restored["files"]) == ["config.json", os.path.join("dataset", "split", "train.txt")]
+    assert restored["symlinks"] == ["linked.bin"] and restored["tarball"] == ["archive.txt"] and restored["chunks"] == ["chunked.bin"]
+
+    train_filepath = os.path.join(target_dir, "dataset", "split", "train.txt")
+    assert os.path.samefile(train_filepath, os.path.join(workspace_dir, "data", "dataset", "split", "train.txt"))
+    assert os.readlink(os.path.join(target_dir, "linked.bin")) == os.path.join(temp_dir, "source", "linked.bin")
+    with open(os.path.join(target_dir, "archive.txt")) as fin:
+        assert fin.read() == "archived" * 100
+    with open(os.path.join(target_dir, "chunked.bin")) as fin:
+        assert fin.read() == "chunked" * 1000
+
+    # existing files are never overwritten unless asked, and nothing is written before the conflicts are found
+    os.remove(train_filepath)
+    with pytest.raises(FileExistsError):
+        restore_data(workspace_dir, target_dir, mode="copy")
+    assert not os.path.exists(train_filepath)
+    restore_data(workspace_dir, target_dir, mode="copy", overwrite=True)
+    assert not os.path.samefile(train_filepath, os.path.join(workspace_dir, "data", "dataset", "split", "train.txt"))
+
+
+def test_restore_data_extract_and_verify(workspace_dir, temp_dir):
+    restored = restore_data(workspace_dir, os.path.join(temp_dir, "extracted"), mode="extract")
+    assert restored["files"] == [] and restored["symlinks"] == []
+    assert sorted(os.listdir(os.path.join(temp_dir, "extracted"))) == ["archive.txt", "chunked.bin"]
+
+    # a backed up file which has been changed since its size was recorded
+    with open(os.path.join(workspace_dir, "data", "config.json"), "w") as fout:
+        fout.write("{\"changed\": true}")
+    with pytest.raises(ValueError, match="config.json"):
+        restore_data(workspace_dir, os.path.join(temp_dir, "verified"))
+
+
+def test_restore_data_verifies_hashes(workspace_dir, temp_dir):
+    manifest = json.load(open(os.path.join(workspace_dir, TRET_ATTRIBUTES_FILENAME), "r", encoding="utf-8"))["manifest"]["data"]
+    assert manifest["files"]["config.json"]["sha256"] and manifest["tarball"]["archive.txt"]["sha256"]
+
+    # corruptions which keep the sizes of a copied file and of a tarball member
+    with open(os.path.join(workspace_dir, "data", "config.json"), "w") as fout:
+        fout.write("[]")
+    content = b"corrupted" * 88 + b"xxxxxxxx"
+    with tarfile.open(os.path.join(workspace_dir, "data", DATA_TARBALL_FILENAME), "w:gz") as tar:
+        tarinfo = tarfile.TarInfo("archive.txt")
+        tarinfo.size = len(content)
+        tar.addfile(tarinfo, io.BytesIO(content))
+    with pytest.raises(ValueError) as excinfo:
+        restore_data(workspace_dir, os.path.join(temp_dir, "verified"), mode="copy")
+    assert "config.json" in str(excinfo.value) and "archive.txt" in str(excinfo.value)
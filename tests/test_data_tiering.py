@@ -0,0 +1,89 @@
+import os
+import gzip
+import pytest
+import tempfile
+from tret.core.data_tiering import (
+    TieringPolicy,
+    classify_datafile,
+    plan_data_tiering,
+    TIER_COPY,
+    TIER_TARBALL,
+    TIER_CHUNKS,
+    TIER_SYMLINK,
+)
+from tret.core.data_backup import backup_data
+
+tempdir_kwargs = {
+    "prefix": "tret-workspace-",
+    "dir": os.path.dirname(__file__),
+}
+
+
+@pytest.fixture
+def temp_dir():
+    temp_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    yield temp_dir.name
+    temp_dir.cleanup()
+
+
+def _write(dirname, filename, content):
+    filepath = os.path.join(dirname, filename)
+    with open(filepath, "wb") as fout:
+        fout.write(content)
+    return filepath
+
+
+def test_classify_datafile(temp_dir):
+    policy = TieringPolicy(symlink_min_size=4 * 1024 * 1024, chunks_min_size=1024 * 1024)
+    text_filepath = _write(temp_dir, "metrics.csv", b"step,loss\n" * 10000)
+    random_filepath = _write(temp_dir, "weights.bin", os.urandom(200 * 1024))
+    gzip_filepath = _write(temp_dir, "logs.gz", gzip.compress(b"log line\n" * 1000))
+    large_filepath = _write(temp_dir, "shard.bin", b"x" * 2 * 1024 * 1024)
+    huge_filepath = _write(temp_dir, "dataset.bin", b"x" * 4 * 1024 * 1024)
+
+    assert classify_datafile(text_filepath, policy)["tier"] == TIER_TARBALL
+    random_classification = classify_datafile(random_filepath, policy)
+    assert random_classification["tier"] == TIER_COPY
+    assert "incompressible" in random_classification["reason"]
+    gzip_classification = classify_datafile(gzip_filepath, policy)
+    assert gzip_classification["tier"] == TIER_COPY
+    assert "gzip" in gzip_classification["reason"]
+    assert classify_datafile(large_filepath, policy)["tier"] == TIER_CHUNKS
+    assert classify_datafile(huge_filepath, policy)["tier"] == TIER_SYMLINK
+
+    plan = plan_data_tiering([text_filepath, random_filepath], policy)
+    # copying incompressible data saves the time gzip would spend on it
+    assert plan["estimate"]["seconds_saved"] > 0
+    assert plan["estimate"]["bytes"] >= plan["estimate"]["naive_bytes"] - 1
+
+
+def test_backup_data_auto(temp_dir):
+    data_dir = os.path.join(temp_dir, "inputs")
+    os.makedirs(data_dir)
+    text_filepath = _write(data_dir, "metrics.csv", b"step,loss\n" * 10000)
+    random_filepath = _write(data_dir, "weights.bin", os.urandom(200 * 1024))
+    workspace_dir = os.path.join(temp_dir, "ws")
+
+    manifest = backup_data(workspace_dir, files_to_backup_auto=[text_filepath, random_filepath])
+    assert any(name.endswith("metrics.csv") for name in manifest["tarball"])
+    assert "weights.bin" in manifest["files"]
+    assert manifest["auto"]["paths"][random_filepath]["tier"] == TIER_COPY
+    assert manifest["auto"]["paths"][text_filepath]["reason"].startswith("compressible")
+
+
+def test_backup_data_auto_links_relative_paths(temp_dir, monkeypatch, capsys):
+    monkeypatch.chdir(temp_dir)
+    _write(temp_dir, "dataset.bin", b"x" * 1024 * 1024)
+    workspace_dir = os.path.join(temp_dir, "ws")
+
+    manifest = backup_data(
+        workspace_dir, files_to_backup_auto=["dataset.bin"],
+        tiering_policy=TieringPolicy(symlink_min_size=1024 * 1024, chunks_min_size=512 * 1024),
+    )
+    link_filepath = os.path.join(workspace_dir, "data", "symlinks", "dataset.bin")
+    assert manifest["auto"]["paths"]["dataset.bin"]["tier"] == TIER_SYMLINK
+    assert os.readlink(link_filepath) == os.path.join(temp_dir, "dataset.bin")
+    assert os.path.getsize(link_filepath) == 1024 * 1024
+    # the estimate is recorded in the manifest instead of being printed into the output of the experiment
+    assert manifest["auto"]["estimate"]["seconds_saved"] >= 0
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,63 @@
+import os
+import zipfile
+import pytest
+import tempfile
+import subprocess
+import importlib.metadata
+from tret.core.environment import (
+    read_workspace_requirements,
+    repack_installed_distribution,
+    add_requirements_to_wheelhouse,
+    build_environment,
+)
+from tret.constants import REQUIREMENTS_TXT_FILENAME
+
+tempdir_kwargs = {
+    "prefix": "tret-workspace-",
+    "dir": os.path.dirname(__file__),
+}
+
+
+@pytest.fixture
+def temp_basedir():
+    temp_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    yield temp_dir.name
+    temp_dir.cleanup()
+
+
+def test_repack_installed_distribution(temp_basedir):
+    wheelhouse_dir = os.path.join(temp_basedir, "wheelhouse")
+    wheel_filepath = repack_installed_distribution("pytest", wheelhouse_dir)
+    assert wheel_filepath is not None
+    with zipfile.ZipFile(wheel_filepath) as wheel:
+        names = wheel.namelist()
+    assert "pytest/__init__.py" in names
+    assert not any("__pycache__" in name for name in names)
+    assert any(name.endswith(".dist-info/RECORD") for name in names)
+
+    version = importlib.metadata.version("pytest")
+    assert add_requirements_to_wheelhouse([f"pytest=={version}", "not-installed==1.0"], wheelhouse_dir) == ["not-installed==1.0"]
+    assert len(os.listdir(wheelhouse_dir)) == 1
+
+
+def test_build_environment_offline(temp_basedir):
+    version = importlib.metadata.version("iniconfig")
+    workspace_dir = os.path.join(temp_basedir, "ws")
+    os.makedirs(workspace_dir)
+    with open(os.path.join(workspace_dir, REQUIREMENTS_TXT_FILENAME), "w") as fout:
+        fout.write(f"iniconfig=={version}")
+    assert read_workspace_requirements(workspace_dir) == [f"iniconfig=={version}"]
+
+    wheelhouse_dir = os.path.join(temp_basedir, "wheelhouse")
+    assert add_requirements_to_wheelhouse([f"iniconfig=={version}"], wheelhouse_dir) == []
+
+    environments_dir = os.path.join(temp_basedir, "envs")
+    environment_dir = build_environment(workspace_dir, wheelhouse_dir, environments_dir)
+    assert build_environment(workspace_dir, wheelhouse_dir, environments_dir) == environment_dir
+
+    target_dir = build_environment(workspace_dir, wheelhouse_dir, environments_dir, target_dir=os.path.join(temp_basedir, "env"))
+    output = subprocess.run(
+        [os.path.join(target_dir, "bin", "python"), "-c", "import iniconfig, sys; print(sys.prefix)"],
+        check=True, capture_output=True, text=True,
+    ).stdout.strip()
+    assert output == target_dir
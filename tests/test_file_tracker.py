@@ -0,0 +1,93 @@
+import os
+import pytest
+import tarfile
+import tempfile
+from tret import TretArguments, TretWorkspace
+from tret.core import file_tracker
+from tret.core.file_tracker import OpenedFileTracker
+from tret.utils.ignore_utils import IgnoreMatcher
+from tret.constants import CODES_TARBALL_FILENAME
+
+tempdir_kwargs = {
+    "prefix": "tret-workspace-",
+    "dir": os.path.dirname(__file__),
+}
+
+
+@pytest.fixture
+def project_dir():
+    temp_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    project_dir = os.path.join(temp_dir.name, "project")
+    os.makedirs(os.path.join(project_dir, "configs"))
+    os.makedirs(os.path.join(project_dir, "ignored"))
+    for relpath, content in [("configs/model.yaml", "layers: 2\n"), ("ignored/cache.txt", "cached"),
+                             ("tokenizer.json", "{}" * 100), ("outside.txt", "outside")]:
+        with open(os.path.join(project_dir if relpath != "outside.txt" else temp_dir.name, relpath), "w") as fout:
+            fout.write(content)
+    yield project_dir
+    temp_dir.cleanup()
+
+
+def test_opened_file_tracker(project_dir):
+    tracker = OpenedFileTracker(root_dir=project_dir, exclude_dirs=[os.path.join(project_dir, "workspaces")])
+    tracker.start()
+    try:
+        with open(os.path.join(project_dir, "configs", "model.yaml")) as fin:
+            fin.read()
+        os.close(os.open(os.path.join(project_dir, "tokenizer.json"), os.O_RDONLY))
+        with open(os.path.join(project_dir, "ignored", "cache.txt"), "rb") as fin:
+            fin.read()
+        with open(os.path.join(os.path.dirname(project_dir), "outside.txt")) as fin:
+            fin.read()
+        # outputs written by the experiment are not recorded, even when they are read again
+        with open(os.path.join(project_dir, "output.txt"), "w") as fout:
+            fout.write("output")
+        with open(os.path.join(project_dir, "output.txt")) as fin:
+            fin.read()
+        os.makedirs(os.path.join(project_dir, "workspaces"))
+        with open(os.path.join(project_dir, "workspaces", "attributes.json"), "w") as fout:
+            fout.write("{}")
+        with open(os.path.join(project_dir, "workspaces", "attributes.json")) as fin:
+            fin.read()
+    finally:
+        tracker.stop()
+    with open(os.path.join(project_dir, "configs", "late.yaml"), "w") as fout:
+        fout.write("stopped")
+    with open(os.path.join(project_dir, "configs", "late.yaml")) as fin:
+        fin.read()
+
+    assert tracker.tracked_files() == [
+        os.path.join(project_dir, "configs", "model.yaml"),
+        os.path.join(project_dir, "ignored", "cache.txt"),
+        os.path.join(project_dir, "tokenizer.json"),
+    ]
+
+
+def test_split_backup_paths(project_dir, monkeypatch):
+    monkeypatch.setattr(file_tracker, "TRACKED_CODEFILE_MAX_SIZE", 100)
+    tracker = OpenedFileTracker(root_dir=project_dir)
+    for relpath in ["configs/model.yaml", "ignored/cache.txt", "tokenizer.json"]:
+        tracker._record(os.path.join(project_dir, relpath))
+    monkeypatch.chdir(project_dir)
+    codefiles, datafiles = tracker.split_backup_paths(IgnoreMatcher(["ignored/"], root_dir=project_dir))
+    assert codefiles == [os.path.join(project_dir, "configs", "model.yaml")]
+    assert datafiles == ["tokenizer.json"]
+
+
+def test_workspace_backs_up_opened_files(project_dir, monkeypatch):
+    monkeypatch.chdir(project_dir)
+    workspace = TretWorkspace(TretArguments(
+        workspace_basedir=os.path.join(project_dir, "workspaces"),
+        workspace_name="tracked",
+        force_backup_codes_as_tarball=True,
+        track_opened_files=True,
+        use_daemon=False,
+    ))
+    try:
+        with open(os.path.join(project_dir, "configs", "model.yaml")) as fin:
+            fin.read()
+        workspace.backup(exclude_patterns=["ignored/"])
+    finally:
+        workspace.file_tracker.stop()
+    with tarfile.open(os.path.join(workspace.workspace_dir, CODES_TARBALL_FILENAME), "r") as tar:
+        assert os.path.join("configs", "model.yaml") in tar.getnames()
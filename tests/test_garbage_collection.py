@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import pytest
+import tempfile
+import warnings
+from tret.core import garbage_collection
+from tret.core.garbage_collection import (
+    list_workspaces,
+    select_expired_workspaces,
+    collect_garbage,
+    unpack_workspace,
+)
+from tret.constants import (
+    TRET_ATTRIBUTES_FILENAME,
+    CODES_TARBALL_FILENAME,
+    TRET_PACKS_DIRNAME,
+)
+
+tempdir_kwargs = {
+    "prefix": "tret-workspace-",
+    "dir": os.path.dirname(__file__),
+}
+
+DAY = 24 * 60 * 60
+
+
+@pytest.fixture
+def temp_basedir():
+    temp_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    yield temp_dir.name
+    temp_dir.cleanup()
+
+
+def _create_workspace(basedir, name, age_in_days, metadata=None, codes=b"codes"):
+    workspace_dir = os.path.join(basedir, name)
+    os.makedirs(workspace_dir)
+    with open(os.path.join(workspace_dir, CODES_TARBALL_FILENAME), "wb") as fout:
+        fout.write(codes)
+    with open(os.path.join(workspace_dir, TRET_ATTRIBUTES_FILENAME), "w", encoding="utf-8") as fout:
+        json.dump({"backup_timestamp": time.time() - age_in_days * DAY, "metadata": metadata or {}}, fout)
+    return workspace_dir
+
+
+def test_select_expired_workspaces(temp_basedir):
+    for i in range(5):
+        _create_workspace(temp_basedir, f"ws{i}", age_in_days=10 - i, metadata={"tags": ["best"]} if i == 0 else {})
+    workspaces = list_workspaces(temp_basedir)
+    assert [workspace["name"] for workspace in workspaces] == [f"ws{i}" for i in range(5)]
+
+    expired = select_expired_workspaces(workspaces, keep_last=2, keep_tagged=True)
+    assert [workspace["name"] for workspace in expired] == ["ws1", "ws2"]
+
+    expired = select_expired_workspaces(workspaces, max_age=7.5 * DAY)
+    assert [workspace["name"] for workspace in expired] == ["ws0", "ws1", "ws2"]
+
+    expired = select_expired_workspaces(workspaces, max_age=7.5 * DAY, keep_predicate=lambda metadata: "tags" in metadata)
+    assert [workspace["name"] for workspace in expired] == ["ws1", "ws2"]
+
+
+def test_collect_garbage_dry_run_and_removal(temp_basedir):
+    for i in range(3):
+        _create_workspace(temp_basedir, f"ws{i}", age_in_days=10 - i)
+
+    report = collect_garbage(temp_basedir, keep_last=1, grace_period=0, dry_run=True)
+    assert report["reclaimed_bytes"] > 0
+    assert len(os.listdir(temp_basedir)) >= 3
+    assert [workspace["name"] for workspace in list_workspaces(temp_basedir)] == ["ws0", "ws1", "ws2"]
+
+    collect_garbage(temp_basedir, keep_last=1, grace_period=0)
+    assert [workspace["name"] for workspace in list_workspaces(temp_basedir)] == ["ws2"]
+
+
+def test_collect_garbage_dedup_and_compaction(temp_basedir):
+    _create_workspace(temp_basedir, "ws0", age_in_days=10)
+    _create_workspace(temp_basedir, "ws1", age_in_days=9)
+    _create_workspace(temp_basedir, "ws2", age_in_days=0, codes=b"other codes")
+    _create_workspace(temp_basedir, "ws3", age_in_days=0, codes=b"other codes")
+
+    report = collect_garbage(temp_basedir, compact_older_than=5 * DAY, grace_period=0)
+    actions = {(action["action"], os.path.basename(action["path"])) for action in report["actions"]}
+    assert ("compact", "ws0") in actions and ("compact", "ws1") in actions
+    assert ("dedup", CODES_TARBALL_FILENAME) in actions
+    assert os.path.samefile(
+        os.path.join(temp_basedir, "ws2", CODES_TARBALL_FILENAME),
+        os.path.join(temp_basedir, "ws3", CODES_TARBALL_FILENAME),
+    )
+    listed = list_workspaces(temp_basedir)
+    assert [(workspace["name"], workspace["unpacked"]) for workspace in listed] == [
+        ("ws0", False), ("ws1", False), ("ws2", True), ("ws3", True),
+    ]
+    assert listed[0]["packs"] == listed[1]["packs"] and listed[0]["size"] > 0
+
+    assert unpack_workspace(temp_basedir, "ws1")
+    with open(os.path.join(temp_basedir, "ws1", CODES_TARBALL_FILENAME), "rb") as fin:
+        assert fin.read() == b"codes"
+    assert not unpack_workspace(temp_basedir, "missing")
+
+
+def test_unpack_workspace_keeps_absolute_symlinks(temp_basedir):
+    target_filepath = os.path.join(temp_basedir, "dataset.bin")
+    with open(target_filepath, "wb") as fout:
+        fout.write(b"data")
+    for i in range(2):
+        workspace_dir = _create_workspace(temp_basedir, f"ws{i}", age_in_days=10)
+        os.makedirs(os.path.join(workspace_dir, "data", "symlinks"))
+        os.symlink(target_filepath, os.path.join(workspace_dir, "data", "symlinks", "dataset.bin"))
+    collect_garbage(temp_basedir, compact_older_than=5 * DAY, grace_period=0)
+    assert not os.path.isdir(os.path.join(temp_basedir, "ws0"))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert unpack_workspace(temp_basedir, "ws0")
+    link_filepath = os.path.join(temp_basedir, "ws0", "data", "symlinks", "dataset.bin")
+    assert os.readlink(link_filepath) == target_filepath
+    with open(link_filepath, "rb") as fin:
+        assert fin.read() == b"data"
+
+
+def test_collect_garbage_expires_packed_workspaces(temp_basedir):
+    for i in range(3):
+        _create_workspace(temp_basedir, f"ws{i}", age_in_days=10 - i, codes=f"codes {i}".encode())
+    collect_garbage(temp_basedir, compact_older_than=5 * DAY, grace_period=0)
+    assert os.listdir(os.path.join(temp_basedir, TRET_PACKS_DIRNAME)) and not os.path.isdir(os.path.join(temp_basedir, "ws0"))
+    # ws0 is unpacked on demand, then both of its copies expire
+    assert unpack_workspace(temp_basedir, "ws0")
+    os.utime(os.path.join(temp_basedir, "ws0"), (time.time() - DAY, time.time() - DAY))
+
+    report = collect_garbage(temp_basedir, max_age=8.5 * DAY, grace_period=0)
+    assert {os.path.basename(action["path"]) for action in report["actions"] if action["action"] == "remove"} == {"ws0", "ws1"}
+    assert [workspace["name"] for workspace in list_workspaces(temp_basedir)] == ["ws2"]
+    assert not unpack_workspace(temp_basedir, "ws0") and not unpack_workspace(temp_basedir, "ws1")
+    assert unpack_workspace(temp_basedir, "ws2")
+    with open(os.path.join(temp_basedir, "ws2", CODES_TARBALL_FILENAME), "rb") as fin:
+        assert fin.read() == b"codes 2"
+
+    collect_garbage(temp_basedir, keep_last=0, max_age=0, grace_period=0)
+    assert list_workspaces(temp_basedir) == []
+    assert os.listdir(os.path.join(temp_basedir, TRET_PACKS_DIRNAME)) == []
+
+
+def test_collect_garbage_keeps_workspaces_written_while_packed(temp_basedir, monkeypatch):
+    for i in range(3):
+        _create_workspace(temp_basedir, f"ws{i}", age_in_days=10)
+    # a backup written into ws1 while the pack is being written
+    get_referenced_chunks = garbage_collection._get_referenced_chunks
+
+    def _get_referenced_chunks(workspace_dir):
+        if os.path.basename(workspace_dir) == "ws1":
+            metrics_filepath = os.path.join(workspace_dir, "metrics.csv")
+            with open(metrics_filepath, "w") as fout:
+                fout.write("step,loss\n")
+            os.utime(metrics_filepath, (time.time() + 1, time.time() + 1))
+        return get_referenced_chunks(workspace_dir)
+    monkeypatch.setattr(garbage_collection, "_get_referenced_chunks", _get_referenced_chunks)
+    # the trash left by an interrupted run
+    os.makedirs(os.path.join(temp_basedir, ".tret-trash-ws2", "data"))
+
+    report = collect_garbage(temp_basedir, compact_older_than=5 * DAY, grace_period=0)
+    assert {os.path.basename(action["path"]) for action in report["actions"] if action["action"] == "compact"} == {"ws0", "ws2"}
+    assert [(workspace["name"], workspace["unpacked"]) for workspace in list_workspaces(temp_basedir)] == [
+        ("ws0", False), ("ws1", True), ("ws2", False),
+    ]
+    assert os.path.isfile(os.path.join(temp_basedir, "ws1", "metrics.csv"))
+    assert not [name for name in os.listdir(temp_basedir) if name.startswith(".tret-trash-")]
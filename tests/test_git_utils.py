@@ -0,0 +1,112 @@
+import os
+import json
+import pytest
+import tempfile
+import subprocess
+from tret.utils.git_utils import GitRepository, find_git_worktree, get_git_repository, read_index_paths, write_gitinfo
+
+tempdir_kwargs = {
+    "prefix": "tret-workspace-",
+    "dir": os.path.dirname(__file__),
+}
+
+
+def _git(repo_dir, *args):
+    return subprocess.run(
+        ["git", "-c", "user.name=tret", "-c", "user.email=tret@example.com", *args],
+        cwd=repo_dir, check=True, stdout=subprocess.PIPE,
+    ).stdout.decode("utf-8").strip()
+
+
+@pytest.fixture
+def repo_dir():
+    temp_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    repo_dir = os.path.join(temp_dir.name, "repo")
+    os.makedirs(os.path.join(repo_dir, "src", "nested"))
+    _git(repo_dir, "init", "-q")
+    for relpath, content in [("main.py", "print('main')\n"), ("src/nested/module.py", "x = 1\n"), ("README.md", "readme\n")]:
+        with open(os.path.join(repo_dir, relpath), "w") as fout:
+            fout.write(content)
+    _git(repo_dir, "add", ".")
+    _git(repo_dir, "commit", "-q", "-m", "initial")
+    yield repo_dir
+    temp_dir.cleanup()
+
+
+@pytest.mark.parametrize("index_version", ["2", "3", "4"])
+def test_read_index_paths(repo_dir, index_version):
+    _git(repo_dir, "update-index", "--index-version", index_version)
+    expected = _git(repo_dir, "ls-files").splitlines()
+    assert read_index_paths(os.path.join(repo_dir, ".git", "index")) == expected
+    assert read_index_paths(os.path.join(repo_dir, ".git", "missing")) is None
+
+
+def test_find_git_worktree_None():
+    assert find_git_worktree("/") is None
+
+
+def test_git_repository(repo_dir):
+    assert find_git_worktree(os.path.join(repo_dir, "src", "nested")) == repo_dir
+    repo = GitRepository(worktree_dir=repo_dir)
+    try:
+        head = _git(repo_dir, "rev-parse", "HEAD")
+        assert repo.head_commit() == head
+        # references moved into `packed-refs` are still resolved from disk
+        _git(repo_dir, "pack-refs", "--all")
+        assert repo.resolve_ref("HEAD") == head
+
+        assert repo.object_type(f"{head}^{{commit}}") == "commit"
+        assert repo.object_type("0" * 40) is None
+        assert repo.read_object(f"{head}:main.py") == b"print('main')\n"
+        assert repo.read_object(f"{head}:src/nested/module.py") == b"x = 1\n"
+
+        with open(os.path.join(repo_dir, "main.py"), "a") as fout:
+            fout.write("print('changed')\n")
+        diff = repo.diff(head)
+        assert "+print('changed')" in diff and not diff.endswith("\n")
+    finally:
+        repo.close()
+
+
+def test_git_repository_of_git_dir_and_linked_worktree(repo_dir):
+    worktree_dir = os.path.join(os.path.dirname(repo_dir), "linked")
+    _git(repo_dir, "worktree", "add", "-q", "-b", "linked", worktree_dir)
+    with open(os.path.join(worktree_dir, "linked.py"), "w") as fout:
+        fout.write("linked = True\n")
+    _git(worktree_dir, "add", "linked.py")
+    _git(worktree_dir, "commit", "-q", "-m", "linked")
+
+    linked = get_git_repository(worktree_dir)
+    assert linked.head_commit() == _git(worktree_dir, "rev-parse", "HEAD")
+    assert "linked.py" in linked.tracked_files()
+    # the git directory of a linked worktree knows its working tree
+    assert get_git_repository(linked.git_dir).worktree_dir == worktree_dir
+    assert get_git_repository(os.path.join(repo_dir, ".git")).head_commit() == _git(repo_dir, "rev-parse", "HEAD")
+
+
+def test_head_commit_of_empty_repository():
+    with tempfile.TemporaryDirectory(**tempdir_kwargs) as temp_dir:
+        _git(temp_dir, "init", "-q")
+        with pytest.raises(ValueError):
+            GitRepository(worktree_dir=temp_dir).head_commit()
+
+
+def test_diff_of_non_utf8_files_applies_again(repo_dir):
+    latin1_filepath = os.path.join(repo_dir, "latin1.txt")
+    with open(latin1_filepath, "wb") as fout:
+        fout.write("café\n".encode("latin-1"))
+    _git(repo_dir, "add", "latin1.txt")
+    _git(repo_dir, "commit", "-q", "-m", "latin-1")
+    with open(latin1_filepath, "ab") as fout:
+        fout.write("crème\n".encode("latin-1"))
+    repo = get_git_repository(repo_dir)
+    diff = repo.diff(_git(repo_dir, "rev-parse", "HEAD"))
+
+    gitinfo_filepath = os.path.join(os.path.dirname(repo_dir), ".gitinfo")
+    write_gitinfo(gitinfo_filepath, {"diff": diff})
+    with open(gitinfo_filepath, "r", encoding="utf-8") as fin:
+        recorded_diff = json.load(fin)["diff"]
+    _git(repo_dir, "checkout", "--", "latin1.txt")
+    repo.run("apply", "-", input=recorded_diff.encode("utf-8", errors="surrogateescape") + b"\n")
+    with open(latin1_filepath, "rb") as fin:
+        assert fin.read() == "café\ncrème\n".encode("latin-1")
@@ -0,0 +1,102 @@
+import os
+import pytest
+import tarfile
+import tempfile
+from tret.utils.ignore_utils import (
+    IgnoreMatcher,
+    load_ignore_matcher,
+)
+from tret.utils.tarball_utils import create_tarball_from_files
+from tret.core.data_backup import backup_data
+from tret.constants import TRETIGNORE_FILENAME
+
+tempdir_kwargs = {
+    "prefix": "tret-tests-",
+    "dir": os.path.dirname(__file__),
+}
+
+
+@pytest.fixture
+def temp_project():
+    temp_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    project_dir = os.path.join(temp_dir.name, "project")
+    for relpath in [
+        "train.py",
+        "checkpoints/epoch-1.pt",
+        ".venv/lib/site.py",
+        "wandb/run-1/log.txt",
+        "src/model.py",
+        "src/__pycache__/model.cpython-311.pyc",
+        "src/node_modules/pkg/index.js",
+        "logs/debug.log",
+        "logs/keep.log",
+    ]:
+        filepath = os.path.join(project_dir, relpath)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, "w") as fout:
+            fout.write(relpath)
+    yield project_dir
+    temp_dir.cleanup()
+
+
+@pytest.mark.parametrize("pattern, path, is_dir, ignored", [
+    ("*.log", "logs/debug.log", False, True),
+    ("*.log", "debug.logs", False, False),
+    ("/build", "build", True, True),
+    ("/build", "src/build", True, False),
+    ("build/", "src/build", True, True),
+    ("build/", "src/build", False, False),
+    ("src/*.py", "src/model.py", False, True),
+    ("src/*.py", "src/a/model.py", False, False),
+    ("**/node_modules", "a/b/node_modules", True, True),
+    ("data/**/*.npy", "data/a/b/x.npy", False, True),
+    ("data/**/*.npy", "data/x.npy", False, True),
+    ("logs/**", "logs/a/b.txt", False, True),
+    ("file[0-9].txt", "file1.txt", False, True),
+    ("file[!0-9].txt", "file1.txt", False, False),
+    ("\\#notes", "#notes", False, True),
+    ("# comment", "# comment", False, False),
+])
+def test_gitignore_semantics(pattern, path, is_dir, ignored):
+    assert IgnoreMatcher([pattern]).match(path, is_dir=is_dir) == ignored
+
+
+def test_last_matching_pattern_wins():
+    matcher = IgnoreMatcher(["*.log", "!keep.log"])
+    assert matcher.match("logs/debug.log")
+    assert not matcher.match("logs/keep.log")
+    matcher = IgnoreMatcher(["!keep.log", "*.log"])
+    assert matcher.match("logs/keep.log")
+
+
+def test_walk_prunes_ignored_directories(temp_project):
+    with open(os.path.join(temp_project, TRETIGNORE_FILENAME), "w") as fout:
+        fout.write("# large or generated directories\ncheckpoints/\n.venv/\nwandb/\n")
+    matcher = load_ignore_matcher(temp_project, exclude_patterns=["node_modules/", "*.log", "!keep.log"])
+    visited_dirs, files = [], []
+    for dirpath, _, filenames in matcher.walk(temp_project):
+        visited_dirs.append(os.path.relpath(dirpath, temp_project))
+        files.extend(os.path.relpath(os.path.join(dirpath, filename), temp_project) for filename in filenames)
+    assert not any(dirname.startswith(("checkpoints", ".venv", "wandb", os.path.join("src", "node_modules")))
+                   for dirname in visited_dirs)
+    assert sorted(files) == sorted([TRETIGNORE_FILENAME, "train.py", "src/model.py", "logs/keep.log"])
+
+
+def test_tarball_and_copies_apply_ignore_patterns(temp_project):
+    workspace_basedir = os.path.join(os.path.dirname(temp_project), "workspaces")
+    os.makedirs(workspace_basedir)
+    with open(os.path.join(workspace_basedir, TRETIGNORE_FILENAME), "w") as fout:
+        fout.write("checkpoints/\n")
+    matcher = load_ignore_matcher(temp_project, workspace_basedir, exclude_patterns=["wandb/", ".venv/"])
+
+    tarball_filepath = os.path.join(workspace_basedir, "codes.tar.gz")
+    create_tarball_from_files([temp_project], tarball_filepath, arcpaths=["project"], ignore_matcher=matcher)
+    with tarfile.open(tarball_filepath, "r") as tar:
+        names = tar.getnames()
+    assert "project/train.py" in names
+    assert not any("checkpoints" in name or "wandb" in name or ".venv" in name or "__pycache__" in name for name in names)
+
+    workspace_dir = os.path.join(workspace_basedir, "ws")
+    manifest = backup_data(workspace_dir, files_to_backup=[temp_project], ignore_matcher=matcher)
+    assert os.path.join("project", "train.py") in manifest["files"]
+    assert not any("checkpoints" in relpath or "__pycache__" in relpath for relpath in manifest["files"])
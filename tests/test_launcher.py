@@ -0,0 +1,86 @@
+import os
+import sys
+import json
+import pytest
+import tarfile
+import tempfile
+import subprocess
+from click.testing import CliRunner
+from tret.main_cli import main_cli
+from tret.constants import (
+    RUN_INFO_FILENAME,
+    TRET_ATTRIBUTES_FILENAME,
+    CODES_TARBALL_FILENAME,
+    GIT_INFO_FILENAME,
+    GIT_DIFF_INFO_KEYNAME,
+)
+
+tempdir_kwargs = {
+    "prefix": "tret-workspace-",
+    "dir": os.path.dirname(__file__),
+}
+
+TRAIN_SOURCE = """
+import sys
+import helpers
+import scratch
+
+# changes made by the run itself are not part of the codes it has started with
+with open("notes.txt", "a") as fout:
+    fout.write("changed during the run")
+sys.exit(helpers.EXIT_CODE)
+"""
+
+
+def _git(repo_dir, *args):
+    return subprocess.run(
+        ["git", "-c", "user.name=tret", "-c", "user.email=tret@example.com", *args],
+        cwd=repo_dir, check=True, stdout=subprocess.PIPE,
+    ).stdout.decode("utf-8").strip()
+
+
+@pytest.fixture
+def project_dir():
+    temp_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    project_dir = os.path.join(temp_dir.name, "project")
+    os.makedirs(project_dir)
+    for filename, content in [("train.py", TRAIN_SOURCE), ("helpers.py", "EXIT_CODE = 3\n"), ("notes.txt", "notes\n")]:
+        with open(os.path.join(project_dir, filename), "w") as fout:
+            fout.write(content)
+    _git(project_dir, "init", "-q")
+    _git(project_dir, "add", ".")
+    _git(project_dir, "commit", "-q", "-m", "initial")
+    # an untracked module, backed up into the code tarball
+    with open(os.path.join(project_dir, "scratch.py"), "w") as fout:
+        fout.write("VALUE = 1\n")
+    yield project_dir
+    temp_dir.cleanup()
+
+
+def test_run_backs_up_the_command_after_it_exits(project_dir, monkeypatch):
+    monkeypatch.chdir(project_dir)
+    monkeypatch.setenv("WANDB_API_KEY", "do-not-record")
+    result = CliRunner().invoke(main_cli, ["run", "--ws", "exp", "--", sys.executable, "train.py", "--lr", "0.1"])
+    assert result.exit_code == 3, result.output
+
+    workspace_dir = os.path.join(project_dir, "tret-workspaces", "exp")
+    run_info = json.load(open(os.path.join(workspace_dir, RUN_INFO_FILENAME), "r", encoding="utf-8"))
+    assert run_info["argv"][1:] == ["train.py", "--lr", "0.1"] and run_info["returncode"] == 3
+    assert run_info["cwd"] == os.getcwd() and run_info["environment"]["WANDB_API_KEY"] == "<redacted>"
+    tret_attributes = json.load(open(os.path.join(workspace_dir, TRET_ATTRIBUTES_FILENAME), "r", encoding="utf-8"))
+    assert tret_attributes["metadata"]["returncode"] == 3
+
+    # the modules imported by the command are those of its own process
+    with tarfile.open(os.path.join(workspace_dir, CODES_TARBALL_FILENAME), "r") as tar:
+        assert tar.getnames() == ["scratch.py"]
+    gitinfo = json.load(open(os.path.join(workspace_dir, GIT_INFO_FILENAME), "r", encoding="utf-8"))
+    assert gitinfo[GIT_DIFF_INFO_KEYNAME] == ""
+    assert "changed during the run" in _git(project_dir, "diff")
+
+
+def test_run_without_python_modules(project_dir, monkeypatch):
+    monkeypatch.chdir(project_dir)
+    with pytest.warns(UserWarning, match="has recorded its modules"):
+        result = CliRunner().invoke(main_cli, ["run", "--ws", "shell", "--tarball", "--", "sh", "-c", "exit 0"])
+    assert result.exit_code == 0, result.output
+    assert os.path.isfile(os.path.join(project_dir, "tret-workspaces", "shell", TRET_ATTRIBUTES_FILENAME))
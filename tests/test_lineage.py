@@ -0,0 +1,126 @@
+import os
+import json
+import pytest
+import tempfile
+import subprocess
+from click.testing import CliRunner
+from tret import TretArguments, TretWorkspace
+from tret.main_cli import main_cli
+from tret.constants import (
+    TRET_ATTRIBUTES_FILENAME,
+    TRET_LINEAGE_DIRNAME,
+    GIT_INFO_FILENAME,
+    GIT_REPO_PATH_KEYNAME,
+    GIT_COMMIT_HASH_KEYNAME,
+    GIT_DIFF_INFO_KEYNAME,
+)
+from tret.core.lineage import find_runs, backfill_lineage_index, extract_snippets, git_blob_id
+
+tempdir_kwargs = {
+    "prefix": "tret-workspace-",
+    "dir": os.path.dirname(__file__),
+}
+
+MODEL_V1 = """
+def helper(x):
+    return x + 1
+
+
+class Model:
+    def forward(self, x):
+        return helper(x) * 2
+"""
+MODEL_V2 = MODEL_V1.replace("* 2", "* 3")
+
+
+def _git(repo_dir, *args):
+    return subprocess.run(
+        ["git", "-c", "user.name=tret", "-c", "user.email=tret@example.com", *args],
+        cwd=repo_dir, check=True, stdout=subprocess.PIPE,
+    ).stdout.decode("utf-8").strip()
+
+
+@pytest.fixture
+def project_dir():
+    temp_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    project_dir = os.path.join(temp_dir.name, "project")
+    os.makedirs(project_dir)
+    yield project_dir
+    temp_dir.cleanup()
+
+
+def _backup(project_dir, name, model_source):
+    with open(os.path.join(project_dir, "model.py"), "w") as fout:
+        fout.write(model_source)
+    workspace = TretWorkspace(TretArguments(
+        workspace_basedir=os.path.join(project_dir, "workspaces"),
+        workspace_name=name,
+        force_backup_codes_as_tarball=True,
+        use_daemon=False,
+    ))
+    workspace.backup(additional_codefiles_to_backup=["model.py"])
+
+
+def test_which_runs_after_backups(project_dir, monkeypatch):
+    monkeypatch.chdir(project_dir)
+    basedir = os.path.join(project_dir, "workspaces")
+    _backup(project_dir, "run-a", MODEL_V1)
+    _backup(project_dir, "run-b", MODEL_V2)
+    _backup(project_dir, "run-c", MODEL_V1)
+
+    runs = find_runs(basedir, "model.py", blob_id=git_blob_id(MODEL_V1.encode("utf-8"))[:7])
+    assert [run["workspace"] for run in runs] == ["run-a", "run-c"]
+    assert not os.listdir(os.path.join(basedir, TRET_LINEAGE_DIRNAME, "pending"))
+    # the definition of `helper` is the same in both versions, that of `Model.forward` is not
+    snippets = extract_snippets(MODEL_V2.encode("utf-8"))
+    assert len(find_runs(basedir, "model.py", snippet_hash=snippets["helper"])) == 3
+    assert [run["workspace"] for run in find_runs(basedir, "model.py", snippet_hash=snippets["Model.forward"])] == ["run-b"]
+
+    # a new backup of a workspace replaces its versions, and removed workspaces are not reported
+    _backup(project_dir, "run-a", MODEL_V2)
+    os.rename(os.path.join(basedir, "run-c"), os.path.join(project_dir, "removed"))
+    result = CliRunner().invoke(main_cli, ["which-runs", "model.py", "--contains", "Model.forward", "--basedir", basedir])
+    assert result.exit_code == 0, result.output
+    assert [line.split("\t")[0] for line in result.stdout.splitlines()] == ["run-b", "run-a"]
+    result = CliRunner().invoke(main_cli, ["which-runs", "model.py", "--contains-hash", snippets["helper"], "--basedir", basedir])
+    assert result.exit_code == 0, result.output
+    assert sorted(line.split("\t")[0] for line in result.stdout.splitlines()) == ["run-a", "run-b"]
+    # names which look like hashes are still names
+    result = CliRunner().invoke(main_cli, ["which-runs", "model.py", "--contains", "cafe", "--basedir", basedir])
+    assert result.exit_code != 0 and "no definition named 'cafe'" in result.output
+
+
+def test_backfill_workspaces_from_gitinfo(project_dir):
+    _git(project_dir, "init", "-q")
+    os.makedirs(os.path.join(project_dir, "src"))
+    for path, content in [("src/model.py", MODEL_V1), ("train.py", "import model\n")]:
+        with open(os.path.join(project_dir, path), "w") as fout:
+            fout.write(content)
+    _git(project_dir, "add", ".")
+    _git(project_dir, "commit", "-q", "-m", "initial")
+    commit_hash = _git(project_dir, "rev-parse", "HEAD")
+
+    basedir = os.path.join(project_dir, "workspaces")
+    for name, model_source in [("old-a", MODEL_V1), ("old-b", MODEL_V2)]:
+        with open(os.path.join(project_dir, "src", "model.py"), "w") as fout:
+            fout.write(model_source)
+        workspace_dir = os.path.join(basedir, name)
+        os.makedirs(workspace_dir)
+        with open(os.path.join(workspace_dir, GIT_INFO_FILENAME), "w", encoding="utf-8") as fout:
+            json.dump({
+                GIT_REPO_PATH_KEYNAME: os.path.join(project_dir, ".git"),
+                GIT_COMMIT_HASH_KEYNAME: commit_hash,
+                GIT_DIFF_INFO_KEYNAME: _git(project_dir, "diff", commit_hash),
+            }, fout)
+        with open(os.path.join(workspace_dir, TRET_ATTRIBUTES_FILENAME), "w", encoding="utf-8") as fout:
+            json.dump({"backup_timestamp": len(name) + ord(name[-1]), "metadata": {}, "manifest": {}}, fout)
+
+    report = backfill_lineage_index(basedir, max_workers=2)
+    assert report == {"indexed": ["old-a", "old-b"], "failed": {}}
+    assert backfill_lineage_index(basedir)["indexed"] == []
+    assert [run["workspace"] for run in find_runs(basedir, "train.py")] == ["old-a", "old-b"]
+    # the version of a file changed by the recorded diff is known from its abbreviated blob id
+    v2_blob_id = git_blob_id(MODEL_V2.encode("utf-8"))
+    assert [run["workspace"] for run in find_runs(basedir, "model.py", blob_id=v2_blob_id)] == ["old-b"]
+    runs = find_runs(basedir, "src/model.py", blob_id=git_blob_id(MODEL_V1.encode("utf-8")))
+    assert [run["workspace"] for run in runs] == ["old-a"]
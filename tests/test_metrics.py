@@ -0,0 +1,85 @@
+import os
+import math
+import pytest
+import tempfile
+from click.testing import CliRunner
+from tret import TretArguments, TretWorkspace
+from tret.main_cli import main_cli
+from tret.constants import METRICS_DIRNAME
+from tret.core import metrics
+from tret.core.metrics import MetricsLogger, list_metrics, read_metric, reduce_metric, aggregate_metric
+
+tempdir_kwargs = {
+    "prefix": "tret-workspace-",
+    "dir": os.path.dirname(__file__),
+}
+
+
+@pytest.fixture
+def basedir():
+    temp_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    yield temp_dir.name
+    temp_dir.cleanup()
+
+
+def test_log_and_read_metrics(basedir):
+    workspace = TretWorkspace(TretArguments(workspace_basedir=basedir, workspace_name="run", use_daemon=False))
+    for step in range(1000):
+        workspace.log_metrics(step, loss=1.0 / (step + 1), lr=0.1)
+        if step % 100 == 0:
+            workspace.log_metrics(step, **{"eval/accuracy": step / 1000})
+    steps, values = workspace.read_metric("loss")
+    assert len(steps) == 1000 and list(steps[:3]) == [0, 1, 2] and values[1] == 0.5
+    assert list(workspace.read_metric("eval/accuracy")[0]) == list(range(0, 1000, 100))
+    assert list_metrics(workspace.workspace_dir) == ["eval/accuracy", "loss", "lr"]
+    assert len(read_metric(workspace.workspace_dir, "missing")[0]) == 0
+
+
+def test_logger_buffers_and_drops_torn_records(basedir, monkeypatch):
+    logger = MetricsLogger(basedir, flush_records=10, flush_interval=3600)
+    metric_filepath = os.path.join(basedir, METRICS_DIRNAME, "loss.metric")
+    for step in range(9):
+        logger.log(step, {"loss": float(step)})
+    assert not os.path.exists(metric_filepath)
+    logger.log(9, {"loss": 9.0})
+    assert os.path.getsize(metric_filepath) == 10 * metrics.METRIC_RECORD.size
+    logger.close()
+
+    # a record half-written by a killed run is ignored by readers and overwritten by the next logger
+    with open(metric_filepath, "ab") as fout:
+        fout.write(b"\x01\x02\x03")
+    assert len(read_metric(basedir, "loss")[0]) == 10
+    logger = MetricsLogger(basedir)
+    logger.log(10, {"loss": 10.0})
+    logger.close()
+    steps, values = read_metric(basedir, "loss")
+    assert list(steps) == list(range(11)) and list(values) == [float(step) for step in range(11)]
+
+    # the pure Python fallback reads and reduces the same records
+    monkeypatch.setattr(metrics, "np", None)
+    steps, values = read_metric(basedir, "loss")
+    assert list(steps) == list(range(11))
+    assert reduce_metric(steps, values, "max", step=5) == {"value": 5.0, "step": 5, "count": 6}
+
+
+def test_aggregate_metric(basedir):
+    for run, scale in [("run-a", 1.0), ("run-b", 2.0)]:
+        logger = MetricsLogger(os.path.join(basedir, run))
+        for step in range(100):
+            logger.log(step, {"loss": scale * abs(step - 50)})
+        logger.close()
+    os.makedirs(os.path.join(basedir, "run-c"))
+    workspace_dirs = [os.path.join(basedir, run) for run in ["run-a", "run-b", "run-c"]]
+
+    results = aggregate_metric(workspace_dirs, "loss", reduction="min")
+    assert results == {
+        workspace_dirs[0]: {"value": 0.0, "step": 50, "count": 100},
+        workspace_dirs[1]: {"value": 0.0, "step": 50, "count": 100},
+    }
+    results = aggregate_metric(workspace_dirs, "loss", reduction="last", step=10)
+    assert [result["value"] for result in results.values()] == [40.0, 80.0]
+    assert math.isclose(aggregate_metric(workspace_dirs[:1], "loss", reduction="mean")[workspace_dirs[0]]["value"], 25.0)
+
+    result = CliRunner().invoke(main_cli, ["metrics", "loss", "--basedir", basedir, "--reduce", "max", "--sort"])
+    assert result.exit_code == 0
+    assert result.stdout.splitlines() == ["run-a\t0\t50\t100", "run-b\t0\t100\t100"]
@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import pytest
+import tempfile
+from tret.core.output_watcher import OutputWatcher
+from tret.constants import (
+    OUTPUTS_DIRNAME,
+    OUTPUTS_MANIFEST_FILENAME,
+)
+
+tempdir_kwargs = {
+    "prefix": "tret-workspace-",
+    "dir": os.path.dirname(__file__),
+}
+
+
+@pytest.fixture
+def temp_dirs():
+    workspace_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    outputs_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    yield workspace_dir.name, outputs_dir.name
+    workspace_dir.cleanup()
+    outputs_dir.cleanup()
+
+
+def _load_manifest(workspace_dir):
+    with open(os.path.join(workspace_dir, OUTPUTS_MANIFEST_FILENAME), "r", encoding="utf-8") as fin:
+        return json.load(fin)["files"]
+
+
+def _stored_content(workspace_dir, entry):
+    with open(os.path.join(workspace_dir, entry["stored_path"]), "rb") as fin:
+        return fin.read()
+
+
+@pytest.mark.parametrize("use_inotify", [False, True])
+def test_watch_outputs(temp_dirs, use_inotify):
+    workspace_dir, outputs_dir = temp_dirs
+    checkpoint_filepath = os.path.join(outputs_dir, "checkpoint.bin")
+    with open(checkpoint_filepath, "wb") as fout:
+        fout.write(b"epoch-0")
+
+    watcher = OutputWatcher(workspace_dir, [outputs_dir], interval=0.1, use_inotify=use_inotify).start()
+    manifest = _load_manifest(workspace_dir)
+    assert _stored_content(workspace_dir, manifest[checkpoint_filepath]) == b"epoch-0"
+    assert manifest[checkpoint_filepath]["stored_path"].startswith(OUTPUTS_DIRNAME + os.sep)
+
+    # new files and new directories are picked up by the background thread
+    os.makedirs(os.path.join(outputs_dir, "logs"))
+    log_filepath = os.path.join(outputs_dir, "logs", "train.log")
+    with open(log_filepath, "wb") as fout:
+        fout.write(b"loss=1.0")
+    with open(checkpoint_filepath, "wb") as fout:
+        fout.write(b"epoch-1")
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        manifest = _load_manifest(workspace_dir)
+        if log_filepath in manifest and _stored_content(workspace_dir, manifest[checkpoint_filepath]) == b"epoch-1":
+            break
+        time.sleep(0.05)
+    assert _stored_content(workspace_dir, manifest[log_filepath]) == b"loss=1.0"
+    assert _stored_content(workspace_dir, manifest[checkpoint_filepath]) == b"epoch-1"
+
+    watcher.stop()
+    assert not watcher.thread.is_alive()
+
+
+def test_unchanged_files_are_not_copied_again(temp_dirs):
+    workspace_dir, outputs_dir = temp_dirs
+    output_filepath = os.path.join(outputs_dir, "result.json")
+    with open(output_filepath, "w") as fout:
+        fout.write("{}")
+
+    watcher = OutputWatcher(workspace_dir, [outputs_dir], use_inotify=False)
+    watcher.sync()
+    stored_filepath = os.path.join(workspace_dir, _load_manifest(workspace_dir)[output_filepath]["stored_path"])
+    stored_mtime = os.stat(stored_filepath).st_mtime_ns
+    time.sleep(0.01)
+    watcher.sync()
+    assert os.stat(stored_filepath).st_mtime_ns == stored_mtime
+
+    # a new watcher resumes from the manifest of the previous one
+    resumed_watcher = OutputWatcher(workspace_dir, [outputs_dir], use_inotify=False)
+    resumed_watcher.sync()
+    assert os.stat(stored_filepath).st_mtime_ns == stored_mtime
+
+
+def test_files_inside_workspace_are_only_recorded(temp_dirs):
+    workspace_dir, _ = temp_dirs
+    metrics_filepath = os.path.join(workspace_dir, "metrics.csv")
+    with open(metrics_filepath, "w") as fout:
+        fout.write("step,loss\n")
+
+    watcher = OutputWatcher(workspace_dir, [workspace_dir], use_inotify=False)
+    watcher.sync()
+    manifest = _load_manifest(workspace_dir)
+    assert list(manifest) == [metrics_filepath]
+    assert manifest[metrics_filepath]["stored_path"] == "metrics.csv"
+    assert not os.path.exists(os.path.join(workspace_dir, OUTPUTS_DIRNAME))
+
+
+def test_file_changed_while_copied_keeps_previous_copy(temp_dirs):
+    workspace_dir, outputs_dir = temp_dirs
+    output_filepath = os.path.join(outputs_dir, "checkpoint.bin")
+    with open(output_filepath, "wb") as fout:
+        fout.write(b"epoch-0")
+    watcher = OutputWatcher(workspace_dir, [outputs_dir], use_inotify=False)
+    watcher.sync()
+    stored_filepath = os.path.join(workspace_dir, _load_manifest(workspace_dir)[output_filepath]["stored_path"])
+
+    def _write_while_copied(nbytes):
+        watcher.throttle.consume = lambda nbytes: None
+        with open(output_filepath, "ab") as fout:
+            fout.write(b"-torn")
+
+    with open(output_filepath, "wb") as fout:
+        fout.write(b"epoch-1")
+    watcher.throttle.consume = _write_while_copied
+    watcher.sync()
+    with open(stored_filepath, "rb") as fin:
+        assert fin.read() == b"epoch-0"
+    assert not [filename for filename in os.listdir(os.path.dirname(stored_filepath)) if filename.endswith(".tmp")]
@@ -0,0 +1,88 @@
+import os
+import json
+import pytest
+import tempfile
+from tret.core.scrub import (
+    scrub,
+    scrub_workspace,
+)
+from tret.constants import (
+    TRET_ATTRIBUTES_FILENAME,
+    CODES_TARBALL_FILENAME,
+    GIT_INFO_FILENAME,
+    GIT_REPO_PATH_KEYNAME,
+    GIT_COMMIT_HASH_KEYNAME,
+    GIT_DIFF_INFO_KEYNAME,
+)
+from tret.utils.tarball_utils import (
+    create_tarball_from_files,
+    get_tarball_manifest,
+)
+
+tempdir_kwargs = {
+    "prefix": "tret-workspace-",
+    "dir": os.path.dirname(__file__),
+}
+
+
+@pytest.fixture
+def temp_basedir():
+    temp_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    yield temp_dir.name
+    temp_dir.cleanup()
+
+
+def _create_workspace(basedir, name):
+    workspace_dir = os.path.join(basedir, name)
+    os.makedirs(os.path.join(workspace_dir, "data", "symlinks"))
+    code_filepath = os.path.join(basedir, f"{name}.py")
+    with open(code_filepath, "w") as fout:
+        fout.write("print('hello')\n" * 1000)
+    tarball_filepath = os.path.join(workspace_dir, CODES_TARBALL_FILENAME)
+    create_tarball_from_files([code_filepath], tarball_filepath, arcpaths=["experiment.py"])
+    os.symlink(code_filepath, os.path.join(workspace_dir, "data", "symlinks", "experiment.py"))
+    with open(os.path.join(workspace_dir, TRET_ATTRIBUTES_FILENAME), "w", encoding="utf-8") as fout:
+        json.dump({"manifest": {"codes": get_tarball_manifest(tarball_filepath), "data": {}}}, fout)
+    return workspace_dir
+
+
+def test_scrub_workspace(temp_basedir):
+    workspace_dir = _create_workspace(temp_basedir, "ws")
+    assert scrub_workspace(workspace_dir)["errors"] == []
+
+    # a flipped byte in the compressed stream
+    tarball_filepath = os.path.join(workspace_dir, CODES_TARBALL_FILENAME)
+    with open(tarball_filepath, "r+b") as fout:
+        fout.seek(os.path.getsize(tarball_filepath) // 2)
+        byte = fout.read(1)
+        fout.seek(-1, os.SEEK_CUR)
+        fout.write(bytes([byte[0] ^ 0xFF]))
+    os.remove(os.path.join(temp_basedir, "ws.py"))
+    with open(os.path.join(workspace_dir, GIT_INFO_FILENAME), "w", encoding="utf-8") as fout:
+        json.dump({
+            GIT_REPO_PATH_KEYNAME: os.path.join(temp_basedir, "missing", ".git"),
+            GIT_COMMIT_HASH_KEYNAME: "0" * 40,
+            GIT_DIFF_INFO_KEYNAME: "",
+        }, fout)
+
+    errors = scrub_workspace(workspace_dir)["errors"]
+    assert any(CODES_TARBALL_FILENAME in error for error in errors)
+    assert any("does not exist" in error and "experiment.py" in error for error in errors)
+    assert any("git repository" in error for error in errors)
+
+
+def test_scrub_resumes_incrementally(temp_basedir):
+    for i in range(3):
+        _create_workspace(temp_basedir, f"ws{i}")
+    report = scrub(temp_basedir, max_workers=2, max_bandwidth=100 * 1024 * 1024)
+    assert sorted(report["verified"]) == ["ws0", "ws1", "ws2"] and not report["errors"]
+
+    # only the changed workspace is verified again
+    os.remove(os.path.join(temp_basedir, "ws1.py"))
+    os.remove(os.path.join(temp_basedir, "ws1", "data", "symlinks", "experiment.py"))
+    report = scrub(temp_basedir, max_workers=2)
+    assert report["verified"] == ["ws1"]
+    assert sorted(report["skipped"]) == ["ws0", "ws2"]
+
+    report = scrub(temp_basedir, max_workers=2, full=True)
+    assert sorted(report["verified"]) == ["ws0", "ws1", "ws2"]
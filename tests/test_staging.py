@@ -0,0 +1,99 @@
+import os
+import json
+import pytest
+import tempfile
+from tret import TretArguments, TretWorkspace
+from tret.constants import (
+    TRET_PACKS_DIRNAME,
+    TRET_STAGED_CHUNKS_DIRNAME,
+    CHUNK_STORE_DIRNAME,
+    TRET_ATTRIBUTES_FILENAME,
+    TRET_LINEAGE_DIRNAME,
+)
+from tret.core.garbage_collection import find_packed_workspace, collect_garbage, list_workspaces
+from tret.core.staging import record_staged_chunks, publish_staged_workspace
+
+tempdir_kwargs = {
+    "prefix": "tret-workspace-",
+    "dir": os.path.dirname(__file__),
+}
+
+
+@pytest.fixture
+def project_dir():
+    temp_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    project_dir = os.path.join(temp_dir.name, "project")
+    os.makedirs(os.path.join(project_dir, "dataset"))
+    for i in range(20):
+        with open(os.path.join(project_dir, "dataset", f"sample{i}.json"), "w") as fout:
+            fout.write(f"{{\"id\": {i}}}")
+    yield project_dir
+    temp_dir.cleanup()
+
+
+def _staged_workspace(project_dir, staging_name):
+    return TretWorkspace(TretArguments(
+        workspace_basedir=os.path.join(project_dir, "shared"),
+        staging_dir=os.path.join(project_dir, staging_name),
+        workspace_name="staged",
+        force_backup_codes_as_tarball=True,
+        use_daemon=False,
+    ))
+
+
+def test_staged_backup_is_published_as_a_pack(project_dir, monkeypatch):
+    monkeypatch.chdir(project_dir)
+    shared_basedir = os.path.join(project_dir, "shared")
+    workspace = _staged_workspace(project_dir, "scratch")
+    assert workspace.workspace_dir == os.path.join(project_dir, "scratch", "staged")
+    workspace.backup(datafiles_to_backup=["dataset"], metadata={"run": 1})
+
+    # nothing but the pack, its index, the shared chunk store and a lineage segment is written into the shared base directory
+    assert sorted(os.listdir(shared_basedir)) == [CHUNK_STORE_DIRNAME, TRET_LINEAGE_DIRNAME, TRET_PACKS_DIRNAME]
+    assert sorted(os.listdir(os.path.join(shared_basedir, TRET_PACKS_DIRNAME))) == ["staged-staged.json", "staged-staged.tar"]
+
+    # a later backup of the same workspace replaces its pack
+    workspace.backup(metadata={"run": 2})
+    assert len(os.listdir(os.path.join(shared_basedir, TRET_PACKS_DIRNAME))) == 2
+    assert find_packed_workspace(shared_basedir, "staged") is not None
+
+    # the workspace is unpacked on demand on another node, i.e. with an empty staging directory, or without staging
+    other_node_workspace = _staged_workspace(project_dir, "other-scratch")
+    with open(os.path.join(other_node_workspace.workspace_dir, TRET_ATTRIBUTES_FILENAME), "r", encoding="utf-8") as fin:
+        assert json.load(fin)["metadata"] == {"run": 2}
+    unstaged_workspace = TretWorkspace(TretArguments(
+        workspace_basedir=shared_basedir, workspace_name="staged", create_directory=False, use_daemon=False,
+    ))
+    assert os.path.isfile(os.path.join(unstaged_workspace.workspace_dir, TRET_ATTRIBUTES_FILENAME))
+    assert os.path.isfile(os.path.join(unstaged_workspace.workspace_dir, "data", "dataset", "sample19.json"))
+
+
+def _count_chunks(basedir):
+    return sum(len(filenames) for _, _, filenames in os.walk(os.path.join(basedir, CHUNK_STORE_DIRNAME)))
+
+
+def test_staged_workspaces_expire_with_their_chunks_recorded_until_published(project_dir, monkeypatch):
+    monkeypatch.chdir(project_dir)
+    shared_basedir = os.path.join(project_dir, "shared")
+    with open(os.path.join(project_dir, "weights.bin"), "wb") as fout:
+        fout.write(os.urandom(1024 * 1024))
+    workspace = _staged_workspace(project_dir, "scratch")
+    workspace.backup(datafiles_to_backup_as_chunks=["weights.bin"])
+    assert not os.listdir(os.path.join(shared_basedir, TRET_STAGED_CHUNKS_DIRNAME))
+    assert [(entry["name"], entry["unpacked"]) for entry in list_workspaces(shared_basedir)] == [("staged", False)]
+    chunk_count = _count_chunks(shared_basedir)
+    assert chunk_count > 0
+
+    # the next backup reuses the chunks, and has recorded them before gc expires the published pack
+    record_staged_chunks(workspace.workspace_dir, shared_basedir)
+    collect_garbage(shared_basedir, max_age=0, grace_period=0)
+    assert os.listdir(os.path.join(shared_basedir, TRET_PACKS_DIRNAME)) == []
+    assert _count_chunks(shared_basedir) == chunk_count
+    # the expired workspace is not unpacked again on another node
+    other_node_workspace = _staged_workspace(project_dir, "other-scratch")
+    assert not os.path.exists(os.path.join(other_node_workspace.workspace_dir, TRET_ATTRIBUTES_FILENAME))
+
+    publish_staged_workspace(workspace.workspace_dir, shared_basedir)
+    assert not os.listdir(os.path.join(shared_basedir, TRET_STAGED_CHUNKS_DIRNAME))
+    collect_garbage(shared_basedir, grace_period=0)
+    assert _count_chunks(shared_basedir) == chunk_count
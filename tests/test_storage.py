@@ -0,0 +1,143 @@
+import os
+import pytest
+import tempfile
+from tret.core.storage import (
+    LocalStorageBackend,
+    S3StorageBackend,
+    STORAGE_MANIFEST_NAME,
+    get_storage_backend,
+)
+
+tempdir_kwargs = {
+    "prefix": "tret-workspace-",
+    "dir": os.path.dirname(__file__),
+}
+
+PART_SIZE = 5 * 1024 * 1024
+
+
+@pytest.fixture
+def temp_workspace():
+    temp_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    yield temp_dir.name
+    temp_dir.cleanup()
+
+
+@pytest.fixture
+def s3_client():
+    moto = pytest.importorskip("moto")
+    boto3 = pytest.importorskip("boto3")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="tret-test")
+        yield client
+
+
+def test_get_storage_backend():
+    assert isinstance(get_storage_backend(None), LocalStorageBackend)
+    with pytest.raises(ValueError):
+        get_storage_backend("ftp://somewhere")
+
+
+def test_s3_upload_and_download_workspace(s3_client, temp_workspace):
+    source_dir = os.path.join(temp_workspace, "source")
+    os.makedirs(os.path.join(source_dir, "data"))
+    large_content = os.urandom(2 * PART_SIZE + 123)
+    with open(os.path.join(source_dir, "data", "data.tar.gz"), "wb") as fout:
+        fout.write(large_content)
+    with open(os.path.join(source_dir, ".tretattributes"), "w") as fout:
+        fout.write("{}")
+    os.symlink("/tmp", os.path.join(source_dir, "data", "link"))
+
+    backend = S3StorageBackend(
+        bucket="tret-test", prefix="workspaces", part_size=PART_SIZE, max_inflight_bytes=2 * PART_SIZE, client=s3_client,
+    )
+    backend.upload_workspace(source_dir, "ws")
+
+    target_dir = os.path.join(temp_workspace, "target")
+    assert backend.download_workspace("ws", target_dir)
+    with open(os.path.join(target_dir, "data", "data.tar.gz"), "rb") as fin:
+        assert fin.read() == large_content
+    with open(os.path.join(target_dir, ".tretattributes"), "r") as fin:
+        assert fin.read() == "{}"
+    assert os.readlink(os.path.join(target_dir, "data", "link")) == "/tmp"
+
+    assert not backend.download_workspace("missing", os.path.join(temp_workspace, "missing"))
+
+
+def _record_put_keys(backend):
+    keys = []
+    put_object = backend.client.put_object
+
+    def _put_object(**kwargs):
+        keys.append(kwargs["Key"])
+        return put_object(**kwargs)
+    backend.client.put_object = _put_object
+    return keys
+
+
+def test_s3_upload_only_sends_changes_and_deletes_removed_files(s3_client, temp_workspace):
+    source_dir = os.path.join(temp_workspace, "source")
+    os.makedirs(os.path.join(source_dir, "data"))
+    for name in ["kept.txt", "changed.txt", "removed.txt"]:
+        with open(os.path.join(source_dir, "data", name), "w") as fout:
+            fout.write(name)
+    backend = S3StorageBackend(bucket="tret-test", part_size=PART_SIZE, client=s3_client)
+    backend.upload_workspace(source_dir, "ws")
+
+    os.remove(os.path.join(source_dir, "data", "removed.txt"))
+    with open(os.path.join(source_dir, "data", "changed.txt"), "w") as fout:
+        fout.write("changed again")
+    put_keys = _record_put_keys(backend)
+    backend.upload_workspace(source_dir, "ws")
+    assert sorted(put_keys) == ["ws/" + STORAGE_MANIFEST_NAME, "ws/data/changed.txt"]
+    remote_keys = {obj["Key"] for obj in s3_client.list_objects_v2(Bucket="tret-test")["Contents"]}
+    assert remote_keys == {"ws/data/kept.txt", "ws/data/changed.txt", "ws/" + STORAGE_MANIFEST_NAME}
+
+    target_dir = os.path.join(temp_workspace, "target")
+    assert backend.download_workspace("ws", target_dir)
+    assert sorted(os.listdir(os.path.join(target_dir, "data"))) == ["changed.txt", "kept.txt"]
+    # the downloaded workspace is up to date with the storage
+    put_keys.clear()
+    backend.upload_workspace(target_dir, "ws")
+    assert put_keys == ["ws/" + STORAGE_MANIFEST_NAME]
+
+
+def test_s3_download_refuses_keys_outside_of_workspace(s3_client, temp_workspace):
+    s3_client.put_object(Bucket="tret-test", Key="ws/../escaped.txt", Body=b"escaped")
+    backend = S3StorageBackend(bucket="tret-test", part_size=PART_SIZE, client=s3_client)
+    with pytest.raises(ValueError):
+        backend.download_workspace("ws", os.path.join(temp_workspace, "target", "ws"))
+    assert not os.path.exists(os.path.join(temp_workspace, "target", "escaped.txt"))
+    assert not os.path.exists(os.path.join(temp_workspace, "target", "ws"))
+    assert os.listdir(os.path.join(temp_workspace, "target")) == []
+
+
+def test_s3_interrupted_download_leaves_no_workspace(s3_client, temp_workspace):
+    source_dir = os.path.join(temp_workspace, "source")
+    os.makedirs(os.path.join(source_dir, "data"))
+    for name in ["first.txt", "second.txt"]:
+        with open(os.path.join(source_dir, "data", name), "w") as fout:
+            fout.write(name)
+    backend = S3StorageBackend(bucket="tret-test", part_size=PART_SIZE, max_workers=1, client=s3_client)
+    backend.upload_workspace(source_dir, "ws")
+
+    calls = []
+    download_range = backend._download_range
+
+    def _failing_download_range(*args):
+        calls.append(args)
+        if len(calls) == 2:
+            raise ConnectionError("connection lost")
+        return download_range(*args)
+    backend._download_range = _failing_download_range
+    with pytest.raises(ConnectionError):
+        backend.download_workspace("ws", os.path.join(temp_workspace, "ws"))
+    assert sorted(os.listdir(temp_workspace)) == ["source"]
+
+    backend._download_range = download_range
+    assert backend.download_workspace("ws", os.path.join(temp_workspace, "ws"))
+    assert sorted(os.listdir(os.path.join(temp_workspace, "ws", "data"))) == ["first.txt", "second.txt"]
@@ -1,3 +1,4 @@
+import io
 import os
 import pytest
 import tarfile
@@ -6,6 +7,9 @@ from tret.utils.tarball_utils import (
     create_tarball_from_files,
     restore_files_from_tarball,
     get_filepaths_in_tarball,
+    get_tarball_manifest,
+    restore_changed_files_from_tarball,
+    replay_restore_journal,
 )
 
 tempdir_kwargs = {
@@ -64,6 +68,51 @@ def test_restore_files_from_tarball(temp_files, temp_tarball_filepath):
     restore_dir.cleanup()
 
 
+def test_restore_subset_and_links_from_tarball(temp_directory):
+    tarball_path = os.path.join(temp_directory.name, "subset-test.tar")
+    with tarfile.open(tarball_path, "w") as tar:
+        for name, content in [("a/x.txt", b"x"), ("a/b/y.txt", b"y"), ("c.txt", b"c")]:
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size, tarinfo.mode = len(content), 0o4777
+            tar.addfile(tarinfo, io.BytesIO(content))
+        for name, link_type, linkname in [("a/link", tarfile.SYMTYPE, "x.txt"), ("a/hardlink", tarfile.LNKTYPE, "a/x.txt")]:
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.type, tarinfo.linkname = link_type, linkname
+            tar.addfile(tarinfo)
+
+    restore_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    with pytest.warns(UserWarning, match="missing"):
+        extracted = restore_files_from_tarball(tarball_path, restore_dir.name, members=["a/", "missing"], max_workers=2)
+    assert sorted(extracted) == ["a/b/y.txt", "a/hardlink", "a/link", "a/x.txt"]
+    assert not os.path.exists(os.path.join(restore_dir.name, "c.txt"))
+    with open(os.path.join(restore_dir.name, "a", "link"), "r") as f:
+        assert f.read() == "x"
+    assert os.path.samefile(os.path.join(restore_dir.name, "a", "hardlink"), os.path.join(restore_dir.name, "a", "x.txt"))
+    # setuid and group/other write bits are dropped
+    assert os.stat(os.path.join(restore_dir.name, "a", "b", "y.txt")).st_mode & 0o7777 == 0o755
+    restore_dir.cleanup()
+
+
+@pytest.mark.parametrize("name, link_type, linkname", [
+    ("../escaped.txt", tarfile.REGTYPE, ""),
+    ("../../absolute-link", tarfile.LNKTYPE, "/etc/passwd"),
+    ("escaping-link", tarfile.SYMTYPE, "../../outside"),
+    ("fifo", tarfile.FIFOTYPE, ""),
+])
+def test_restore_files_from_tarball_refuses_unsafe_members(temp_directory, name, link_type, linkname):
+    tarball_path = os.path.join(temp_directory.name, "unsafe-test.tar")
+    with tarfile.open(tarball_path, "w") as tar:
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.type, tarinfo.linkname = link_type, linkname
+        tar.addfile(tarinfo, io.BytesIO(b""))
+
+    restore_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    with pytest.raises(tarfile.TarError):
+        restore_files_from_tarball(tarball_path, os.path.join(restore_dir.name, "output"))
+    assert os.listdir(restore_dir.name) == ["output"] and not os.listdir(os.path.join(restore_dir.name, "output"))
+    restore_dir.cleanup()
+
+
 def test_get_filepaths_in_tarball(temp_files, temp_tarball_filepath):
     arcpaths = [os.path.basename(file) for file in temp_files]
 
@@ -84,3 +133,131 @@ def test_append_to_existing_tarball(temp_files, temp_tarball_filepath):
         tar_members = tar.getnames()
         for filepath in temp_files:
             assert os.path.basename(filepath) in tar_members
+
+
+def test_manifest_is_built_while_writing(temp_files, temp_tarball_filepath):
+    arcpaths = [os.path.basename(file) for file in temp_files]
+    create_tarball_from_files(temp_files[:2], temp_tarball_filepath, arcpaths=arcpaths[:2])
+    manifest = {}
+    create_tarball_from_files(
+        [temp_files[2]], temp_tarball_filepath, arcpaths=[arcpaths[2]], members_from_memory={"requirements.txt": b"tret"},
+        manifest=manifest,
+    )
+    # the appended members are included
+    assert manifest == get_tarball_manifest(temp_tarball_filepath)
+    assert set(arcpaths + ["requirements.txt"]) <= set(manifest)
+
+
+def test_restore_changed_files_and_replay_journal(temp_directory):
+    source_dir = os.path.join(temp_directory.name, "journal-source")
+    os.makedirs(source_dir)
+    for name, content in [("same.txt", "same"), ("changed.txt", "old"), ("created.txt", "new file")]:
+        with open(os.path.join(source_dir, name), "w") as f:
+            f.write(content)
+    tarball_path = os.path.join(temp_directory.name, "journal-test.tar.gz")
+    names = ["same.txt", "changed.txt", "created.txt"]
+    create_tarball_from_files(
+        [os.path.join(source_dir, name) for name in names], tarball_path, arcpaths=names, append_data_to_existing_tarball=False
+    )
+
+    restore_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    with open(os.path.join(restore_dir.name, "same.txt"), "w") as f:
+        f.write("same")
+    with open(os.path.join(restore_dir.name, "changed.txt"), "w") as f:
+        f.write("current")
+
+    journal_path = os.path.join(temp_directory.name, "journal.tar.gz")
+    written = restore_changed_files_from_tarball(tarball_path, restore_dir.name, journal_path=journal_path)
+    assert sorted(written) == ["changed.txt", "created.txt"]
+    assert sorted(get_filepaths_in_tarball(journal_path)) == [".tret-restore-journal", "changed.txt"]
+    with open(os.path.join(restore_dir.name, "changed.txt"), "r") as f:
+        assert f.read() == "old"
+
+    replay_restore_journal(journal_path, restore_dir.name)
+    with open(os.path.join(restore_dir.name, "changed.txt"), "r") as f:
+        assert f.read() == "current"
+    assert not os.path.exists(os.path.join(restore_dir.name, "created.txt"))
+    assert os.path.isfile(os.path.join(restore_dir.name, "same.txt"))
+
+    restore_dir.cleanup()
+
+
+def test_create_tarball_with_members_from_memory(temp_files, temp_tarball_filepath):
+    create_tarball_from_files(
+        temp_files[:1],
+        temp_tarball_filepath,
+        append_data_to_existing_tarball=False,
+        members_from_memory={"generated.txt": b"generated content"},
+    )
+    with tarfile.open(temp_tarball_filepath, "r") as tar:
+        assert tar.extractfile("generated.txt").read() == b"generated content"
+    assert not os.path.exists("generated.txt")
+    assert not any(name.endswith(".tmp") for name in os.listdir(os.path.dirname(temp_tarball_filepath)))
+
+
+def _add_member(tar, name, content=None, linkname=None):
+    tarinfo = tarfile.TarInfo(name)
+    if linkname is not None:
+        tarinfo.type, tarinfo.linkname = tarfile.SYMTYPE, linkname
+        tar.addfile(tarinfo)
+    else:
+        tarinfo.size = len(content)
+        tar.addfile(tarinfo, io.BytesIO(content))
+
+
+@pytest.mark.parametrize("name, linkname", [("../escaped.txt", None), ("lnk", "/etc/passwd"), ("lnk", "../../outside")])
+def test_restore_changed_files_refuses_unsafe_members(temp_directory, name, linkname):
+    tarball_path = os.path.join(temp_directory.name, "unsafe.tar.gz")
+    with tarfile.open(tarball_path, "w:gz") as tar:
+        _add_member(tar, "safe.txt", b"safe")
+        _add_member(tar, name, b"escaped", linkname=linkname)
+
+    restore_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    journal_path = os.path.join(restore_dir.name, "journal.tar.gz")
+    with pytest.raises(tarfile.TarError):
+        restore_changed_files_from_tarball(tarball_path, os.path.join(restore_dir.name, "out"), journal_path=journal_path)
+    # members are checked before anything is written
+    assert sorted(os.listdir(restore_dir.name)) == ["out"] and not os.listdir(os.path.join(restore_dir.name, "out"))
+    restore_dir.cleanup()
+
+
+def test_restore_changed_links_and_replay_journal(temp_directory):
+    tarball_path = os.path.join(temp_directory.name, "links.tar.gz")
+    with tarfile.open(tarball_path, "w:gz") as tar:
+        _add_member(tar, "target.txt", b"target")
+        _add_member(tar, "same-link", linkname="target.txt")
+        _add_member(tar, "changed-link", linkname="target.txt")
+        _add_member(tar, "file-to-link", linkname="target.txt")
+
+    restore_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    with open(os.path.join(restore_dir.name, "target.txt"), "wb") as f:
+        f.write(b"target")
+    os.symlink("target.txt", os.path.join(restore_dir.name, "same-link"))
+    os.symlink("elsewhere.txt", os.path.join(restore_dir.name, "changed-link"))
+    with open(os.path.join(restore_dir.name, "file-to-link"), "wb") as f:
+        f.write(b"a regular file")
+
+    journal_path = os.path.join(temp_directory.name, "links-journal.tar.gz")
+    written = restore_changed_files_from_tarball(tarball_path, restore_dir.name, journal_path=journal_path)
+    assert sorted(written) == ["changed-link", "file-to-link"]
+    assert os.readlink(os.path.join(restore_dir.name, "changed-link")) == "target.txt"
+    assert os.readlink(os.path.join(restore_dir.name, "file-to-link")) == "target.txt"
+
+    replay_restore_journal(journal_path, restore_dir.name)
+    assert os.readlink(os.path.join(restore_dir.name, "changed-link")) == "elsewhere.txt"
+    assert not os.path.islink(os.path.join(restore_dir.name, "file-to-link"))
+    with open(os.path.join(restore_dir.name, "file-to-link"), "rb") as f:
+        assert f.read() == b"a regular file"
+    restore_dir.cleanup()
+
+
+def test_replay_restore_journal_refuses_escaping_members(temp_directory):
+    journal_path = os.path.join(temp_directory.name, "unsafe-journal.tar.gz")
+    with tarfile.open(journal_path, "w:gz") as tar:
+        _add_member(tar, ".tret-restore-journal", b'{"created": []}')
+        _add_member(tar, "../escaped.txt", b"escaped")
+    restore_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    with pytest.raises(tarfile.TarError):
+        replay_restore_journal(journal_path, os.path.join(restore_dir.name, "out"))
+    assert not os.path.exists(os.path.join(restore_dir.name, "escaped.txt"))
+    restore_dir.cleanup()
@@ -0,0 +1,69 @@
+import os
+import json
+import pytest
+import tempfile
+from tret.core.code_backup_and_restore import backup_codes
+from tret.core.workspace_diff import diff_workspaces
+from tret.constants import TRET_ATTRIBUTES_FILENAME
+
+tempdir_kwargs = {
+    "prefix": "tret-workspace-",
+    "dir": os.path.dirname(__file__),
+}
+
+
+@pytest.fixture
+def temp_workspaces():
+    temp_dirs = [tempfile.TemporaryDirectory(**tempdir_kwargs) for _ in range(2)]
+    yield [temp_dir.name for temp_dir in temp_dirs]
+    for temp_dir in temp_dirs:
+        temp_dir.cleanup()
+
+
+@pytest.fixture
+def temp_code_file():
+    temp_dir = tempfile.TemporaryDirectory(**tempdir_kwargs)
+    code_file = os.path.join(temp_dir.name, "model.py")
+    yield code_file
+    temp_dir.cleanup()
+
+
+def _backup(workspace_dir, code_file, metadata):
+    manifest = backup_codes(workspace_dir, additional_codefiles_to_backup=[code_file], backup_codes_as_tarball=True)
+    with open(os.path.join(workspace_dir, TRET_ATTRIBUTES_FILENAME), "w", encoding="utf-8") as fout:
+        json.dump({"metadata": metadata, "manifest": {"codes": manifest, "data": {}}}, fout)
+
+
+def test_diff_workspaces(temp_workspaces, temp_code_file):
+    workspace_a, workspace_b = temp_workspaces
+    with open(temp_code_file, "w", encoding="utf-8") as fout:
+        fout.write("lr = 0.1\n")
+    _backup(workspace_a, temp_code_file, {"lr": 0.1})
+    with open(temp_code_file, "w", encoding="utf-8") as fout:
+        fout.write("lr = 0.2\n")
+    _backup(workspace_b, temp_code_file, {"lr": 0.2})
+
+    code_name = os.path.relpath(temp_code_file, os.getcwd())
+    summary = diff_workspaces(workspace_a, workspace_b, summary=True).splitlines()
+    assert f"M {code_name}" in summary
+    assert "metadata.lr: 0.1 -> 0.2" in summary
+
+    unified = diff_workspaces(workspace_a, workspace_b).splitlines()
+    assert "-lr = 0.1" in unified
+    assert "+lr = 0.2" in unified
+
+    assert diff_workspaces(workspace_a, workspace_a) == ""
+
+
+def test_diff_workspace_against_worktree(temp_workspaces, temp_code_file):
+    workspace_dir = temp_workspaces[0]
+    with open(temp_code_file, "w", encoding="utf-8") as fout:
+        fout.write("lr = 0.1\n")
+    _backup(workspace_dir, temp_code_file, {})
+
+    code_name = os.path.relpath(temp_code_file, os.getcwd())
+    assert f"M {code_name}" not in diff_workspaces(workspace_dir, summary=True).splitlines()
+
+    with open(temp_code_file, "w", encoding="utf-8") as fout:
+        fout.write("lr = 0.3\n")
+    assert f"M {code_name}" in diff_workspaces(workspace_dir, summary=True).splitlines()